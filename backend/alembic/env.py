@@ -27,6 +27,19 @@ from app import models
 
 target_metadata = models.Base.metadata
 
+# --------------------------------------------------------
+# Objetos fuera de los modelos (índice de búsqueda, ver app/models.py):
+# que el autogenerate no proponga borrarlos
+# --------------------------------------------------------
+def include_object(obj, name, type_, reflected, compare_to):
+    if type_ == "column" and name == "search_tsv":
+        return False
+    if type_ == "index" and name and name.endswith("_search_tsv"):
+        return False
+    if type_ == "table" and name and name.startswith(models.SEARCH_FTS_TABLE):
+        return False
+    return True
+
 # --------------------------------------------------------
 # URL de la base (desde config.py / .env)
 # --------------------------------------------------------
@@ -49,6 +62,7 @@ def run_migrations_offline() -> None:
         dialect_opts={"paramstyle": "named"},
         compare_type=True,           # detecta cambios en tipos
         compare_server_default=True, # detecta cambios en defaults
+        include_object=include_object,
     )
     with context.begin_transaction():
         context.run_migrations()
@@ -71,6 +85,7 @@ def run_migrations_online() -> None:
             target_metadata=target_metadata,
             compare_type=True,
             compare_server_default=True,
+            include_object=include_object,
         )
         with context.begin_transaction():
             context.run_migrations()
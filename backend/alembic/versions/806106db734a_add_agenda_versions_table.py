@@ -0,0 +1,35 @@
+"""add agenda_versions table (ETag por doctora)
+
+Revision ID: 806106db734a
+Revises: 510dec007313
+Create Date: 2026-10-19 15:02:11.418270+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '806106db734a'
+down_revision: Union[str, Sequence[str], None] = '510dec007313'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'agenda_versions',
+        sa.Column('doctor_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['doctor_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('doctor_id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('agenda_versions')
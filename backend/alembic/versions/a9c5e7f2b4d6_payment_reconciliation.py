@@ -0,0 +1,82 @@
+"""conciliación de pagos: caché de estado PayPhone, hallazgos y marcas de agua
+
+Revision ID: a9c5e7f2b4d6
+Revises: f3b8d1e5a7c2
+Create Date: 2026-10-19 23:11:26.640913+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c5e7f2b4d6'
+down_revision: Union[str, Sequence[str], None] = 'f3b8d1e5a7c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'payphone_transactions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('transaction_id', sa.String(length=60), nullable=False),
+        sa.Column('client_tx_id', sa.String(length=80), nullable=True),
+        sa.Column('transaction_status', sa.String(length=40), nullable=True),
+        sa.Column('status_code', sa.Integer(), nullable=False),
+        sa.Column('approved', sa.Boolean(), nullable=False),
+        sa.Column('amount_cents', sa.Integer(), nullable=False),
+        sa.Column('appointment_ids', sa.JSON(), nullable=True),
+        sa.Column('failed_appointments', sa.JSON(), nullable=True),
+        sa.Column('payment_id', sa.Integer(), nullable=True),
+        sa.Column('checked_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('transaction_id'),
+    )
+    op.create_index(op.f('ix_payphone_transactions_client_tx_id'), 'payphone_transactions', ['client_tx_id'], unique=False)
+    op.create_index(op.f('ix_payphone_transactions_checked_at'), 'payphone_transactions', ['checked_at'], unique=False)
+
+    op.create_table(
+        'reconciliation_issues',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=40), nullable=False),
+        sa.Column('subject', sa.String(length=80), nullable=False),
+        sa.Column('payment_id', sa.Integer(), nullable=True),
+        sa.Column('appointment_id', sa.Integer(), nullable=True),
+        sa.Column('payphone_tx_id', sa.String(length=60), nullable=True),
+        sa.Column('detail', sa.JSON(), nullable=True),
+        sa.Column('detected_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('resolved_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('kind', 'subject', name='uq_reconciliation_kind_subject'),
+    )
+    op.create_index(op.f('ix_reconciliation_issues_kind'), 'reconciliation_issues', ['kind'], unique=False)
+
+    op.create_table(
+        'reconciliation_watermarks',
+        sa.Column('name', sa.String(length=40), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.Column('last_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+    # Barrido de holds vencidos: (hold_until, id) solo sobre pendientes del flujo legado
+    op.create_index(
+        'ix_appointments_pending_hold', 'appointments', ['hold_until', 'id'],
+        postgresql_where=sa.text("status = 'pending' AND client_tx_id IS NOT NULL"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_appointments_pending_hold', table_name='appointments')
+    op.drop_table('reconciliation_watermarks')
+    op.drop_index(op.f('ix_reconciliation_issues_kind'), table_name='reconciliation_issues')
+    op.drop_table('reconciliation_issues')
+    op.drop_index(op.f('ix_payphone_transactions_checked_at'), table_name='payphone_transactions')
+    op.drop_index(op.f('ix_payphone_transactions_client_tx_id'), table_name='payphone_transactions')
+    op.drop_table('payphone_transactions')
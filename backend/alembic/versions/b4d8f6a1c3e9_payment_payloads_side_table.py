@@ -0,0 +1,113 @@
+"""payments.raw_payload -> payment_payloads (comprimido) + payments.appointment_ids
+
+Revision ID: b4d8f6a1c3e9
+Revises: a9c5e7f2b4d6
+Create Date: 2026-10-20 00:02:47.319554+00:00
+
+"""
+import json
+import zlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d8f6a1c3e9'
+down_revision: Union[str, Sequence[str], None] = 'a9c5e7f2b4d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 500
+
+payments = sa.table(
+    'payments',
+    sa.column('id', sa.Integer),
+    sa.column('raw_payload', sa.JSON),
+    sa.column('appointment_ids', sa.JSON),
+)
+payment_payloads = sa.table(
+    'payment_payloads',
+    sa.column('payment_id', sa.Integer),
+    sa.column('codec', sa.String),
+    sa.column('data', sa.LargeBinary),
+)
+
+
+def _appt_ids(payload) -> list:
+    """Mismo formato que optionalParameter3 en app/payphone_processing.py: 'appts=1,2'."""
+    opt3 = str((payload or {}).get("optionalParameter3") or "").strip()
+    if not opt3.startswith("appts="):
+        return []
+    return [int(t) for t in (tok.strip() for tok in opt3[6:].split(",")) if t.isdigit()]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'payment_payloads',
+        sa.Column('payment_id', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=10), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['payment_id'], ['payments.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('payment_id'),
+    )
+    op.add_column('payments', sa.Column('appointment_ids', sa.JSON(), nullable=True))
+
+    # Backfill por lotes (zlib: stdlib, no depende de paquetes opcionales)
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(payments.c.id, payments.c.raw_payload)
+            .where(payments.c.id > last_id)
+            .where(payments.c.raw_payload.is_not(None))
+            .order_by(payments.c.id)
+            .limit(BATCH)
+        ).all()
+        if not rows:
+            break
+        bind.execute(payment_payloads.insert(), [
+            {
+                "payment_id": pid,
+                "codec": "zlib",
+                "data": zlib.compress(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 6),
+            }
+            for pid, payload in rows
+        ])
+        for pid, payload in rows:
+            ids = _appt_ids(payload)
+            if ids:
+                bind.execute(payments.update().where(payments.c.id == pid).values(appointment_ids=ids))
+        last_id = rows[-1][0]
+
+    op.drop_column('payments', 'raw_payload')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('payments', sa.Column('raw_payload', sa.JSON(), nullable=True))
+
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(payment_payloads.c.payment_id, payment_payloads.c.codec, payment_payloads.c.data)
+            .where(payment_payloads.c.payment_id > last_id)
+            .order_by(payment_payloads.c.payment_id)
+            .limit(BATCH)
+        ).all()
+        if not rows:
+            break
+        for pid, codec, data in rows:
+            if codec == "zstd":
+                import zstandard  # filas escritas por la app con el paquete instalado
+                raw = zstandard.ZstdDecompressor().decompress(data)
+            else:
+                raw = zlib.decompress(data)
+            bind.execute(payments.update().where(payments.c.id == pid).values(raw_payload=json.loads(raw)))
+        last_id = rows[-1][0]
+
+    op.drop_column('payments', 'appointment_ids')
+    op.drop_table('payment_payloads')
@@ -0,0 +1,56 @@
+"""add appointment_series (citas recurrentes)
+
+Revision ID: c4e2a9f1d3b7
+Revises: 806106db734a
+Create Date: 2026-10-19 18:20:41.902113+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e2a9f1d3b7'
+down_revision: Union[str, Sequence[str], None] = '806106db734a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'appointment_series',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('doctor_id', sa.Integer(), nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=True),
+        sa.Column('dtstart', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('duration_min', sa.Integer(), nullable=False),
+        sa.Column('rrule', sa.String(length=255), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['doctor_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['patient_id'], ['users.id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['created_by'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_appointment_series_doctor_id', 'appointment_series', ['doctor_id'])
+    op.create_index('ix_appointment_series_patient_id', 'appointment_series', ['patient_id'])
+
+    op.add_column('appointments', sa.Column('series_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'fk_appointments_series_id', 'appointments', 'appointment_series',
+        ['series_id'], ['id'], ondelete='SET NULL',
+    )
+    op.create_index('ix_appointments_series_id', 'appointments', ['series_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_appointments_series_id', table_name='appointments')
+    op.drop_constraint('fk_appointments_series_id', 'appointments', type_='foreignkey')
+    op.drop_column('appointments', 'series_id')
+    op.drop_index('ix_appointment_series_patient_id', table_name='appointment_series')
+    op.drop_index('ix_appointment_series_doctor_id', table_name='appointment_series')
+    op.drop_table('appointment_series')
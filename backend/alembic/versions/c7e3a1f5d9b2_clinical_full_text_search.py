@@ -0,0 +1,77 @@
+"""búsqueda de texto completo: search_tsv + GIN (Postgres) / FTS5 + triggers (SQLite)
+
+Revision ID: c7e3a1f5d9b2
+Revises: b4d8f6a1c3e9
+Create Date: 2026-10-20 00:41:12.508311+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e3a1f5d9b2'
+down_revision: Union[str, Sequence[str], None] = 'b4d8f6a1c3e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Copia congelada de app.models.SEARCH_SOURCES: tabla -> (columnas, rowid_tag)
+SOURCES = {
+    'clinical_histories': ((
+        'antecedentes_personales', 'antecedentes_familiares', 'medicacion_actual',
+        'alergias', 'diagnosticos_previos', 'consumo', 'antecedentes_psico',
+        'notas', 'factores_protectores',
+    ), 0),
+    'therapeutic_plans': (('objetivos', 'frecuencia', 'intervenciones', 'tareas', 'metricas', 'notas'), 1),
+}
+FTS = 'clinical_search'
+
+
+def _document(columns, prefix: str = '') -> str:
+    return " || ' ' || ".join(f"coalesce({prefix}{c}, '')" for c in columns)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, (columns, _) in SOURCES.items():
+            # La columna generada se calcula para las filas existentes al agregarla
+            op.execute(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_tsv tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('spanish'::regconfig, {_document(columns)})) STORED"
+            )
+            op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_search_tsv ON {table} USING gin (search_tsv)")
+        return
+
+    op.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS} USING fts5("
+        "body, patient_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+    )
+    for table, (columns, tag) in SOURCES.items():
+        insert = (
+            f"INSERT INTO {FTS}(rowid, body, patient_id) "
+            f"VALUES (NEW.id * 2 + {tag}, {_document(columns, 'NEW.')}, NEW.patient_id);"
+        )
+        delete = f"DELETE FROM {FTS} WHERE rowid = OLD.id * 2 + {tag};"
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_ai AFTER INSERT ON {table} BEGIN {insert} END")
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_au AFTER UPDATE ON {table} BEGIN {delete} {insert} END")
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_ad AFTER DELETE ON {table} BEGIN {delete} END")
+        op.execute(
+            f"INSERT INTO {FTS}(rowid, body, patient_id) "
+            f"SELECT id * 2 + {tag}, {_document(columns)}, patient_id FROM {table}"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in SOURCES:
+            op.execute(f"DROP INDEX IF EXISTS ix_{table}_search_tsv")
+            op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_tsv")
+        return
+
+    for table in SOURCES:
+        for suffix in ('ai', 'au', 'ad'):
+            op.execute(f"DROP TRIGGER IF EXISTS {table}_search_{suffix}")
+    op.execute(f"DROP TABLE IF EXISTS {FTS}")
@@ -0,0 +1,46 @@
+"""historial de revisiones: clinical_revisions (fotos + diffs)
+
+Revision ID: d1f6b3a8e2c4
+Revises: c7e3a1f5d9b2
+Create Date: 2026-10-20 01:18:36.904127+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1f6b3a8e2c4'
+down_revision: Union[str, Sequence[str], None] = 'c7e3a1f5d9b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Los registros existentes no se copian: su primera edición guarda una
+    # foto 'baseline' con el contenido previo (ver app/revisions.py)
+    op.create_table(
+        'clinical_revisions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=32), nullable=False),
+        sa.Column('record_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('action', sa.String(length=16), nullable=False),
+        sa.Column('is_snapshot', sa.Boolean(), nullable=False),
+        sa.Column('changed_fields', sa.JSON(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=True),
+        sa.Column('codec', sa.String(length=10), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('kind', 'record_id', 'version', name='uq_clinical_revisions_version'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('clinical_revisions')
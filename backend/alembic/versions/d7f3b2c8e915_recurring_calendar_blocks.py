@@ -0,0 +1,36 @@
+"""calendar_blocks: bloqueos recurrentes (rrule + recur_until)
+
+Revision ID: d7f3b2c8e915
+Revises: c4e2a9f1d3b7
+Create Date: 2026-10-19 19:05:12.417730+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7f3b2c8e915'
+down_revision: Union[str, Sequence[str], None] = 'c4e2a9f1d3b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('calendar_blocks', sa.Column('rrule', sa.String(length=255), nullable=True))
+    op.add_column('calendar_blocks', sa.Column('recur_until', sa.DateTime(timezone=True), nullable=True))
+    # Los recurrentes se filtran por (doctor, recur_until) además del rango habitual
+    op.create_index(
+        'ix_calendar_blocks_recurring', 'calendar_blocks', ['doctor_id', 'recur_until'],
+        postgresql_where=sa.text('rrule IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_calendar_blocks_recurring', table_name='calendar_blocks')
+    op.drop_column('calendar_blocks', 'recur_until')
+    op.drop_column('calendar_blocks', 'rrule')
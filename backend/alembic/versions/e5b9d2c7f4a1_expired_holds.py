@@ -0,0 +1,47 @@
+"""lápidas de holds vencidos (expired_holds) para la conciliación
+
+Revision ID: e5b9d2c7f4a1
+Revises: d1f6b3a8e2c4
+Create Date: 2026-10-20 09:42:17.318406+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b9d2c7f4a1'
+down_revision: Union[str, Sequence[str], None] = 'd1f6b3a8e2c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'expired_holds',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('appointment_id', sa.Integer(), nullable=False),
+        sa.Column('client_tx_id', sa.String(length=120), nullable=False),
+        sa.Column('doctor_id', sa.Integer(), nullable=True),
+        sa.Column('patient_id', sa.Integer(), nullable=True),
+        sa.Column('hold_until', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_expired_holds_hold_until', 'expired_holds', ['hold_until', 'id'], unique=False)
+
+    # El barrido ya no lee holds vivos de appointments (se borran al vencer)
+    op.drop_index('ix_appointments_pending_hold', table_name='appointments')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(
+        'ix_appointments_pending_hold', 'appointments', ['hold_until', 'id'],
+        postgresql_where=sa.text("status = 'pending' AND client_tx_id IS NOT NULL"),
+    )
+    op.drop_index('ix_expired_holds_hold_until', table_name='expired_holds')
+    op.drop_table('expired_holds')
@@ -0,0 +1,50 @@
+"""payphone_notifications: cola de notificaciones servidor a servidor
+
+Revision ID: f3b8d1e5a7c2
+Revises: e2a6c4d9b1f3
+Create Date: 2026-10-19 22:03:51.118204+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d1e5a7c2'
+down_revision: Union[str, Sequence[str], None] = 'e2a6c4d9b1f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'payphone_notifications',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('transaction_id', sa.String(length=60), nullable=False),
+        sa.Column('client_tx_id', sa.String(length=80), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('payment_id', sa.Integer(), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('transaction_id'),
+    )
+    # El job periódico solo mira las que faltan procesar
+    op.create_index(
+        'ix_payphone_notifications_due', 'payphone_notifications', ['next_attempt_at'],
+        postgresql_where=sa.text("status IN ('pending', 'processing')"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payphone_notifications_due', table_name='payphone_notifications')
+    op.drop_table('payphone_notifications')
@@ -0,0 +1,582 @@
+# app/agenda_index.py
+"""
+Índice de ocupación en memoria por doctora.
+
+Cada doctora tiene un bitmap de tramos de 5 minutos por día LOCAL (un int
+de 288 bits) más la lista exacta de intervalos de ese día. "¿[s, e) está
+libre?" es un AND de bits; solo si algún tramo está marcado se revisan los
+intervalos del día (tramos parciales, holds vencidos, cita excluida).
+
+- Se construye perezosamente por rango de días (citas activas + bloqueos)
+  y se extiende cuando una consulta cae fuera de lo cargado.
+- Coherencia entre workers: el índice guarda la versión de `agenda_versions`
+  con la que se construyó (ver http_cache). Si la BD tiene otra, se
+  reconstruye. La lectura de versión se comparte con el ETag del request.
+- Las escrituras de ESTE proceso se aplican incrementalmente tras el commit
+  (hooks de sesión) y la versión avanza +1, igual que en la BD.
+- La BD sigue mandando al confirmar: si un chequeo respondido por el índice
+  termina en commit y la versión de la doctora se movió entretanto, se
+  repite la consulta SQL antes de confirmar (409 si ya no está libre).
+"""
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from . import models, recurring_blocks
+from .config import settings
+from .db import SessionLocal
+from .http_cache import BUMPED_KEY, TOUCHED_KEY, agenda_version
+from .slot_engine import BusyIndex, Interval, iter_free_slots
+from .utils.tz import aware_to_local_naive, db_aware_utc, local_naive_to_aware_utc
+
+BUCKET = timedelta(minutes=5)
+BUCKETS_PER_DAY = 24 * 60 // 5
+
+Key = Tuple  # ("appt", id) | ("block", id) | ("block", id, índice de ocurrencia)
+
+_CHANGES_KEY = "agenda_index_changes"   # cambios ya flusheados en la transacción
+_CHECKS_KEY = "agenda_index_checks"     # chequeos "libre" respondidos por el índice
+
+ACTIVE_STATUSES = (models.AppointmentStatus.confirmed, models.AppointmentStatus.pending)
+
+
+# =========================
+# Consulta SQL (la fuente de verdad)
+# =========================
+
+def _active_appt_clause(now_utc: datetime):
+    """Citas que ocupan horario: confirmadas o pending con hold vigente."""
+    return or_(
+        models.Appointment.status == models.AppointmentStatus.confirmed,
+        and_(
+            models.Appointment.status == models.AppointmentStatus.pending,
+            or_(
+                models.Appointment.hold_until == None,  # noqa: E711
+                models.Appointment.hold_until > now_utc,
+            ),
+        ),
+    )
+
+
+def sql_conflict(
+    db: Session,
+    *,
+    doctor_id: int,
+    start_utc: datetime,
+    end_utc: datetime,
+    exclude_appt_ids: Tuple[int, ...] = (),
+    blocks: bool = True,
+) -> bool:
+    """
+    True si [start_utc, end_utc) cruza una cita confirmada, una pending con
+    hold vigente o (si `blocks`) un bloqueo de calendario.
+    """
+    appt_stmt = (
+        select(models.Appointment.id)
+        .where(models.Appointment.doctor_id == doctor_id)
+        .where(models.Appointment.start_at < end_utc)
+        .where(models.Appointment.end_at > start_utc)
+        .where(_active_appt_clause(datetime.now(timezone.utc)))
+    )
+    if exclude_appt_ids:
+        appt_stmt = appt_stmt.where(models.Appointment.id.notin_(exclude_appt_ids))
+    if db.scalar(appt_stmt):
+        return True
+    if not blocks:
+        return False
+    # Bloqueos simples y ocurrencias de los recurrentes
+    return bool(recurring_blocks.doctor_blocks(db, doctor_id, start_utc, end_utc))
+
+
+class _Sweep:
+    """
+    Intervalos ocupados ordenados por inicio + máximo fin acumulado (y de
+    quién): "¿qué pisa [s, e)?" es un bisect, sin fusionar intervalos.
+    """
+
+    def __init__(self, rows: List[Tuple[datetime, datetime, int]]):
+        rows = sorted(rows, key=lambda r: r[0])
+        self.starts = [s for s, _, _ in rows]
+        self.max_end: List[datetime] = []
+        self.who: List[int] = []
+        for _, e, rid in rows:
+            if not self.max_end or e > self.max_end[-1]:
+                self.max_end.append(e); self.who.append(rid)
+            else:
+                self.max_end.append(self.max_end[-1]); self.who.append(self.who[-1])
+
+    def hit(self, s: datetime, e: datetime) -> Optional[int]:
+        j = bisect_left(self.starts, e) - 1
+        if j >= 0 and self.max_end[j] > s:
+            return self.who[j]
+        return None
+
+
+def sql_conflicts_many(
+    db: Session,
+    *,
+    doctor_id: int,
+    intervals: List[Tuple[datetime, datetime]],
+    exclude_appt_ids: Tuple[int, ...] = (),
+    blocks: bool = True,
+) -> List[Optional[Key]]:
+    """
+    Igual que sql_conflict pero para muchos intervalos UTC (series, pagos
+    de varias citas): una consulta de rango para citas y otra para bloqueos
+    sobre [min inicio, max fin), y el cruce se resuelve en memoria. Devuelve,
+    por intervalo, la clave ("appt", id) | ("block", id) de algo que lo
+    pisa, o None.
+    """
+    if not intervals:
+        return []
+    lo = min(s for s, _ in intervals)
+    hi = max(e for _, e in intervals)
+
+    appt_stmt = (
+        select(models.Appointment.id, models.Appointment.start_at, models.Appointment.end_at)
+        .where(models.Appointment.doctor_id == doctor_id)
+        .where(models.Appointment.start_at < hi)
+        .where(models.Appointment.end_at > lo)
+        .where(_active_appt_clause(datetime.now(timezone.utc)))
+    )
+    if exclude_appt_ids:
+        appt_stmt = appt_stmt.where(models.Appointment.id.notin_(exclude_appt_ids))
+    appt_rows = db.execute(appt_stmt)
+    sources = [("appt", [(db_aware_utc(s), db_aware_utc(e), rid) for rid, s, e in appt_rows])]
+    if blocks:
+        sources.append(("block", [(s, e, rid) for rid, _, s, e in recurring_blocks.doctor_blocks(db, doctor_id, lo, hi)]))
+
+    out: List[Optional[Key]] = [None] * len(intervals)
+    for kind, rows in sources:
+        if not rows:
+            continue
+        sweep = _Sweep(rows)
+        for i, (s, e) in enumerate(intervals):
+            if out[i] is None:
+                hit = sweep.hit(s, e)
+                if hit is not None:
+                    out[i] = (kind, hit)
+    return out
+
+
+def recurring_block_conflict(
+    db: Session,
+    *,
+    doctor_id: int,
+    start_utc: datetime,
+    end_utc: datetime,
+    rrule: str,
+    until_utc: Optional[datetime],
+) -> Optional[Tuple[int, datetime]]:
+    """
+    Para crear un bloqueo recurrente: (id de cita, inicio de la ocurrencia)
+    de la primera cita activa que pisa alguna ocurrencia, o None. Una sola
+    consulta de rango [start_utc, until_utc) (sin fin si no hay until); las
+    ocurrencias se expanden solo hasta la última cita encontrada.
+    """
+    stmt = (
+        select(models.Appointment.id, models.Appointment.start_at, models.Appointment.end_at)
+        .where(models.Appointment.doctor_id == doctor_id)
+        .where(models.Appointment.end_at > start_utc)
+        .where(_active_appt_clause(datetime.now(timezone.utc)))
+        .order_by(models.Appointment.start_at)
+    )
+    if until_utc is not None:
+        stmt = stmt.where(models.Appointment.start_at < until_utc)
+    appts = [(rid, db_aware_utc(s), db_aware_utc(e)) for rid, s, e in db.execute(stmt)]
+    if not appts:
+        return None
+    hi = max(e for _, _, e in appts)
+    occurrences = [(s, e, s) for _, s, e in recurring_blocks.expand_row(start_utc, end_utc, rrule, start_utc, hi)]
+    if not occurrences:
+        return None
+    sweep = _Sweep(occurrences)
+    for appt_id, s, e in appts:
+        occ_start = sweep.hit(s, e)
+        if occ_start is not None:
+            return appt_id, occ_start
+    return None
+
+
+# =========================
+# Índice de una doctora
+# =========================
+
+class _Day:
+    __slots__ = ("bits", "entries")
+
+    def __init__(self) -> None:
+        self.bits = 0
+        # (inicio LOCAL, fin LOCAL, clave, vence_utc | None)
+        self.entries: List[Tuple[datetime, datetime, Key, Optional[datetime]]] = []
+
+
+def _mask(day: date, s_local: datetime, e_local: datetime) -> int:
+    """Bits de los tramos de `day` que toca [s_local, e_local)."""
+    midnight = datetime.combine(day, dtime())
+    first = max(0, (s_local - midnight) // BUCKET)
+    last = min(BUCKETS_PER_DAY, -(-(e_local - midnight) // BUCKET))
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def _days_of(s_local: datetime, e_local: datetime) -> Iterator[date]:
+    d = s_local.date()
+    last = (e_local - timedelta(microseconds=1)).date()
+    while d <= last:
+        yield d
+        d += timedelta(days=1)
+
+
+def _local_midnight_utc(d: date) -> datetime:
+    return local_naive_to_aware_utc(datetime.combine(d, dtime()))
+
+
+class AgendaIndex:
+    """Ocupación de UNA doctora para los días cargados [lo, hi)."""
+
+    def __init__(self, doctor_id: int, version: int):
+        self.doctor_id = doctor_id
+        self.version = version
+        self.lo: Optional[date] = None
+        self.hi: Optional[date] = None
+        self._items: Dict[Key, Tuple[datetime, datetime, Optional[datetime]]] = {}
+        self._days: Dict[date, _Day] = {}
+        self.lock = threading.RLock()
+
+    # ---- carga ----
+    def ensure(self, db: Session, start_utc: datetime, end_utc: datetime) -> None:
+        """Carga desde la BD los días de [start_utc, end_utc) que falten."""
+        d0 = aware_to_local_naive(start_utc).date()
+        d1 = aware_to_local_naive(end_utc - timedelta(microseconds=1)).date() + timedelta(days=1)
+        min_span = timedelta(days=max(1, settings.AGENDA_INDEX_LOAD_DAYS))
+        with self.lock:
+            if self.lo is None:
+                self._load(db, d0, max(d1, d0 + min_span))
+                return
+            if d0 < self.lo:
+                self._load(db, d0, self.lo)
+            if d1 > self.hi:
+                self._load(db, self.hi, max(d1, self.hi + min_span))
+
+    def _load(self, db: Session, d0: date, d1: date) -> None:
+        lo_utc, hi_utc = _local_midnight_utc(d0), _local_midnight_utc(d1)
+        appts = db.execute(
+            select(
+                models.Appointment.id, models.Appointment.start_at, models.Appointment.end_at,
+                models.Appointment.status, models.Appointment.hold_until,
+            )
+            .where(models.Appointment.doctor_id == self.doctor_id)
+            .where(models.Appointment.status.in_(ACTIVE_STATUSES))
+            .where(models.Appointment.start_at < hi_utc)
+            .where(models.Appointment.end_at > lo_utc)
+        )
+        for appt_id, s, e, st, hold_until in appts:
+            expires = db_aware_utc(hold_until) if st == models.AppointmentStatus.pending else None
+            self._put(("appt", appt_id), db_aware_utc(s), db_aware_utc(e), expires)
+
+        # Ocurrencias de los recurrentes con clave propia: ("block", id, índice)
+        for block_id, idx, s, e in recurring_blocks.doctor_blocks(db, self.doctor_id, lo_utc, hi_utc):
+            self._put(("block", block_id) if idx is None else ("block", block_id, idx), s, e, None)
+
+        self.lo = d0 if self.lo is None else min(self.lo, d0)
+        self.hi = d1 if self.hi is None else max(self.hi, d1)
+
+    # ---- escritura ----
+    def _put(self, key: Key, s_utc: datetime, e_utc: datetime, expires: Optional[datetime]) -> None:
+        self._drop(key)
+        if e_utc <= s_utc:
+            return
+        self._items[key] = (s_utc, e_utc, expires)
+        s_local, e_local = aware_to_local_naive(s_utc), aware_to_local_naive(e_utc)
+        for d in _days_of(s_local, e_local):
+            day = self._days.get(d)
+            if day is None:
+                day = self._days[d] = _Day()
+            day.entries.append((s_local, e_local, key, expires))
+            day.bits |= _mask(d, s_local, e_local)
+
+    def _drop(self, key: Key) -> None:
+        old = self._items.pop(key, None)
+        if old is None:
+            return
+        s_local, e_local = aware_to_local_naive(old[0]), aware_to_local_naive(old[1])
+        for d in _days_of(s_local, e_local):
+            day = self._days.get(d)
+            if day is None:
+                continue
+            day.entries = [x for x in day.entries if x[2] != key]
+            if not day.entries:
+                del self._days[d]
+                continue
+            bits = 0
+            for es, ee, _, _ in day.entries:
+                bits |= _mask(d, es, ee)
+            day.bits = bits
+
+    def apply(self, key: Key, payload: Optional[Tuple[datetime, datetime, Optional[datetime]]]) -> None:
+        """Aplica un cambio ya confirmado en BD (payload None = ya no ocupa)."""
+        with self.lock:
+            if payload is None:
+                self._drop(key)
+            else:
+                self._put(key, *payload)
+
+    # ---- lectura ----
+    def is_free(
+        self,
+        start_utc: datetime,
+        end_utc: datetime,
+        *,
+        now_utc: datetime,
+        exclude_appt_id: Optional[int] = None,
+        blocks: bool = True,
+    ) -> bool:
+        s_local, e_local = aware_to_local_naive(start_utc), aware_to_local_naive(end_utc)
+        exclude = ("appt", exclude_appt_id) if exclude_appt_id else None
+        with self.lock:
+            for d in _days_of(s_local, e_local):
+                day = self._days.get(d)
+                if day is None or not day.bits & _mask(d, s_local, e_local):
+                    continue
+                # Algún tramo marcado: decide la lista exacta del día
+                for es, ee, key, expires in day.entries:
+                    if key == exclude or (not blocks and key[0] == "block"):
+                        continue
+                    if expires is not None and expires <= now_utc:
+                        continue
+                    if es < e_local and ee > s_local:
+                        return False
+        return True
+
+    def busy_local(self, start_utc: datetime, end_utc: datetime, now_utc: datetime) -> List[Interval]:
+        """Intervalos ocupados (LOCAL naive) que cruzan [start_utc, end_utc)."""
+        s_local, e_local = aware_to_local_naive(start_utc), aware_to_local_naive(end_utc)
+        seen: set = set()
+        out: List[Interval] = []
+        with self.lock:
+            for d in _days_of(s_local, e_local):
+                day = self._days.get(d)
+                if day is None:
+                    continue
+                for es, ee, key, expires in day.entries:
+                    if key in seen or (expires is not None and expires <= now_utc):
+                        continue
+                    seen.add(key)
+                    if es < e_local and ee > s_local:
+                        out.append((es, ee))
+        return out
+
+    def free_slots(
+        self,
+        *,
+        ranges_by_wd: dict,
+        df_local: datetime,
+        dt_local: datetime,
+        step: timedelta,
+        now_local: datetime,
+        now_utc: datetime,
+    ) -> Iterator[Interval]:
+        """Slots libres de duración `step` en [df_local, dt_local) (motor de slot_engine)."""
+        busy = BusyIndex(self.busy_local(
+            local_naive_to_aware_utc(df_local), local_naive_to_aware_utc(dt_local), now_utc,
+        ))
+        return iter_free_slots(
+            ranges_by_wd=ranges_by_wd, busy_local=busy, df_local=df_local,
+            dt_local=dt_local, step=step, now_local=now_local,
+        )
+
+
+# =========================
+# Registro por proceso
+# =========================
+
+_INDEXES: "OrderedDict[int, AgendaIndex]" = OrderedDict()
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_index(db: Session, doctor_id: int, start_utc: datetime, end_utc: datetime) -> Optional[AgendaIndex]:
+    """
+    Índice de la doctora al día con la versión de la BD y con el rango
+    cargado. None si está deshabilitado o si esta transacción ya tiene
+    cambios sin confirmar de la doctora (ahí responde el SQL).
+    """
+    if not settings.AGENDA_INDEX_ENABLED or _has_pending_changes(db, doctor_id):
+        return None
+    version = agenda_version(db, doctor_id)
+    with _REGISTRY_LOCK:
+        idx = _INDEXES.get(doctor_id)
+        if idx is None or idx.version != version:
+            idx = _INDEXES[doctor_id] = AgendaIndex(doctor_id, version)
+        _INDEXES.move_to_end(doctor_id)
+        while len(_INDEXES) > max(1, settings.AGENDA_INDEX_MAX_DOCTORS):
+            _INDEXES.popitem(last=False)
+    idx.ensure(db, start_utc, end_utc)
+    return idx
+
+
+def invalidate(doctor_id: Optional[int] = None) -> None:
+    """Descarta el índice de una doctora (o todos)."""
+    with _REGISTRY_LOCK:
+        if doctor_id is None:
+            _INDEXES.clear()
+        else:
+            _INDEXES.pop(doctor_id, None)
+
+
+def has_conflict(
+    db: Session,
+    *,
+    doctor_id: int,
+    start_utc: datetime,
+    end_utc: datetime,
+    exclude_appt_id: Optional[int] = None,
+    blocks: bool = True,
+) -> bool:
+    """
+    Chequeo de conflicto para los endpoints de escritura: responde el índice
+    (microsegundos) y, si dice "libre", se registra para revalidar contra la
+    BD en el commit si otra escritura se coló entretanto.
+    """
+    idx = get_index(db, doctor_id, start_utc, end_utc)
+    if idx is None:
+        excl = (exclude_appt_id,) if exclude_appt_id else ()
+        return sql_conflict(db, doctor_id=doctor_id, start_utc=start_utc, end_utc=end_utc,
+                            exclude_appt_ids=excl, blocks=blocks)
+    now_utc = datetime.now(timezone.utc)
+    if not idx.is_free(start_utc, end_utc, now_utc=now_utc, exclude_appt_id=exclude_appt_id, blocks=blocks):
+        return True
+    db.info.setdefault(_CHECKS_KEY, []).append(
+        (doctor_id, agenda_version(db, doctor_id), start_utc, end_utc, exclude_appt_id, blocks)
+    )
+    return False
+
+
+# =========================
+# Hooks de sesión
+# =========================
+
+def _has_pending_changes(db: Session, doctor_id: int) -> bool:
+    return any(doctor_id in doctors for doctors, _ in db.info.get(_CHANGES_KEY, {}).values())
+
+
+def _change_of(obj, deleted: bool) -> Optional[Tuple[Key, set, Optional[tuple]]]:
+    state = inspect(obj)
+    d = state.dict  # sin lazy-loads (objetos borrados/expirados)
+    key_id = d.get("id") or (state.identity[0] if state.identity else None)
+    if key_id is None:
+        return None
+    doctors = {int(x) for x in [d.get("doctor_id"), *(state.attrs.doctor_id.history.deleted or ())] if x}
+    kind = "appt" if isinstance(obj, models.Appointment) else "block"
+    if kind == "block" and (d.get("rrule") or "rrule" not in d):
+        return (kind, key_id), doctors, ...  # recurrente (o no se sabe): muchas ocurrencias, recargar
+    if deleted:
+        return (kind, key_id), doctors, None
+    if "start_at" not in d or "end_at" not in d or (kind == "appt" and "status" not in d):
+        return (kind, key_id), doctors, ...  # no sabemos el estado final: invalidar
+    if kind == "appt":
+        st = d["status"]
+        if st not in ACTIVE_STATUSES:
+            return (kind, key_id), doctors, None
+        expires = db_aware_utc(d.get("hold_until")) if st == models.AppointmentStatus.pending else None
+        return (kind, key_id), doctors, (db_aware_utc(d["start_at"]), db_aware_utc(d["end_at"]), expires)
+    return (kind, key_id), doctors, (db_aware_utc(d["start_at"]), db_aware_utc(d["end_at"]), None)
+
+
+def record_bulk_insert(db: Session, objs) -> None:
+    """
+    Registra filas creadas con INSERT ... RETURNING (no pasan por el flush
+    del ORM) para aplicarlas al índice tras el commit, como las demás.
+    """
+    changes = db.info.setdefault(_CHANGES_KEY, {})
+    for obj in objs:
+        change = _change_of(obj, False)
+        if change is not None:
+            key, doctors, payload = change
+            changes[key] = (doctors | changes.get(key, (set(), None))[0], payload)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session: Session, flush_context) -> None:
+    changes = None
+    deleted = set(session.deleted)
+    for obj in list(session.new) + list(session.dirty) + list(deleted):
+        if not isinstance(obj, (models.Appointment, models.CalendarBlock)):
+            continue
+        change = _change_of(obj, obj in deleted)
+        if change is None:
+            continue
+        if changes is None:
+            changes = session.info.setdefault(_CHANGES_KEY, {})
+        key, doctors, payload = change
+        prev_doctors = changes.get(key, (set(), None))[0]
+        changes[key] = (doctors | prev_doctors, payload)
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _revalidate_checks(session: Session) -> None:
+    """
+    Corre después del bump de http_cache (se registra luego). Si la versión
+    de la doctora no es la leída (+1 por este commit), otra escritura se coló
+    desde el chequeo: se repite la consulta SQL. En Postgres la fila de
+    agenda_versions ya quedó bloqueada por el bump, así que nadie más puede
+    confirmar cambios de esa doctora hasta que terminemos.
+    """
+    checks = session.info.pop(_CHECKS_KEY, None)
+    if not checks:
+        return
+    bumped = session.info.get(BUMPED_KEY, set())
+    own = session.info.get(_CHANGES_KEY, {})
+    current: Dict[int, int] = {}
+    for doctor_id, seen, s, e, exclude_id, blocks in checks:
+        if doctor_id not in current:
+            current[doctor_id] = agenda_version(session, doctor_id, fresh=True)
+        if current[doctor_id] == seen + (1 if doctor_id in bumped else 0):
+            continue
+        own_appts = tuple(k[1] for k, (docs, _) in own.items() if k[0] == "appt" and doctor_id in docs)
+        excl = own_appts + ((exclude_id,) if exclude_id else ())
+        if sql_conflict(session, doctor_id=doctor_id, start_utc=s, end_utc=e,
+                        exclude_appt_ids=excl, blocks=blocks):
+            raise HTTPException(status_code=409, detail="El horario ya no está disponible")
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_committed(session: Session) -> None:
+    changes = session.info.pop(_CHANGES_KEY, None) or {}
+    touched = session.info.pop(TOUCHED_KEY, None) or set()
+    bumped = session.info.get(BUMPED_KEY) or set()
+    if not bumped:
+        return
+    by_doctor: Dict[int, list] = {}
+    for key, (doctors, payload) in changes.items():
+        for doctor_id in doctors:
+            by_doctor.setdefault(doctor_id, []).append((key, payload))
+
+    with _REGISTRY_LOCK:
+        targets = [(d, _INDEXES.get(d)) for d in bumped]
+    for doctor_id, idx in targets:
+        if idx is None:
+            continue
+        items = by_doctor.get(doctor_id, [])
+        if doctor_id in touched or any(p is ... for _, p in items):
+            invalidate(doctor_id)
+            continue
+        with idx.lock:
+            for key, payload in items:
+                idx.apply(key, payload)
+            idx.version += 1
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_on_rollback(session: Session, previous_transaction) -> None:
+    session.info.pop(_CHANGES_KEY, None)
+    session.info.pop(_CHECKS_KEY, None)
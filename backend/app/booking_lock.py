@@ -0,0 +1,157 @@
+# app/booking_lock.py
+"""
+Candado de reservas por doctora.
+
+Toda mutación de reservas (hold, crear, confirmar, reagendar, confirmar
+pago) toma primero el candado de la(s) doctora(s) y lo mantiene hasta el
+fin de la transacción. Así, entre el chequeo de conflictos y el commit no
+se cuela otra escritura de la misma agenda y basta UN chequeo.
+
+- Postgres: `pg_try_advisory_xact_lock(ns, doctor_id)`; lo suelta la BD al
+  hacer commit/rollback (sirve entre workers y procesos).
+- Otros dialectos (SQLite en dev/pruebas): un threading.Lock por doctora
+  en el proceso, liberado por hooks de sesión al terminar la transacción.
+  SQLite ya serializa escritores entre procesos.
+
+Se intenta sin bloquear y se reintenta con espera corta: bloquear el
+event loop esperando el candado frenaría a las demás corrutinas. La espera
+se mide en `booking_lock_wait_seconds` (y en Server-Timing como `lock`).
+
+La sección con candado no hace red: las rutas confirman y hacen commit
+(suelta el candado) y recién después llaman a Zoom; el link se guarda en
+una segunda transacción corta.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List
+
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .db import SessionLocal
+from .metrics import record_lock_wait
+
+# Espacio de claves propio para los advisory locks ("CITA")
+_NAMESPACE = 0x43495441 & 0x7FFFFFFF
+
+_HELD_KEY = "booking_locks_held"      # doctoras con candado en esta transacción
+_LOCAL_KEY = "booking_locks_local"    # threading.Lock a soltar al terminar
+
+_LOCAL_LOCKS: Dict[int, threading.Lock] = {}
+_LOCAL_LOCKS_GUARD = threading.Lock()
+
+
+def _backend(db: Session) -> str:
+    return "advisory" if db.get_bind().dialect.name == "postgresql" else "local"
+
+
+def _local_lock(doctor_id: int) -> threading.Lock:
+    with _LOCAL_LOCKS_GUARD:
+        lock = _LOCAL_LOCKS.get(doctor_id)
+        if lock is None:
+            lock = _LOCAL_LOCKS[doctor_id] = threading.Lock()
+        return lock
+
+
+def _try_acquire(db: Session, backend: str, doctor_id: int) -> bool:
+    if backend == "advisory":
+        return bool(db.scalar(
+            text("SELECT pg_try_advisory_xact_lock(:ns, :doctor_id)"),
+            {"ns": _NAMESPACE, "doctor_id": doctor_id},
+        ))
+    lock = _local_lock(doctor_id)
+    if not lock.acquire(blocking=False):
+        return False
+    db.info.setdefault(_LOCAL_KEY, []).append(lock)
+    return True
+
+
+def _pending(db: Session, doctor_ids: Iterable[int]) -> List[int]:
+    held = db.info.setdefault(_HELD_KEY, set())
+    return [d for d in sorted({int(x) for x in doctor_ids if x}) if d not in held]
+
+
+def _delays() -> Iterator[float]:
+    delay = 0.002
+    while True:
+        yield delay
+        delay = min(delay * 2, 0.05)
+
+
+def _timeout(backend: str, waited: float) -> HTTPException:
+    record_lock_wait(backend, "timeout", waited)
+    return HTTPException(
+        status_code=503,
+        detail="La agenda está ocupada con otra reserva; intenta de nuevo.",
+        headers={"Retry-After": "1"},
+    )
+
+
+def lock_doctors(db: Session, doctor_ids: Iterable[int]) -> None:
+    """
+    Toma el candado de cada doctora (en orden de id, sin deadlocks entre
+    requests) hasta el fin de la transacción. Idempotente por sesión.
+    Para endpoints síncronos (corren en el threadpool).
+    """
+    todo = _pending(db, doctor_ids)
+    if not todo:
+        return
+    backend = _backend(db)
+    db.connection()  # abre la transacción: los hooks de fin sueltan el candado
+    t0 = time.perf_counter()
+    deadline = t0 + settings.BOOKING_LOCK_TIMEOUT_SECONDS
+    delays = _delays()
+    for doctor_id in todo:
+        while not _try_acquire(db, backend, doctor_id):
+            if time.perf_counter() >= deadline:
+                raise _timeout(backend, time.perf_counter() - t0)
+            time.sleep(next(delays))
+        db.info[_HELD_KEY].add(doctor_id)
+    record_lock_wait(backend, "acquired", time.perf_counter() - t0)
+
+
+async def lock_doctors_async(db: Session, doctor_ids: Iterable[int]) -> None:
+    """Igual que lock_doctors, pero espera cediendo el event loop."""
+    todo = _pending(db, doctor_ids)
+    if not todo:
+        return
+    backend = _backend(db)
+    db.connection()
+    t0 = time.perf_counter()
+    deadline = t0 + settings.BOOKING_LOCK_TIMEOUT_SECONDS
+    delays = _delays()
+    for doctor_id in todo:
+        while not _try_acquire(db, backend, doctor_id):
+            if time.perf_counter() >= deadline:
+                raise _timeout(backend, time.perf_counter() - t0)
+            await asyncio.sleep(next(delays))
+        db.info[_HELD_KEY].add(doctor_id)
+    record_lock_wait(backend, "acquired", time.perf_counter() - t0)
+
+
+def lock_doctor(db: Session, doctor_id: int) -> None:
+    lock_doctors(db, [doctor_id])
+
+
+async def lock_doctor_async(db: Session, doctor_id: int) -> None:
+    await lock_doctors_async(db, [doctor_id])
+
+
+# =========================
+# Hooks de sesión
+# =========================
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _release(session: Session, transaction) -> None:
+    # commit, rollback o close(); los savepoints no sueltan nada.
+    # Los advisory xact locks ya los soltó la BD; acá solo los locales.
+    if transaction.parent is not None:
+        return
+    session.info.pop(_HELD_KEY, None)
+    for lock in session.info.pop(_LOCAL_KEY, ()):
+        lock.release()
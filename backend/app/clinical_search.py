@@ -0,0 +1,165 @@
+# app/clinical_search.py
+"""
+Búsqueda de texto completo en historias clínicas y planes terapéuticos
+(GET /search/clinical).
+
+- Postgres: `websearch_to_tsquery('spanish', q)` contra la columna
+  generada `search_tsv` (índice GIN); orden por ts_rank_cd y extractos con
+  ts_headline, calculados solo para la página pedida.
+- SQLite (dev/pruebas): tabla FTS5 `clinical_search`; cada palabra se busca
+  como prefijo (suple en parte la falta de stemming) y orden por bm25.
+
+Solo devuelve id, paciente, fecha y un extracto resaltado: el texto
+completo queda en la BD. El extracto llega escapado para HTML con las
+coincidencias entre <mark>...</mark>.
+"""
+from __future__ import annotations
+
+import html
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .models import SEARCH_FTS_TABLE, SEARCH_SOURCES
+
+# Delimitadores del motor (uso privado de Unicode: no aparecen en notas)
+_START, _STOP = "\ue000", "\ue001"
+_SNIPPET_WORDS = 24
+_HEADLINE_OPTS = (
+    f"StartSel={_START}, StopSel={_STOP}, MaxWords={_SNIPPET_WORDS}, MinWords=8, "
+    "MaxFragments=2, FragmentDelimiter=\" … \""
+)
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class SearchPage:
+    items: List[Dict[str, Any]]
+    has_more: bool
+
+
+def _highlight(raw: Optional[str]) -> str:
+    return html.escape(raw or "").replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def _scope_sql(alias: str, patient_id: Optional[int]) -> str:
+    cond = f"{alias}.patient_id IN (SELECT id FROM users WHERE doctor_id = :doctor_id)"
+    if patient_id is not None:
+        cond += f" AND {alias}.patient_id = :patient_id"
+    return cond
+
+
+# =========================
+# Postgres
+# =========================
+
+def _search_postgres(db: Session, params: Dict[str, Any], kinds: Sequence[str], patient_id: Optional[int]) -> list:
+    # La consulta va en línea (constante para el planner => usa el GIN)
+    tsq = "websearch_to_tsquery('spanish', :q)"
+    hits = " UNION ALL ".join(
+        f"SELECT '{kind}' AS kind, t.id, t.patient_id, t.updated_at, ts_rank_cd(t.search_tsv, {tsq}) AS rank "
+        f"FROM {SEARCH_SOURCES[kind].table} t "
+        f"WHERE t.search_tsv @@ {tsq} AND {_scope_sql('t', patient_id)}"
+        for kind in kinds
+    )
+    joins = " ".join(
+        f"LEFT JOIN {SEARCH_SOURCES[kind].table} s{i} ON h.kind = '{kind}' AND s{i}.id = h.id"
+        for i, kind in enumerate(kinds)
+    )
+    document = "CASE h.kind " + " ".join(
+        f"WHEN '{kind}' THEN {SEARCH_SOURCES[kind].document_sql(f's{i}.')}"
+        for i, kind in enumerate(kinds)
+    ) + " END"
+    sql = f"""
+        WITH page AS (
+            SELECT * FROM ({hits}) h
+            ORDER BY rank DESC, updated_at DESC, id DESC
+            LIMIT :limit OFFSET :skip
+        )
+        SELECT h.kind, h.id, h.patient_id, u.name AS patient_name, h.updated_at, h.rank,
+               ts_headline('spanish', {document}, {tsq}, :opts) AS snippet
+        FROM page h
+        JOIN users u ON u.id = h.patient_id
+        {joins}
+        ORDER BY h.rank DESC, h.updated_at DESC, h.id DESC
+    """
+    return list(db.execute(text(sql), {**params, "opts": _HEADLINE_OPTS}).mappings())
+
+
+# =========================
+# SQLite FTS5
+# =========================
+
+def _fts_query(q: str) -> str:
+    """Cada palabra entre comillas y como prefijo; todas deben aparecer (AND)."""
+    return " ".join(f'"{tok}"*' for tok in _TOKEN.findall(q))
+
+
+def _search_sqlite(db: Session, params: Dict[str, Any], kinds: Sequence[str], patient_id: Optional[int]) -> list:
+    match = _fts_query(params["q"])
+    if not match:
+        return []
+    tags = ", ".join(str(SEARCH_SOURCES[k].rowid_tag) for k in kinds)
+    joins = " ".join(
+        f"LEFT JOIN {src.table} s{i} ON s{i}.id = f.rowid / 2 AND f.rowid % 2 = {src.rowid_tag}"
+        for i, src in enumerate(SEARCH_SOURCES.values())
+    )
+    kind_case = "CASE f.rowid % 2 " + " ".join(
+        f"WHEN {src.rowid_tag} THEN '{kind}'" for kind, src in SEARCH_SOURCES.items()
+    ) + " END"
+    updated = "coalesce(" + ", ".join(f"s{i}.updated_at" for i in range(len(SEARCH_SOURCES))) + ")"
+    sql = f"""
+        SELECT {kind_case} AS kind, f.rowid / 2 AS id, f.patient_id, u.name AS patient_name,
+               {updated} AS updated_at, -bm25({SEARCH_FTS_TABLE}) AS rank,
+               snippet({SEARCH_FTS_TABLE}, 0, :start, :stop, ' … ', :words) AS snippet
+        FROM {SEARCH_FTS_TABLE} f
+        JOIN users u ON u.id = f.patient_id
+        {joins}
+        WHERE {SEARCH_FTS_TABLE} MATCH :match
+          AND f.rowid % 2 IN ({tags})
+          AND {_scope_sql('f', patient_id)}
+        ORDER BY bm25({SEARCH_FTS_TABLE}), f.rowid DESC
+        LIMIT :limit OFFSET :skip
+    """
+    return list(db.execute(text(sql), {
+        **params, "match": match, "start": _START, "stop": _STOP, "words": _SNIPPET_WORDS,
+    }).mappings())
+
+
+# =========================
+# API
+# =========================
+
+def search(
+    db: Session,
+    *,
+    doctor_id: int,
+    q: str,
+    kinds: Sequence[str] = tuple(SEARCH_SOURCES),
+    patient_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 20,
+) -> SearchPage:
+    """Una página de coincidencias entre los pacientes de `doctor_id`, mejores primero."""
+    params: Dict[str, Any] = {
+        "q": q, "doctor_id": doctor_id, "patient_id": patient_id,
+        "skip": skip, "limit": limit + 1,  # una de más para saber si hay otra página
+    }
+    run = _search_postgres if db.get_bind().dialect.name == "postgresql" else _search_sqlite
+    rows = run(db, params, list(kinds), patient_id)
+    items = [
+        {
+            "kind": r["kind"],
+            "id": r["id"],
+            "patient_id": r["patient_id"],
+            "patient_name": r["patient_name"],
+            "updated_at": r["updated_at"],
+            "rank": float(r["rank"] or 0),
+            "snippet": _highlight(r["snippet"]),
+        }
+        for r in rows[:limit]
+    ]
+    return SearchPage(items=items, has_more=len(rows) > limit)
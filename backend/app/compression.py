@@ -0,0 +1,234 @@
+# app/compression.py
+"""
+Middleware ASGI de compresión de respuestas (brotli / gzip).
+
+- Negocia con Accept-Encoding respetando los q, `*` e `identity;q=0`; a
+  igual q prefiere br (si el paquete `brotli` está instalado).
+- Solo comprime content-types de la allowlist (JSON, HTML, texto...).
+- Respuestas de un solo bloque: se comprimen solo si superan `minimum_size`.
+- Respuestas en streaming (varios bloques): se comprimen al vuelo con flush
+  por bloque, así el cliente recibe cada trozo sin esperar al final.
+- No toca respuestas que ya traen Content-Encoding ni los 304/204.
+- Toda respuesta comprimible lleva `Vary: Accept-Encoding`, también las que
+  salen sin comprimir (cuerpo chico o cliente sin gzip/br): una caché
+  compartida no debe servirlas a clientes con otro Accept-Encoding.
+"""
+from __future__ import annotations
+
+import zlib
+from typing import Iterable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:  # dependencia opcional
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - depende del entorno
+    brotli = None
+
+
+DEFAULT_CONTENT_TYPES = (
+    "application/json",
+    "application/problem+json",
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/csv",
+    "application/javascript",
+)
+
+
+# =========================
+# Compresores
+# =========================
+
+class _GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self, level: int):
+        # wbits=31 => contenedor gzip (cabecera + CRC)
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    encoding = "br"
+
+    def __init__(self, quality: int):
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+def _accepted_encodings(accept_encoding: str) -> dict[str, float]:
+    """Parsea 'gzip;q=0.8, br, *;q=0' -> {'gzip': 0.8, 'br': 1.0, '*': 0.0}."""
+    out: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, *params = part.split(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() != "q":
+                continue
+            try:
+                q = min(max(float(value.strip()), 0.0), 1.0)
+            except ValueError:
+                q = 0.0
+        out[token] = q
+    return out
+
+
+def _negotiate(accepted: dict[str, float], codings: Iterable[str]) -> tuple[Optional[str], bool]:
+    """
+    (códec, forzar) para un Accept-Encoding parseado. `codings` va en orden
+    de preferencia del servidor (desempata a igual q). Un códec no listado
+    toma el q de `*`; `identity` solo compite si aparece (él o `*`).
+    `forzar` = identity prohibido: hay que comprimir aunque sea chico.
+    """
+    best, best_q = None, 0.0
+    for coding in codings:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    identity_q = accepted.get("identity", accepted.get("*"))
+    if best is None or (identity_q is not None and identity_q > best_q):
+        return None, False
+    return best, identity_q == 0
+
+
+# =========================
+# Middleware
+# =========================
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        minimum_size: int = 1024,
+        content_types: Iterable[str] = DEFAULT_CONTENT_TYPES,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        enable_brotli: bool = True,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = tuple(ct.lower() for ct in content_types)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.enable_brotli = enable_brotli and brotli is not None
+
+    def _pick_encoding(self, scope: Scope) -> tuple[Optional[str], bool]:
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        return _negotiate(accepted, ("br", "gzip") if self.enable_brotli else ("gzip",))
+
+    def _new_compressor(self, encoding: str):
+        if encoding == "br":
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.gzip_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Sin códec igual pasa por el responder: agrega Vary a lo comprimible
+        encoding, force = self._pick_encoding(scope)
+        responder = _CompressionResponder(self, encoding, send, force=force)
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+    def __init__(self, mw: CompressionMiddleware, encoding: Optional[str], send: Send, *, force: bool = False):
+        self.mw = mw
+        self.encoding = encoding
+        self.force = force  # identity prohibido: sin mínimo ni allowlist
+        self.send = send
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+        self.compressor = None  # se crea al decidir comprimir
+
+    def _eligible(self, message: Message) -> bool:
+        if message["status"] in (204, 304) or message["status"] < 200:
+            return False
+        headers = Headers(raw=message["headers"])
+        if "content-encoding" in headers:
+            return False
+        if self.force:
+            return True
+        ctype = headers.get("content-type", "").split(";")[0].strip().lower()
+        return ctype in self.mw.content_types
+
+    def _start_compressed(self, *, content_length: Optional[int]) -> Message:
+        assert self.start_message is not None
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        if content_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(content_length)
+        # Un ETag fuerte deja de ser válido al cambiar los bytes
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        return self.start_message
+
+    async def __call__(self, message: Message) -> None:
+        mtype = message["type"]
+
+        if mtype == "http.response.start":
+            self.start_message = message
+            eligible = self._eligible(message)
+            if eligible:
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+            self.passthrough = not eligible or self.encoding is None
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if mtype != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            if not more_body:
+                # Respuesta completa en un solo bloque
+                if len(body) < self.mw.minimum_size and not self.force:
+                    await self.send(self.start_message)
+                    await self.send(message)
+                    return
+                c = self.mw._new_compressor(self.encoding)
+                data = c.compress(body) + c.finish()
+                await self.send(self._start_compressed(content_length=len(data)))
+                await self.send({"type": "http.response.body", "body": data, "more_body": False})
+                return
+
+            # Streaming: comprimimos al vuelo, sin Content-Length
+            self.compressor = self.mw._new_compressor(self.encoding)
+            await self.send(self._start_compressed(content_length=None))
+
+        if more_body:
+            data = self.compressor.compress(body) + self.compressor.flush()
+        else:
+            data = self.compressor.compress(body) + self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -23,6 +23,7 @@ class Settings(BaseSettings):
     ZOOM_CLIENT_SECRET: str
     ZOOM_DEFAULT_USER: str
     ZOOM_API_BASE: str = "https://api.zoom.us/v2"
+    ZOOM_OAUTH_URL: str = "https://zoom.us/oauth/token"
 
     # =====================================================
     # 💳 PayPhone (Pasarela de pagos)
@@ -30,6 +31,121 @@ class Settings(BaseSettings):
     PAYPHONE_PRIVATE_TOKEN: str | None = None
     PAYPHONE_CONFIRM_URL: str = "https://pay.payphonetodoesposible.com/api/button/V2/Confirm"
     PAYPHONE_STORE_ID: str | None = None
+    PAYPHONE_PROVISION_CONCURRENCY: int = 4   # reuniones Zoom creadas en paralelo al confirmar un pago
+    # Notificación servidor a servidor (POST /payments/payphone/notify?token=...)
+    PAYPHONE_WEBHOOK_TOKEN: str | None = None  # sin token el endpoint queda deshabilitado
+    PAYPHONE_NOTIFY_SWEEP_SECONDS: int = 60    # job que reintenta las pendientes
+    PAYPHONE_NOTIFY_MAX_ATTEMPTS: int = 8      # luego queda 'failed' (una nueva notificación la reactiva)
+
+    # =====================================================
+    # 🧾 Conciliación de pagos (app/reconciliation.py)
+    # =====================================================
+    RECONCILIATION_INTERVAL_MINUTES: int = 15    # 0 => sin job periódico
+    RECONCILIATION_BATCH_SIZE: int = 500
+    RECONCILIATION_MAX_BATCHES: int = 20         # por barrido y corrida
+    RECONCILIATION_HOLD_GRACE_MINUTES: int = 30  # hold vencido hace más que esto sin pago
+
+    # =====================================================
+    # 🗃️ Caché HTTP (ETag de agenda)
+    # =====================================================
+    # Ventana (segundos) que se suma al ETag de endpoints que dependen de la
+    # hora actual (slots pasados, holds que vencen).
+    AGENDA_ETAG_WINDOW_SECONDS: int = 30
+
+    # =====================================================
+    # 🧮 Motor de slots
+    # =====================================================
+    # "python" (por defecto) o "numpy" (vectorizado; conviene en ventanas
+    # largas y requiere `pip install numpy`, que no está en requirements.txt;
+    # sin él se usa el de Python con un aviso). /availability/next usa siempre
+    # el de Python porque corta en cuanto encuentra N slots.
+    SLOT_ENGINE: str = "python"
+
+    # =====================================================
+    # 🗂️ Índice de ocupación en memoria (app/agenda_index.py)
+    # =====================================================
+    AGENDA_INDEX_ENABLED: bool = True
+    AGENDA_INDEX_MAX_DOCTORS: int = 256       # LRU por proceso
+    AGENDA_INDEX_LOAD_DAYS: int = 62          # días mínimos que se cargan de una vez
+
+    # =====================================================
+    # 🗜️ Compresión de respuestas (gzip / brotli)
+    # =====================================================
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024           # bytes; debajo de esto no compensa
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_ENABLED: bool = True    # requiere el paquete `brotli`
+    COMPRESSION_BROTLI_QUALITY: int = 4        # 4-5: buen ratio con poco CPU para JSON dinámico
+    COMPRESSION_CONTENT_TYPES: list[str] = [
+        "application/json",
+        "application/problem+json",
+        "text/html",
+        "text/plain",
+        "text/css",
+        "text/csv",
+        "application/javascript",
+    ]
+
+    # =====================================================
+    # 📡 Eventos de agenda (SSE)
+    # =====================================================
+    AGENDA_EVENTS_HEARTBEAT_SECONDS: int = 15
+    # True => fan-out entre workers vía Postgres LISTEN/NOTIFY
+    AGENDA_EVENTS_PG_NOTIFY: bool = False
+
+    # =====================================================
+    # 📈 Métricas (Prometheus en /metrics)
+    # =====================================================
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str | None = None          # si se define, /metrics exige Bearer <token>
+    METRICS_SERVER_TIMING: bool = False       # agrega Server-Timing y X-DB-Statements a cada respuesta
+
+    # =====================================================
+    # 🐢 Detector de consultas lentas / N+1 (dev y staging)
+    # =====================================================
+    QUERY_WATCH_ENABLED: bool = False
+    QUERY_WATCH_SLOW_MS: int = 200            # loguea sentencias más lentas que esto
+    QUERY_WATCH_N1_THRESHOLD: int = 5         # misma huella repetida N veces en un request/job
+
+    # =====================================================
+    # 🔒 Candado de reservas por doctora (app/booking_lock.py)
+    # =====================================================
+    BOOKING_LOCK_TIMEOUT_SECONDS: float = 10.0  # luego 503 "agenda ocupada"
+
+    # =====================================================
+    # 🔁 Series de citas recurrentes (POST /appointments/series)
+    # =====================================================
+    SERIES_MAX_OCCURRENCES: int = 52          # tope de ocurrencias por serie
+    SERIES_PROVISION_CONCURRENCY: int = 4     # reuniones Zoom creadas en paralelo
+
+    # =====================================================
+    # 🔑 Idempotency-Key (app/idempotency.py)
+    # =====================================================
+    IDEMPOTENCY_ENABLED: bool = True
+    IDEMPOTENCY_TTL_HOURS: int = 24           # cuánto se recuerda una respuesta
+    IDEMPOTENCY_LOCK_SECONDS: int = 60        # un "en curso" más viejo se puede retomar
+    # Rutas POST (regex sobre el path) que aceptan la cabecera
+    IDEMPOTENCY_PATHS: list[str] = [
+        r"^/appointments$",
+        r"^/appointments/series$",
+        r"^/appointments/hold$",
+        r"^/appointments/\d+/(confirm|reschedule)$",
+        r"^/payments/payphone/confirm$",
+    ]
+
+    # =====================================================
+    # 📝 Historias clínicas y planes (listados)
+    # =====================================================
+    # Los listados devuelven un resumen (id, paciente, fechas y un extracto);
+    # el texto completo solo en GET /{id} o pidiéndolo con ?fields=
+    CLINICAL_SNIPPET_CHARS: int = 160
+
+    # =====================================================
+    # 🕘 Historial de revisiones clínicas (app/revisions.py)
+    # =====================================================
+    # Cada cuántas versiones se guarda una foto completa en lugar de un diff
+    # (reconstruir una versión aplica como mucho N-1 diffs)
+    REVISION_SNAPSHOT_EVERY: int = 10
 
     # =====================================================
     # ⚙️ Configuración de entorno
@@ -0,0 +1,235 @@
+# app/events.py
+"""
+Eventos de agenda en tiempo real (SSE) para reemplazar el polling de
+/availability/slots y /appointments.
+
+Flujo:
+  endpoint de escritura --emit_agenda_event(db, ...)--> session.info
+      └─ commit OK ─┬─ (por defecto) broadcaster en memoria de ESTE proceso
+                    └─ (AGENDA_EVENTS_PG_NOTIFY) pg_notify dentro de la misma
+                       transacción → cada worker hace LISTEN y reenvía a su
+                       broadcaster local.
+  Si la transacción hace rollback, los eventos se descartan.
+
+Los deltas son compactos (tipo, doctor_id, ids y horarios en UTC) y NO
+incluyen datos del paciente: el stream es público igual que /availability/slots.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .db import SessionLocal, engine
+from .utils.tz import db_aware_utc
+
+logger = logging.getLogger(__name__)
+
+PG_CHANNEL = "agenda_events"
+_INFO_KEY = "agenda_events"
+
+# Tipos de delta publicados
+SLOT_TAKEN = "slot_taken"                    # hold o cita nueva
+SLOT_RELEASED = "slot_released"              # cita eliminada
+HOLD_EXPIRED = "hold_expired"                # hold vencido limpiado
+APPT_CONFIRMED = "appointment_confirmed"
+APPT_RESCHEDULED = "appointment_rescheduled"
+APPT_UPDATED = "appointment_updated"
+BLOCK_ADDED = "block_added"
+BLOCK_REMOVED = "block_removed"
+RULES_CHANGED = "rules_changed"
+SETTINGS_CHANGED = "settings_changed"
+RESYNC = "resync"                            # el cliente debe recargar todo
+
+
+def _iso(dt: Optional[datetime]) -> Optional[str]:
+    if dt is None:
+        return None
+    return db_aware_utc(dt).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+# =========================
+# Broadcaster en memoria
+# =========================
+
+class AgendaBroadcaster:
+    """
+    Reparte eventos a las colas de los clientes SSE suscritos por doctora.
+    `publish` es thread-safe: los endpoints síncronos corren en el threadpool
+    de FastAPI y se encolan en el event loop con call_soon_threadsafe.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subs: Dict[int, set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = itertools.count(1)
+
+    def subscribe(self, doctor_id: int) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subs.setdefault(doctor_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, doctor_id: int, q: asyncio.Queue) -> None:
+        subs = self._subs.get(doctor_id)
+        if subs:
+            subs.discard(q)
+            if not subs:
+                self._subs.pop(doctor_id, None)
+
+    def subscriber_count(self, doctor_id: Optional[int] = None) -> int:
+        if doctor_id is not None:
+            return len(self._subs.get(doctor_id, ()))
+        return sum(len(s) for s in self._subs.values())
+
+    def publish(self, ev: Dict[str, Any]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return  # nadie se ha suscrito nunca en este proceso
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(ev)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, ev)
+
+    def _dispatch(self, ev: Dict[str, Any]) -> None:
+        doctor_id = ev.get("doctor_id")
+        subs = self._subs.get(doctor_id)
+        if not subs:
+            return
+        ev = {**ev, "seq": next(self._seq)}
+        for q in list(subs):
+            try:
+                q.put_nowait(ev)
+            except asyncio.QueueFull:
+                # Cliente lento: vaciamos y le pedimos que recargue todo
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait({"type": RESYNC, "doctor_id": doctor_id, "seq": ev["seq"]})
+
+
+broadcaster = AgendaBroadcaster()
+
+
+# =========================
+# Productores (endpoints de escritura)
+# =========================
+
+def emit_agenda_event(db: Session, doctor_id: Optional[int], type_: str, **fields: Any) -> None:
+    """
+    Registra un delta para publicarlo SOLO si la transacción hace commit.
+    Los datetimes se serializan a ISO UTC con 'Z'.
+    """
+    if not doctor_id:
+        return
+    ev: Dict[str, Any] = {"type": type_, "doctor_id": int(doctor_id)}
+    for k, v in fields.items():
+        ev[k] = _iso(v) if isinstance(v, datetime) else v
+    ev["ts"] = _iso(datetime.now(timezone.utc))
+    # Sin transacción abierta un rollback no dispara after_soft_rollback y el
+    # delta saldría en el siguiente commit: la abrimos (no toca la BD todavía)
+    if not db.in_transaction():
+        db.begin()
+    db.info.setdefault(_INFO_KEY, []).append(ev)
+
+
+def emit_appointment_event(db: Session, type_: str, appt, **extra: Any) -> None:
+    """Atajo para deltas de citas (sin datos del paciente)."""
+    status = getattr(appt.status, "value", appt.status)
+    emit_agenda_event(
+        db,
+        appt.doctor_id,
+        type_,
+        appointment_id=appt.id,
+        status=status,
+        start_at=appt.start_at,
+        end_at=appt.end_at,
+        **extra,
+    )
+
+
+def _pg_notify_enabled(session: Session) -> bool:
+    return bool(settings.AGENDA_EVENTS_PG_NOTIFY) and session.get_bind().dialect.name == "postgresql"
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _notify_before_commit(session: Session) -> None:
+    # NOTIFY es transaccional: Postgres lo entrega solo si el commit sale bien
+    if not session.info.get(_INFO_KEY) or not _pg_notify_enabled(session):
+        return
+    for ev in session.info.pop(_INFO_KEY):
+        session.execute(select(func.pg_notify(PG_CHANNEL, json.dumps(ev, separators=(",", ":")))))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_after_commit(session: Session) -> None:
+    for ev in session.info.pop(_INFO_KEY, None) or ():
+        broadcaster.publish(ev)
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_on_rollback(session: Session, previous_transaction) -> None:
+    session.info.pop(_INFO_KEY, None)
+
+
+# =========================
+# Fan-out multi-worker (LISTEN/NOTIFY)
+# =========================
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+async def _pg_listen_loop() -> None:
+    import psycopg  # ya es dependencia (driver de SQLAlchemy)
+
+    conninfo = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    while True:
+        try:
+            conn = await psycopg.AsyncConnection.connect(conninfo, autocommit=True)
+            async with conn:
+                await conn.execute(f"LISTEN {PG_CHANNEL}")
+                logger.info("[events] LISTEN %s activo", PG_CHANNEL)
+                async for notify in conn.notifies():
+                    try:
+                        broadcaster.publish(json.loads(notify.payload))
+                    except ValueError:
+                        logger.warning("[events] payload inválido: %r", notify.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            logger.warning("[events] LISTEN caído (%s); reintento en 5s", ex)
+            await asyncio.sleep(5)
+
+
+def start_pg_listener() -> None:
+    """Inicia el LISTEN en background si está habilitado y la BD es Postgres."""
+    global _listener_task
+    if not settings.AGENDA_EVENTS_PG_NOTIFY or engine.dialect.name != "postgresql":
+        return
+    if _listener_task and not _listener_task.done():
+        return
+    # El broadcaster necesita conocer el loop aunque aún no haya suscriptores
+    broadcaster._loop = asyncio.get_running_loop()
+    _listener_task = asyncio.create_task(_pg_listen_loop())
+
+
+async def stop_pg_listener() -> None:
+    global _listener_task
+    if _listener_task:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _listener_task = None
@@ -0,0 +1,236 @@
+# app/http_cache.py
+"""
+Caché HTTP condicional (ETag / If-None-Match) para los endpoints de agenda
+que los portales consultan en bucle (reglas semanales, configuración,
+slots, bloqueos y citas).
+
+- Cada doctora tiene un contador en `agenda_versions` que se incrementa en
+  el MISMO commit que modifica sus citas, bloqueos, reglas o configuración
+  (hooks de sesión de SQLAlchemy, sin tocar cada endpoint).
+- El ETag = hash(ruta + query + versión [+ ventana de tiempo]). Calcularlo
+  cuesta una lectura por PK, así que un 304 no ejecuta la consulta principal.
+- Los endpoints que dependen del reloj (slots en el pasado, holds que vencen)
+  agregan una ventana de AGENDA_ETAG_WINDOW_SECONDS al ETag.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+from .db import SessionLocal
+
+# Modelos cuyo cambio invalida la agenda de su doctora
+_TRACKED_MODELS = (
+    models.Appointment,
+    models.CalendarBlock,
+    models.AvailabilityRule,
+    models.DoctorSettings,
+)
+
+_INFO_KEY = "agenda_dirty_doctors"
+# Doctoras marcadas a mano (sin objetos del ORM) y las incrementadas en el
+# último commit: las usa agenda_index para mantener su caché coherente.
+TOUCHED_KEY = "agenda_touched_doctors"
+BUMPED_KEY = "agenda_bumped_doctors"
+# Versiones leídas en esta sesión (una lectura por doctora y request)
+_SEEN_KEY = "agenda_versions_seen"
+
+# Cache-Control: el front (Cloudflare Pages) vive en otro origen, así que el
+# navegador guarda la respuesta pero revalida SIEMPRE con If-None-Match.
+CACHE_PUBLIC = "public, no-cache"
+CACHE_PRIVATE = "private, no-cache"
+
+
+# =========================
+# Registro de doctoras "sucias" en la sesión
+# =========================
+
+def touch_agenda(db: Session, doctor_id: Optional[int]) -> None:
+    """
+    Marca manualmente la agenda de una doctora como modificada.
+    Necesario solo para escrituras que no pasan por el ORM
+    (p.ej. `delete(...)` masivos).
+    """
+    if doctor_id:
+        db.info.setdefault(_INFO_KEY, set()).add(int(doctor_id))
+        db.info.setdefault(TOUCHED_KEY, set()).add(int(doctor_id))
+
+
+def mark_agenda_changed(db: Session, doctor_id: Optional[int]) -> None:
+    """
+    Como touch_agenda, para escrituras que no pasan por el flush del ORM
+    pero cuyos cambios ya quedaron registrados para el índice de agenda
+    (INSERT ... RETURNING): se incrementa la versión sin invalidar el índice.
+    """
+    if doctor_id:
+        db.info.setdefault(_INFO_KEY, set()).add(int(doctor_id))
+
+
+def _doctor_ids_of(obj) -> Iterable[int]:
+    state = inspect(obj)
+    # Leemos del __dict__ para no disparar lazy-loads (objetos borrados/expirados)
+    current = state.dict.get("doctor_id")
+    if current:
+        yield int(current)
+    hist = state.attrs.doctor_id.history
+    for old in hist.deleted or ():
+        if old:
+            yield int(old)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_dirty_doctors(session: Session, flush_context) -> None:
+    dirty: set[int] = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _TRACKED_MODELS):
+            dirty.update(_doctor_ids_of(obj))
+    if dirty:
+        session.info.setdefault(_INFO_KEY, set()).update(dirty)
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _bump_versions_before_commit(session: Session) -> None:
+    # Flush explícito: before_commit corre antes del flush final del commit
+    session.flush()
+    dirty = session.info.pop(_INFO_KEY, None)
+    session.info[BUMPED_KEY] = set(dirty or ())
+    if dirty:
+        bump_versions(session, dirty)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _forget_bumped_versions(session: Session) -> None:
+    # La versión leída de las doctoras incrementadas ya no sirve
+    seen = session.info.get(_SEEN_KEY)
+    if seen:
+        for doctor_id in session.info.get(BUMPED_KEY, ()):
+            seen.pop(doctor_id, None)
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_dirty_on_rollback(session: Session, previous_transaction) -> None:
+    session.info.pop(_INFO_KEY, None)
+    session.info.pop(TOUCHED_KEY, None)
+    session.info.pop(BUMPED_KEY, None)
+    session.info.pop(_SEEN_KEY, None)
+
+
+def _upsert_stmt(dialect_name: str, doctor_id: int):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    stmt = insert(models.AgendaVersion).values(doctor_id=doctor_id, version=1)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.AgendaVersion.doctor_id],
+        set_={
+            "version": models.AgendaVersion.version + 1,
+            "updated_at": func.now(),
+        },
+    )
+
+
+def bump_versions(session: Session, doctor_ids: Iterable[int]) -> None:
+    """
+    Incrementa (upsert) la versión de cada doctora dentro de la transacción
+    actual. Orden fijo por id para no provocar deadlocks entre commits.
+    """
+    dialect_name = session.get_bind().dialect.name
+    for doctor_id in sorted(set(doctor_ids)):
+        stmt = _upsert_stmt(dialect_name, doctor_id)
+        if stmt is not None:
+            session.execute(stmt)
+            continue
+        # Fallback genérico: UPDATE y, si no existía, INSERT
+        res = session.execute(
+            update(models.AgendaVersion)
+            .where(models.AgendaVersion.doctor_id == doctor_id)
+            .values(version=models.AgendaVersion.version + 1)
+        )
+        if not res.rowcount:
+            session.add(models.AgendaVersion(doctor_id=doctor_id, version=1))
+
+
+# =========================
+# Lectura de versiones + ETag
+# =========================
+
+def agenda_version(db: Session, doctor_id: Optional[int] = None, *, fresh: bool = False) -> int:
+    """
+    Versión de la agenda de una doctora. Sin doctor_id se usa la suma de
+    todas (crece con cualquier escritura), útil para listados globales.
+    La de una doctora se lee una sola vez por sesión (ETag e índice de
+    agenda comparten la lectura); `fresh=True` fuerza releerla.
+    """
+    if doctor_id:
+        seen = db.info.setdefault(_SEEN_KEY, {})
+        if not fresh and doctor_id in seen:
+            return seen[doctor_id]
+        v = int(db.scalar(
+            select(models.AgendaVersion.version).where(models.AgendaVersion.doctor_id == doctor_id)
+        ) or 0)
+        seen[doctor_id] = v
+        return v
+    v = db.scalar(select(func.coalesce(func.sum(models.AgendaVersion.version), 0)))
+    return int(v or 0)
+
+
+def agenda_etag(
+    db: Session,
+    request: Request,
+    *,
+    doctor_id: Optional[int] = None,
+    time_sensitive: bool = False,
+) -> str:
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    parts = [request.url.path, query, str(agenda_version(db, doctor_id))]
+    if time_sensitive:
+        window = max(1, settings.AGENDA_ETAG_WINDOW_SECONDS)
+        parts.append(str(int(time.time() // window)))
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    # Comparación débil: ignora el prefijo W/
+    bare = etag.removeprefix("W/")
+    return any(c.removeprefix("W/") == bare for c in candidates)
+
+
+def not_modified(
+    db: Session,
+    request: Request,
+    response: Response,
+    *,
+    doctor_id: Optional[int] = None,
+    time_sensitive: bool = False,
+    private: bool = False,
+) -> Optional[Response]:
+    """
+    Calcula el ETag y fija ETag/Cache-Control en `response`.
+    Si el cliente ya tiene esa versión (If-None-Match) devuelve un 304 listo
+    para retornar desde el endpoint; si no, None y el endpoint sigue normal.
+    """
+    etag = agenda_etag(db, request, doctor_id=doctor_id, time_sensitive=time_sensitive)
+    cache_control = CACHE_PRIVATE if private else CACHE_PUBLIC
+
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
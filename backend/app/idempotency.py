@@ -0,0 +1,284 @@
+# app/idempotency.py
+"""
+Middleware ASGI de `Idempotency-Key` para reservas y pagos.
+
+Las redes móviles inestables reintentan POST /appointments/hold, /confirm o
+/payments/payphone/confirm. Con la cabecera `Idempotency-Key` el primer
+request se ejecuta normal y su respuesta queda guardada (tabla
+idempotency_keys, con TTL); los reintentos reciben esa misma respuesta
+sin volver a tocar PayPhone, Zoom ni los chequeos de conflicto.
+
+- La clave es por usuario (claim `sub` del JWT) + método + ruta.
+- Huella = sha256(query + cuerpo): misma clave con otro cuerpo => 422.
+- Mientras el primero sigue en curso, un reintento recibe 409 (+Retry-After);
+  pasado IDEMPOTENCY_LOCK_SECONDS se asume caído y se puede retomar.
+- Solo se guardan respuestas < 500: ante un 5xx o una excepción se borra
+  la reserva de la clave y el cliente puede reintentar de verdad.
+- Las respuestas repetidas llevan `Idempotent-Replayed: true`.
+
+Solo aplica a las rutas de IDEMPOTENCY_PATHS; sin cabecera o sin token
+válido el request pasa tal cual (el endpoint responderá 401 si toca).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from jose import JWTError, jwt
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import models
+from .config import settings
+from .db import SessionLocal
+from .utils.tz import db_aware_utc
+
+HEADER = "idempotency-key"
+_MAX_KEY_LEN = 255
+_PURGE_EVERY_SECONDS = 600
+
+_next_purge = 0.0
+
+
+# =========================
+# Registro de claves
+# =========================
+
+@dataclass
+class _Claim:
+    outcome: str                      # "new" | "replay" | "busy" | "mismatch"
+    record_id: Optional[int] = None
+    status_code: Optional[int] = None
+    content_type: Optional[str] = None
+    body: bytes = b""
+
+
+def _purge_expired(db, now: datetime) -> None:
+    """
+    Borra claves vencidas como mucho cada _PURGE_EVERY_SECONDS por proceso.
+    Con commit propio: replay/busy/mismatch salen de _claim sin commit y el
+    close() desharía el DELETE.
+    """
+    global _next_purge
+    if time.monotonic() < _next_purge:
+        return
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= now))
+    db.commit()
+    _next_purge = time.monotonic() + _PURGE_EVERY_SECONDS
+
+
+def _claim(scope_key: str, key: str, fingerprint: str) -> _Claim:
+    """Reserva la clave o devuelve lo que ya hay guardado (sync, va al threadpool)."""
+    K = models.IdempotencyKey
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        _purge_expired(db, now)
+        rec = db.scalar(select(K).where(K.scope == scope_key, K.key == key))
+        if rec is not None and db_aware_utc(rec.expires_at) <= now:
+            db.delete(rec)
+            db.flush()
+            rec = None
+
+        if rec is None:
+            rec = K(
+                scope=scope_key,
+                key=key,
+                fingerprint=fingerprint,
+                created_at=now,
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS),
+            )
+            db.add(rec)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Otro reintento la reservó entre el SELECT y el INSERT
+                db.rollback()
+                return _Claim("busy")
+            return _Claim("new", record_id=rec.id)
+
+        if rec.fingerprint != fingerprint:
+            return _Claim("mismatch")
+        if rec.status_code is not None:
+            return _Claim(
+                "replay",
+                status_code=rec.status_code,
+                content_type=rec.content_type,
+                body=rec.body or b"",
+            )
+        if db_aware_utc(rec.created_at) + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS) > now:
+            return _Claim("busy")
+
+        # El primer intento quedó colgado: se retoma si nadie se adelantó
+        taken = db.execute(
+            update(K)
+            .where(K.id == rec.id, K.status_code.is_(None), K.created_at == rec.created_at)
+            .values(created_at=now)
+        ).rowcount
+        db.commit()
+        return _Claim("new", record_id=rec.id) if taken else _Claim("busy")
+    finally:
+        db.close()
+
+
+def _store(record_id: int, status_code: int, content_type: Optional[str], body: bytes) -> None:
+    K = models.IdempotencyKey
+    with SessionLocal() as db:
+        db.execute(
+            update(K)
+            .where(K.id == record_id)
+            .values(status_code=status_code, content_type=content_type, body=body)
+        )
+        db.commit()
+
+
+def _release(record_id: int) -> None:
+    with SessionLocal() as db:
+        db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.id == record_id))
+        db.commit()
+
+
+# =========================
+# Middleware
+# =========================
+
+def _principal(authorization: Optional[str]) -> Optional[str]:
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:].strip(), settings.JWT_SECRET, algorithms=[settings.JWT_ALG])
+    except JWTError:
+        return None
+    sub = payload.get("sub")
+    return str(sub) if sub else None
+
+
+def _fingerprint(scope: Scope, body: bytes) -> str:
+    h = hashlib.sha256()
+    h.update(scope.get("query_string", b""))
+    h.update(b"\n")
+    h.update(body)
+    return h.hexdigest()
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def _send_json(send: Send, status_code: int, detail: str, headers: Iterable[tuple] = ()) -> None:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await _send_raw(send, status_code, "application/json", body, headers)
+
+
+async def _send_raw(
+    send: Send,
+    status_code: int,
+    content_type: Optional[str],
+    body: bytes,
+    headers: Iterable[tuple] = (),
+) -> None:
+    raw = [(b"content-length", str(len(body)).encode("latin-1"))]
+    if content_type:
+        raw.append((b"content-type", content_type.encode("latin-1")))
+    raw.extend(headers)
+    await send({"type": "http.response.start", "status": status_code, "headers": raw})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app: ASGIApp, *, paths: Iterable[str]):
+        self.app = app
+        self.paths = [re.compile(p) for p in paths]
+
+    def _applies(self, scope: Scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and scope["method"] == "POST"
+            and any(p.match(scope["path"]) for p in self.paths)
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        key = (headers.get(HEADER) or "").strip()
+        principal = _principal(headers.get("authorization")) if key else None
+        if not key or principal is None:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > _MAX_KEY_LEN:
+            await _send_json(send, 400, f"Idempotency-Key admite hasta {_MAX_KEY_LEN} caracteres")
+            return
+
+        body = await _read_body(receive)
+        scope_key = f"{principal} {scope['method']} {scope['path']}"[:255]
+        claim = await run_in_threadpool(_claim, scope_key, key, _fingerprint(scope, body))
+
+        if claim.outcome == "replay":
+            await _send_raw(
+                send, claim.status_code, claim.content_type, claim.body,
+                headers=[(b"idempotent-replayed", b"true")],
+            )
+            return
+        if claim.outcome == "busy":
+            await _send_json(
+                send, 409, "Hay un request en curso con esta Idempotency-Key; reintenta en unos segundos.",
+                headers=[(b"retry-after", b"1")],
+            )
+            return
+        if claim.outcome == "mismatch":
+            await _send_json(send, 422, "Idempotency-Key ya usada con otro cuerpo de request")
+            return
+
+        await self._run(scope, receive, send, body, claim.record_id)
+
+    async def _run(self, scope: Scope, receive: Receive, send: Send, body: bytes, record_id: int) -> None:
+        sent_body = False
+
+        async def replay_receive() -> Message:
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()  # tras el cuerpo solo queda esperar el disconnect
+
+        status_code = 500
+        content_type: Optional[str] = None
+        chunks: List[bytes] = []
+
+        async def capture(message: Message) -> None:
+            nonlocal status_code, content_type
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = Headers(raw=message.get("headers", [])).get("content-type")
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture)
+        except BaseException:
+            await run_in_threadpool(_release, record_id)
+            raise
+
+        if status_code >= 500:
+            await run_in_threadpool(_release, record_id)
+        else:
+            await run_in_threadpool(_store, record_id, status_code, content_type, b"".join(chunks))
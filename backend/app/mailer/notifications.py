@@ -1,7 +1,6 @@
 from __future__ import annotations
 from datetime import timezone
 from typing import Optional, Dict, Any
-from zoneinfo import ZoneInfo
 
 from sqlalchemy.orm import Session
 
@@ -10,19 +9,18 @@ from app.mailer.service import send_email
 from app import models
 from app.email_settings import EmailSettings
 from app.db import SessionLocal
+from app.utils.tz import aware_to_local_naive_many
 
-TZ_LOCAL = ZoneInfo("America/Guayaquil")
-
-def _fmt_local(dt):
-    if dt is None:
-        return None
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(TZ_LOCAL).strftime("%A %d %b %Y, %H:%M")
+def _fmt_local_many(*dts):
+    """Formatea en hora de Ecuador (naive = UTC); convierte todas en un solo lote."""
+    present = [d if d.tzinfo else d.replace(tzinfo=timezone.utc) for d in dts if d is not None]
+    local = iter(aware_to_local_naive_many(present))
+    return [None if d is None else next(local).strftime("%A %d %b %Y, %H:%M") for d in dts]
 
 def _appt_context(appt: models.Appointment, db: Session) -> Dict[str, Any]:
     doc: Optional[models.User] = db.get(models.User, appt.doctor_id) if appt.doctor_id else None
     pat: Optional[models.User] = db.get(models.User, appt.patient_id) if appt.patient_id else None
+    start_local, end_local = _fmt_local_many(appt.start_at, appt.end_at)
 
     return {
         "appointment_id": appt.id,
@@ -30,8 +28,8 @@ def _appt_context(appt: models.Appointment, db: Session) -> Dict[str, Any]:
         "doctor_email": getattr(doc, "email", None),
         "patient_name": getattr(pat, "full_name", None) or (getattr(pat, "email", None) or f"Paciente #{appt.patient_id}"),
         "patient_email": getattr(pat, "email", None),
-        "start_local": _fmt_local(appt.start_at),
-        "end_local": _fmt_local(appt.end_at),
+        "start_local": start_local,
+        "end_local": end_local,
         "join_url": appt.zoom_join_url,
         "env": "local",  # puedes sobreescribir si quieres pasar otro valor en prod
     }
@@ -71,9 +69,10 @@ async def send_rescheduled_emails(appt: models.Appointment, db: Session, old_sta
     """
     settings = EmailSettings()
     ctx = _appt_context(appt, db)
+    old_start_local, old_end_local = _fmt_local_many(old_start, old_end)
     ctx.update({
-        "old_start_local": _fmt_local(old_start),
-        "old_end_local": _fmt_local(old_end),
+        "old_start_local": old_start_local,
+        "old_end_local": old_end_local,
     })
 
     # Paciente
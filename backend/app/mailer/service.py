@@ -3,6 +3,7 @@ from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from fastapi_mail.errors import ConnectionErrors
 from typing import List, Dict, Any
 from app.email_settings import EmailSettings
+from app.metrics import track_outbound
 import logging
 
 log = logging.getLogger("mailer")
@@ -41,7 +42,8 @@ async def send_email(
         template_body=context,
     )
     try:
-        await fm.send_message(msg, template_name=template_name)
+        async with track_outbound("smtp", "send"):
+            await fm.send_message(msg, template_name=template_name)
         log.info("Email sent: %s -> %s", subject, recipients)
     except ConnectionErrors as ex:
         log.error("SMTP connection error: %s", ex)
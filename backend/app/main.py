@@ -1,11 +1,18 @@
 # app/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 
 from .scheduler import start_scheduler, shutdown_scheduler, rebuild_jobs_on_startup
 from .db import SessionLocal
 from .config import settings as app_settings
+from .compression import CompressionMiddleware
+from .idempotency import IdempotencyMiddleware
+from .metrics import MetricsMiddleware, render_metrics
+from .query_watch import QueryWatchMiddleware
+from .events import start_pg_listener, stop_pg_listener
+from .payphone_processing import start_notification_sweep
+from .reconciliation import start_reconciliation_job
 
 # Routers
 from .routers import (
@@ -23,6 +30,8 @@ from .routers import (
     debug_scheduler,
     jobs,
     blocks,
+    events,
+    search,
 )
 
 app = FastAPI(
@@ -41,16 +50,33 @@ async def _startup():
     try:
         start_scheduler()
         rebuild_jobs_on_startup()
+        start_notification_sweep()
+        start_reconciliation_job()
     except Exception as e:
         # IMPORTANTE: no tumbar la app en producción por el scheduler
         print(f"[scheduler] no se pudo iniciar: {e}")
 
+    # Fan-out de eventos SSE entre workers (solo si está habilitado)
+    try:
+        start_pg_listener()
+    except Exception as e:
+        print(f"[events] no se pudo iniciar LISTEN: {e}")
+
 @app.on_event("shutdown")
 async def _shutdown():
     try:
         shutdown_scheduler()
     except Exception:
         pass
+    await stop_pg_listener()
+
+# =========================
+# Idempotency-Key (reservas y pagos)
+# =========================
+# Va primero => queda más adentro: guarda el cuerpo sin comprimir y las
+# respuestas repetidas pasan igual por CORS, compresión y métricas.
+if app_settings.IDEMPOTENCY_ENABLED:
+    app.add_middleware(IdempotencyMiddleware, paths=app_settings.IDEMPOTENCY_PATHS)
 
 # =========================
 # CORS
@@ -68,8 +94,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed"],  # 👈 caché condicional (If-None-Match) y reintentos idempotentes
 )
 
+# =========================
+# Compresión (gzip / brotli)
+# =========================
+if app_settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=app_settings.COMPRESSION_MIN_SIZE,
+        content_types=app_settings.COMPRESSION_CONTENT_TYPES,
+        gzip_level=app_settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=app_settings.COMPRESSION_BROTLI_QUALITY,
+        enable_brotli=app_settings.COMPRESSION_BROTLI_ENABLED,
+    )
+
+# =========================
+# Métricas (latencia, SQL por request, llamadas salientes)
+# =========================
+if app_settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, server_timing=app_settings.METRICS_SERVER_TIMING)
+
+# =========================
+# Detector de consultas lentas / N+1 (opt-in)
+# =========================
+if app_settings.QUERY_WATCH_ENABLED:
+    app.add_middleware(QueryWatchMiddleware)
+
 # =========================
 # Routers
 # =========================
@@ -78,6 +130,7 @@ app.include_router(users.router)
 app.include_router(patients.router)
 app.include_router(clinical_histories.router)
 app.include_router(therapeutic_plans.router)
+app.include_router(search.router)
 app.include_router(appointments.router)
 app.include_router(payments.router)
 app.include_router(availability.router)
@@ -87,6 +140,7 @@ app.include_router(debug_email.router)
 app.include_router(debug_scheduler.router)
 app.include_router(jobs.router)  # ✅ añadido aquí
 app.include_router(blocks.router)
+app.include_router(events.router)
 
 # =========================
 # Healthchecks y debug
@@ -100,6 +154,18 @@ def health():
 def root():
     return {"ok": True, "service": "CitasPsico API"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics(authorization: str | None = Header(default=None)):
+    """
+    Métricas en formato Prometheus. Si METRICS_TOKEN está definido,
+    exige `Authorization: Bearer <token>`.
+    """
+    token = app_settings.METRICS_TOKEN
+    if token and authorization != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="No autorizado")
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 @app.get("/health/db")
 def health_db():
     with SessionLocal() as db:
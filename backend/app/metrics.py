@@ -0,0 +1,253 @@
+# app/metrics.py
+"""
+Instrumentación de la API (formato Prometheus en /metrics).
+
+- Latencia por ruta (plantilla, p.ej. /appointments/{id}), método y status.
+- Por request: cantidad de sentencias SQL y tiempo acumulado en BD
+  (eventos before/after_cursor_execute a nivel de Engine, así también
+  cuentan los engines que se creen en pruebas o scripts).
+- Tiempo de llamadas salientes a Zoom, PayPhone y SMTP (`track_outbound`).
+- Espera por el candado de reservas por doctora (`record_lock_wait`).
+
+Las estadísticas por request viajan en un ContextVar; FastAPI copia el
+contexto al threadpool de los endpoints síncronos, así que las consultas
+hechas ahí se suman al mismo request.
+"""
+from __future__ import annotations
+
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Rutas que no se miden (streams largos y el propio scrape)
+SKIP_PREFIXES = ("/metrics", "/events/")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+
+# =========================
+# Métricas
+# =========================
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latencia de requests HTTP por ruta",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests HTTP en curso",
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "Sentencias SQL ejecutadas por request",
+    ["method", "route"],
+    buckets=STATEMENT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Tiempo acumulado en BD por request",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_STATEMENT_SECONDS = Histogram(
+    "db_statement_duration_seconds",
+    "Duración de cada sentencia SQL (incluye scheduler y tareas en background)",
+    buckets=LATENCY_BUCKETS,
+)
+OUTBOUND_SECONDS = Histogram(
+    "outbound_request_duration_seconds",
+    "Duración de llamadas salientes (zoom, payphone, smtp)",
+    ["service", "operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+OUTBOUND_ERRORS = Counter(
+    "outbound_request_errors_total",
+    "Llamadas salientes que terminaron en excepción o con HTTP >= 400",
+    ["service", "operation"],
+)
+BOOKING_LOCK_WAIT_SECONDS = Histogram(
+    "booking_lock_wait_seconds",
+    "Espera por el candado de reservas de una doctora",
+    ["backend", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+# =========================
+# Estadísticas por request
+# =========================
+
+@dataclass
+class RequestStats:
+    sql_count: int = 0
+    sql_seconds: float = 0.0
+    outbound_seconds: float = 0.0
+    lock_seconds: float = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+# =========================
+# Hooks del engine (SQL)
+# =========================
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_query_t0", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("_query_t0")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    DB_STATEMENT_SECONDS.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += elapsed
+
+
+# =========================
+# Llamadas salientes
+# =========================
+
+class track_outbound:
+    """
+    Mide una llamada saliente. Sirve como context manager sync o async:
+
+        with track_outbound("payphone", "confirm"): ...
+        async with track_outbound("zoom", "create_meeting") as call:
+            resp = await ...
+            if resp.status_code >= 400:
+                call.fail()   # respuesta de error sin excepción
+
+    El tiempo se suma al request en curso: no anidar (p.ej. pedir el token
+    OAuth antes de abrir la medición de la llamada).
+    """
+
+    def __init__(self, service: str, operation: str):
+        self.service = service
+        self.operation = operation
+        self._t0 = 0.0
+        self._failed = False
+
+    def fail(self) -> None:
+        self._failed = True
+
+    def _start(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def _stop(self, exc_type) -> None:
+        elapsed = time.perf_counter() - self._t0
+        failed = bool(exc_type) or self._failed
+        outcome = "error" if failed else "ok"
+        OUTBOUND_SECONDS.labels(self.service, self.operation, outcome).observe(elapsed)
+        if failed:
+            OUTBOUND_ERRORS.labels(self.service, self.operation).inc()
+        stats = _current.get()
+        if stats is not None:
+            stats.outbound_seconds += elapsed
+
+    def __enter__(self):
+        return self._start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop(exc_type)
+        return False
+
+    async def __aenter__(self):
+        return self._start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._stop(exc_type)
+        return False
+
+
+def record_lock_wait(backend: str, outcome: str, seconds: float) -> None:
+    """Espera por el candado de reservas (ver booking_lock)."""
+    BOOKING_LOCK_WAIT_SECONDS.labels(backend, outcome).observe(seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.lock_seconds += seconds
+
+
+# =========================
+# Middleware ASGI
+# =========================
+
+def _route_label(scope: Scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, *, server_timing: bool = False) -> None:
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(SKIP_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        t0 = time.perf_counter()
+        status_code = 500
+        # Se congela al enviar el último bloque: las BackgroundTasks (emails,
+        # recordatorios) corren después y no deben inflar la latencia.
+        done: Optional[tuple[float, int, float]] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, done
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                done = (time.perf_counter(), stats.sql_count, stats.sql_seconds)
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    total_ms = (time.perf_counter() - t0) * 1000
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing",
+                        f"app;dur={total_ms:.1f}, db;dur={stats.sql_seconds * 1000:.1f}, "
+                        f"ext;dur={stats.outbound_seconds * 1000:.1f}, "
+                        f"lock;dur={stats.lock_seconds * 1000:.1f}",
+                    )
+                    headers.append("X-DB-Statements", str(stats.sql_count))
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            _current.reset(token)
+            t_end, sql_count, sql_seconds = done or (time.perf_counter(), stats.sql_count, stats.sql_seconds)
+            route = _route_label(scope)
+            method = scope["method"]
+            HTTP_LATENCY.labels(method, route, str(status_code)).observe(t_end - t0)
+            REQUEST_DB_STATEMENTS.labels(method, route).observe(sql_count)
+            REQUEST_DB_SECONDS.labels(method, route).observe(sql_seconds)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """(payload, content_type) para el endpoint /metrics."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -4,23 +4,28 @@ from datetime import datetime, date, timezone
 from typing import List, Optional
 
 from sqlalchemy import (
+    DDL,
     JSON,
     Boolean,
     Date,
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     Numeric,
     String,
     Text,
     UniqueConstraint,
+    event,
     func,
     text,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
+from .utils import compact_json
 
 
 # =========================
@@ -205,6 +210,37 @@ class Appointment(Base):
 
     client_tx_id: Mapped[Optional[str]] = mapped_column(String(120), index=True)
 
+    # Serie recurrente de la que salió (None = cita suelta)
+    series_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("appointment_series.id", ondelete="SET NULL"), index=True, nullable=True
+    )
+
+
+# =========================
+# Series de citas recurrentes
+# =========================
+
+class AppointmentSeries(Base):
+    __tablename__ = "appointment_series"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    doctor_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False
+    )
+    patient_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("users.id", ondelete="SET NULL"), index=True, nullable=True
+    )
+    # Primera ocurrencia (UTC) + duración; la hora local se repite en cada ocurrencia
+    dtstart: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    duration_min: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Regla en texto RRULE (FREQ=WEEKLY;INTERVAL=2;COUNT=10)
+    rrule: Mapped[str] = mapped_column(String(255), nullable=False)
+
+    created_by: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
 
 class Payment(Base):
     __tablename__ = "payments"
@@ -217,7 +253,8 @@ class Payment(Base):
     amount_cents: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     payphone_tx_id: Mapped[str] = mapped_column(String(60), nullable=False, index=True)  # transactionId como string
     client_tx_id: Mapped[Optional[str]] = mapped_column(String(80), nullable=True, index=True)
-    raw_payload: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    # Extraído de optionalParameter3 ("appts=1,2"): citas que cubre el pago
+    appointment_ids: Mapped[Optional[list]] = mapped_column(JSON, nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), nullable=False
@@ -225,10 +262,139 @@ class Payment(Base):
 
     appointment: Mapped[Optional["Appointment"]] = relationship("Appointment", backref="payments")
 
+    # Respuesta completa de PayPhone, comprimida en payment_payloads: solo se
+    # lee si alguien accede a `raw_payload` (los SELECT de pagos no la traen)
+    payload: Mapped[Optional["PaymentPayload"]] = relationship(
+        back_populates="payment", uselist=False, cascade="all, delete-orphan", passive_deletes=True,
+    )
+
     __table_args__ = (
         UniqueConstraint("payphone_tx_id", name="uq_payment_payphone_tx_id"),  # <-- idempotencia  # TODO: alembic
     )
 
+    @property
+    def raw_payload(self) -> Optional[dict]:
+        if self.payload is None:
+            return None
+        return compact_json.unpack(self.payload.codec, self.payload.data)
+
+    @raw_payload.setter
+    def raw_payload(self, value: Optional[dict]) -> None:
+        if value is None:
+            self.payload = None
+            return
+        codec, data = compact_json.pack(value)
+        self.payload = PaymentPayload(codec=codec, data=data)
+
+
+class PaymentPayload(Base):
+    __tablename__ = "payment_payloads"
+
+    payment_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("payments.id", ondelete="CASCADE"), primary_key=True
+    )
+    codec: Mapped[str] = mapped_column(String(10), nullable=False)  # zstd | zlib (app/utils/compact_json.py)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    payment: Mapped["Payment"] = relationship(back_populates="payload")
+
+
+class PayphoneNotification(Base):
+    """Cola de notificaciones de PayPhone (ver app/payphone_processing.py)."""
+    __tablename__ = "payphone_notifications"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    transaction_id: Mapped[str] = mapped_column(String(60), nullable=False, unique=True)  # como Payment.payphone_tx_id
+    client_tx_id: Mapped[Optional[str]] = mapped_column(String(80), nullable=True)
+
+    # pending | processing | done | failed
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    payment_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    payload: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)  # cuerpo recibido (auditoría)
+
+    received_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class PayphoneTransaction(Base):
+    """Último estado consultado a PayPhone Confirm por transacción (conciliación)."""
+    __tablename__ = "payphone_transactions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    transaction_id: Mapped[str] = mapped_column(String(60), nullable=False, unique=True)
+    client_tx_id: Mapped[Optional[str]] = mapped_column(String(80), nullable=True, index=True)
+    transaction_status: Mapped[Optional[str]] = mapped_column(String(40), nullable=True)
+    status_code: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    approved: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    amount_cents: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    appointment_ids: Mapped[Optional[list]] = mapped_column(JSON, nullable=True)       # citas que pagó
+    failed_appointments: Mapped[Optional[list]] = mapped_column(JSON, nullable=True)   # [{appointment_id, reason}]
+    payment_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    checked_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+# =========================
+# Conciliación de pagos (app/reconciliation.py)
+# =========================
+
+class ReconciliationIssue(Base):
+    __tablename__ = "reconciliation_issues"
+    __table_args__ = (UniqueConstraint("kind", "subject", name="uq_reconciliation_kind_subject"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # approved_without_payment | appointment_missing | appointment_not_confirmed
+    # | payment_orphaned | hold_expired_unpaid
+    kind: Mapped[str] = mapped_column(String(40), nullable=False, index=True)
+    subject: Mapped[str] = mapped_column(String(80), nullable=False)  # "tx:123", "appt:45"...
+    payment_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    appointment_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    payphone_tx_id: Mapped[Optional[str]] = mapped_column(String(60), nullable=True)
+    detail: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    detected_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    resolved_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class ReconciliationWatermark(Base):
+    """Hasta dónde llegó cada barrido: (last_at, last_id) en el orden del barrido."""
+    __tablename__ = "reconciliation_watermarks"
+
+    name: Mapped[str] = mapped_column(String(40), primary_key=True)
+    last_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
+    )
+
+
+class ExpiredHold(Base):
+    """
+    Lápida de un hold del flujo legado (client_tx_id) que delete_stale_holds
+    borró al vencer. La conciliación la revisa pasado el margen de gracia
+    (¿volvió el pago?) y la descarta: funciona como cola. Si dos limpiezas
+    concurrentes dejan la misma lápida, el hallazgo se deduplica por subject.
+    """
+    __tablename__ = "expired_holds"
+    __table_args__ = (Index("ix_expired_holds_hold_until", "hold_until", "id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Sin FK: la cita ya no existe
+    appointment_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    client_tx_id: Mapped[str] = mapped_column(String(120), nullable=False)
+    doctor_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    patient_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    hold_until: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    deleted_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
 
 # =========================
 # Availability (slots puntuales)
@@ -384,8 +550,182 @@ class CalendarBlock(Base):
     # Opcional: motivo/nota
     reason:   Mapped[Optional[str]] = mapped_column(default=None)
 
+    # Recurrencia (ver app/recurring_blocks.py): start_at/end_at es la primera
+    # ocurrencia; recur_until = fin de la última (None = sin fin)
+    rrule:       Mapped[Optional[str]] = mapped_column(String(255), default=None)
+    recur_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), default=None)
+
     created_by: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
 
     doctor: Mapped["User"] = relationship(foreign_keys=[doctor_id])
-    creator: Mapped["User"] = relationship(foreign_keys=[created_by])
\ No newline at end of file
+    creator: Mapped["User"] = relationship(foreign_keys=[created_by])
+
+# =========================
+# Versiones de agenda (ETag / caché HTTP)
+# =========================
+
+class AgendaVersion(Base):
+    __tablename__ = "agenda_versions"
+
+    # Una fila por doctora; se incrementa en cada commit que toca su agenda
+    # (citas, bloqueos, reglas semanales o configuración de consulta).
+    doctor_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
+    )
+
+
+# =========================
+# Idempotency-Key (app/idempotency.py)
+# =========================
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("scope", "key", name="uq_idempotency_scope_key"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    # "<usuario> <método> <ruta>": la misma clave en otra ruta u otro usuario es otra
+    scope: Mapped[str] = mapped_column(String(255), nullable=False)
+    key: Mapped[str] = mapped_column(String(255), nullable=False)
+    # sha256 de query + cuerpo; un reintento con otro cuerpo es un error (422)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+
+    # None mientras el primer request está en curso
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, default=None)
+    content_type: Mapped[Optional[str]] = mapped_column(String(128), default=None)
+    body: Mapped[Optional[bytes]] = mapped_column(LargeBinary, default=None)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+# =========================
+# Historial de revisiones clínicas (app/revisions.py)
+# =========================
+
+class ClinicalRevision(Base):
+    """
+    Log append-only de versiones de ClinicalHistory / TherapeuticPlan. Cada
+    fila guarda una foto completa (is_snapshot) o solo el diff contra la
+    versión anterior, comprimidos con app/utils/compact_json.py.
+    """
+    __tablename__ = "clinical_revisions"
+    __table_args__ = (
+        UniqueConstraint("kind", "record_id", "version", name="uq_clinical_revisions_version"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)  # clinical_history | therapeutic_plan
+    # Sin FK: el historial sobrevive al borrado del registro
+    record_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)  # 1, 2, ... por registro
+
+    action: Mapped[str] = mapped_column(String(16), nullable=False)  # create | update | delete | baseline
+    is_snapshot: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    changed_fields: Mapped[List[str]] = mapped_column(JSON, nullable=False, default=list)
+    author_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True
+    )
+
+    codec: Mapped[str] = mapped_column(String(10), nullable=False)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False
+    )
+
+
+# =========================
+# Búsqueda de texto completo (app/clinical_search.py)
+# =========================
+# Columnas indexadas por origen. El índice vive fuera de los modelos ORM:
+# - Postgres: columna generada `search_tsv` (to_tsvector 'spanish') + GIN
+#   en cada tabla.
+# - SQLite (dev/pruebas): tabla FTS5 `clinical_search` mantenida por
+#   triggers; rowid = id * 2 + SEARCH_SOURCES[kind].rowid_tag.
+
+class SearchSource:
+    def __init__(self, table: str, columns: tuple, rowid_tag: int):
+        self.table = table
+        self.columns = columns
+        self.rowid_tag = rowid_tag
+
+    def document_sql(self, prefix: str = "") -> str:
+        """Texto indexado: las columnas unidas por espacio (expresión inmutable para GENERATED)."""
+        return " || ' ' || ".join(f"coalesce({prefix}{c}, '')" for c in self.columns)
+
+
+SEARCH_SOURCES = {
+    "clinical_history": SearchSource(
+        "clinical_histories",
+        (
+            "antecedentes_personales", "antecedentes_familiares", "medicacion_actual",
+            "alergias", "diagnosticos_previos", "consumo", "antecedentes_psico",
+            "notas", "factores_protectores",
+        ),
+        rowid_tag=0,
+    ),
+    "therapeutic_plan": SearchSource(
+        "therapeutic_plans",
+        ("objetivos", "frecuencia", "intervenciones", "tareas", "metricas", "notas"),
+        rowid_tag=1,
+    ),
+}
+SEARCH_FTS_TABLE = "clinical_search"
+
+
+def search_ddl_postgres(src: SearchSource) -> list:
+    return [
+        f"ALTER TABLE {src.table} ADD COLUMN IF NOT EXISTS search_tsv tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('spanish'::regconfig, {src.document_sql()})) STORED",
+        f"CREATE INDEX IF NOT EXISTS ix_{src.table}_search_tsv ON {src.table} USING gin (search_tsv)",
+    ]
+
+
+def search_ddl_sqlite_table() -> list:
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_FTS_TABLE} USING fts5("
+        "body, patient_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')",
+    ]
+
+
+def search_ddl_sqlite_triggers(src: SearchSource) -> list:
+    rowid_new = f"NEW.id * 2 + {src.rowid_tag}"
+    rowid_old = f"OLD.id * 2 + {src.rowid_tag}"
+    insert = (
+        f"INSERT INTO {SEARCH_FTS_TABLE}(rowid, body, patient_id) "
+        f"VALUES ({rowid_new}, {src.document_sql('NEW.')}, NEW.patient_id);"
+    )
+    delete = f"DELETE FROM {SEARCH_FTS_TABLE} WHERE rowid = {rowid_old};"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {src.table}_search_ai AFTER INSERT ON {src.table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {src.table}_search_au AFTER UPDATE ON {src.table} BEGIN {delete} {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {src.table}_search_ad AFTER DELETE ON {src.table} BEGIN {delete} END",
+    ]
+
+
+def _register_search_ddl() -> None:
+    """create_all / drop_all (pruebas, BD nuevas) también crean el índice; las BD existentes van por Alembic."""
+    for src in SEARCH_SOURCES.values():
+        table = Base.metadata.tables[src.table]
+        for stmt in search_ddl_postgres(src):
+            event.listen(table, "after_create", DDL(stmt).execute_if(dialect="postgresql"))
+        for stmt in search_ddl_sqlite_table() + search_ddl_sqlite_triggers(src):
+            event.listen(table, "after_create", DDL(stmt).execute_if(dialect="sqlite"))
+    event.listen(
+        Base.metadata, "before_drop",
+        DDL(f"DROP TABLE IF EXISTS {SEARCH_FTS_TABLE}").execute_if(dialect="sqlite"),
+    )
+
+
+_register_search_ddl()
@@ -3,6 +3,7 @@ from __future__ import annotations
 from typing import Any, Dict
 import httpx
 from .config import settings
+from .metrics import track_outbound
 
 CONFIRM_URL_DEFAULT = "https://pay.payphonetodoesposible.com/api/button/V2/Confirm"
 
@@ -29,7 +30,7 @@ def confirm_button(*, transaction_id: int, client_tx_id: str) -> Dict[str, Any]:
     }
 
     try:
-        with httpx.Client(timeout=15.0) as cli:
+        with httpx.Client(timeout=15.0) as cli, track_outbound("payphone", "confirm"):
             resp = cli.post(confirm_url, json=payload, headers=headers)
     except Exception as ex:
         raise PayphoneError(f"Error de red al consultar PayPhone Confirm: {ex}") from ex
@@ -0,0 +1,628 @@
+# app/payphone_processing.py
+"""
+Confirmación de pagos PayPhone, compartida por las dos entradas:
+
+- POST /payments/payphone/confirm: el navegador vuelve de PayPhone
+  (PaymentResult.jsx) y espera el resultado.
+- POST /payments/payphone/notify: notificación servidor a servidor. Solo
+  verifica el token y encola la transacción (tabla payphone_notifications);
+  el procesador de abajo consulta Confirm y confirma las citas fuera del
+  request, así una pestaña cerrada ya no deja un pago sin confirmar.
+
+El cuerpo de la notificación nunca se toma como verdad: solo aporta el
+transactionId; el estado y las citas salen siempre de Confirm (con nuestro
+token privado). Ambas entradas son idempotentes por payphone_tx_id.
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import agenda_index, booking_lock, models, schemas
+from . import scheduler as app_scheduler
+from .config import settings
+from .db import SessionLocal
+from .events import APPT_CONFIRMED, emit_appointment_event
+from .mailer.notifications import send_confirmed_emails_by_id
+from .payphone_client import PayphoneError, confirm_button
+from .query_watch import watched
+from .scheduler import schedule_reminder_job_by_id
+from .utils.tz import aware_to_local, db_aware_utc
+from .zoom_client import zoom
+
+logger = logging.getLogger(__name__)
+
+# Estados de payphone_notifications.status
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+SWEEP_JOB_ID = "payphone_notifications:sweep"
+_SWEEP_BATCH = 20
+_STALE_CLAIM = timedelta(minutes=5)     # un "processing" más viejo se da por caído
+_MAX_BACKOFF = timedelta(hours=1)
+
+
+# =========================
+# Helpers
+# =========================
+
+def _parse_optional_appt_ids(opt3: Optional[str]) -> List[int]:
+    """
+    Espera formato 'appts=12,34,56'. Devuelve [12,34,56].
+    """
+    if not opt3:
+        return []
+    opt3 = str(opt3).strip()
+    if not opt3.startswith("appts="):
+        return []
+    payload = opt3[6:].strip()
+    if not payload:
+        return []
+    ids: List[int] = []
+    for tok in payload.split(","):
+        tok = tok.strip()
+        if tok.isdigit():
+            ids.append(int(tok))
+    return ids
+
+
+def _zoom_start_iso_local_gye(start_utc: datetime) -> str:
+    """
+    Zoom: si envías timezone="America/Guayaquil", NO debes enviar 'Z'.
+    Debes pasar el start_time en hora local (sin sufijo Z).
+    """
+    local_dt = aware_to_local(start_utc).replace(microsecond=0)
+    # isoformat sin Z: p.ej. "2025-11-13T14:00:00"
+    return local_dt.isoformat(timespec="seconds")
+
+
+def _fmt_diag_times(s_utc: datetime, e_utc: datetime) -> Dict[str, str]:
+    """Pequeño helper para adjuntar horarios en UTC y en GYE (texto)."""
+    s_gye = aware_to_local(s_utc)
+    e_gye = aware_to_local(e_utc)
+    return {
+        "start_utc": s_utc.replace(microsecond=0).isoformat(),
+        "end_utc": e_utc.replace(microsecond=0).isoformat(),
+        "start_gye": s_gye.replace(microsecond=0).isoformat(),
+        "end_gye": e_gye.replace(microsecond=0).isoformat(),
+    }
+
+
+# ---- confirmación en dos fases: validación en conjunto + Zoom en paralelo
+def _validate_targets(db: Session, appts: List[models.Appointment]) -> Dict[int, str]:
+    """
+    Fase 1: motivo de rechazo por id de cita (las que no aparecen pasan).
+    Una consulta de rango por doctora (citas + bloqueos) para todas sus
+    citas del pago; las del propio pago no se cuentan como conflicto entre
+    sí salvo que se pisen. Se llama con el candado de reservas tomado.
+    """
+    errors: Dict[int, str] = {}
+    by_doctor: Dict[int, List[Tuple[models.Appointment, datetime, datetime]]] = {}
+    for appt in appts:
+        s_utc = db_aware_utc(appt.start_at)
+        e_utc = db_aware_utc(appt.end_at)
+        if e_utc <= s_utc:
+            errors[appt.id] = "Rango horario inválido"
+            continue
+        by_doctor.setdefault(appt.doctor_id, []).append((appt, s_utc, e_utc))
+
+    for doctor_id, items in by_doctor.items():
+        hits = agenda_index.sql_conflicts_many(
+            db,
+            doctor_id=doctor_id,
+            intervals=[(s_utc, e_utc) for _, s_utc, e_utc in items],
+            exclude_appt_ids=tuple(appt.id for appt, _, _ in items),
+        )
+        for (appt, _, _), hit in zip(items, hits):
+            if hit is not None:
+                errors[appt.id] = "Conflicto con otro evento/hold"
+
+        # Citas del mismo pago que se pisan entre sí: ninguna se confirma
+        reach: Optional[Tuple[datetime, int]] = None
+        for appt, s_utc, e_utc in sorted(items, key=lambda t: t[1]):
+            if reach is not None and s_utc < reach[0]:
+                errors[appt.id] = errors[reach[1]] = "Conflicto con otro evento/hold"
+            if reach is None or e_utc > reach[0]:
+                reach = (e_utc, appt.id)
+    return errors
+
+
+async def _provision_zoom(appts: List[models.Appointment]) -> None:
+    """
+    Fase 2, ya confirmadas y sin candado: crea las reuniones Zoom que
+    falten, en paralelo y acotado (PAYPHONE_PROVISION_CONCURRENCY). Un
+    fallo no deshace la confirmación: la cita queda sin link (podrás
+    reintentar luego).
+    """
+    pending = [a for a in appts if not a.zoom_meeting_id or not a.zoom_join_url]
+    if not pending:
+        return
+    sem = asyncio.Semaphore(max(1, settings.PAYPHONE_PROVISION_CONCURRENCY))
+
+    async def create(appt: models.Appointment):
+        if not settings.ZOOM_DEFAULT_USER:
+            raise RuntimeError("ZOOM_DEFAULT_USER no configurado")
+        s_utc = db_aware_utc(appt.start_at)
+        e_utc = db_aware_utc(appt.end_at)
+        async with sem:
+            return await zoom.create_meeting(
+                user_id=settings.ZOOM_DEFAULT_USER,
+                topic=f"Cita {appt.id} - Doctor {appt.doctor_id}",
+                start_time_iso=_zoom_start_iso_local_gye(s_utc),  # HORA LOCAL GYE (sin 'Z')
+                duration_minutes=int((e_utc - s_utc).total_seconds() // 60) or 45,
+                timezone="America/Guayaquil",                    # timezone declarado
+                waiting_room=True,
+                join_before_host=False,
+            )
+
+    results = await asyncio.gather(*(create(a) for a in pending), return_exceptions=True)
+    for appt, z in zip(pending, results):
+        if isinstance(z, BaseException):
+            logger.warning("[payments] No se pudo crear Zoom para cita %s: %s", appt.id, z)
+            appt.zoom_meeting_id = None
+            appt.zoom_join_url = None
+            continue
+        appt.zoom_meeting_id = str(z.get("id"))
+        appt.zoom_join_url = z.get("join_url")
+
+
+def _cache_status(
+    db: Session,
+    *,
+    transaction_id: int,
+    client_tx_id: str,
+    resp: Dict[str, Any],
+    approved: bool,
+    appointment_ids: List[int],
+    payment_id: Optional[int],
+    failed: List[Dict[str, Any]],
+) -> None:
+    """
+    Guarda lo último que dijo Confirm de la transacción (payphone_transactions)
+    para la conciliación (app/reconciliation.py). No hace commit.
+    """
+    T = models.PayphoneTransaction
+    values = dict(
+        client_tx_id=client_tx_id or None,
+        transaction_status=(resp.get("transactionStatus") or "")[:40] or None,
+        status_code=int(resp.get("statusCode") or 0),
+        approved=approved,
+        amount_cents=int(resp.get("amount") or 0),
+        appointment_ids=appointment_ids,
+        failed_appointments=[{"appointment_id": f["appointment_id"], "reason": f["reason"]} for f in failed],
+        payment_id=payment_id,
+        checked_at=datetime.now(timezone.utc),
+    )
+    row = db.scalar(select(T).where(T.transaction_id == str(transaction_id)))
+    if row is None:
+        try:
+            with db.begin_nested():
+                db.add(T(transaction_id=str(transaction_id), **values))
+            return
+        except IntegrityError:
+            # El navegador y la notificación la registraron a la vez
+            row = db.scalar(select(T).where(T.transaction_id == str(transaction_id)))
+    if row.payment_id is not None:
+        # Una re-consulta tardía no "des-registra" un pago ya aplicado
+        values.pop("payment_id")
+    for key, value in values.items():
+        setattr(row, key, value)
+
+
+def _existing_payment(db: Session, transaction_id: int) -> Optional[models.Payment]:
+    return db.scalar(
+        select(models.Payment).where(models.Payment.payphone_tx_id == str(transaction_id))
+    )
+
+
+# =========================
+# Confirmación (común a /confirm y al procesador)
+# =========================
+
+async def confirm_transaction(
+    db: Session,
+    resp: Dict[str, Any],
+    *,
+    transaction_id: int,
+    client_tx_id: str,
+    patient_id: Optional[int] = None,
+) -> Tuple[schemas.PayphoneConfirmOut, List[int]]:
+    """
+    Aplica la respuesta de PayPhone Confirm (`resp`):
+    - Lee optionalParameter3 = 'appts=ID1,ID2,...' y confirma SOLO esas citas (nuevo flujo)
+    - Si no llega optionalParameter3, cae al flujo anterior por clientTxId (legado)
+    - Registra Payment idempotente por payphone_tx_id (transactionId)
+    - `patient_id` restringe las citas a las de ese paciente (flujo del navegador)
+
+    Hace commit. Devuelve (respuesta, ids confirmados); correos y
+    recordatorios quedan a cargo del llamador.
+    """
+    transaction_status = (resp.get("transactionStatus") or "").strip()
+    status_code = int(resp.get("statusCode") or 0)
+    transaction_id = int(resp.get("transactionId") or transaction_id)
+    client_tx_id = resp.get("clientTransactionId") or client_tx_id or ""
+    amount = int(resp.get("amount") or 0)  # centavos
+    opt3 = resp.get("optionalParameter3")  # p.ej. "appts=12,34,56"
+    appt_ids_from_opt3 = _parse_optional_appt_ids(opt3)
+
+    approved = (transaction_status.lower() == "approved") and (status_code == 3)
+
+    logger.info(
+        "[payments] Payphone confirm tx_id=%s approved=%s client_tx_id=%s opt3=%s",
+        transaction_id, approved, client_tx_id, opt3
+    )
+
+    def out(**kw) -> schemas.PayphoneConfirmOut:
+        return schemas.PayphoneConfirmOut(
+            transaction_status=transaction_status,
+            status_code=status_code,
+            transaction_id=transaction_id,
+            client_tx_id=client_tx_id,
+            amount_cents=amount,
+            **kw,
+        )
+
+    def already_registered(payment: models.Payment) -> schemas.PayphoneConfirmOut:
+        stmt = select(models.Appointment)
+        if appt_ids_from_opt3:
+            stmt = stmt.where(models.Appointment.id.in_(appt_ids_from_opt3))
+        else:
+            stmt = stmt.where(models.Appointment.client_tx_id == client_tx_id)
+            if patient_id is not None:
+                stmt = stmt.where(models.Appointment.patient_id == patient_id)
+        confirmed_ids = [a.id for a in db.scalars(stmt) if a.status == models.AppointmentStatus.confirmed]
+
+        logger.info(
+            "[payments] Pago idempotente tx_id=%s -> confirmed=%s",
+            transaction_id, confirmed_ids
+        )
+        return out(
+            approved=approved,
+            confirmed_appointment_ids=confirmed_ids,
+            payment_id=payment.id,
+            message="Pago ya había sido registrado (idempotente).",
+            failed_appointments=[],
+        )
+
+    # 1) Idempotencia por pago
+    existing_payment = _existing_payment(db, transaction_id)
+    if existing_payment:
+        return already_registered(existing_payment), []
+
+    # 2) Si NO está aprobado, respondemos sin confirmar nada
+    if not approved:
+        logger.info(
+            "[payments] Transacción NO aprobada (tx_id=%s): status=%s code=%s msg=%s",
+            transaction_id, transaction_status, status_code, resp.get("message")
+        )
+        _cache_status(
+            db, transaction_id=transaction_id, client_tx_id=client_tx_id, resp=resp, approved=False,
+            appointment_ids=appt_ids_from_opt3, payment_id=None, failed=[],
+        )
+        db.commit()
+        return out(
+            approved=False,
+            confirmed_appointment_ids=[],
+            payment_id=None,
+            message=resp.get("message") or "Transacción no aprobada.",
+            failed_appointments=[],
+        ), []
+
+    # 3) Obtener citas a confirmar
+    confirmable = [
+        models.AppointmentStatus.pending,
+        getattr(models.AppointmentStatus, "processing", models.AppointmentStatus.pending),
+        models.AppointmentStatus.free,
+    ]
+    target_stmt = select(models.Appointment).where(models.Appointment.status.in_(confirmable))
+    if patient_id is not None:
+        target_stmt = target_stmt.where(models.Appointment.patient_id == patient_id)
+    if appt_ids_from_opt3:
+        target_stmt = target_stmt.where(models.Appointment.id.in_(appt_ids_from_opt3))
+    else:
+        # LEGADO: por client_tx_id
+        target_stmt = target_stmt.where(models.Appointment.client_tx_id == client_tx_id)
+
+    # Candado de reservas de cada doctora involucrada y lectura bajo el candado:
+    # cada cita se chequea una sola vez y nadie toma el horario hasta el commit
+    doctor_ids = list(db.scalars(target_stmt.with_only_columns(models.Appointment.doctor_id).distinct()))
+    await booking_lock.lock_doctors_async(db, doctor_ids)
+    # El navegador y la notificación pueden llegar a la vez: el segundo en
+    # tomar el candado encuentra el pago ya registrado. Se re-chequea aunque
+    # no queden citas confirmables: las pudo confirmar justo el otro.
+    existing_payment = _existing_payment(db, transaction_id)
+    if existing_payment:
+        return already_registered(existing_payment), []
+    target_appts = list(db.scalars(target_stmt.execution_options(populate_existing=True)))
+
+    logger.info(
+        "[payments] Citas objetivo para confirmar (tx=%s): %s",
+        transaction_id, [a.id for a in target_appts]
+    )
+
+    confirmed_ids: List[int] = []
+    failed: List[Dict[str, Any]] = []
+
+    # 4) Validar todas las citas de una vez (saltando conflictos
+    #    individualmente) y confirmar; Zoom va después del commit
+    errors = _validate_targets(db, target_appts)
+
+    for appt in target_appts:
+        diag = _fmt_diag_times(db_aware_utc(appt.start_at), db_aware_utc(appt.end_at))
+        err = errors.get(appt.id)
+        if err is None:
+            appt.status = models.AppointmentStatus.confirmed
+            appt.hold_until = None
+            confirmed_ids.append(appt.id)
+            emit_appointment_event(db, APPT_CONFIRMED, appt)
+            logger.info("[payments] Cita %s confirmada OK | diag=%s", appt.id, diag)
+        else:
+            logger.info(
+                "[payments] Cita %s NO confirmada: %s | diag=%s",
+                appt.id, err, diag
+            )
+            # enriquecer con horarios para depurar TZ
+            failed.append({
+                "appointment_id": appt.id,
+                "reason": err,
+                **diag
+            })
+
+    # 5) Registrar Payment si al menos una cita fue confirmada
+    payment_row: Optional[models.Payment] = None
+    if confirmed_ids:
+        ref_id = confirmed_ids[0]
+        payment_row = models.Payment(
+            appointment_id=ref_id,
+            method="payphone",
+            amount_cents=amount,
+            payphone_tx_id=str(transaction_id),
+            client_tx_id=client_tx_id,
+            appointment_ids=appt_ids_from_opt3 or None,
+            raw_payload=resp,  # auditoría completa (comprimida en payment_payloads)
+        )
+        db.add(payment_row)
+        db.flush()
+
+    _cache_status(
+        db, transaction_id=transaction_id, client_tx_id=client_tx_id, resp=resp, approved=True,
+        appointment_ids=appt_ids_from_opt3 or [a.id for a in target_appts],
+        payment_id=payment_row.id if payment_row else None, failed=failed,
+    )
+    payment_id: Optional[int] = payment_row.id if payment_row else None
+    db.commit()
+
+    # 6) Zoom fuera del candado (el commit lo soltó) y links en otra
+    #    transacción corta: una llamada lenta no frena otras reservas
+    if confirmed_ids:
+        # Una lectura recarga las citas que el commit dejó expiradas
+        confirmed_appts = list(db.scalars(
+            select(models.Appointment).where(models.Appointment.id.in_(confirmed_ids))
+        ))
+        await _provision_zoom(confirmed_appts)
+        db.commit()
+
+    logger.info(
+        "[payments] Resultado confirmación tx=%s -> confirmed=%s failed=%s",
+        transaction_id, confirmed_ids, [f.get("appointment_id") for f in failed]
+    )
+
+    return out(
+        approved=True,
+        confirmed_appointment_ids=confirmed_ids,
+        payment_id=payment_id,
+        message=(
+            "Pago aprobado. Citas confirmadas."
+            if confirmed_ids else
+            "Pago aprobado, pero no se confirmó ninguna cita (posible conflicto/expiración)."
+        ),
+        failed_appointments=failed,
+    ), confirmed_ids
+
+
+# =========================
+# Notificaciones servidor a servidor
+# =========================
+
+def _field(payload: Dict[str, Any], *names: str) -> Any:
+    """PayPhone manda PascalCase en la notificación y camelCase en Confirm."""
+    lowered = {str(k).lower(): v for k, v in payload.items()}
+    for name in names:
+        value = lowered.get(name.lower())
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def verify_notification(token: Optional[str], payload: Dict[str, Any]) -> Tuple[int, str]:
+    """
+    Valida la notificación y devuelve (transaction_id, client_tx_id).
+    - Token compartido (PAYPHONE_WEBHOOK_TOKEN) en ?token= o X-Payphone-Token.
+    - Si viene StoreId, debe ser el nuestro.
+    """
+    expected = settings.PAYPHONE_WEBHOOK_TOKEN
+    if not expected:
+        raise HTTPException(status_code=404, detail="Notificaciones PayPhone no habilitadas")
+    if not token or not hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Token de notificación inválido")
+
+    store_id = _field(payload, "storeId")
+    if store_id and settings.PAYPHONE_STORE_ID and str(store_id) != str(settings.PAYPHONE_STORE_ID):
+        raise HTTPException(status_code=403, detail="StoreId no corresponde a este comercio")
+
+    raw_tx = _field(payload, "transactionId")
+    try:
+        transaction_id = int(raw_tx)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Notificación sin transactionId válido")
+    client_tx_id = str(_field(payload, "clientTransactionId", "clientTxId") or "")
+    return transaction_id, client_tx_id
+
+
+def enqueue_notification(
+    db: Session,
+    *,
+    transaction_id: int,
+    client_tx_id: str,
+    payload: Dict[str, Any],
+) -> Tuple[models.PayphoneNotification, bool]:
+    """
+    Registra la transacción para procesar (un INSERT). Devuelve (fila, nueva).
+    Las repetidas no se re-encolan salvo que la anterior haya fallado.
+    """
+    N = models.PayphoneNotification
+    now = datetime.now(timezone.utc)
+    row = db.scalar(select(N).where(N.transaction_id == str(transaction_id)))
+    if row is None:
+        row = N(
+            transaction_id=str(transaction_id),
+            client_tx_id=client_tx_id or None,
+            status=PENDING,
+            attempts=0,
+            next_attempt_at=now,
+            payload=payload,
+        )
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Notificación duplicada que llegó en paralelo
+            db.rollback()
+            return db.scalar(select(N).where(N.transaction_id == str(transaction_id))), False
+        return row, True
+
+    if row.status == FAILED:
+        row.status = PENDING
+        row.attempts = 0
+        row.next_attempt_at = now
+        row.payload = payload
+        db.commit()
+        return row, True
+    return row, False
+
+
+def _claim(db: Session, notification_id: int) -> bool:
+    N = models.PayphoneNotification
+    now = datetime.now(timezone.utc)
+    claimed = db.execute(
+        update(N)
+        .where(N.id == notification_id)
+        .where(or_(
+            (N.status == PENDING) & (N.next_attempt_at <= now),
+            (N.status == PROCESSING) & (N.claimed_at < now - _STALE_CLAIM),
+        ))
+        .values(status=PROCESSING, claimed_at=now, attempts=N.attempts + 1)
+    ).rowcount
+    db.commit()
+    return bool(claimed)
+
+
+def _retry_later(db: Session, row: models.PayphoneNotification, error: str) -> None:
+    row.last_error = error[:2000]
+    if row.attempts >= settings.PAYPHONE_NOTIFY_MAX_ATTEMPTS:
+        row.status = FAILED
+        logger.error("[payments] Notificación tx=%s agotó reintentos: %s", row.transaction_id, error)
+    else:
+        row.status = PENDING
+        backoff = timedelta(seconds=settings.PAYPHONE_NOTIFY_SWEEP_SECONDS * 2 ** (row.attempts - 1))
+        row.next_attempt_at = datetime.now(timezone.utc) + min(backoff, _MAX_BACKOFF)
+        logger.warning("[payments] Notificación tx=%s reintento %s: %s", row.transaction_id, row.attempts, error)
+    db.commit()
+
+
+async def _after_confirm(confirmed_ids: List[int]) -> None:
+    for appt_id in confirmed_ids:
+        try:
+            await send_confirmed_emails_by_id(appt_id)
+        except Exception as ex:
+            logger.warning("[payments] No se pudo enviar correo de cita %s: %s", appt_id, ex)
+        schedule_reminder_job_by_id(appt_id)
+
+
+@watched("job:payphone_notification")
+async def process_notification(notification_id: int) -> None:
+    """
+    Procesa una notificación encolada: consulta Confirm y aplica
+    confirm_transaction. Errores de PayPhone o de agenda ocupada se
+    reintentan con backoff; tras PAYPHONE_NOTIFY_MAX_ATTEMPTS queda 'failed'.
+    """
+    db = SessionLocal()
+    try:
+        if not _claim(db, notification_id):
+            return  # ya procesada, en curso en otro worker o aún no toca
+        row = db.get(models.PayphoneNotification, notification_id)
+        transaction_id = int(row.transaction_id)
+        client_tx_id = row.client_tx_id or ""
+
+        try:
+            resp = await asyncio.to_thread(confirm_button, transaction_id=transaction_id, client_tx_id=client_tx_id)
+            result, confirmed_ids = await confirm_transaction(
+                db, resp, transaction_id=transaction_id, client_tx_id=client_tx_id,
+            )
+        except (PayphoneError, HTTPException) as ex:
+            db.rollback()
+            _retry_later(db, db.get(models.PayphoneNotification, notification_id), str(getattr(ex, "detail", ex)))
+            return
+        except Exception as ex:
+            db.rollback()
+            logger.exception("[payments] Error procesando notificación tx=%s", transaction_id)
+            _retry_later(db, db.get(models.PayphoneNotification, notification_id), repr(ex))
+            return
+
+        row = db.get(models.PayphoneNotification, notification_id)
+        row.status = DONE
+        row.processed_at = datetime.now(timezone.utc)
+        row.payment_id = result.payment_id
+        row.last_error = None if result.approved else result.message
+        db.commit()
+    finally:
+        db.close()
+
+    await _after_confirm(confirmed_ids)
+
+
+@watched("job:payphone_notifications_sweep")
+async def process_due_notifications() -> int:
+    """Job periódico: procesa las notificaciones pendientes (reintentos, caídas)."""
+    N = models.PayphoneNotification
+    now = datetime.now(timezone.utc)
+    with SessionLocal() as db:
+        ids = list(db.scalars(
+            select(N.id)
+            .where(or_(
+                (N.status == PENDING) & (N.next_attempt_at <= now),
+                (N.status == PROCESSING) & (N.claimed_at < now - _STALE_CLAIM),
+            ))
+            .order_by(N.next_attempt_at)
+            .limit(_SWEEP_BATCH)
+        ))
+    for notification_id in ids:
+        await process_notification(notification_id)
+    return len(ids)
+
+
+def start_notification_sweep() -> None:
+    """Registra el job periódico en el scheduler (llamar tras start_scheduler)."""
+    sched = app_scheduler.scheduler
+    if not sched:
+        return
+    sched.add_job(
+        func=process_due_notifications,
+        trigger="interval",
+        seconds=settings.PAYPHONE_NOTIFY_SWEEP_SECONDS,
+        id=SWEEP_JOB_ID,
+        replace_existing=True,
+        misfire_grace_time=60,
+        coalesce=True,
+        max_instances=1,
+    )
@@ -0,0 +1,270 @@
+# app/query_watch.py
+"""
+Detector de consultas lentas y N+1 (opt-in, pensado para dev/staging y tests).
+
+- Agrupa cada sentencia SQL por "huella" (literales, números y listas IN
+  normalizados) dentro de un ámbito: un request HTTP (QueryWatchMiddleware)
+  o un job (`@watched("job:...")`).
+- Al cerrar el ámbito, avisa si una misma huella se repitió N o más veces
+  (patrón típico: un `db.get` por elemento dentro de un for).
+- Registra las sentencias más lentas que QUERY_WATCH_SLOW_MS con los
+  parámetros redactados (solo tipo y largo, nunca el valor).
+- `query_budget(...)` hace fallar un test si una ruta supera su presupuesto.
+
+Se activa con QUERY_WATCH_ENABLED=true; `query_budget` lo instala solo.
+"""
+from __future__ import annotations
+
+import functools
+import inspect
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Se superó el presupuesto de consultas de un ámbito (falla el test)."""
+
+
+# =========================
+# Huellas y redacción
+# =========================
+
+_RE_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?")
+_RE_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)|\bIN\s*\(\s*__\[POSTCOMPILE_\w+\]\s*\)", re.I)
+_RE_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Normaliza una sentencia para agrupar las que solo cambian en valores:
+        SELECT ... WHERE id = 7      -> SELECT ... WHERE id = ?
+        ... IN (1, 2, 3)             -> ... IN (...)
+    """
+    s = _RE_COMMENT.sub(" ", statement)
+    s = _RE_STRING.sub("?", s)
+    s = _RE_PARAM.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_IN_LIST.sub("IN (...)", s)
+    return _RE_SPACES.sub(" ", s).strip()
+
+
+def _redact_value(v: Any) -> Any:
+    if v is None or isinstance(v, bool):
+        return v
+    if isinstance(v, (str, bytes)):
+        return f"<{type(v).__name__}:{len(v)}>"
+    return f"<{type(v).__name__}>"
+
+
+def redact_params(parameters: Any) -> Any:
+    """Reemplaza cada valor por su tipo (y largo en strings): sin PII en logs."""
+    if isinstance(parameters, dict):
+        return {k: _redact_value(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: basta con la primera fila y el total
+            return {"rows": len(parameters), "first": redact_params(parameters[0])}
+        return [_redact_value(v) for v in parameters]
+    return _redact_value(parameters)
+
+
+# =========================
+# Ámbitos (request / job / test)
+# =========================
+
+@dataclass
+class QueryWatch:
+    name: str
+    n1_threshold: int
+    statements: int = 0
+    seconds: float = 0.0
+    counts: Counter = field(default_factory=Counter)
+
+    def record(self, fp: str, elapsed: float) -> None:
+        self.statements += 1
+        self.seconds += elapsed
+        self.counts[fp] += 1
+
+    def repeated(self, threshold: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Huellas repetidas >= threshold veces (posibles N+1), de mayor a menor."""
+        t = threshold or self.n1_threshold
+        return [(fp, n) for fp, n in self.counts.most_common() if n >= t]
+
+    def log_report(self) -> None:
+        for fp, n in self.repeated():
+            logger.warning("[query_watch] posible N+1 en %s: %dx %s", self.name, n, fp[:300])
+
+
+_active: ContextVar[Tuple[QueryWatch, ...]] = ContextVar("query_watch_active", default=())
+
+
+class watch:
+    """
+    Abre un ámbito de observación (context manager sync o async):
+
+        with watch("job:rebuild_jobs") as w: ...
+        w.statements, w.repeated()
+    """
+
+    def __init__(self, name: str, *, n1_threshold: Optional[int] = None, report: bool = True):
+        self.qw = QueryWatch(name=name, n1_threshold=n1_threshold or settings.QUERY_WATCH_N1_THRESHOLD)
+        self.report = report
+        self._token = None
+
+    def _enter(self) -> QueryWatch:
+        self._token = _active.set(_active.get() + (self.qw,))
+        return self.qw
+
+    def _exit(self) -> None:
+        _active.reset(self._token)
+        if self.report:
+            self.qw.log_report()
+
+    def __enter__(self) -> QueryWatch:
+        return self._enter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._exit()
+        return False
+
+    async def __aenter__(self) -> QueryWatch:
+        return self._enter()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._exit()
+        return False
+
+
+def watched(name: str) -> Callable:
+    """Decorador para jobs: ejecuta la función (sync o async) dentro de `watch(name)`."""
+
+    def deco(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                async with watch(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with watch(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return deco
+
+
+class query_budget(watch):
+    """
+    Para tests: falla con QueryBudgetExceeded si el bloque ejecuta más de
+    `max_statements` sentencias o repite una huella `n1_threshold` veces.
+
+        with query_budget(max_statements=6, n1_threshold=3):
+            client.get("/availability/slots", params=...)
+    """
+
+    def __init__(self, max_statements: Optional[int] = None, *, n1_threshold: Optional[int] = None,
+                 name: str = "budget"):
+        super().__init__(name, n1_threshold=n1_threshold, report=False)
+        self.max_statements = max_statements
+        install()
+
+    def _exit(self) -> None:
+        super()._exit()
+        problems = []
+        if self.max_statements is not None and self.qw.statements > self.max_statements:
+            problems.append(f"{self.qw.statements} sentencias (máximo {self.max_statements})")
+        for fp, n in self.qw.repeated():
+            problems.append(f"{n}x {fp[:200]}")
+        if problems:
+            raise QueryBudgetExceeded(f"[{self.qw.name}] " + "; ".join(problems))
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # No tapar el error original del bloque
+            _active.reset(self._token)
+            return False
+        self._exit()
+        return False
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+# =========================
+# Hooks del engine
+# =========================
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_qw_t0", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("_qw_t0")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    scopes = _active.get()
+    if not scopes and elapsed * 1000 < settings.QUERY_WATCH_SLOW_MS:
+        return
+
+    fp = fingerprint(statement)
+    for qw in scopes:
+        qw.record(fp, elapsed)
+
+    if elapsed * 1000 >= settings.QUERY_WATCH_SLOW_MS:
+        logger.warning(
+            "[query_watch] consulta lenta (%.0f ms) en %s: %s | params=%s",
+            elapsed * 1000,
+            scopes[-1].name if scopes else "-",
+            _RE_SPACES.sub(" ", statement).strip()[:500],
+            redact_params(parameters),
+        )
+
+
+def install() -> None:
+    """Registra los hooks en todos los Engine (idempotente)."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# =========================
+# Middleware ASGI (un ámbito por request)
+# =========================
+
+class QueryWatchMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        install()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(("/metrics", "/events/")):
+            await self.app(scope, receive, send)
+            return
+        w = watch(f"{scope['method']} {scope['path']}")
+        async with w:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # Con la ruta resuelta, agrupamos por plantilla (/appointments/{id})
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    w.qw.name = f"{scope['method']} {route}"
@@ -0,0 +1,287 @@
+# app/reconciliation.py
+"""
+Conciliación de pagos PayPhone (job periódico + GET /payments/reconciliation).
+
+Barre tres fuentes por lotes, cada una desde su marca de agua
+(reconciliation_watermarks), así cada corrida solo mira lo nuevo y el
+costo no crece con el historial:
+
+- payphone_transactions (por checked_at, id): transacciones aprobadas por
+  PayPhone sin Payment registrado => `approved_without_payment` (las citas
+  vencieron o chocaron y el cobro quedó sin aplicar).
+- payments (por id): citas que el pago dice cubrir y que no existen
+  (`appointment_missing`: el hold venció y se borró) o no están
+  confirmadas (`appointment_not_confirmed`); pagos sin ninguna cita
+  (`payment_orphaned`).
+- expired_holds (por hold_until, id): lápidas que deja delete_stale_holds
+  al borrar un hold del flujo legado (client_tx_id); pasado
+  RECONCILIATION_HOLD_GRACE_MINUTES, si el pago nunca volvió =>
+  `hold_expired_unpaid`. Es una cola: cada lápida revisada se borra en el
+  mismo commit, así que no depende de la marca de agua (una lápida puede
+  llegar tarde, con un hold_until anterior a la marca, si nadie limpió
+  holds por un rato).
+
+Cada hallazgo es una fila en reconciliation_issues, única por (kind,
+subject): volver a barrer lo mismo no duplica. Hallazgos y marca de agua se
+guardan en el mismo commit por lote (una caída no salta ni repite nada).
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from . import models
+from . import scheduler as app_scheduler
+from .config import settings
+from .db import SessionLocal
+from .query_watch import watched
+from .utils.tz import db_aware_utc
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "payments:reconciliation"
+
+Issue = Dict[str, Any]
+# (issues, filas leídas, nueva marca (last_at, last_id))
+BatchResult = Tuple[List[Issue], int, Tuple[Optional[datetime], int]]
+
+
+def _after(col_at, col_id, last_at: Optional[datetime], last_id: int):
+    """Filas posteriores a la marca (last_at, last_id) en orden (col_at, col_id)."""
+    if last_at is None:
+        return col_id > last_id
+    return or_(col_at > last_at, and_(col_at == last_at, col_id > last_id))
+
+
+def _issue(kind: str, subject: str, **fields) -> Issue:
+    return {"kind": kind, "subject": subject, **fields}
+
+
+# =========================
+# Barridos
+# =========================
+
+def _scan_transactions(db: Session, last_at: Optional[datetime], last_id: int, limit: int) -> BatchResult:
+    T = models.PayphoneTransaction
+    rows = list(db.execute(
+        select(T.id, T.checked_at, T.transaction_id, T.approved, T.payment_id,
+               T.amount_cents, T.appointment_ids, T.failed_appointments)
+        .where(_after(T.checked_at, T.id, last_at, last_id))
+        .order_by(T.checked_at, T.id)
+        .limit(limit)
+    ))
+    issues = [
+        _issue(
+            "approved_without_payment", f"tx:{r.transaction_id}",
+            payphone_tx_id=r.transaction_id,
+            detail={
+                "amount_cents": r.amount_cents,
+                "appointment_ids": r.appointment_ids or [],
+                "failed_appointments": r.failed_appointments or [],
+            },
+        )
+        for r in rows
+        if r.approved and r.payment_id is None
+    ]
+    # Una re-consulta posterior que sí registró el pago cierra el hallazgo
+    settled = [f"tx:{r.transaction_id}" for r in rows if r.approved and r.payment_id is not None]
+    if settled:
+        R = models.ReconciliationIssue
+        db.execute(
+            update(R)
+            .where(R.kind == "approved_without_payment", R.subject.in_(settled), R.resolved_at.is_(None))
+            .values(resolved_at=datetime.now(timezone.utc))
+        )
+    mark = (db_aware_utc(rows[-1].checked_at), rows[-1].id) if rows else (last_at, last_id)
+    return issues, len(rows), mark
+
+
+def _scan_payments(db: Session, last_at: Optional[datetime], last_id: int, limit: int) -> BatchResult:
+    P, A = models.Payment, models.Appointment
+    rows = list(db.execute(
+        select(P.id, P.payphone_tx_id, P.client_tx_id, P.appointment_ids)
+        .where(P.id > last_id)
+        .order_by(P.id)
+        .limit(limit)
+    ))
+    if not rows:
+        return [], 0, (last_at, last_id)
+
+    # Citas esperadas: appointment_ids (de optionalParameter3) o, en el flujo legado, client_tx_id
+    expected: Dict[int, List[int]] = {r.id: list(r.appointment_ids or []) for r in rows}
+    legacy = {r.client_tx_id for r in rows if not expected[r.id] and r.client_tx_id}
+    by_ctx: Dict[str, List[int]] = {}
+    if legacy:
+        for appt_id, ctx in db.execute(select(A.id, A.client_tx_id).where(A.client_tx_id.in_(legacy))):
+            by_ctx.setdefault(ctx, []).append(appt_id)
+    for r in rows:
+        if not expected[r.id] and r.client_tx_id:
+            expected[r.id] = by_ctx.get(r.client_tx_id, [])
+
+    wanted = {i for ids in expected.values() for i in ids}
+    status_of = dict(db.execute(select(A.id, A.status).where(A.id.in_(wanted))).all()) if wanted else {}
+
+    issues: List[Issue] = []
+    for r in rows:
+        ids = expected[r.id]
+        if not ids:
+            issues.append(_issue("payment_orphaned", f"payment:{r.id}", payment_id=r.id, payphone_tx_id=r.payphone_tx_id))
+            continue
+        for appt_id in ids:
+            st = status_of.get(appt_id)
+            if st is None:
+                kind = "appointment_missing"
+            elif st != models.AppointmentStatus.confirmed:
+                kind = "appointment_not_confirmed"
+            else:
+                continue
+            issues.append(_issue(
+                kind, f"payment:{r.id}:appt:{appt_id}",
+                payment_id=r.id, appointment_id=appt_id, payphone_tx_id=r.payphone_tx_id,
+                detail={"status": st.value if st is not None else None},
+            ))
+    return issues, len(rows), (last_at, rows[-1].id)
+
+
+def _scan_stale_holds(db: Session, last_at: Optional[datetime], last_id: int, limit: int) -> BatchResult:
+    H, P, T = models.ExpiredHold, models.Payment, models.PayphoneTransaction
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=settings.RECONCILIATION_HOLD_GRACE_MINUTES)
+    # Cola de lápidas: sin filtro por marca de agua (ver docstring del módulo)
+    rows = list(db.execute(
+        select(H.id, H.appointment_id, H.hold_until, H.client_tx_id, H.patient_id, H.doctor_id)
+        .where(H.hold_until < cutoff)
+        .order_by(H.hold_until, H.id)
+        .limit(limit)
+    ))
+    if not rows:
+        return [], 0, (last_at, last_id)
+    db.execute(delete(H).where(H.id.in_([r.id for r in rows])))
+
+    ctxs = {r.client_tx_id for r in rows}
+    paid = set(db.scalars(select(P.client_tx_id).where(P.client_tx_id.in_(ctxs))))
+    # Si PayPhone la aprobó, ya lo reporta approved_without_payment
+    approved = set(db.scalars(select(T.client_tx_id).where(T.client_tx_id.in_(ctxs), T.approved.is_(True))))
+    issues = [
+        _issue(
+            "hold_expired_unpaid", f"appt:{r.appointment_id}",
+            appointment_id=r.appointment_id,
+            detail={
+                "client_tx_id": r.client_tx_id,
+                "hold_until": db_aware_utc(r.hold_until).isoformat(),
+                "doctor_id": r.doctor_id,
+                "patient_id": r.patient_id,
+            },
+        )
+        for r in rows
+        if r.client_tx_id not in paid and r.client_tx_id not in approved
+    ]
+    return issues, len(rows), (db_aware_utc(rows[-1].hold_until), rows[-1].id)
+
+
+SCANS: Dict[str, Callable[[Session, Optional[datetime], int, int], BatchResult]] = {
+    "payphone_transactions": _scan_transactions,
+    "payments": _scan_payments,
+    "stale_holds": _scan_stale_holds,
+}
+
+
+# =========================
+# Corrida
+# =========================
+
+def _save_issues(db: Session, issues: List[Issue]) -> int:
+    """Inserta los hallazgos nuevos (una consulta para descartar los ya reportados)."""
+    if not issues:
+        return 0
+    R = models.ReconciliationIssue
+    keys = {(i["kind"], i["subject"]) for i in issues}
+    seen = set(db.execute(select(R.kind, R.subject).where(tuple_(R.kind, R.subject).in_(keys))).all())
+    new = []
+    for i in issues:
+        key = (i["kind"], i["subject"])
+        if key not in seen:
+            seen.add(key)
+            new.append(R(**i))
+    db.add_all(new)
+    return len(new)
+
+
+def _watermark(db: Session, name: str) -> models.ReconciliationWatermark:
+    wm = db.get(models.ReconciliationWatermark, name)
+    if wm is None:
+        wm = models.ReconciliationWatermark(name=name, last_id=0, last_at=None)
+        db.add(wm)
+    return wm
+
+
+@watched("job:payments_reconciliation")
+def run_reconciliation(max_batches: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Una pasada: cada barrido avanza hasta agotar lo nuevo o hasta
+    `max_batches` lotes de RECONCILIATION_BATCH_SIZE. Devuelve por barrido
+    {"scanned": filas leídas, "issues": hallazgos nuevos}.
+    """
+    limit = max(1, settings.RECONCILIATION_BATCH_SIZE)
+    max_batches = max_batches or settings.RECONCILIATION_MAX_BATCHES
+    out: Dict[str, Dict[str, int]] = {}
+    db = SessionLocal()
+    try:
+        for name, scan in SCANS.items():
+            stats = out[name] = {"scanned": 0, "issues": 0}
+            wm = _watermark(db, name)
+            last_at, last_id = (db_aware_utc(wm.last_at) if wm.last_at else None), wm.last_id
+            for _ in range(max_batches):
+                issues, n, (last_at, last_id) = scan(db, last_at, last_id, limit)
+                stats["scanned"] += n
+                stats["issues"] += _save_issues(db, issues)
+                wm.last_at, wm.last_id = last_at, last_id
+                db.commit()
+                if n < limit:
+                    break
+    finally:
+        db.close()
+    found = sum(s["issues"] for s in out.values())
+    if found:
+        logger.warning("[reconciliation] %s hallazgos nuevos: %s", found, out)
+    return out
+
+
+def summary(db: Session, *, recent: int = 50) -> Dict[str, Any]:
+    """Resumen para GET /payments/reconciliation."""
+    R = models.ReconciliationIssue
+    open_by_kind = dict(db.execute(
+        select(R.kind, func.count()).where(R.resolved_at.is_(None)).group_by(R.kind)
+    ).all())
+    notifications = dict(db.execute(
+        select(models.PayphoneNotification.status, func.count()).group_by(models.PayphoneNotification.status)
+    ).all())
+    return {
+        "open_total": sum(open_by_kind.values()),
+        "open_by_kind": open_by_kind,
+        "notifications_by_status": notifications,
+        "watermarks": list(db.scalars(select(models.ReconciliationWatermark).order_by(models.ReconciliationWatermark.name))),
+        "recent": list(db.scalars(
+            select(R).where(R.resolved_at.is_(None)).order_by(R.id.desc()).limit(recent)
+        )),
+    }
+
+
+def start_reconciliation_job() -> None:
+    """Registra la conciliación periódica en el scheduler (llamar tras start_scheduler)."""
+    sched = app_scheduler.scheduler
+    if not sched or settings.RECONCILIATION_INTERVAL_MINUTES <= 0:
+        return
+    sched.add_job(
+        func=run_reconciliation,
+        trigger="interval",
+        minutes=settings.RECONCILIATION_INTERVAL_MINUTES,
+        id=JOB_ID,
+        replace_existing=True,
+        misfire_grace_time=300,
+        coalesce=True,
+        max_instances=1,
+    )
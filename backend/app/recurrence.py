@@ -0,0 +1,136 @@
+# app/recurrence.py
+"""
+Recurrencias semanales estilo RRULE (FREQ=WEEKLY) en hora LOCAL naive.
+
+    WeeklyRule(interval=2, count=10)            -> cada 2 semanas, 10 veces
+    WeeklyRule(weekdays=(1, 2, 3, 4, 5))        -> lunes a viernes (modelo Sun=0..Sat=6)
+    WeeklyRule(until=datetime(2026, 12, 31))    -> hasta esa fecha (inclusive)
+
+Las semanas empiezan en lunes (WKST=MO) y se cuentan desde la semana de
+`dtstart`; las ocurrencias conservan la hora local de `dtstart`. Con `lo`
+se salta directo al período de la ventana sin recorrer los anteriores, así
+expandir una recurrencia larga para una semana concreta cuesta lo mismo
+que para la primera.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, Optional, Tuple
+
+# Tope duro para reglas sin count/until ni ventana (evita bucles infinitos)
+_MAX_PERIODS = 52 * 50
+
+
+@dataclass(frozen=True)
+class WeeklyRule:
+    interval: int = 1
+    weekdays: Tuple[int, ...] = ()       # modelo Sun=0..Sat=6; vacío = el día de dtstart
+    count: Optional[int] = None
+    until: Optional[datetime] = None     # LOCAL naive, inclusive
+
+    def to_rrule(self) -> str:
+        parts = ["FREQ=WEEKLY", f"INTERVAL={self.interval}"]
+        if self.weekdays:
+            parts.append("BYDAY=" + ",".join(_BYDAY[wd] for wd in sorted(self.weekdays)))
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until is not None:
+            parts.append("UNTIL=" + self.until.strftime("%Y%m%dT%H%M%S"))
+        return ";".join(parts)
+
+
+_BYDAY = ["SU", "MO", "TU", "WE", "TH", "FR", "SA"]
+
+
+def parse_rrule(text: str) -> WeeklyRule:
+    """
+    Subconjunto de RFC 5545 que usamos: FREQ=WEEKLY con INTERVAL, BYDAY,
+    COUNT y UNTIL (hora local, sin zona). ValueError si trae otra cosa.
+    """
+    fields = {}
+    for part in text.strip().removeprefix("RRULE:").split(";"):
+        if not part:
+            continue
+        k, _, v = part.partition("=")
+        fields[k.strip().upper()] = v.strip().upper()
+    if fields.pop("FREQ", None) != "WEEKLY":
+        raise ValueError("solo se admite FREQ=WEEKLY")
+    interval = int(fields.pop("INTERVAL", "1"))
+    weekdays: Tuple[int, ...] = ()
+    if "BYDAY" in fields:
+        try:
+            weekdays = tuple(sorted({_BYDAY.index(d) for d in fields.pop("BYDAY").split(",")}))
+        except ValueError:
+            raise ValueError("BYDAY inválido") from None
+    count = int(fields.pop("COUNT")) if "COUNT" in fields else None
+    until = None
+    if "UNTIL" in fields:
+        raw = fields.pop("UNTIL").rstrip("Z")
+        fmt = "%Y%m%dT%H%M%S" if re.fullmatch(r"\d{8}T\d{6}", raw) else "%Y%m%d"
+        until = datetime.strptime(raw, fmt)
+        if fmt == "%Y%m%d":
+            until = until.replace(hour=23, minute=59, second=59)
+    if fields:
+        raise ValueError(f"parte RRULE no soportada: {', '.join(sorted(fields))}")
+    rule = WeeklyRule(interval=interval, weekdays=weekdays, count=count, until=until)
+    validate(rule)
+    return rule
+
+
+def validate(rule: WeeklyRule) -> None:
+    if rule.interval < 1:
+        raise ValueError("INTERVAL debe ser >= 1")
+    if rule.count is not None and rule.count < 1:
+        raise ValueError("COUNT debe ser >= 1")
+    if rule.count is not None and rule.until is not None:
+        raise ValueError("COUNT y UNTIL son excluyentes")
+    if any(not 0 <= wd <= 6 for wd in rule.weekdays):
+        raise ValueError("weekday fuera de rango (0=domingo..6=sábado)")
+
+
+def iter_weekly(
+    dtstart: datetime,
+    rule: WeeklyRule,
+    *,
+    lo: Optional[datetime] = None,
+    hi: Optional[datetime] = None,
+) -> Iterator[Tuple[int, datetime]]:
+    """
+    (índice, inicio LOCAL) de cada ocurrencia con lo <= inicio < hi, en orden.
+    El índice es la posición en la serie completa (0 = dtstart o la primera
+    ocurrencia posterior), el mismo que cuenta COUNT.
+    """
+    # Desplazamientos desde el lunes (Python weekday) de los días de la regla
+    if rule.weekdays:
+        offsets = sorted({(wd - 1) % 7 for wd in rule.weekdays})
+    else:
+        offsets = [dtstart.weekday()]
+    per = len(offsets)
+    skipped = sum(1 for off in offsets if off < dtstart.weekday())
+    week0 = (dtstart - timedelta(days=dtstart.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    tod = dtstart - dtstart.replace(hour=0, minute=0, second=0, microsecond=0)
+    period = timedelta(weeks=rule.interval)
+
+    p = 0
+    if lo is not None and lo > week0:
+        p = (lo - week0) // period
+    last_p = p + _MAX_PERIODS
+    while p <= last_p:
+        base = week0 + period * p
+        for j, off in enumerate(offsets):
+            idx = p * per + j - skipped
+            if idx < 0:
+                continue
+            if rule.count is not None and idx >= rule.count:
+                return
+            occ = base + timedelta(days=off) + tod
+            if rule.until is not None and occ > rule.until:
+                return
+            if hi is not None and occ >= hi:
+                return
+            if lo is not None and occ < lo:
+                continue
+            yield idx, occ
+        p += 1
@@ -0,0 +1,110 @@
+# app/recurring_blocks.py
+"""
+Bloqueos de agenda recurrentes (almuerzo de lunes a viernes, un viernes sí
+y otro no...) guardados en UNA fila de calendar_blocks:
+
+- `start_at`/`end_at`: primera ocurrencia (fija hora local y duración).
+- `rrule`: regla semanal (subconjunto RRULE de recurrence.py).
+- `recur_until`: fin de la última ocurrencia, o None si no termina. Permite
+  filtrar en SQL las filas que pueden tocar una ventana sin expandir nada.
+
+Las ocurrencias solo se expanden para la ventana consultada (por días
+locales) y esa expansión se memoiza: /slots, el índice de agenda y los
+chequeos de conflicto piden una y otra vez las mismas semanas.
+"""
+from __future__ import annotations
+
+from datetime import datetime, time as dtime, timedelta
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from . import models, recurrence
+from .utils.tz import aware_to_local_naive, db_aware_utc, local_naive_to_aware_utc_many
+
+# Ventanas (regla, primera ocurrencia, días) recordadas por proceso
+_MEMO_SIZE = 4096
+
+Occurrence = Tuple[Optional[int], datetime, datetime]  # (índice | None si no es recurrente, inicio UTC, fin UTC)
+
+
+def overlaps_clause(lo_utc: Optional[datetime] = None, hi_utc: Optional[datetime] = None):
+    """
+    Filtro SQL: bloqueos (simples o recurrentes) que PUEDEN cruzar [lo, hi).
+    Para los recurrentes hay que expandir después con `expand_row`.
+    """
+    B = models.CalendarBlock
+    conds = []
+    if hi_utc is not None:
+        conds.append(B.start_at < hi_utc)
+    if lo_utc is not None:
+        conds.append(or_(
+            B.end_at > lo_utc,
+            and_(B.rrule.is_not(None), or_(B.recur_until.is_(None), B.recur_until > lo_utc)),
+        ))
+    return and_(*conds)
+
+
+def expand_row(
+    start_at: datetime,
+    end_at: datetime,
+    rrule: Optional[str],
+    lo_utc: datetime,
+    hi_utc: datetime,
+) -> Iterator[Occurrence]:
+    """Ocurrencias de un bloqueo que cruzan [lo_utc, hi_utc), en orden."""
+    s, e = db_aware_utc(start_at), db_aware_utc(end_at)
+    if not rrule:
+        if s < hi_utc and e > lo_utc:
+            yield None, s, e
+        return
+    d0 = aware_to_local_naive(lo_utc).date()
+    d1 = aware_to_local_naive(hi_utc - timedelta(microseconds=1)).date() + timedelta(days=1)
+    for idx, os_, oe in _expand_days(rrule, s, e - s, d0, d1):
+        if os_ < hi_utc and oe > lo_utc:
+            yield idx, os_, oe
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def _expand_days(rrule: str, start_utc: datetime, duration: timedelta, d0, d1) -> Tuple[Tuple[int, datetime, datetime], ...]:
+    """Ocurrencias (UTC) que cruzan los días LOCALES [d0, d1). Memoizado."""
+    rule = recurrence.parse_rrule(rrule)
+    lo = datetime.combine(d0, dtime()) - duration
+    hi = datetime.combine(d1, dtime())
+    occ = list(recurrence.iter_weekly(aware_to_local_naive(start_utc), rule, lo=lo, hi=hi))
+    starts = local_naive_to_aware_utc_many([o for _, o in occ])
+    return tuple((idx, s, s + duration) for (idx, _), s in zip(occ, starts))
+
+
+def recur_until(start_utc: datetime, end_utc: datetime, rule: recurrence.WeeklyRule) -> Optional[datetime]:
+    """Fin (UTC) de la última ocurrencia; None si la regla no tiene COUNT ni UNTIL."""
+    if rule.count is None and rule.until is None:
+        return None
+    last = None
+    for _, occ in recurrence.iter_weekly(aware_to_local_naive(start_utc), rule):
+        last = occ
+    if last is None:
+        return end_utc
+    return local_naive_to_aware_utc_many([last])[0] + (end_utc - start_utc)
+
+
+def doctor_blocks(
+    db: Session,
+    doctor_id: int,
+    lo_utc: datetime,
+    hi_utc: datetime,
+) -> List[Tuple[int, Optional[int], datetime, datetime]]:
+    """(id, índice, inicio UTC, fin UTC) de los bloqueos de la doctora en la ventana (una consulta)."""
+    B = models.CalendarBlock
+    rows = db.execute(
+        select(B.id, B.start_at, B.end_at, B.rrule)
+        .where(B.doctor_id == doctor_id)
+        .where(overlaps_clause(lo_utc, hi_utc))
+    )
+    return [
+        (block_id, idx, s, e)
+        for block_id, start_at, end_at, rrule in rows
+        for idx, s, e in expand_row(start_at, end_at, rrule, lo_utc, hi_utc)
+    ]
@@ -0,0 +1,275 @@
+# app/revisions.py
+"""
+Historial de versiones de historias clínicas y planes terapéuticos.
+
+- Un hook de sesión (after_flush) registra cada alta, edición y borrado en
+  `clinical_revisions`, en la MISMA transacción que el cambio y sin tocar
+  los endpoints.
+- El alta (versión 1) es una foto completa; las ediciones siguientes
+  guardan solo el diff contra la versión anterior: por campo de texto
+  las operaciones mantener/borrar/insertar sobre palabras, o el valor
+  entero si sale más corto. Cada REVISION_SNAPSHOT_EVERY versiones se
+  vuelve a guardar una foto: reconstruir una versión aplica como mucho
+  N-1 diffs (tiempo acotado, una sola consulta).
+- Registros anteriores a esta función: la primera edición guarda antes una
+  foto `baseline` con el contenido previo.
+- Autor: el usuario autenticado del request (lo deja get_current_user en
+  `session.info`).
+
+Supone que los cambios pasan por el ORM: un UPDATE masivo fuera de la
+sesión no queda en el historial.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import case, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+from .db import SessionLocal
+from .utils import compact_json
+
+ACTOR_KEY = "revision_actor_id"
+
+# Palabra + espacios que la siguen: sin un token "espacio" repetido miles de
+# veces, SequenceMatcher resuelve ~20 KB de notas en pocos ms
+_TOKENS = re.compile(r"\S+\s*|\s+")
+
+
+@dataclass(frozen=True)
+class _Tracked:
+    kind: str
+    fields: Tuple[str, ...]
+
+
+TRACKED = {
+    models.ClinicalHistory: _Tracked("clinical_history", (
+        "patient_id",
+        "antecedentes_personales", "antecedentes_familiares", "medicacion_actual",
+        "alergias", "diagnosticos_previos", "consumo", "antecedentes_psico",
+        "notas", "factores_protectores",
+    )),
+    models.TherapeuticPlan: _Tracked("therapeutic_plan", (
+        "patient_id", "objetivos", "frecuencia", "intervenciones", "tareas",
+        "metricas", "proxima_revision", "notas",
+    )),
+}
+
+
+# =========================
+# Diffs
+# =========================
+# Delta por campo: {"s": valor} (valor completo) o {"d": ops}, donde cada
+# op es un int > 0 (mantener n caracteres), un int < 0 (saltar n) o un str
+# (insertar).
+
+def _json_value(v: Any) -> Any:
+    return v.isoformat() if isinstance(v, (date, datetime)) else v
+
+
+def text_ops(old: str, new: str) -> List[Any]:
+    a, b = _TOKENS.findall(old), _TOKENS.findall(new)
+    ops: List[Any] = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append(sum(len(t) for t in a[i1:i2]))
+            continue
+        if i2 > i1:
+            ops.append(-sum(len(t) for t in a[i1:i2]))
+        if j2 > j1:
+            ops.append("".join(b[j1:j2]))
+    return ops
+
+
+def apply_ops(old: str, ops: List[Any]) -> str:
+    out: List[str] = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.append(old[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return "".join(out)
+
+
+def _field_delta(old: Any, new: Any) -> Dict[str, Any]:
+    if isinstance(old, str) and isinstance(new, str):
+        ops = text_ops(old, new)
+        inserted = sum(len(op) for op in ops if isinstance(op, str))
+        if inserted < len(new):
+            return {"d": ops}
+    return {"s": _json_value(new)}
+
+
+def apply_delta(state: Dict[str, Any], delta: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    out = dict(state)
+    for field, change in delta.items():
+        out[field] = apply_ops(out.get(field) or "", change["d"]) if "d" in change else change["s"]
+    return out
+
+
+# =========================
+# Registro (hook de sesión)
+# =========================
+
+def _snapshot(obj, tracked: _Tracked, overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    loaded = inspect(obj).dict  # evita recargar (el objeto puede estar borrado)
+    data = {f: _json_value(loaded[f] if f in loaded else getattr(obj, f)) for f in tracked.fields}
+    data.update(overrides or {})
+    return data
+
+
+def _changes(obj, tracked: _Tracked) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(delta, valores anteriores) de los campos modificados en este flush."""
+    delta: Dict[str, Any] = {}
+    previous: Dict[str, Any] = {}
+    state = inspect(obj)
+    for f in tracked.fields:
+        hist = state.attrs[f].history
+        if not hist.added:
+            continue
+        new = hist.added[0]
+        if hist.deleted:
+            old = hist.deleted[0]
+            if old == new:
+                continue
+            previous[f] = _json_value(old)
+            delta[f] = _field_delta(old, new)
+        else:
+            # Valor anterior no cargado: se guarda el nuevo completo
+            delta[f] = {"s": _json_value(new)}
+    return delta, previous
+
+
+def _last_versions(session: Session, kind: str, record_id: int) -> Tuple[int, int]:
+    """(última versión, última versión con foto); 0 si no hay."""
+    R = models.ClinicalRevision
+    last, last_snapshot = session.execute(
+        select(func.max(R.version), func.max(case((R.is_snapshot, R.version))))
+        .where(R.kind == kind, R.record_id == record_id)
+    ).one()
+    return last or 0, last_snapshot or 0
+
+
+def _row(kind, record_id, version, action, is_snapshot, changed, payload, author_id, now) -> Dict[str, Any]:
+    codec, data = compact_json.pack(payload)
+    return {
+        "kind": kind, "record_id": record_id, "version": version, "action": action,
+        "is_snapshot": is_snapshot, "changed_fields": sorted(changed), "author_id": author_id,
+        "codec": codec, "data": data, "created_at": now,
+    }
+
+
+def _revisions_for(session: Session, obj, tracked: _Tracked, action: str, author_id, now) -> List[Dict[str, Any]]:
+    last, last_snapshot = _last_versions(session, tracked.kind, obj.id)
+    if action == "create":
+        return [_row(tracked.kind, obj.id, last + 1, "create", True, tracked.fields,
+                     _snapshot(obj, tracked), author_id, now)]
+    if action == "delete":
+        # Sin cambios de contenido: la versión borrada es la anterior
+        if last == 0:
+            return [_row(tracked.kind, obj.id, 1, "delete", True, (), _snapshot(obj, tracked), author_id, now)]
+        return [_row(tracked.kind, obj.id, last + 1, "delete", False, (), {}, author_id, now)]
+
+    delta, previous = _changes(obj, tracked)
+    if not delta:
+        return []
+    rows = []
+    if last == 0:
+        # Registro previo al historial: foto del contenido antes de esta edición
+        rows.append(_row(tracked.kind, obj.id, 1, "baseline", True, (),
+                         _snapshot(obj, tracked, previous), None, now))
+        last = last_snapshot = 1
+    version = last + 1
+    if version - last_snapshot >= max(1, settings.REVISION_SNAPSHOT_EVERY):
+        rows.append(_row(tracked.kind, obj.id, version, "update", True, delta, _snapshot(obj, tracked), author_id, now))
+    else:
+        rows.append(_row(tracked.kind, obj.id, version, "update", False, delta, delta, author_id, now))
+    return rows
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _record_revisions(session: Session, flush_context) -> None:
+    pending = [(obj, "create") for obj in session.new] + \
+              [(obj, "update") for obj in session.dirty] + \
+              [(obj, "delete") for obj in session.deleted]
+    pending = [(obj, action) for obj, action in pending if type(obj) in TRACKED]
+    if not pending:
+        return
+    author_id = session.info.get(ACTOR_KEY)
+    now = datetime.now(timezone.utc)
+    rows: List[Dict[str, Any]] = []
+    for obj, action in pending:
+        if action == "update" and not session.is_modified(obj, include_collections=False):
+            continue
+        rows.extend(_revisions_for(session, obj, TRACKED[type(obj)], action, author_id, now))
+    if rows:
+        session.execute(insert(models.ClinicalRevision.__table__), rows)
+
+
+def set_actor(db: Session, user_id: Optional[int]) -> None:
+    """Autor de las revisiones que se registren en esta sesión."""
+    db.info[ACTOR_KEY] = user_id
+
+
+# =========================
+# Lectura
+# =========================
+
+def list_revisions(db: Session, kind: str, record_id: int) -> List[Dict[str, Any]]:
+    R = models.ClinicalRevision
+    # Sin leer `data`: solo metadatos y tamaño
+    rows = list(db.execute(
+        select(R.id, R.version, R.action, R.is_snapshot, R.changed_fields, R.author_id, R.created_at,
+               func.length(R.data).label("size_bytes"))
+        .where(R.kind == kind, R.record_id == record_id)
+        .order_by(R.version.desc())
+    ).mappings())
+    if not rows:
+        raise HTTPException(status_code=404, detail="Sin historial para este registro")
+    return rows
+
+
+def materialize(db: Session, kind: str, record_id: int, version: int) -> Dict[str, Any]:
+    """
+    Contenido de `version`: la última foto <= version más los diffs hasta
+    ella, leídos en una sola consulta (como mucho REVISION_SNAPSHOT_EVERY filas).
+    """
+    R = models.ClinicalRevision
+    base = (
+        select(func.max(R.version))
+        .where(R.kind == kind, R.record_id == record_id, R.is_snapshot, R.version <= version)
+        .scalar_subquery()
+    )
+    rows = list(db.scalars(
+        select(R)
+        .where(R.kind == kind, R.record_id == record_id, R.version >= base, R.version <= version)
+        .order_by(R.version)
+    ))
+    if not rows or rows[-1].version != version:
+        raise HTTPException(status_code=404, detail="Versión no encontrada")
+
+    state: Dict[str, Any] = {}
+    for rev in rows:
+        payload = compact_json.unpack(rev.codec, rev.data)
+        state = payload if rev.is_snapshot else apply_delta(state, payload)
+    last = rows[-1]
+    return {
+        "kind": kind,
+        "record_id": record_id,
+        "version": last.version,
+        "action": last.action,
+        "author_id": last.author_id,
+        "created_at": last.created_at,
+        "data": state,
+    }
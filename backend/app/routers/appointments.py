@@ -1,8 +1,12 @@
 # app/routers/appointments.py
 from __future__ import annotations
-from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, select, and_
+import asyncio
+import logging
+from itertools import islice
+from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks, Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import select, and_, insert, update
 from typing import List, Optional
 from datetime import datetime, timedelta, timezone
 
@@ -11,13 +15,23 @@ from .. import models, schemas
 from ..security import require_role, get_current_user
 from ..config import settings
 from ..zoom_client import zoom
-from ..mailer.notifications import send_confirmed_emails, send_rescheduled_emails
-from ..scheduler import schedule_reminder_job, cancel_reminder_job
+from ..mailer.notifications import send_confirmed_emails, send_confirmed_emails_by_id, send_rescheduled_emails
+from ..scheduler import schedule_reminder_job, schedule_reminder_jobs, cancel_reminder_job, cancel_reminder_jobs
+from ..http_cache import not_modified, mark_agenda_changed
+from .. import agenda_index, booking_lock, recurrence
+from ..events import (
+    emit_appointment_event,
+    SLOT_TAKEN, SLOT_RELEASED, HOLD_EXPIRED,
+    APPT_CONFIRMED, APPT_RESCHEDULED, APPT_UPDATED,
+)
 
 # 🔹 Utilidades TZ centralizadas
-from ..utils.tz import to_utc, db_aware_utc, iso_utc_z
+from ..utils.tz import (
+    to_utc, db_aware_utc, iso_utc_z, aware_to_local_naive, local_naive_to_aware_utc_many,
+)
 
 router = APIRouter(prefix="/appointments", tags=["appointments"])
+logger = logging.getLogger(__name__)
 
 # --- Constantes ---
 # Estados que bloquean horario (además se revalida 'processing' donde aplique)
@@ -27,35 +41,58 @@ BLOCKING_STATES = ["pending", "confirmed"]
 def delete_stale_holds(db: Session) -> int:
     """
     Elimina appointments en 'pending' o 'processing' cuyo hold_until ya venció.
+    Cantidad fija de consultas aunque hayan vencido muchos: una lectura de
+    las citas (con sus pagos y recordatorios, que el borrado desvincula), un
+    UPDATE de recordatorios, las lápidas y el DELETE en lote.
+
+    Los holds pendientes del flujo legado (client_tx_id) dejan una lápida en
+    expired_holds: la conciliación revisa después si su pago volvió.
     """
     now_utc = datetime.now(timezone.utc)
     status_processing = getattr(models.AppointmentStatus, "processing", models.AppointmentStatus.pending)
 
-    ids = list(
+    stale = list(
         db.scalars(
-            select(models.Appointment.id).where(
+            select(models.Appointment)
+            .where(
                 and_(
                     models.Appointment.status.in_([models.AppointmentStatus.pending, status_processing]),
                     models.Appointment.hold_until.is_not(None),
                     models.Appointment.hold_until < now_utc,
                 )
             )
+            .options(
+                selectinload(models.Appointment.payments),
+                selectinload(models.Appointment.reminder_jobs),
+            )
         )
     )
-    if not ids:
+    if not stale:
         return 0
 
-    for appt_id in ids:
-        a = db.get(models.Appointment, appt_id)
-        if a:
-            try:
-                cancel_reminder_job(a.id)
-            except Exception:
-                pass
-            db.delete(a)
+    try:
+        cancel_reminder_jobs([a.id for a in stale])
+    except Exception:
+        pass
+    tombstones = [
+        {
+            "appointment_id": a.id,
+            "client_tx_id": a.client_tx_id,
+            "doctor_id": a.doctor_id,
+            "patient_id": a.patient_id,
+            "hold_until": a.hold_until,
+        }
+        for a in stale
+        if a.client_tx_id and a.status == models.AppointmentStatus.pending
+    ]
+    if tombstones:
+        db.execute(insert(models.ExpiredHold), tombstones)
+    for a in stale:
+        emit_appointment_event(db, HOLD_EXPIRED, a)
+        db.delete(a)
 
     db.commit()
-    return len(ids)
+    return len(stale)
 
 
 # --- Helper: solape en UTC ---
@@ -75,42 +112,11 @@ def has_conflict_or_block(
 ) -> bool:
     """
     True si [start_utc, end_utc) entra en conflicto con citas/bloqueos.
+    Responde el índice de agenda en memoria; la BD revalida en el commit.
     """
-    now_utc = datetime.now(timezone.utc)
-
-    appt_stmt = (
-        select(models.Appointment.id)
-        .where(models.Appointment.doctor_id == doctor_id)
-        .where(models.Appointment.start_at < end_utc)
-        .where(models.Appointment.end_at > start_utc)
-        .where(
-            or_(
-                models.Appointment.status == models.AppointmentStatus.confirmed,
-                and_(
-                    models.Appointment.status == models.AppointmentStatus.pending,
-                    or_(
-                        models.Appointment.hold_until == None,  # noqa: E711
-                        models.Appointment.hold_until > now_utc,
-                    )
-                )
-            )
-        )
+    return agenda_index.has_conflict(
+        db, doctor_id=doctor_id, start_utc=start_utc, end_utc=end_utc, exclude_appt_id=exclude_appt_id,
     )
-    if exclude_appt_id:
-        appt_stmt = appt_stmt.where(models.Appointment.id != exclude_appt_id)
-
-    appt_conflict_id = db.scalar(appt_stmt)
-    if appt_conflict_id:
-        return True
-
-    block_stmt = (
-        select(models.CalendarBlock.id)
-        .where(models.CalendarBlock.doctor_id == doctor_id)
-        .where(models.CalendarBlock.start_at < end_utc)
-        .where(models.CalendarBlock.end_at > start_utc)
-    )
-    block_conflict_id = db.scalar(block_stmt)
-    return bool(block_conflict_id)
 
 
 # --- CRUD básico (doctor) ---
@@ -167,6 +173,7 @@ async def create_appt(
             except Exception:
                 raise HTTPException(status_code=400, detail="method inválido")
 
+    await booking_lock.lock_doctor_async(db, payload.doctor_id)
     if has_conflict_or_block(db, doctor_id=payload.doctor_id, start_utc=s, end_utc=e):
         raise HTTPException(status_code=409, detail="Ese horario ya está ocupado o bloqueado")
 
@@ -179,6 +186,8 @@ async def create_appt(
         method=method_in,
     )
     db.add(appt)
+    db.flush()  # asigna id para el evento
+    emit_appointment_event(db, SLOT_TAKEN, appt)
     db.commit()
     db.refresh(appt)
 
@@ -215,6 +224,8 @@ async def create_appt(
 
 @router.get("", response_model=List[schemas.AppointmentOut])
 def list_appts(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     doctor_id: Optional[int] = None,
     patient_id: Optional[int] = None,
@@ -222,6 +233,11 @@ def list_appts(
     skip: int = 0,
     limit: int = Query(200, le=500),
 ):
+    # ⚡ 304 si nada cambió (sin limpiar holds ni correr la consulta)
+    cached = not_modified(db, request, response, doctor_id=doctor_id, time_sensitive=True, private=True)
+    if cached:
+        return cached
+
     delete_stale_holds(db)
 
     stmt = select(models.Appointment).order_by(models.Appointment.start_at.asc())
@@ -268,6 +284,7 @@ def update_appt(id: int, payload: schemas.AppointmentUpdate, db: Session = Depen
     for f, v in data.items():
         setattr(appt, f, v)
 
+    emit_appointment_event(db, APPT_UPDATED, appt)
     db.commit()
     db.refresh(appt)
     return appt
@@ -283,6 +300,7 @@ def delete_appt(id: int, db: Session = Depends(get_db)):
     if not appt:
         raise HTTPException(status_code=404, detail="No encontrado")
     cancel_reminder_job(appt.id)
+    emit_appointment_event(db, SLOT_RELEASED, appt)
     db.delete(appt)
     db.commit()
     return None
@@ -299,9 +317,16 @@ def hold_appointments(
     Crea citas en estado PENDING (method=payphone) con hold_until, pero
     **NO** genera ni guarda client_tx_id. El vínculo para confirmar luego
     se hará por IDs de cita (en optionalParameter3 del pago).
+
+    Una sola transacción con idas y vueltas constantes, sin importar
+    cuántos horarios se elijan: candado de la agenda de la doctora,
+    chequeo de conflictos por conjunto (citas + bloqueos) e INSERT
+    multi-fila con RETURNING.
     """
     if current.role != models.UserRole.patient:
         raise HTTPException(403, detail="Solo pacientes pueden bloquear horarios")
+    if not payload.slots:
+        raise HTTPException(400, detail="Debes elegir al menos un horario")
 
     # 🧹 Limpia holds vencidos antes de intentar crear nuevos
     delete_stale_holds(db)
@@ -313,110 +338,251 @@ def hold_appointments(
     now = datetime.now(timezone.utc)
     hold_until = now + timedelta(minutes=payload.hold_minutes)
 
-    requested_min = min(to_utc(s.start_at) for s in payload.slots)
-    requested_max = max(to_utc(s.end_at) for s in payload.slots)
-
-    # Intersecciones existentes (citas activas)
-    existing = list(
-        db.scalars(
-            select(models.Appointment).where(
-                and_(
-                    models.Appointment.doctor_id == payload.doctor_id,
-                    models.Appointment.status.in_(BLOCKING_STATES),
-                    models.Appointment.start_at < requested_max,
-                    models.Appointment.end_at > requested_min,
-                )
-            )
-        )
-    )
-    # Bloqueos existentes
-    blocks = list(
-        db.scalars(
-            select(models.CalendarBlock).where(
-                and_(
-                    models.CalendarBlock.doctor_id == payload.doctor_id,
-                    models.CalendarBlock.start_at < requested_max,
-                    models.CalendarBlock.end_at > requested_min,
-                )
-            )
-        )
-    )
-
-    to_create: list[models.Appointment] = []
-    for s in payload.slots:
-        s_start = to_utc(s.start_at)
-        s_end = to_utc(s.end_at)
+    # 1) Validación en memoria: rangos, pasado y solapes entre los elegidos (ordenados)
+    intervals = sorted((to_utc(s.start_at), to_utc(s.end_at)) for s in payload.slots)
+    for s_start, s_end in intervals:
         if s_end <= s_start:
             raise HTTPException(400, detail="Rango horario inválido en slots")
         if s_start <= now:
             raise HTTPException(400, detail="No puedes elegir un horario en el pasado")
+    if any(prev[1] > nxt[0] for prev, nxt in zip(intervals, intervals[1:])):
+        raise HTTPException(409, detail="Selección contiene horarios solapados/duplicados")
+
+    # 2) Candado de reservas de la doctora hasta el commit: otro hold
+    #    concurrente espera aquí y luego ve nuestras filas
+    booking_lock.lock_doctor(db, payload.doctor_id)
+
+    # 3) Conflictos de todos los horarios a la vez (una consulta de citas y una de bloqueos)
+    hits = agenda_index.sql_conflicts_many(db, doctor_id=payload.doctor_id, intervals=intervals)
+    kinds = {hit[0] for hit in hits if hit is not None}
+    if "appt" in kinds:
+        raise HTTPException(409, detail="Uno o más horarios ya no están disponibles")
+    if "block" in kinds:
+        raise HTTPException(409, detail="Uno o más horarios están bloqueados por la doctora")
+
+    # 4) INSERT multi-fila ... RETURNING (❌ sin client_tx_id: el amarre se hará por IDs)
+    #    (sin sort_by_parameter_order: forzaría una sentencia por fila en
+    #    algunos dialectos; se ordena después por inicio, que es único)
+    created = list(db.scalars(
+        insert(models.Appointment).returning(models.Appointment),
+        [
+            {
+                "doctor_id": payload.doctor_id,
+                "patient_id": current.id,
+                "start_at": s_start,
+                "end_at": s_end,
+                "status": models.AppointmentStatus.pending,
+                "method": models.PaymentMethod.payphone,
+                "hold_until": hold_until,
+            }
+            for s_start, s_end in intervals
+        ],
+    ))
+    created.sort(key=lambda a: a.start_at)
+    # No pasan por el flush del ORM: se registran a mano (índice + versión)
+    agenda_index.record_bulk_insert(db, created)
+    mark_agenda_changed(db, payload.doctor_id)
+    for a in created:
+        emit_appointment_event(db, SLOT_TAKEN, a)
+    # Serializar antes del commit: RETURNING ya trajo todas las columnas y
+    # el commit las expira (evita un SELECT por cita)
+    out = [schemas.AppointmentOut.model_validate(a) for a in created]
+    db.commit()
 
-        # Conflicto con citas previamente cargadas
-        for ea in existing:
-            if overlaps_utc(s_start, s_end, ea.start_at, ea.end_at):
-                raise HTTPException(409, detail="Uno o más horarios ya no están disponibles")
+    # ✅ Devolvemos SOLO las citas (sin client_tx_id)
+    return {"appointments": out}
+
+
+# --- Series recurrentes (doctor) ---
+def _series_rule(payload: schemas.AppointmentSeriesCreate) -> recurrence.WeeklyRule:
+    try:
+        if payload.rrule:
+            rule = recurrence.parse_rrule(payload.rrule)
+        else:
+            rule = recurrence.WeeklyRule(
+                interval=payload.interval_weeks,
+                weekdays=tuple(sorted(set(payload.weekdays))),
+                count=payload.count,
+                # UNTIL en hora local, como las ocurrencias
+                until=aware_to_local_naive(to_utc(payload.until)) if payload.until else None,
+            )
+            recurrence.validate(rule)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=f"Recurrencia inválida: {ex}")
+    if rule.count is None and rule.until is None:
+        raise HTTPException(status_code=400, detail="La serie necesita count o until")
+    return rule
 
-        # Conflicto con bloqueos
-        for bl in blocks:
-            if overlaps_utc(s_start, s_end, bl.start_at, bl.end_at):
-                raise HTTPException(409, detail="Uno o más horarios están bloqueados por la doctora")
 
-        # Conflicto entre slots seleccionados (duplicados/solapados)
-        for tmp in to_create:
-            if overlaps_utc(s_start, s_end, tmp.start_at, tmp.end_at):
-                raise HTTPException(409, detail="Selección contiene horarios solapados/duplicados")
+@router.post(
+    "/series",
+    response_model=schemas.AppointmentSeriesOut,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(require_role(models.UserRole.doctor))],
+)
+async def create_series(
+    payload: schemas.AppointmentSeriesCreate,
+    bg: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current = Depends(get_current_user),
+):
+    """
+    Crea una serie semanal/quincenal de citas CONFIRMADAS para un paciente.
+
+    - Todas las ocurrencias se validan con una consulta de rango (citas y
+      bloqueos) y se insertan en una sola transacción.
+    - Si alguna choca: 409 con el detalle por ocurrencia, salvo
+      `skip_conflicts=true`, que crea las libres y reporta el resto.
+    - Las reuniones Zoom se crean en paralelo (SERIES_PROVISION_CONCURRENCY);
+      un fallo de Zoom no deshace la serie, se reporta por cita.
+    """
+    doc = db.get(models.User, payload.doctor_id)
+    if not doc or doc.role != models.UserRole.doctor:
+        raise HTTPException(status_code=400, detail="doctor_id inválido")
+
+    if current.role == models.UserRole.doctor and current.id != payload.doctor_id:
+        raise HTTPException(status_code=403, detail="No puedes crear citas para otra doctora")
 
-        appt = models.Appointment(
-            doctor_id=payload.doctor_id,
-            patient_id=current.id,
-            start_at=s_start,
-            end_at=s_end,
-            status=models.AppointmentStatus.pending,
-            method=models.PaymentMethod.payphone,
-            hold_until=hold_until,
-            # ❌ Sin client_tx_id: el amarre se hará por IDs en optionalParameter3
-        )
-        to_create.append(appt)
+    pat = db.get(models.User, payload.patient_id)
+    if not pat or pat.role != models.UserRole.patient:
+        raise HTTPException(status_code=400, detail="patient_id inválido (debe ser paciente)")
 
-    # Inserta en DB
-    for a in to_create:
-        db.add(a)
+    s = to_utc(payload.start_at)
+    e = to_utc(payload.end_at)
+    if e <= s:
+        raise HTTPException(status_code=400, detail="Rango horario inválido")
+    if s <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=400, detail="No puedes crear una cita en el pasado")
+    if not settings.ZOOM_DEFAULT_USER:
+        raise HTTPException(500, detail="ZOOM_DEFAULT_USER no configurado")
+    # Sin 'manual' en el enum, la serie queda como payphone (pago por sesión)
+    method_in = (
+        models.PaymentMethod(payload.method) if payload.method
+        else getattr(models.PaymentMethod, "manual", models.PaymentMethod.payphone)
+    )
 
-    # Verificación final exacta (carrera)
-    for a in to_create:
-        # contra citas exactas
-        clash = db.scalar(
-            select(models.Appointment.id).where(
-                and_(
-                    models.Appointment.doctor_id == a.doctor_id,
-                    models.Appointment.status.in_(BLOCKING_STATES),
-                    models.Appointment.start_at == a.start_at,
-                    models.Appointment.end_at == a.end_at,
-                )
-            )
+    rule = _series_rule(payload)
+
+    # 1) Expandir en hora local (la hora de la cita se mantiene) y pasar a UTC de una vez
+    limit = settings.SERIES_MAX_OCCURRENCES
+    occurrences = list(islice(recurrence.iter_weekly(aware_to_local_naive(s), rule), limit + 1))
+    if not occurrences:
+        raise HTTPException(status_code=400, detail="La recurrencia no genera ocurrencias")
+    if len(occurrences) > limit:
+        raise HTTPException(status_code=400, detail=f"La serie supera el máximo de {limit} ocurrencias")
+    duration = e - s
+    starts = local_naive_to_aware_utc_many([occ for _, occ in occurrences])
+    intervals = [(st, st + duration) for st in starts]
+    if any(prev[1] > nxt[0] for prev, nxt in zip(intervals, intervals[1:])):
+        raise HTTPException(status_code=400, detail="Las ocurrencias de la serie se solapan entre sí")
+
+    # 2) Conflictos de toda la serie en una consulta de rango (con la agenda bajo candado)
+    await booking_lock.lock_doctor_async(db, payload.doctor_id)
+    hits = agenda_index.sql_conflicts_many(db, doctor_id=payload.doctor_id, intervals=intervals)
+    conflicts = [
+        {
+            "index": idx,
+            "start_at": st,
+            "end_at": en,
+            "reason": "appointment" if hit[0] == "appt" else "block",
+            "conflicting_id": hit[1],
+        }
+        for (idx, _), (st, en), hit in zip(occurrences, intervals, hits)
+        if hit is not None
+    ]
+    if conflicts and not payload.skip_conflicts:
+        raise HTTPException(status_code=409, detail=jsonable_encoder({
+            "message": "Una o más ocurrencias chocan con citas o bloqueos",
+            "conflicts": conflicts,
+        }))
+    free = [iv for iv, hit in zip(intervals, hits) if hit is None]
+    if not free:
+        raise HTTPException(status_code=409, detail="Ninguna ocurrencia de la serie está libre")
+
+    # 3) Serie + citas en una sola transacción
+    series = models.AppointmentSeries(
+        doctor_id=payload.doctor_id,
+        patient_id=payload.patient_id,
+        dtstart=s,
+        duration_min=int(duration.total_seconds() // 60),
+        rrule=rule.to_rrule(),
+        created_by=current.id,
+    )
+    db.add(series)
+    db.flush()
+    series_id, rrule_text = series.id, series.rrule
+    appts = [
+        models.Appointment(
+            doctor_id=payload.doctor_id,
+            patient_id=payload.patient_id,
+            start_at=st,
+            end_at=en,
+            status=models.AppointmentStatus.confirmed,
+            method=method_in,
+            series_id=series_id,
         )
-        if clash:
-            raise HTTPException(409, detail="Otro usuario tomó uno de los horarios durante el proceso")
+        for st, en in free
+    ]
+    db.add_all(appts)
+    db.flush()  # asigna ids para los eventos
+    for a in appts:
+        emit_appointment_event(db, SLOT_TAKEN, a)
+    ids = [a.id for a in appts]
+    db.commit()
 
-        # contra bloqueos en el mismo rango
-        bl_clash = db.scalar(
-            select(models.CalendarBlock.id).where(
-                and_(
-                    models.CalendarBlock.doctor_id == a.doctor_id,
-                    models.CalendarBlock.start_at < a.end_at,
-                    models.CalendarBlock.end_at > a.start_at,
-                )
+    # 4) Zoom en paralelo acotado; un solo commit con todos los enlaces
+    sem = asyncio.Semaphore(max(1, settings.SERIES_PROVISION_CONCURRENCY))
+    minutes = int(duration.total_seconds() // 60) or 45
+
+    async def provision(appt_id: int, start_utc: datetime):
+        async with sem:
+            return await zoom.create_meeting(
+                user_id=settings.ZOOM_DEFAULT_USER,
+                topic=f"Cita {appt_id} - Doctor {payload.doctor_id}",
+                start_time_iso=iso_utc_z(start_utc),
+                duration_minutes=minutes,
+                timezone=None,  # usamos UTC → no enviamos timezone
+                waiting_room=True,
+                join_before_host=False,
             )
-        )
-        if bl_clash:
-            raise HTTPException(409, detail="Uno de los horarios se bloqueó durante el proceso")
 
+    results = await asyncio.gather(
+        *(provision(appt_id, st) for appt_id, (st, _) in zip(ids, free)),
+        return_exceptions=True,
+    )
+    by_id = _series_appointments(db, series_id)
+    provisioning_errors = []
+    for appt_id, z in zip(ids, results):
+        if isinstance(z, BaseException):
+            provisioning_errors.append({"appointment_id": appt_id, "error": f"No se pudo crear reunión Zoom: {z}"})
+            continue
+        by_id[appt_id].zoom_meeting_id = str(z.get("id"))
+        by_id[appt_id].zoom_join_url = z.get("join_url")
     db.commit()
-    for a in to_create:
-        db.refresh(a)
 
-    # ✅ Devolvemos SOLO las citas (sin client_tx_id)
-    return {"appointments": to_create}
+    # 5) Recordatorios en lote y correos en segundo plano
+    appts = list(_series_appointments(db, series_id).values())
+    schedule_reminder_jobs(appts)
+    for a in appts:
+        bg.add_task(send_confirmed_emails_by_id, a.id)
+
+    return {
+        "series_id": series_id,
+        "rrule": rrule_text,
+        "appointments": appts,
+        "conflicts": conflicts,
+        "provisioning_errors": provisioning_errors,
+    }
+
+
+def _series_appointments(db: Session, series_id: int) -> dict:
+    """Citas de la serie por id, en orden, con una sola consulta."""
+    rows = db.scalars(
+        select(models.Appointment)
+        .where(models.Appointment.series_id == series_id)
+        .order_by(models.Appointment.start_at)
+    )
+    return {a.id: a for a in rows}
 
 
 # --- Confirmación (post-pago) ---
@@ -443,6 +609,11 @@ async def confirm_appt(
     if not appt:
         raise HTTPException(404, detail="No encontrado")
 
+    # Candado de la agenda y estado releído bajo el candado (otra
+    # confirmación pudo terminar mientras esperábamos)
+    await booking_lock.lock_doctor_async(db, appt.doctor_id)
+    db.refresh(appt)
+
     # Autorización
     if current.role == models.UserRole.doctor:
         if appt.doctor_id != current.id:
@@ -467,41 +638,51 @@ async def confirm_appt(
     if e <= s:
         raise HTTPException(status_code=400, detail="Rango horario inválido")
 
+    # Un solo chequeo: con la agenda bajo candado nadie más puede tomar el horario
     now_utc = datetime.now(timezone.utc)
-    # Si el hold expiró, revalida conflictos y limpia hold_until si aún sigue disponible
-    if appt.status == models.AppointmentStatus.pending and appt.method == models.PaymentMethod.payphone:
-        if appt.hold_until and now_utc > db_aware_utc(appt.hold_until):
-            if has_conflict_or_block(db, doctor_id=appt.doctor_id, start_utc=s, end_utc=e, exclude_appt_id=appt.id):
-                raise HTTPException(400, detail="El horario fue tomado o bloqueado; el paciente debe elegir otro.")
-            appt.hold_until = None
-
-    # Validación final de conflicto/bloqueo
+    hold_expired = bool(appt.hold_until) and now_utc > db_aware_utc(appt.hold_until)
     if has_conflict_or_block(db, doctor_id=appt.doctor_id, start_utc=s, end_utc=e, exclude_appt_id=appt.id):
+        if hold_expired:
+            raise HTTPException(400, detail="El horario fue tomado o bloqueado; el paciente debe elegir otro.")
         raise HTTPException(409, detail="Ese horario ya está ocupado o bloqueado")
+    if hold_expired and appt.status == models.AppointmentStatus.pending and appt.method == models.PaymentMethod.payphone:
+        appt.hold_until = None
 
-    # Crear Zoom si hace falta
-    if not appt.zoom_meeting_id or not appt.zoom_join_url:
-        if not settings.ZOOM_DEFAULT_USER:
-            raise HTTPException(500, detail="ZOOM_DEFAULT_USER no configurado")
-
-        # ✅ Zoom en UTC (Z) y sin timezone
-        start_iso = iso_utc_z(s)
-        duration = int((e - s).total_seconds() // 60) or 45
-
-        z = await zoom.create_meeting(
-            user_id=settings.ZOOM_DEFAULT_USER,
-            topic=f"Cita {appt.id} - Doctor {appt.doctor_id}",
-            start_time_iso=start_iso,
-            duration_minutes=duration,
-            timezone=None,  # usamos UTC → no pasamos timezone
-            waiting_room=True,
-            join_before_host=False,
-        )
-        appt.zoom_meeting_id = str(z.get("id"))
-        appt.zoom_join_url = z.get("join_url")
+    needs_zoom = not appt.zoom_meeting_id or not appt.zoom_join_url
+    if needs_zoom and not settings.ZOOM_DEFAULT_USER:
+        raise HTTPException(500, detail="ZOOM_DEFAULT_USER no configurado")
 
+    # Commit ya: suelta el candado antes de ir a Zoom (la llamada puede
+    # tardar más que BOOKING_LOCK_TIMEOUT_SECONDS)
     appt.status = models.AppointmentStatus.confirmed
+    emit_appointment_event(db, APPT_CONFIRMED, appt)
+    appt_id, doctor_id = appt.id, appt.doctor_id
     db.commit()
+
+    # Crear Zoom si hace falta; el link va en una segunda transacción corta
+    if needs_zoom:
+        try:
+            z = await zoom.create_meeting(
+                user_id=settings.ZOOM_DEFAULT_USER,
+                topic=f"Cita {appt_id} - Doctor {doctor_id}",
+                start_time_iso=iso_utc_z(s),  # ✅ Zoom en UTC (Z) y sin timezone
+                duration_minutes=int((e - s).total_seconds() // 60) or 45,
+                timezone=None,  # usamos UTC → no pasamos timezone
+                waiting_room=True,
+                join_before_host=False,
+            )
+        except Exception as ex:
+            # La cita ya está confirmada: queda sin link (como en el flujo PayPhone)
+            logger.warning("[appointments] No se pudo crear Zoom para cita %s: %s", appt_id, ex)
+        else:
+            # UPDATE directo: no recarga la cita expirada por el commit
+            db.execute(
+                update(models.Appointment)
+                .where(models.Appointment.id == appt_id)
+                .values(zoom_meeting_id=str(z.get("id")), zoom_join_url=z.get("join_url"))
+            )
+            mark_agenda_changed(db, doctor_id)
+            db.commit()
     db.refresh(appt)
 
     # Notificar + recordatorio
@@ -511,6 +692,40 @@ async def confirm_appt(
     return appt
 
 
+async def _move_zoom_meeting(appt: models.Appointment, start_utc: datetime, end_utc: datetime) -> Optional[dict]:
+    """
+    Mueve la reunión Zoom de la cita al nuevo horario. Si Zoom ya no la
+    tiene, crea otra y la devuelve (el llamador guarda el link).
+    """
+    # ✅ Usamos UTC con 'Z' y sin timezone
+    start_iso = iso_utc_z(start_utc)
+    duration = max(1, int((end_utc - start_utc).total_seconds() // 60))
+    try:
+        await zoom.update_meeting(
+            meeting_id=appt.zoom_meeting_id,
+            start_time_iso=start_iso,
+            duration_minutes=duration,
+            topic=f"Cita {appt.id} - Doctor {appt.doctor_id}",
+        )
+        return None
+    except RuntimeError as zerr:
+        # Si la reunión no existe → recreamos; otro error se propaga
+        msg = str(zerr).lower()
+        if not ("404" in msg or "3001" in msg or "meeting does not exist" in msg):
+            raise
+    if not settings.ZOOM_DEFAULT_USER:
+        raise RuntimeError("ZOOM_DEFAULT_USER no configurado")
+    return await zoom.create_meeting(
+        user_id=settings.ZOOM_DEFAULT_USER,
+        topic=f"Cita {appt.id} - Doctor {appt.doctor_id}",
+        start_time_iso=start_iso,
+        duration_minutes=duration,
+        timezone=None,  # usamos UTC → no pasamos timezone
+        waiting_room=True,
+        join_before_host=False,
+    )
+
+
 # --- Reagendar (patient o doctor) ---
 @router.post(
     "/{id}/reschedule",
@@ -531,6 +746,9 @@ async def reschedule_appt(
     if not appt:
         raise HTTPException(404, "No encontrado")
 
+    await booking_lock.lock_doctor_async(db, appt.doctor_id)
+    db.refresh(appt)
+
     # Permisos: paciente dueño o doctor dueño
     if not (
         (current.role == models.UserRole.patient and appt.patient_id == current.id) or
@@ -558,48 +776,24 @@ async def reschedule_appt(
     appt.end_at = new_e
     appt.hold_until = None
 
-    # Si estaba confirmada y hay reunión Zoom → actualizarla
+    # Persistimos ya: suelta el candado antes de ir a Zoom
+    emit_appointment_event(db, APPT_RESCHEDULED, appt, old_start_at=old_start, old_end_at=old_end)
+    db.commit()
+    db.refresh(appt)
+
+    # Si estaba confirmada y hay reunión Zoom → moverla (fuera del candado)
     if appt.status == models.AppointmentStatus.confirmed and appt.zoom_meeting_id:
         try:
-            # ✅ Usamos UTC con 'Z' y sin timezone
-            start_iso = iso_utc_z(new_s)
-            duration = max(1, int((new_e - new_s).total_seconds() // 60))
-
-            try:
-                await zoom.update_meeting(
-                    meeting_id=appt.zoom_meeting_id,
-                    start_time_iso=start_iso,
-                    duration_minutes=duration,
-                    topic=f"Cita {appt.id} - Doctor {appt.doctor_id}",
-                )
-            except RuntimeError as zerr:
-                # Si la reunión no existe → recreamos
-                msg = str(zerr).lower()
-                if "404" in msg or "3001" in msg or "meeting does not exist" in msg:
-                    if not settings.ZOOM_DEFAULT_USER:
-                        raise HTTPException(500, "ZOOM_DEFAULT_USER no configurado")
-                    z = await zoom.create_meeting(
-                        user_id=settings.ZOOM_DEFAULT_USER,
-                        topic=f"Cita {appt.id} - Doctor {appt.doctor_id}",
-                        start_time_iso=start_iso,
-                        duration_minutes=duration,
-                        timezone=None,  # usamos UTC → no pasamos timezone
-                        waiting_room=True,
-                        join_before_host=False,
-                    )
-                    appt.zoom_meeting_id = str(z.get("id"))
-                    appt.zoom_join_url = z.get("join_url")
-                else:
-                    # Otro error: aborta
-                    raise
-
+            z = await _move_zoom_meeting(appt, new_s, new_e)
         except Exception as ex:
-            db.rollback()
-            raise HTTPException(502, f"No se pudo actualizar la reunión en Zoom: {ex}")
-
-    # Persistimos
-    db.commit()
-    db.refresh(appt)
+            # La cita ya se movió; el link sigue sirviendo aunque Zoom muestre la hora vieja
+            logger.warning("[appointments] No se pudo actualizar Zoom de la cita %s: %s", appt.id, ex)
+        else:
+            if z is not None:
+                appt.zoom_meeting_id = str(z.get("id"))
+                appt.zoom_join_url = z.get("join_url")
+                db.commit()
+                db.refresh(appt)
 
     # Emails de reagendado
     bg.add_task(send_rescheduled_emails, appt, db, old_start, old_end)
@@ -1,20 +1,29 @@
 # app/routers/availability.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import select, delete, and_
 from typing import List
-from datetime import datetime, timedelta, time as dtime, timezone
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+import heapq
 
 from ..db import get_db
+from ..config import settings
+from .. import agenda_index, recurring_blocks
 from .. import models, schemas
 from ..security import require_role
+from ..http_cache import not_modified, touch_agenda
+from ..events import emit_agenda_event, emit_appointment_event, HOLD_EXPIRED, RULES_CHANGED
 from ..utils.tz import (
     TZ_EC,                       # zona base América/Guayaquil
     to_utc,                      # payload/user input -> aware UTC
-    db_aware_utc,                # valores leídos de BD -> aware UTC (sin sorpresas)
     aware_to_local_naive,        # aware UTC -> naive local (Ecuador)
     local_naive_to_aware_utc,    # naive local (Ecuador) -> aware UTC
+    local_naive_to_aware_utc_many,
+    db_intervals_to_local_naive,
 )
+from ..slot_engine import BusyIndex, iter_free_slots, ranges_by_weekday, select_engine
 
 router = APIRouter(prefix="/availability", tags=["availability"])
 
@@ -46,6 +55,7 @@ def delete_stale_holds(db: Session) -> int:
     for appt_id in stale_ids:
         a = db.get(models.Appointment, appt_id)
         if a:
+            emit_appointment_event(db, HOLD_EXPIRED, a)
             db.delete(a)
     db.commit()
     return len(stale_ids)
@@ -151,6 +161,8 @@ def delete_slot(id: int, db: Session = Depends(get_db)):
 
 @router.get("/weekly", response_model=List[schemas.AvailabilityRuleOut])
 def get_weekly_rules(
+    request: Request,
+    response: Response,
     doctor_id: int = Query(..., description="ID de la psicóloga"),
     db: Session = Depends(get_db),
 ):
@@ -158,6 +170,10 @@ def get_weekly_rules(
     Devuelve la lista de reglas 0..6 para el doctor.
     Si un día no existe aún, simplemente no aparece en el listado.
     """
+    cached = not_modified(db, request, response, doctor_id=doctor_id)
+    if cached:
+        return cached
+
     stmt = (
         select(models.AvailabilityRule)
         .where(models.AvailabilityRule.doctor_id == doctor_id)
@@ -209,6 +225,7 @@ def upsert_weekly_rules(
             )
             db.add(newr)
 
+    emit_agenda_event(db, payload.doctor_id, RULES_CHANGED)
     db.commit()
 
     updated = db.scalars(
@@ -235,6 +252,8 @@ def reset_weekly_rules(
     """
     stmt = delete(models.AvailabilityRule).where(models.AvailabilityRule.doctor_id == doctor_id)
     db.execute(stmt)
+    touch_agenda(db, doctor_id)  # delete masivo: no pasa por los hooks del ORM
+    emit_agenda_event(db, doctor_id, RULES_CHANGED)
     db.commit()
     return None
 
@@ -243,33 +262,119 @@ def reset_weekly_rules(
 # 3) ENDPOINT: CÁLCULO DE SLOTS DISPONIBLES (reglas + citas ocupadas + BLOQUEOS)
 # ==========================
 
-def _overlaps(a_start: datetime, a_end: datetime, b_start: datetime, b_end: datetime) -> bool:
-    """Comparación entre intervalos en el MISMO tipo (aquí: todos LOCAL naive)."""
-    return (a_start < b_end) and (a_end > b_start)
+MAX_WINDOW_DAYS = 31
+MAX_LOOKAHEAD_DAYS = 365     # /availability/next puede mirar más allá de 31 días
+NEXT_CHUNK_DAYS = 14         # /availability/next consulta la BD por tramos
+DEFAULT_DURATION_MIN = 50
+
+
+def _normalize_window(date_from: datetime, date_to: datetime) -> tuple[datetime, datetime]:
+    """
+    Normaliza el rango solicitado a UTC aware (naive => se asume Ecuador)
+    y valida el tamaño máximo de la ventana.
+    """
+    df_aware = to_utc(date_from)
+    dt_aware = to_utc(date_to)
+    if dt_aware <= df_aware:
+        raise HTTPException(400, "date_to debe ser mayor que date_from")
+    if (dt_aware - df_aware).days > MAX_WINDOW_DAYS:
+        raise HTTPException(400, f"Rango máximo permitido: {MAX_WINDOW_DAYS} días")
+    return df_aware, dt_aware
+
+
+def _busy_intervals_by_doctor(
+    db: Session,
+    doctor_ids: list[int],
+    df_aware: datetime,
+    dt_aware: datetime,
+    now_utc: datetime,
+) -> dict[int, list[tuple[datetime, datetime]]]:
+    """
+    Citas activas (confirmadas o pending con hold vigente) + BLOQUEOS (y
+    ocurrencias de los recurrentes) que cruzan el rango, agrupados por
+    doctora y en LOCAL naive.
+    Una consulta para citas y otra para bloqueos, sin importar cuántas doctoras.
+    """
+    busy: dict[int, list[tuple[datetime, datetime]]] = {d: [] for d in doctor_ids}
+    if not doctor_ids:
+        return busy
+
+    appt_rows = db.execute(
+        select(models.Appointment.doctor_id, models.Appointment.start_at, models.Appointment.end_at)
+        .where(models.Appointment.doctor_id.in_(doctor_ids))
+        .where(
+            (
+                models.Appointment.status == models.AppointmentStatus.confirmed
+            ) | (
+                (models.Appointment.status == models.AppointmentStatus.pending) &
+                (
+                    (models.Appointment.hold_until == None) |  # noqa: E711
+                    (models.Appointment.hold_until > now_utc)
+                )
+            )
+        )
+        .where(models.Appointment.start_at < dt_aware)
+        .where(models.Appointment.end_at > df_aware)
+    )
+    block_rows = db.execute(
+        select(
+            models.CalendarBlock.doctor_id, models.CalendarBlock.start_at,
+            models.CalendarBlock.end_at, models.CalendarBlock.rrule,
+        )
+        .where(models.CalendarBlock.doctor_id.in_(doctor_ids))
+        .where(recurring_blocks.overlaps_clause(df_aware, dt_aware))
+    )
+    # Recurrentes: solo las ocurrencias de la ventana (expansión memoizada)
+    rows = list(appt_rows) + [
+        (doc_id, s, e)
+        for doc_id, start_at, end_at, rrule in block_rows
+        for _, s, e in recurring_blocks.expand_row(start_at, end_at, rrule, df_aware, dt_aware)
+    ]
+    # Conversión a LOCAL en lote (offset precalculado, sin ZoneInfo por fila)
+    for (doc_id, _, _), interval in zip(rows, db_intervals_to_local_naive((s, e) for _, s, e in rows)):
+        busy[doc_id].append(interval)
+    return busy
+
+
+def _busy_local(
+    db: Session, doctor_id: int, df_aware: datetime, dt_aware: datetime, now_utc: datetime,
+) -> list[tuple[datetime, datetime]]:
+    """Ocupación de UNA doctora: del índice en memoria si está activo, si no de la BD."""
+    idx = agenda_index.get_index(db, doctor_id, df_aware, dt_aware)
+    if idx is not None:
+        return idx.busy_local(df_aware, dt_aware, now_utc)
+    return _busy_intervals_by_doctor(db, [doctor_id], df_aware, dt_aware, now_utc)[doctor_id]
+
+
+def _slots_out(items) -> List[schemas.AvailableSlotOut]:
+    """(inicio LOCAL, fin LOCAL, doctora) -> AvailableSlotOut en UTC, convirtiendo en lote."""
+    utc = local_naive_to_aware_utc_many([x for s_local, e_local, _ in items for x in (s_local, e_local)])
+    return [
+        schemas.AvailableSlotOut(doctor_id=doc_id, start_at=utc[2 * i], end_at=utc[2 * i + 1])
+        for i, (_, _, doc_id) in enumerate(items)
+    ]
 
-def _hhmm_to_time(hhmm: str) -> dtime:
-    h, m = hhmm.split(":")
-    return dtime(hour=int(h), minute=int(m))
 
 @router.get("/slots", response_model=List[schemas.AvailableSlotOut])
 def get_available_slots(
+    request: Request,
+    response: Response,
     doctor_id: int = Query(...),
     date_from: datetime = Query(..., description="ISO8601 (puede traer Z)"),
     date_to: datetime = Query(..., description="ISO8601 (exclusivo)"),
     duration_min: int | None = Query(None, ge=10, le=240),
     db: Session = Depends(get_db),
 ):
+    # ⚡ 304 si el cliente ya tiene esta versión de la agenda (sin recalcular)
+    cached = not_modified(db, request, response, doctor_id=doctor_id, time_sensitive=True)
+    if cached:
+        return cached
+
     # 🧹 Limpia holds vencidos para que no “bloqueen” falsamente la agenda
     delete_stale_holds(db)
 
     # 1) Normalizar rango solicitado a UTC aware
-    #    - naive => se asume Ecuador y se convierte a UTC
-    df_aware = to_utc(date_from)
-    dt_aware = to_utc(date_to)
-    if dt_aware <= df_aware:
-        raise HTTPException(400, "date_to debe ser mayor que date_from")
-    if (dt_aware - df_aware).days > 31:
-        raise HTTPException(400, "Rango máximo permitido: 31 días")
+    df_aware, dt_aware = _normalize_window(date_from, date_to)
 
     # Para generar y comparar contra reglas por día, trabajamos en LOCAL (Ecuador) naive
     df_local = aware_to_local_naive(df_aware)
@@ -277,122 +382,204 @@ def get_available_slots(
 
     # 2) Duración (min)
     if duration_min is None:
-        cfg = db.get(models.DoctorSettings, doctor_id) if hasattr(models, "DoctorSettings") else None
-        duration_min = int(cfg.duration_min) if cfg and cfg.duration_min else 50
+        cfg = db.get(models.DoctorSettings, doctor_id)
+        duration_min = int(cfg.duration_min) if cfg and cfg.duration_min else DEFAULT_DURATION_MIN
     step = timedelta(minutes=duration_min)
 
     # 3) Reglas (local)
     rules = list(db.scalars(
         select(models.AvailabilityRule).where(models.AvailabilityRule.doctor_id == doctor_id)
     ))
-    rule_by_weekday = {r.weekday: r for r in rules if r.enabled and r.ranges}
-    if not rule_by_weekday:
+    ranges_by_wd = ranges_by_weekday(rules)
+    if not ranges_by_wd:
         return []
 
-    # 4) Traer citas ocupadas (de BD → db_aware_utc) y convertir a LOCAL naive
+    # 4) Citas ocupadas + BLOQUEOS (LOCAL naive)
     now_utc = datetime.now(timezone.utc)
-
-    busy_stmt = (
-        select(models.Appointment)
-        .where(models.Appointment.doctor_id == doctor_id)
-        .where(
-            (
-                models.Appointment.status == models.AppointmentStatus.confirmed
-            ) | (
-                (models.Appointment.status == models.AppointmentStatus.pending) &
-                (
-                    (models.Appointment.hold_until == None) |  # noqa: E711
-                    (models.Appointment.hold_until > now_utc)
-                )
-            )
-        )
-        .where(models.Appointment.start_at < dt_aware)
-        .where(models.Appointment.end_at > df_aware)
-    )
-    busy_appts = list(db.scalars(busy_stmt))
-    busy_intervals_local = [
-        (
-            aware_to_local_naive(db_aware_utc(a.start_at)),
-            aware_to_local_naive(db_aware_utc(a.end_at)),
+    busy = _busy_local(db, doctor_id, df_aware, dt_aware, now_utc)
+
+    # 5) Construir slots desde reglas y filtrar (descarta pasados y conflictos)
+    #    Responder como UTC aware (el front ya renderiza en GYE)
+    engine = select_engine(settings.SLOT_ENGINE)
+    return _slots_out([
+        (s_local, e_local, doctor_id)
+        for s_local, e_local in engine(
+            ranges_by_wd=ranges_by_wd,
+            busy_local=busy,
+            df_local=df_local,
+            dt_local=dt_local,
+            step=step,
+            now_local=aware_to_local_naive(now_utc),
         )
-        for a in busy_appts
-    ]
+    ])
 
-    # 5) Traer BLOQUEOS (CalendarBlock) que cruzan el rango y convertir a LOCAL naive
-    blocks_stmt = (
-        select(models.CalendarBlock)
-        .where(models.CalendarBlock.doctor_id == doctor_id)
-        .where(models.CalendarBlock.start_at < dt_aware)
-        .where(models.CalendarBlock.end_at > df_aware)
-    )
-    blocks = list(db.scalars(blocks_stmt))
-    block_intervals_local = [
-        (
-            aware_to_local_naive(db_aware_utc(b.start_at)),
-            aware_to_local_naive(db_aware_utc(b.end_at)),
+
+# ==========================
+# 4) ENDPOINT: BÚSQUEDA MULTI-DOCTORA (próximos slots con cualquier psicóloga)
+# ==========================
+
+@router.get("/search", response_model=List[schemas.AvailableSlotOut])
+def search_available_slots(
+    date_from: datetime = Query(..., description="ISO8601 (puede traer Z)"),
+    date_to: datetime = Query(..., description="ISO8601 (exclusivo)"),
+    region: str | None = Query(None, description="Filtra doctoras por User.region"),
+    duration_min: int | None = Query(None, ge=10, le=240, description="Si no viene, usa la de cada doctora"),
+    limit: int = Query(200, ge=1, le=2000),
+    stream: bool = Query(False, description="true => NDJSON en streaming (una línea por slot)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Slots libres de TODAS las doctoras (opcionalmente de una región), del más
+    próximo al más lejano. Se calcula en una sola pasada con 4 consultas en
+    total (reglas, configuración, citas y bloqueos) agrupadas por doctora, y
+    se mezclan con heapq.merge, así que cortar por `limit` no calcula de más.
+    """
+    df_aware, dt_aware = _normalize_window(date_from, date_to)
+    df_local = aware_to_local_naive(df_aware)
+    dt_local = aware_to_local_naive(dt_aware)
+    now_utc = datetime.now(timezone.utc)
+    now_local = aware_to_local_naive(now_utc)
+
+    # 1) Doctoras candidatas (+ reglas en la misma ida a BD por doctora)
+    doc_stmt = select(models.User.id).where(models.User.role == models.UserRole.doctor)
+    if region:
+        doc_stmt = doc_stmt.where(models.User.region == region)
+
+    rules_by_doctor: dict[int, list[models.AvailabilityRule]] = {}
+    for r in db.scalars(
+        select(models.AvailabilityRule).where(models.AvailabilityRule.doctor_id.in_(doc_stmt))
+    ):
+        rules_by_doctor.setdefault(r.doctor_id, []).append(r)
+
+    ranges_by_doctor = {d: ranges_by_weekday(rs) for d, rs in rules_by_doctor.items()}
+    doctor_ids = sorted(d for d, rw in ranges_by_doctor.items() if rw)
+    if not doctor_ids:
+        return []
+
+    # 2) Duración por doctora
+    if duration_min is None:
+        durations = {
+            d: int(m) for d, m in db.execute(
+                select(models.DoctorSettings.doctor_id, models.DoctorSettings.duration_min)
+                .where(models.DoctorSettings.doctor_id.in_(doctor_ids))
+            ) if m
+        }
+    else:
+        durations = {}
+
+    # 3) Citas + bloqueos de todas las doctoras en dos consultas
+    busy = _busy_intervals_by_doctor(db, doctor_ids, df_aware, dt_aware, now_utc)
+
+    # 4) Un generador ordenado por doctora → merge perezoso earliest-first
+    engine = select_engine(settings.SLOT_ENGINE)
+
+    def _doctor_slots(doc_id: int):
+        step = timedelta(minutes=duration_min or durations.get(doc_id, DEFAULT_DURATION_MIN))
+        for s_local, e_local in engine(
+            ranges_by_wd=ranges_by_doctor[doc_id],
+            busy_local=busy[doc_id],
+            df_local=df_local,
+            dt_local=dt_local,
+            step=step,
+            now_local=now_local,
+        ):
+            yield (s_local, e_local, doc_id)
+
+    merged = islice(heapq.merge(*(_doctor_slots(d) for d in doctor_ids)), limit)
+
+    def _out(item) -> schemas.AvailableSlotOut:
+        s_local, e_local, doc_id = item
+        return schemas.AvailableSlotOut(
+            doctor_id=doc_id,
+            start_at=local_naive_to_aware_utc(s_local),
+            end_at=local_naive_to_aware_utc(e_local),
         )
-        for b in blocks
-    ]
 
-    # 6) “Ahora” local para descartar slots en el pasado
+    if stream:
+        def _ndjson():
+            for item in merged:
+                yield _out(item).model_dump_json() + "\n"
+        return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+    return _slots_out(list(merged))
+
+
+# ==========================
+# 5) ENDPOINT: PRÓXIMOS N SLOTS LIBRES (early exit)
+# ==========================
+
+@router.get("/next", response_model=List[schemas.AvailableSlotOut])
+def next_available_slots(
+    doctor_id: int = Query(...),
+    n: int = Query(1, ge=1, le=50, description="Cuántos slots devolver"),
+    date_from: datetime | None = Query(None, description="Desde cuándo buscar (por defecto: ahora)"),
+    max_days: int = Query(90, ge=1, le=MAX_LOOKAHEAD_DAYS, description="Horizonte máximo de búsqueda"),
+    duration_min: int | None = Query(None, ge=10, le=240),
+    db: Session = Depends(get_db),
+):
+    """
+    Responde "¿cuándo es la próxima cita libre?" sin calcular toda la ventana:
+    recorre las reglas día a día en tramos de NEXT_CHUNK_DAYS, consulta las
+    citas/bloqueos SOLO de ese tramo (índice ordenado con bisect) y se
+    detiene en cuanto tiene `n` slots.
+
+    Los slots salen alineados al inicio de cada rango de la regla (no a
+    `date_from`), igual que los ve la doctora en su plantilla semanal.
+    """
+    now_utc = datetime.now(timezone.utc)
     now_local = aware_to_local_naive(now_utc)
+    start_utc = max(to_utc(date_from), now_utc) if date_from else now_utc
+    start_local = aware_to_local_naive(start_utc)
+
+    rules = list(db.scalars(
+        select(models.AvailabilityRule).where(models.AvailabilityRule.doctor_id == doctor_id)
+    ))
+    ranges_by_wd = ranges_by_weekday(rules)
+    if not ranges_by_wd:
+        return []
+
+    if duration_min is None:
+        cfg = db.get(models.DoctorSettings, doctor_id)
+        duration_min = int(cfg.duration_min) if cfg and cfg.duration_min else DEFAULT_DURATION_MIN
+    step = timedelta(minutes=duration_min)
+
+    # Tramos cortados a medianoche LOCAL: las reglas nunca cruzan de día,
+    # así el resultado es idéntico a generar la ventana completa.
+    day0 = start_local.replace(hour=0, minute=0, second=0, microsecond=0)
+    horizon_local = day0 + timedelta(days=max_days)
+    chunk = timedelta(days=NEXT_CHUNK_DAYS)
 
-    # 7) Construir slots desde reglas (todo en LOCAL naive) y filtrar contra citas y bloqueos
     results: list[schemas.AvailableSlotOut] = []
+    chunk_start = day0
+    while chunk_start < horizon_local and len(results) < n:
+        chunk_end = min(chunk_start + chunk, horizon_local)
+        busy = BusyIndex(_busy_local(
+            db,
+            doctor_id,
+            local_naive_to_aware_utc(chunk_start),
+            local_naive_to_aware_utc(chunk_end),
+            now_utc,
+        ))
+
+        for s_local, e_local in iter_free_slots(
+            ranges_by_wd=ranges_by_wd,
+            busy_local=busy,
+            df_local=chunk_start,
+            dt_local=chunk_end,
+            step=step,
+            now_local=now_local,
+        ):
+            if s_local < start_local:
+                continue  # en curso o antes de date_from
+            results.append(
+                schemas.AvailableSlotOut(
+                    doctor_id=doctor_id,
+                    start_at=local_naive_to_aware_utc(s_local),
+                    end_at=local_naive_to_aware_utc(e_local),
+                )
+            )
+            if len(results) >= n:
+                break
+        chunk_start = chunk_end
 
-    day = df_local.replace(hour=0, minute=0, second=0, microsecond=0)
-    while day < dt_local:
-        # python Mon=0..Sun=6  => modelo Sun=0..Sat=6
-        rule_weekday = (day.weekday() + 1) % 7
-        rule = rule_by_weekday.get(rule_weekday)
-        if rule:
-            for r in rule.ranges:
-                start_t = _hhmm_to_time(r.get("start"))
-                end_t   = _hhmm_to_time(r.get("end"))
-
-                window_start = datetime.combine(day.date(), start_t)  # LOCAL naive
-                window_end   = datetime.combine(day.date(), end_t)    # LOCAL naive
-
-                slot_win_start = max(window_start, df_local)
-                slot_win_end   = min(window_end, dt_local)
-                if slot_win_end <= slot_win_start:
-                    continue
-
-                cur = slot_win_start
-                while cur + step <= slot_win_end:
-                    s_local = cur
-                    e_local = cur + step
-
-                    # 7.1 Saltar slots en el pasado
-                    if e_local <= now_local:
-                        cur = e_local
-                        continue
-
-                    # 7.2 Conflicto contra appointments
-                    conflict = False
-                    for b_s, b_e in busy_intervals_local:
-                        if _overlaps(s_local, e_local, b_s, b_e):
-                            conflict = True
-                            break
-
-                    # 7.3 Conflicto contra BLOQUEOS
-                    if not conflict:
-                        for bl_s, bl_e in block_intervals_local:
-                            if _overlaps(s_local, e_local, bl_s, bl_e):
-                                conflict = True
-                                break
-
-                    if not conflict:
-                        # Responder como UTC aware (el front ya renderiza en GYE)
-                        results.append(
-                            schemas.AvailableSlotOut(
-                                doctor_id=doctor_id,
-                                start_at=local_naive_to_aware_utc(s_local),
-                                end_at=local_naive_to_aware_utc(e_local),
-                            )
-                        )
-                    cur = e_local
-        day += timedelta(days=1)
-
-    results.sort(key=lambda x: (x.start_at, x.end_at))
     return results
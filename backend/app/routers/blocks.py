@@ -1,14 +1,17 @@
 # app/routers/blocks.py
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_, or_
+from sqlalchemy import select
 from datetime import datetime, timezone
 from typing import List, Optional
 
 from ..db import get_db
 from .. import models, schemas
 from ..security import require_role, get_current_user
-from ..utils.tz import to_utc
+from ..utils.tz import to_utc, iso_utc_z
+from ..http_cache import not_modified
+from .. import agenda_index, booking_lock, recurrence, recurring_blocks
+from ..events import emit_agenda_event, BLOCK_ADDED, BLOCK_REMOVED
 
 router = APIRouter(prefix="/blocks", tags=["blocks"])
 
@@ -39,33 +42,37 @@ def create_block(
     if e <= now:
         raise HTTPException(status_code=400, detail="No puedes bloquear tiempo completamente en el pasado.")
 
+    # Bajo el candado de reservas: ninguna cita nueva entra mientras se valida
+    booking_lock.lock_doctor(db, payload.doctor_id)
+
+    rule = None
+    until_utc = None
+    if payload.rrule:
+        try:
+            rule = recurrence.parse_rrule(payload.rrule)
+        except ValueError as ex:
+            raise HTTPException(status_code=400, detail=f"Recurrencia inválida: {ex}")
+        until_utc = recurring_blocks.recur_until(s, e, rule)
+
     # 1) Conflictos con citas confirmadas o pendientes (con hold vigente)
-    status_processing = getattr(models.AppointmentStatus, "processing", models.AppointmentStatus.pending)
-
-    appt_stmt = (
-        select(models.Appointment.id)
-        .where(models.Appointment.doctor_id == payload.doctor_id)
-        .where(models.Appointment.start_at < e)
-        .where(models.Appointment.end_at > s)
-        .where(
-            or_(
-                models.Appointment.status == models.AppointmentStatus.confirmed,
-                and_(
-                    models.Appointment.status.in_([models.AppointmentStatus.pending, status_processing]),
-                    or_(
-                        models.Appointment.hold_until == None,  # noqa: E711
-                        models.Appointment.hold_until > now,
-                    ),
-                ),
+    if rule is None:
+        if agenda_index.has_conflict(db, doctor_id=payload.doctor_id, start_utc=s, end_utc=e, blocks=False):
+            raise HTTPException(
+                status_code=409,
+                detail="Existen citas dentro de ese rango. Reagenda/cancela antes de bloquear."
             )
+    else:
+        # Recurrente: una sola consulta de rango sobre toda la vigencia de la regla
+        hit = agenda_index.recurring_block_conflict(
+            db, doctor_id=payload.doctor_id, start_utc=s, end_utc=e, rrule=rule.to_rrule(), until_utc=until_utc,
         )
-    )
-    appt_conflict_id = db.scalar(appt_stmt)
-    if appt_conflict_id:
-        raise HTTPException(
-            status_code=409,
-            detail="Existen citas dentro de ese rango. Reagenda/cancela antes de bloquear."
-        )
+        if hit:
+            appt_id, occ_start = hit
+            raise HTTPException(
+                status_code=409,
+                detail=f"La cita #{appt_id} cae en una ocurrencia del bloqueo ({iso_utc_z(occ_start)}). "
+                       "Reagenda/cancela antes de bloquear."
+            )
 
     # 2) Guardar el bloqueo (guardamos SIEMPRE en UTC)
     b = models.CalendarBlock(
@@ -74,9 +81,14 @@ def create_block(
         end_at=e,
         all_day=payload.all_day,
         reason=payload.reason,
+        rrule=rule.to_rrule() if rule else None,
+        recur_until=until_utc,
         created_by=current.id,
     )
     db.add(b)
+    db.flush()  # asigna id para el evento
+    emit_agenda_event(db, b.doctor_id, BLOCK_ADDED, block_id=b.id, start_at=s, end_at=e, all_day=b.all_day,
+                      rrule=b.rrule, recur_until=until_utc)
     db.commit()
     db.refresh(b)
     return b
@@ -85,6 +97,8 @@ def create_block(
 # Listar bloqueos por doctor y/o por rango
 @router.get("", response_model=List[schemas.CalendarBlockOut])
 def list_blocks(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     doctor_id: Optional[int] = None,
     date_from: Optional[datetime] = None,
@@ -92,21 +106,19 @@ def list_blocks(
     skip: int = 0,
     limit: int = Query(200, le=1000),
 ):
+    cached = not_modified(db, request, response, doctor_id=doctor_id)
+    if cached:
+        return cached
+
     stmt = select(models.CalendarBlock).order_by(models.CalendarBlock.start_at.asc())
 
     if doctor_id:
         stmt = stmt.where(models.CalendarBlock.doctor_id == doctor_id)
 
-    # Filtros de rango (guardados en UTC)
-    if date_from and date_to:
-        f = to_utc(date_from); t = to_utc(date_to)
-        stmt = stmt.where(models.CalendarBlock.start_at < t).where(models.CalendarBlock.end_at > f)
-    elif date_from:
-        f = to_utc(date_from)
-        stmt = stmt.where(models.CalendarBlock.end_at > f)
-    elif date_to:
-        t = to_utc(date_to)
-        stmt = stmt.where(models.CalendarBlock.start_at < t)
+    # Filtros de rango (guardados en UTC). Los recurrentes se listan una vez
+    # (su definición) si alguna ocurrencia puede caer en el rango.
+    if date_from or date_to:
+        stmt = stmt.where(recurring_blocks.overlaps_clause(to_utc(date_from), to_utc(date_to)))
 
     stmt = stmt.offset(skip).limit(limit)
     return list(db.scalars(stmt))
@@ -131,6 +143,7 @@ def delete_block(
     if b.doctor_id != current.id:
         raise HTTPException(status_code=403, detail="No puedes eliminar bloqueos de otra doctora.")
 
+    emit_agenda_event(db, b.doctor_id, BLOCK_REMOVED, block_id=b.id, start_at=b.start_at, end_at=b.end_at)
     db.delete(b)
     db.commit()
     return None
@@ -4,9 +4,12 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select
 from typing import List, Optional
 
+from ..config import settings
 from ..db import get_db
 from .. import models, schemas
 from ..security import require_role
+from ..utils.projection import parse_fields, snippet
+from .. import revisions
 
 router = APIRouter(prefix="/clinical_histories", tags=["clinical_histories"])
 
@@ -34,18 +37,46 @@ def create_ch(payload: schemas.ClinicalHistoryCreate, db: Session = Depends(get_
     db.refresh(ch)
     return ch
 
-@router.get("", response_model=List[schemas.ClinicalHistoryOut])
+# Columnas de texto (pesadas): fuera del listado salvo que se pidan con ?fields=
+TEXT_FIELDS = (
+    "antecedentes_personales", "antecedentes_familiares", "medicacion_actual",
+    "alergias", "diagnosticos_previos", "consumo", "antecedentes_psico",
+    "notas", "factores_protectores",
+)
+# De dónde sale el extracto: la primera no vacía
+SNIPPET_FROM = ("notas", "diagnosticos_previos", "antecedentes_personales", "antecedentes_psico")
+
+@router.get(
+    "",
+    response_model=List[schemas.ClinicalHistorySummaryOut],
+    response_model_exclude_unset=True,
+)
 def list_ch(
     db: Session = Depends(get_db),
     patient_id: Optional[int] = None,
     skip: int = 0,
     limit: int = Query(100, le=500),
+    fields: Optional[str] = Query(
+        None,
+        description="Textos completos a incluir, separados por coma ('all' = todos). "
+                    "Por defecto solo id, patient_id, fechas y snippet.",
+    ),
 ):
-    stmt = select(models.ClinicalHistory).order_by(models.ClinicalHistory.id.desc())
+    """
+    Listado liviano: solo lee de la BD las columnas de la proyección (el
+    extracto lo corta la BD). El texto completo está en GET /{id}.
+    """
+    CH = models.ClinicalHistory
+    extra = parse_fields(fields, TEXT_FIELDS)
+    stmt = select(
+        CH.id, CH.patient_id, CH.created_at, CH.updated_at,
+        snippet([getattr(CH, f) for f in SNIPPET_FROM], settings.CLINICAL_SNIPPET_CHARS).label("snippet"),
+        *(getattr(CH, f) for f in extra),
+    ).order_by(CH.id.desc())
     if patient_id:
-        stmt = stmt.where(models.ClinicalHistory.patient_id == patient_id)
+        stmt = stmt.where(CH.patient_id == patient_id)
     stmt = stmt.offset(skip).limit(limit)
-    return list(db.scalars(stmt))
+    return [dict(row) for row in db.execute(stmt).mappings()]
 
 @router.get("/{id}", response_model=schemas.ClinicalHistoryOut)
 def get_ch(id: int, db: Session = Depends(get_db)):
@@ -88,3 +119,25 @@ def delete_ch(id: int, db: Session = Depends(get_db)):
     db.delete(ch)
     db.commit()
     return None
+
+
+# =========================
+# Historial de revisiones (app/revisions.py)
+# =========================
+@router.get(
+    "/{id}/revisions",
+    response_model=List[schemas.ClinicalRevisionOut],
+    dependencies=[Depends(require_role(models.UserRole.doctor))],
+)
+def list_ch_revisions(id: int, db: Session = Depends(get_db)):
+    """Versiones de la historia clínica, la más reciente primero (también si ya se borró)."""
+    return revisions.list_revisions(db, "clinical_history", id)
+
+@router.get(
+    "/{id}/revisions/{version}",
+    response_model=schemas.ClinicalRevisionContentOut,
+    dependencies=[Depends(require_role(models.UserRole.doctor))],
+)
+def get_ch_revision(id: int, version: int, db: Session = Depends(get_db)):
+    """Contenido completo de la historia clínica en esa versión."""
+    return revisions.materialize(db, "clinical_history", id, version)
@@ -0,0 +1,63 @@
+# app/routers/events.py
+import asyncio
+import json
+
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+
+from ..config import settings
+from ..events import broadcaster
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+def _sse(ev: dict) -> str:
+    return (
+        f"id: {ev.get('seq', '')}\n"
+        f"event: {ev['type']}\n"
+        f"data: {json.dumps(ev, separators=(',', ':'))}\n\n"
+    )
+
+
+@router.get("/agenda")
+async def agenda_events(
+    request: Request,
+    doctor_id: int = Query(..., description="ID de la psicóloga"),
+):
+    """
+    Stream SSE (text/event-stream) con los cambios de agenda de una doctora:
+    slot_taken, hold_expired, slot_released, appointment_confirmed,
+    appointment_rescheduled, appointment_updated, block_added, block_removed,
+    rules_changed, settings_changed y resync (recargar todo).
+
+    Uso en el front: `new EventSource(`${API_URL}/events/agenda?doctor_id=1`)`.
+    """
+    queue = broadcaster.subscribe(doctor_id)
+    heartbeat = max(1, settings.AGENDA_EVENTS_HEARTBEAT_SECONDS)
+
+    async def stream():
+        try:
+            # Reintento sugerido al navegador + evento inicial
+            yield "retry: 5000\n\n"
+            yield _sse({"type": "ready", "doctor_id": doctor_id, "seq": 0})
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    ev = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    # Comentario SSE: mantiene viva la conexión tras proxies (Render)
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(ev)
+        finally:
+            broadcaster.unsubscribe(doctor_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # evita buffering en proxies nginx
+        },
+    )
@@ -0,0 +1,46 @@
+# app/routers/search.py
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from ..db import get_db
+from .. import clinical_search, models, schemas
+from ..security import get_current_user, require_role
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+@router.get(
+    "/clinical",
+    response_model=schemas.ClinicalSearchOut,
+    dependencies=[Depends(require_role(models.UserRole.doctor))],
+)
+def search_clinical(
+    q: str = Query(..., min_length=2, max_length=200, description='Palabras (todas deben aparecer); en Postgres también "frases", -excluir y OR'),
+    kind: Optional[List[schemas.ClinicalSearchKindLiteral]] = Query(None, description="Filtrar por origen (repetible)"),
+    patient_id: Optional[int] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current=Depends(get_current_user),
+):
+    """
+    Busca en historias clínicas y planes terapéuticos de los pacientes de la
+    doctora autenticada. Devuelve extractos resaltados (no los registros
+    completos: para eso GET /clinical_histories/{id} o /therapeutic_plans/{id}).
+    """
+    if patient_id is not None:
+        pat = db.get(models.User, patient_id)
+        if not pat or pat.doctor_id != current.id:
+            raise HTTPException(status_code=404, detail="Paciente no encontrado")
+    page = clinical_search.search(
+        db,
+        doctor_id=current.id,
+        q=q,
+        kinds=kind or list(models.SEARCH_SOURCES),
+        patient_id=patient_id,
+        skip=skip,
+        limit=limit,
+    )
+    return {"items": page.items, "skip": skip, "limit": limit, "has_more": page.has_more}
@@ -1,18 +1,25 @@
 # app/routers/settings.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 from ..db import get_db
 from .. import models, schemas
 from ..security import require_role
+from ..http_cache import not_modified
+from ..events import emit_agenda_event, SETTINGS_CHANGED
 
 router = APIRouter(prefix="/settings", tags=["settings"])
 
 @router.get("/consultation", response_model=schemas.DoctorSettingsOut)
 def get_consultation_settings(
+    request: Request,
+    response: Response,
     doctor_id: int = Query(...),
     db: Session = Depends(get_db),
 ):
+    cached = not_modified(db, request, response, doctor_id=doctor_id)
+    if cached:
+        return cached
     cfg = db.get(models.DoctorSettings, doctor_id)
     if not cfg:
         # fallback razonable si no existe registro aún
@@ -45,6 +52,7 @@ def upsert_consultation_settings(
         cfg.duration_min = payload.duration_min
         cfg.price_usd = payload.price_usd
 
+    emit_agenda_event(db, payload.doctor_id, SETTINGS_CHANGED, duration_min=payload.duration_min)
     db.commit()
     db.refresh(cfg)
     return cfg
@@ -3,9 +3,12 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 from typing import List
+from ..config import settings
 from ..db import get_db
 from .. import models, schemas
 from ..security import require_role
+from ..utils.projection import parse_fields, snippet
+from .. import revisions
 
 router = APIRouter(prefix="/therapeutic_plans", tags=["therapeutic_plans"])
 
@@ -17,13 +20,30 @@ def create_tp(payload: schemas.TherapeuticPlanCreate, db: Session = Depends(get_
     tp = models.TherapeuticPlan(**payload.model_dump())
     db.add(tp); db.commit(); db.refresh(tp); return tp
 
-@router.get("", response_model=List[schemas.TherapeuticPlanOut])
-def list_tp(db: Session = Depends(get_db), patient_id: int | None = None, skip: int = 0, limit: int = Query(100, le=500)):
-    stmt = select(models.TherapeuticPlan).order_by(models.TherapeuticPlan.id.desc())
+# Columnas de texto: fuera del listado salvo que se pidan con ?fields=
+TEXT_FIELDS = ("objetivos", "frecuencia", "intervenciones", "tareas", "metricas", "notas")
+SNIPPET_FROM = ("objetivos", "notas", "intervenciones")
+
+@router.get("", response_model=List[schemas.TherapeuticPlanSummaryOut], response_model_exclude_unset=True)
+def list_tp(
+    db: Session = Depends(get_db),
+    patient_id: int | None = None,
+    skip: int = 0,
+    limit: int = Query(100, le=500),
+    fields: str | None = Query(None, description="Textos completos a incluir, separados por coma ('all' = todos)"),
+):
+    """Listado liviano (id, paciente, fechas, próxima revisión y snippet); el texto completo en GET /{id}."""
+    TP = models.TherapeuticPlan
+    extra = parse_fields(fields, TEXT_FIELDS)
+    stmt = select(
+        TP.id, TP.patient_id, TP.proxima_revision, TP.created_at, TP.updated_at,
+        snippet([getattr(TP, f) for f in SNIPPET_FROM], settings.CLINICAL_SNIPPET_CHARS).label("snippet"),
+        *(getattr(TP, f) for f in extra),
+    ).order_by(TP.id.desc())
     if patient_id:
-        stmt = stmt.where(models.TherapeuticPlan.patient_id == patient_id)
+        stmt = stmt.where(TP.patient_id == patient_id)
     stmt = stmt.offset(skip).limit(limit)
-    return list(db.scalars(stmt))
+    return [dict(row) for row in db.execute(stmt).mappings()]
 
 @router.get("/{id}", response_model=schemas.TherapeuticPlanOut)
 def get_tp(id: int, db: Session = Depends(get_db)):
@@ -43,3 +63,25 @@ def delete_tp(id: int, db: Session = Depends(get_db)):
     tp = db.get(models.TherapeuticPlan, id)
     if not tp: raise HTTPException(404, "No encontrado")
     db.delete(tp); db.commit(); return None
+
+
+# =========================
+# Historial de revisiones (app/revisions.py)
+# =========================
+@router.get(
+    "/{id}/revisions",
+    response_model=List[schemas.ClinicalRevisionOut],
+    dependencies=[Depends(require_role(models.UserRole.doctor))],
+)
+def list_tp_revisions(id: int, db: Session = Depends(get_db)):
+    """Versiones del plan terapéutico, la más reciente primero (también si ya se borró)."""
+    return revisions.list_revisions(db, "therapeutic_plan", id)
+
+@router.get(
+    "/{id}/revisions/{version}",
+    response_model=schemas.ClinicalRevisionContentOut,
+    dependencies=[Depends(require_role(models.UserRole.doctor))],
+)
+def get_tp_revision(id: int, version: int, db: Session = Depends(get_db)):
+    """Contenido completo del plan terapéutico en esa versión."""
+    return revisions.materialize(db, "therapeutic_plan", id, version)
@@ -2,18 +2,20 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Iterable, Optional
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.memory import MemoryJobStore
 # Si prefieres persistencia completa del scheduler:
 # from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
 from .db import SessionLocal  # sessionmaker
 from . import models
 from .mailer.notifications import send_reminder_emails
+from .query_watch import watched
 
 # =========================
 # Config
@@ -74,6 +76,7 @@ def shutdown_scheduler():
         scheduler = None
 
 
+@watched("job:rebuild_jobs_on_startup")
 def rebuild_jobs_on_startup():
     """
     Reconstruye en APScheduler todos los jobs que estén 'scheduled' en BD y futuros.
@@ -119,6 +122,7 @@ def rebuild_jobs_on_startup():
 # Core job
 # =========================
 
+@watched("job:reminder")
 async def _reminder_job(appt_id: int):
     """
     Job ejecutado por APScheduler. Crea su propia sesión, valida la cita
@@ -171,23 +175,14 @@ async def _reminder_job(appt_id: int):
 # API desde código (programar/cancelar)
 # =========================
 
-def schedule_reminder_job(appt: models.Appointment):
-    """
-    Registra/actualiza el job en BD y lo programa en APScheduler para
-    enviar recordatorio REMINDER_LEAD_MINUTES antes del inicio.
-    Si falta menos de 2 minutos, no programa.
-    """
-    global scheduler
-    if scheduler is None:
-        start_scheduler()
-
+def _reminder_run_at(appt: models.Appointment, now_utc: datetime) -> Optional[datetime]:
+    """Instante UTC del recordatorio, o None si no corresponde programarlo."""
     if appt.status != models.AppointmentStatus.confirmed:
-        return
+        return None
 
     # Normalizar a UTC
     start_utc = (appt.start_at if appt.start_at.tzinfo else appt.start_at.replace(tzinfo=timezone.utc)).astimezone(timezone.utc)
     run_at = start_utc - timedelta(minutes=REMINDER_LEAD_MINUTES)
-    now_utc = datetime.now(timezone.utc)
 
     # Si ya pasó el run_at, pero aún faltan >=2 min para el inicio, envía en 1 min (para pruebas)
     if run_at <= now_utc:
@@ -195,32 +190,26 @@ def schedule_reminder_job(appt: models.Appointment):
             run_at = now_utc + timedelta(minutes=1)
         else:
             # Demasiado tarde
-            return
+            return None
+    return run_at
 
-    job_id = get_job_id(appt.id)
 
-    # Upsert en BD
-    db: Session = SessionLocal()
-    try:
-        rj = db.get(models.ReminderJob, job_id)
-        if not rj:
-            rj = models.ReminderJob(
-                id=job_id,
-                appointment_id=appt.id,
-                run_at_utc=run_at,
-                status=models.ReminderStatus.scheduled,
-            )
-            db.add(rj)
-        else:
-            rj.run_at_utc = run_at
-            rj.status = models.ReminderStatus.scheduled
-            rj.executed_at_utc = None
-            rj.last_error = None
-        db.commit()
-    finally:
-        db.close()
-
-    # Programar en APS
+def _upsert_reminder_row(db: Session, rj: Optional[models.ReminderJob], job_id: str, appt_id: int, run_at: datetime):
+    if not rj:
+        db.add(models.ReminderJob(
+            id=job_id,
+            appointment_id=appt_id,
+            run_at_utc=run_at,
+            status=models.ReminderStatus.scheduled,
+        ))
+    else:
+        rj.run_at_utc = run_at
+        rj.status = models.ReminderStatus.scheduled
+        rj.executed_at_utc = None
+        rj.last_error = None
+
+
+def _add_aps_job(job_id: str, appt_id: int, run_at: datetime):
     if scheduler:
         scheduler.add_job(
             func=_reminder_job,
@@ -228,11 +217,74 @@ def schedule_reminder_job(appt: models.Appointment):
             run_date=run_at,
             id=job_id,
             replace_existing=True,
-            kwargs={"appt_id": appt.id},
+            kwargs={"appt_id": appt_id},
             misfire_grace_time=300,
             coalesce=True,
         )
 
+
+def schedule_reminder_job(appt: models.Appointment):
+    """
+    Registra/actualiza el job en BD y lo programa en APScheduler para
+    enviar recordatorio REMINDER_LEAD_MINUTES antes del inicio.
+    Si falta menos de 2 minutos, no programa.
+    """
+    global scheduler
+    if scheduler is None:
+        start_scheduler()
+
+    run_at = _reminder_run_at(appt, datetime.now(timezone.utc))
+    if run_at is None:
+        return
+
+    job_id = get_job_id(appt.id)
+
+    # Upsert en BD
+    db: Session = SessionLocal()
+    try:
+        _upsert_reminder_row(db, db.get(models.ReminderJob, job_id), job_id, appt.id, run_at)
+        db.commit()
+    finally:
+        db.close()
+
+    # Programar en APS
+    _add_aps_job(job_id, appt.id, run_at)
+
+
+def schedule_reminder_jobs(appts: Iterable[models.Appointment]):
+    """
+    Igual que schedule_reminder_job pero para muchas citas (series): una
+    sola sesión, un SELECT ... IN para los jobs existentes y un commit.
+    """
+    global scheduler
+    if scheduler is None:
+        start_scheduler()
+
+    now_utc = datetime.now(timezone.utc)
+    plan = {}
+    for appt in appts:
+        run_at = _reminder_run_at(appt, now_utc)
+        if run_at is not None:
+            plan[get_job_id(appt.id)] = (appt.id, run_at)
+    if not plan:
+        return
+
+    db: Session = SessionLocal()
+    try:
+        existing = {
+            rj.id: rj
+            for rj in db.scalars(select(models.ReminderJob).where(models.ReminderJob.id.in_(list(plan))))
+        }
+        for job_id, (appt_id, run_at) in plan.items():
+            _upsert_reminder_row(db, existing.get(job_id), job_id, appt_id, run_at)
+        db.commit()
+    finally:
+        db.close()
+
+    for job_id, (appt_id, run_at) in plan.items():
+        _add_aps_job(job_id, appt_id, run_at)
+
+
 def schedule_reminder_job_by_id(appt_id: int):
     """
     Versión segura para background: abre su propia sesión, carga la cita y
@@ -270,3 +322,32 @@ def cancel_reminder_job(appt_id: int):
     finally:
         db.close()
 
+
+def cancel_reminder_jobs(appt_ids: Iterable[int]):
+    """
+    Igual que cancel_reminder_job para muchas citas (holds vencidos): un
+    solo UPDATE ... IN en BD, sin importar cuántas sean.
+    """
+    job_ids = [get_job_id(i) for i in appt_ids]
+    if not job_ids:
+        return
+    if scheduler:
+        for job_id in job_ids:
+            try:
+                scheduler.remove_job(job_id)
+            except Exception:
+                pass
+
+    db: Session = SessionLocal()
+    try:
+        db.execute(
+            update(models.ReminderJob)
+            .where(
+                models.ReminderJob.id.in_(job_ids),
+                models.ReminderJob.status == models.ReminderStatus.scheduled,
+            )
+            .values(status=models.ReminderStatus.canceled)
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -128,6 +128,27 @@ class ClinicalHistoryOut(BaseModel):
     class Config:
         from_attributes = True
 
+class ClinicalHistorySummaryOut(BaseModel):
+    """
+    Fila de GET /clinical_histories: extracto en lugar de los textos. Los
+    campos de texto solo vienen si se piden con ?fields= (el router excluye
+    los no pedidos).
+    """
+    id: int
+    patient_id: int
+    snippet: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    antecedentes_personales: Optional[str] = None
+    antecedentes_familiares: Optional[str] = None
+    medicacion_actual: Optional[str] = None
+    alergias: Optional[str] = None
+    diagnosticos_previos: Optional[str] = None
+    consumo: Optional[str] = None
+    antecedentes_psico: Optional[str] = None
+    notas: Optional[str] = None
+    factores_protectores: Optional[str] = None
+
 # Therapeutic Plan
 class TherapeuticPlanBase(BaseModel):
     objetivos: Optional[str] = None
@@ -160,6 +181,60 @@ class TherapeuticPlanOut(BaseModel):
     class Config:
         from_attributes = True
 
+class TherapeuticPlanSummaryOut(BaseModel):
+    """Fila de GET /therapeutic_plans (ver ClinicalHistorySummaryOut)."""
+    id: int
+    patient_id: int
+    snippet: Optional[str] = None
+    proxima_revision: Optional[date] = None
+    created_at: datetime
+    updated_at: datetime
+    objetivos: Optional[str] = None
+    frecuencia: Optional[str] = None
+    intervenciones: Optional[str] = None
+    tareas: Optional[str] = None
+    metricas: Optional[str] = None
+    notas: Optional[str] = None
+
+ClinicalSearchKindLiteral = Literal["clinical_history", "therapeutic_plan"]
+
+# Historial de revisiones (GET /clinical_histories/{id}/revisions, /therapeutic_plans/{id}/revisions)
+class ClinicalRevisionOut(BaseModel):
+    id: int
+    version: int
+    action: str                 # create | update | delete | baseline
+    is_snapshot: bool
+    changed_fields: List[str]
+    author_id: Optional[int] = None
+    created_at: datetime
+    size_bytes: int             # tamaño guardado (comprimido)
+
+class ClinicalRevisionContentOut(BaseModel):
+    kind: ClinicalSearchKindLiteral
+    record_id: int
+    version: int
+    action: str
+    author_id: Optional[int] = None
+    created_at: datetime
+    data: dict                  # campos del registro en esa versión
+
+# Búsqueda de texto completo (GET /search/clinical)
+
+class ClinicalSearchHitOut(BaseModel):
+    kind: ClinicalSearchKindLiteral
+    id: int
+    patient_id: int
+    patient_name: str
+    updated_at: Optional[datetime] = None
+    rank: float
+    snippet: str  # escapado para HTML; coincidencias entre <mark>...</mark>
+
+class ClinicalSearchOut(BaseModel):
+    items: List[ClinicalSearchHitOut]
+    skip: int
+    limit: int
+    has_more: bool
+
 # Literales
 
 
@@ -207,6 +282,41 @@ class AppointmentHoldIn(BaseModel):
 class AppointmentHoldOut(BaseModel):
     appointments: List[AppointmentOut]
 
+# --- SERIES (citas recurrentes) ---
+class AppointmentSeriesCreate(BaseModel):
+    doctor_id: int
+    patient_id: int
+    # Primera ocurrencia; las siguientes repiten la misma hora local
+    start_at: datetime
+    end_at: datetime
+    method: Optional[PayMethodLiteral] = None
+    # Regla: texto RRULE ("FREQ=WEEKLY;INTERVAL=2;COUNT=10") o los campos sueltos
+    rrule: Optional[str] = None
+    interval_weeks: int = Field(default=1, ge=1, le=8)
+    weekdays: List[int] = Field(default_factory=list)  # 0=domingo..6=sábado; vacío = día de start_at
+    count: Optional[int] = Field(default=None, ge=1)
+    until: Optional[datetime] = None
+    # True => crea las ocurrencias libres y reporta el resto; False => 409 si alguna choca
+    skip_conflicts: bool = False
+
+class SeriesConflictOut(BaseModel):
+    index: int
+    start_at: datetime
+    end_at: datetime
+    reason: Literal["appointment", "block"]
+    conflicting_id: int
+
+class SeriesProvisionErrorOut(BaseModel):
+    appointment_id: int
+    error: str
+
+class AppointmentSeriesOut(BaseModel):
+    series_id: int
+    rrule: str
+    appointments: List[AppointmentOut]
+    conflicts: List[SeriesConflictOut] = Field(default_factory=list)
+    provisioning_errors: List[SeriesProvisionErrorOut] = Field(default_factory=list)
+
 # Payments (renombramos stripe -> payphone)
 class PaymentBase(BaseModel):
     appointment_id: int
@@ -356,6 +466,8 @@ class CalendarBlockBase(BaseModel):
     end_at: datetime
     all_day: bool = False
     reason: str | None = None
+    # Recurrencia semanal (RRULE: "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"); start_at/end_at = primera ocurrencia
+    rrule: str | None = None
 
     @field_validator("end_at")
     @classmethod
@@ -374,6 +486,7 @@ class CalendarBlockUpdate(BaseModel):
 
 class CalendarBlockOut(CalendarBlockBase):
     id: int
+    recur_until: datetime | None = None
     created_by: int
     created_at: datetime
 
@@ -384,6 +497,15 @@ class PayphoneConfirmIn(BaseModel):
     id: int
     clientTxId: str
 
+class PayphoneFailedAppointmentOut(BaseModel):
+    appointment_id: int
+    reason: str
+    # Horarios en UTC y hora de Ecuador (texto) para depurar TZ
+    start_utc: str
+    end_utc: str
+    start_gye: str
+    end_gye: str
+
 class PayphoneConfirmOut(BaseModel):
     transaction_status: str
     status_code: int
@@ -394,3 +516,40 @@ class PayphoneConfirmOut(BaseModel):
     confirmed_appointment_ids: list[int] = []
     payment_id: int | None = None
     message: str | None = None
+    failed_appointments: list[PayphoneFailedAppointmentOut] = []
+
+class ReconciliationIssueOut(BaseModel):
+    id: int
+    kind: str
+    subject: str
+    payment_id: int | None = None
+    appointment_id: int | None = None
+    payphone_tx_id: str | None = None
+    detail: dict | None = None
+    detected_at: datetime
+    resolved_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
+
+class ReconciliationWatermarkOut(BaseModel):
+    name: str
+    last_id: int
+    last_at: datetime | None = None
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class ReconciliationSummaryOut(BaseModel):
+    open_total: int
+    open_by_kind: dict[str, int]
+    notifications_by_status: dict[str, int]
+    watermarks: list[ReconciliationWatermarkOut]
+    recent: list[ReconciliationIssueOut]
+
+class PayphoneNotifyOut(BaseModel):
+    received: bool = True
+    transaction_id: int
+    queued: bool                 # False => ya estaba encolada o procesada
+    status: str                  # pending | processing | done | failed
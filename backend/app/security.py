@@ -12,6 +12,7 @@ from sqlalchemy.exc import OperationalError  # 👈 importante
 from .config import settings
 from .db import get_db
 from . import models
+from .revisions import set_actor
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
@@ -79,6 +80,9 @@ def get_current_user(
     if not user:
         raise credentials_exc
 
+    # Autor de las revisiones clínicas que registre este request (app/revisions.py)
+    set_actor(db, user.id)
+
     return user
 
 
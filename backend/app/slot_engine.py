@@ -0,0 +1,142 @@
+# app/slot_engine.py
+"""
+Motor de generación de slots disponibles (sin BD).
+
+Recibe reglas semanales, intervalos ocupados (citas + bloqueos) y una
+ventana, todo en hora LOCAL naive (Ecuador), y produce los slots libres en
+orden cronológico. Lo usan /availability/slots (una doctora) y
+/availability/search (varias doctoras).
+
+Hay una variante vectorizada opcional en slot_engine_numpy (misma salida);
+`select_engine` elige según SLOT_ENGINE.
+"""
+from __future__ import annotations
+
+import logging
+from bisect import bisect_right
+from datetime import datetime, timedelta, time as dtime
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+Interval = Tuple[datetime, datetime]
+
+logger = logging.getLogger(__name__)
+
+
+def overlaps(a_start: datetime, a_end: datetime, b_start: datetime, b_end: datetime) -> bool:
+    """Comparación entre intervalos en el MISMO tipo (aquí: todos LOCAL naive)."""
+    return (a_start < b_end) and (a_end > b_start)
+
+
+def hhmm_to_time(hhmm: str) -> dtime:
+    h, m = hhmm.split(":")
+    return dtime(hour=int(h), minute=int(m))
+
+
+def rule_weekday(day: datetime) -> int:
+    """python Mon=0..Sun=6  => modelo Sun=0..Sat=6"""
+    return (day.weekday() + 1) % 7
+
+
+class BusyIndex:
+    """
+    Índice de intervalos ocupados de UNA doctora: ordenados y fusionados
+    (disjuntos), así "¿[s, e) está libre?" es un bisect O(log n) en vez de
+    recorrer todas las citas y bloqueos por cada slot.
+    """
+
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, intervals: Iterable[Interval]):
+        merged: List[List[datetime]] = []
+        for s, e in sorted(intervals):
+            if merged and s <= merged[-1][1]:
+                if e > merged[-1][1]:
+                    merged[-1][1] = e
+            else:
+                merged.append([s, e])
+        self._starts = [m[0] for m in merged]
+        self._ends = [m[1] for m in merged]
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def bounds(self) -> Tuple[List[datetime], List[datetime]]:
+        """(inicios, fines) de los intervalos fusionados, en orden."""
+        return self._starts, self._ends
+
+    def is_free(self, start: datetime, end: datetime) -> bool:
+        # Primer intervalo que termina después de `start`; como son disjuntos y
+        # ordenados, es el único candidato a solaparse.
+        i = bisect_right(self._ends, start)
+        return i == len(self._starts) or self._starts[i] >= end
+
+
+def ranges_by_weekday(rules: Sequence) -> Dict[int, List[dict]]:
+    """
+    {weekday: [ {start, end}, ... ]} solo con reglas habilitadas y con rangos,
+    ordenando los rangos por hora de inicio (el schema ya impide solapes).
+    """
+    out: Dict[int, List[dict]] = {}
+    for r in rules:
+        if r.enabled and r.ranges:
+            out[r.weekday] = sorted(r.ranges, key=lambda x: x.get("start"))
+    return out
+
+
+def iter_free_slots(
+    *,
+    ranges_by_wd: Dict[int, List[dict]],
+    busy_local: Union[Sequence[Interval], BusyIndex],
+    df_local: datetime,
+    dt_local: datetime,
+    step: timedelta,
+    now_local: datetime,
+) -> Iterator[Interval]:
+    """
+    Genera (start_local, end_local) libres en orden cronológico dentro de
+    [df_local, dt_local). `busy_local` une citas activas y bloqueos
+    (lista de intervalos o un BusyIndex ya construido).
+    Es un generador: quien consume puede cortar antes (early exit).
+    """
+    busy = busy_local if isinstance(busy_local, BusyIndex) else BusyIndex(busy_local)
+    day = df_local.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < dt_local:
+        for r in ranges_by_wd.get(rule_weekday(day), ()):
+            window_start = datetime.combine(day.date(), hhmm_to_time(r.get("start")))
+            window_end = datetime.combine(day.date(), hhmm_to_time(r.get("end")))
+
+            slot_win_start = max(window_start, df_local)
+            slot_win_end = min(window_end, dt_local)
+            if slot_win_end <= slot_win_start:
+                continue
+
+            cur = slot_win_start
+            while cur + step <= slot_win_end:
+                s_local = cur
+                e_local = cur + step
+                cur = e_local
+
+                # Saltar slots en el pasado
+                if e_local <= now_local:
+                    continue
+
+                # Conflicto contra citas y bloqueos
+                if not busy.is_free(s_local, e_local):
+                    continue
+
+                yield (s_local, e_local)
+        day += timedelta(days=1)
+
+
+def select_engine(name: str) -> Callable[..., Iterator[Interval]]:
+    """
+    "python" (generador perezoso) o "numpy" (ventana completa vectorizada).
+    Si se pide numpy y no está instalado, se usa el de Python con un aviso.
+    """
+    if name == "numpy":
+        from . import slot_engine_numpy
+
+        if slot_engine_numpy.available():
+            return slot_engine_numpy.iter_free_slots
+        logger.warning("SLOT_ENGINE=numpy pero numpy no está instalado; se usa el motor de Python")
+    return iter_free_slots
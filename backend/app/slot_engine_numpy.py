@@ -0,0 +1,123 @@
+# app/slot_engine_numpy.py
+"""
+Motor de slots vectorizado con NumPy (opcional, SLOT_ENGINE="numpy").
+
+Misma firma y MISMA salida que slot_engine.iter_free_slots, pero calcula la
+ventana completa de una vez sobre arrays int64:
+
+- Ventanas de reglas: una fila por (día, rango) con inicio/fin recortados
+  a [df_local, dt_local).
+- Grilla candidata: repeat + arange dentro de cada ventana.
+- Conflictos: searchsorted sobre los ocupados ordenados por inicio más el
+  máximo acumulado de sus fines (mismo resultado que BusyIndex.is_free).
+
+Las horas se representan en microsegundos desde la época (no minutos) para
+que `date_from` con segundos o microsegundos dé exactamente la misma grilla.
+Conviene para ventanas largas (semanas/meses); para "el próximo slot" el
+generador de Python corta antes y sigue siendo mejor.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Sequence, Union
+
+try:  # dependencia opcional
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover - depende del entorno
+    np = None
+
+from .slot_engine import BusyIndex, Interval, hhmm_to_time
+
+_US_PER_DAY = 86_400_000_000
+_EPOCH = datetime(1970, 1, 1)
+# 1970-01-01 fue jueves: weekday() == 3
+_EPOCH_WEEKDAY = 3
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _us(dt: datetime) -> int:
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def _to_datetimes(values) -> List[datetime]:
+    return values.astype("datetime64[us]").astype(object).tolist()
+
+
+def iter_free_slots(
+    *,
+    ranges_by_wd: Dict[int, List[dict]],
+    busy_local: Union[Sequence[Interval], BusyIndex],
+    df_local: datetime,
+    dt_local: datetime,
+    step: timedelta,
+    now_local: datetime,
+) -> Iterator[Interval]:
+    """Versión vectorizada de slot_engine.iter_free_slots (ver ese docstring)."""
+    if np is None:
+        raise RuntimeError("SLOT_ENGINE=numpy requiere el paquete `numpy`")
+
+    df_us, dt_us, now_us = _us(df_local), _us(dt_local), _us(now_local)
+    step_us = step // timedelta(microseconds=1)
+    day0 = df_local.replace(hour=0, minute=0, second=0, microsecond=0)
+    day0_us = _us(day0)
+    n_days = -(-(dt_us - day0_us) // _US_PER_DAY) if dt_us > day0_us else 0
+    if n_days <= 0 or step_us <= 0:
+        return iter(())
+
+    days_us = day0_us + np.arange(n_days, dtype=np.int64) * _US_PER_DAY
+    # Modelo Sun=0..Sat=6 (igual que rule_weekday)
+    rule_wd = ((days_us // _US_PER_DAY + _EPOCH_WEEKDAY) + 1) % 7
+
+    # 1) Ventanas (día, rango) en el mismo orden que el generador de Python
+    win_start, win_end, win_day, win_rank = [], [], [], []
+    for wd, ranges in ranges_by_wd.items():
+        day_idx = np.nonzero(rule_wd == wd)[0]
+        if not day_idx.size:
+            continue
+        for rank, r in enumerate(ranges):
+            t0, t1 = hhmm_to_time(r.get("start")), hhmm_to_time(r.get("end"))
+            off0 = (t0.hour * 3600 + t0.minute * 60) * 1_000_000
+            off1 = (t1.hour * 3600 + t1.minute * 60) * 1_000_000
+            win_start.append(days_us[day_idx] + off0)
+            win_end.append(days_us[day_idx] + off1)
+            win_day.append(day_idx)
+            win_rank.append(np.full(day_idx.size, rank))
+    if not win_start:
+        return iter(())
+
+    order = np.lexsort((np.concatenate(win_rank), np.concatenate(win_day)))
+    ws = np.maximum(np.concatenate(win_start)[order], df_us)
+    we = np.minimum(np.concatenate(win_end)[order], dt_us)
+
+    # 2) Grilla candidata: n slots completos por ventana
+    counts = np.where(we > ws, (we - ws) // step_us, 0)
+    total = int(counts.sum())
+    if not total:
+        return iter(())
+    first = np.cumsum(counts) - counts
+    k = np.arange(total, dtype=np.int64) - np.repeat(first, counts)
+    starts = np.repeat(ws, counts) + k * step_us
+    ends = starts + step_us
+
+    # 3) Pasados y conflictos. Un slot [s, e) choca si algún ocupado empieza
+    #    antes de e y el mayor fin entre esos supera s (mismo criterio que
+    #    BusyIndex.is_free, sin fusionar en Python).
+    keep = ends > now_us
+    if isinstance(busy_local, BusyIndex):
+        b_starts, b_ends = busy_local.bounds()
+        pairs = zip(b_starts, b_ends)
+    else:
+        pairs = busy_local
+    flat = [_us(x) for pair in pairs for x in pair]
+    if flat:
+        busy = np.array(flat, dtype=np.int64).reshape(-1, 2)
+        busy = busy[np.argsort(busy[:, 0], kind="stable")]
+        max_end = np.maximum.accumulate(busy[:, 1])
+        j = np.searchsorted(busy[:, 0], ends, side="left") - 1
+        keep &= (j < 0) | (max_end[np.maximum(j, 0)] <= starts)
+
+    starts, ends = starts[keep], ends[keep]
+    return zip(_to_datetimes(starts), _to_datetimes(ends))
@@ -0,0 +1,44 @@
+# app/utils/compact_json.py
+"""
+JSON compacto y comprimido para payloads de auditoría (p.ej. la respuesta
+de PayPhone en payment_payloads): se guardan como bytes con su códec.
+
+- "zstd" si el paquete `zstandard` está instalado (opcional, fuera de
+  requirements.txt: `pip install zstandard`; mejor ratio y más rápido).
+- "zlib" (stdlib) si no; también es el códec de la migración que movió los
+  payloads existentes.
+Cada fila recuerda su códec, así conviven ambos.
+"""
+from __future__ import annotations
+
+import json
+import zlib
+from typing import Any, Tuple
+
+try:  # dependencia opcional
+    import zstandard  # type: ignore
+except ImportError:  # pragma: no cover - depende del entorno
+    zstandard = None
+
+_ZSTD_LEVEL = 10
+_ZLIB_LEVEL = 6
+
+
+def pack(obj: Any) -> Tuple[str, bytes]:
+    """(códec, bytes) del objeto serializado sin espacios."""
+    raw = json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, _ZLIB_LEVEL)
+
+
+def unpack(codec: str, data: bytes) -> Any:
+    if codec == "zlib":
+        raw = zlib.decompress(data)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Payload comprimido con zstd: instala el paquete `zstandard` para leerlo")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raise ValueError(f"Códec de payload desconocido: {codec!r}")
+    return json.loads(raw.decode("utf-8"))
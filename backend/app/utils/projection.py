@@ -0,0 +1,42 @@
+# app/utils/projection.py
+"""
+Proyecciones para listados con columnas de texto grandes (historias
+clínicas, planes terapéuticos): el listado trae solo columnas livianas y
+un extracto calculado en SQL; los textos completos se piden explícitamente
+con `?fields=` o se leen en GET /{id}.
+"""
+from __future__ import annotations
+
+from typing import List, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.sql.elements import ColumnElement
+
+ALL = "all"
+
+
+def parse_fields(raw: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """
+    'notas,alergias' -> ['notas', 'alergias'] (en el orden de `allowed`);
+    'all' -> todos. Un campo desconocido responde 422.
+    """
+    if not raw:
+        return []
+    wanted = {f.strip() for f in raw.split(",") if f.strip()}
+    if ALL in wanted:
+        return list(allowed)
+    unknown = wanted - set(allowed)
+    if unknown:
+        raise HTTPException(
+            status_code=422,
+            detail=f"fields no válidos: {', '.join(sorted(unknown))}. "
+                   f"Permitidos: {', '.join(allowed)} o '{ALL}'",
+        )
+    return [f for f in allowed if f in wanted]
+
+
+def snippet(columns: Sequence[ColumnElement], length: int) -> ColumnElement:
+    """Primeros `length` caracteres de la primera columna no vacía (lo corta la BD)."""
+    first = func.coalesce(*(func.nullif(c, "") for c in columns))
+    return func.substr(first, 1, max(1, length))
@@ -1,5 +1,10 @@
 # app/utils/tz.py
-from datetime import datetime, timezone
+from __future__ import annotations
+
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Tuple
 from zoneinfo import ZoneInfo
 
 TZ_EC = ZoneInfo("America/Guayaquil")
@@ -24,12 +29,155 @@ def db_aware_utc(dt: datetime | None) -> datetime | None:
     return dt.astimezone(timezone.utc)
 
 def aware_to_local_naive(dt: datetime) -> datetime:
-    return dt.astimezone(TZ_EC).replace(tzinfo=None)
+    return _default_window().to_local_naive(dt)
 
 def local_naive_to_aware_utc(dt: datetime) -> datetime:
-    return dt.replace(tzinfo=TZ_EC).astimezone(timezone.utc)
+    return _default_window().to_aware_utc(dt)
+
+def aware_to_local(dt: datetime) -> datetime:
+    """aware -> aware en hora de Ecuador (tzinfo de offset fijo; mismo isoformat que ZoneInfo)."""
+    local = aware_to_local_naive(dt)
+    return local.replace(tzinfo=timezone(local - _naive_utc(dt)))
 
 def iso_utc_z(dt: datetime) -> str:
     d = to_utc(dt).replace(microsecond=0)
     s = d.isoformat()
     return s if s.endswith("Z") or "+" in s else s + "Z"
+
+
+# =========================
+# Conversión rápida (offsets precalculados)
+# =========================
+# Guayaquil es UTC-5 fijo desde 1993, pero cada astimezone(ZoneInfo) vuelve a
+# buscar la transición. Aquí se calculan UNA vez los tramos de offset de un
+# rango y se convierte sumando/restando el timedelta del tramo; ZoneInfo solo
+# se usa fuera del rango o a pocas horas de una transición (huecos/solapes).
+
+_UTC = timezone.utc
+_ONE_DAY = timedelta(days=1)
+_ONE_SECOND = timedelta(seconds=1)
+# Rango del conversor por defecto: desde 2000 (un solo tramo) hasta la agenda futura
+_DEFAULT_RANGE = (datetime(2000, 1, 1, tzinfo=_UTC), datetime(2100, 1, 1, tzinfo=_UTC))
+
+
+def _naive_utc(dt: datetime) -> datetime:
+    """aware (cualquier tz) -> naive UTC sin pasar por astimezone."""
+    off = dt.utcoffset()
+    return dt.replace(tzinfo=None) - off if off else dt.replace(tzinfo=None)
+
+
+class TzWindow:
+    """
+    Tramos de offset de `tz` entre [lo, hi) (UTC). Convierte en ambos
+    sentidos con el offset del tramo; si el rango tiene un solo tramo
+    (el caso de Ecuador hoy) no hay ni bisect.
+    """
+
+    __slots__ = ("tz", "lo", "hi", "_starts", "_offsets", "_local_starts",
+                 "_local_lo", "_local_hi", "_guard", "_single")
+
+    def __init__(self, lo: datetime, hi: datetime, tz: ZoneInfo = TZ_EC):
+        self.tz = tz
+        self.lo = lo.astimezone(_UTC)
+        self.hi = hi.astimezone(_UTC)
+        starts: List[datetime] = [self.lo]
+        offsets: List[timedelta] = [self._offset_at(self.lo)]
+        # Muestreo diario + búsqueda binaria del segundo exacto de cada cambio
+        t = self.lo
+        while t < self.hi:
+            nxt = min(t + _ONE_DAY, self.hi)
+            off = self._offset_at(nxt)
+            if off != offsets[-1]:
+                a, b = 0, int((nxt - t) / _ONE_SECOND)
+                while b - a > 1:
+                    mid = (a + b) // 2
+                    if self._offset_at(t + mid * _ONE_SECOND) == offsets[-1]:
+                        a = mid
+                    else:
+                        b = mid
+                starts.append(t + b * _ONE_SECOND)
+                offsets.append(off)
+            t = nxt
+        self._starts = starts
+        self._offsets = offsets
+        # Inicio de cada tramo en hora local (naive), para el sentido local -> UTC
+        self._local_starts = [s.replace(tzinfo=None) + o for s, o in zip(starts, offsets)]
+        self._local_lo = self._local_starts[0]
+        self._local_hi = self.hi.replace(tzinfo=None) + offsets[-1]
+        # Distancia mínima a una transición (en hora local) para confiar en el tramo
+        self._guard = max((abs(offsets[i] - offsets[i - 1]) for i in range(1, len(offsets))), default=timedelta(0))
+        self._single = len(offsets) == 1
+
+    def _offset_at(self, utc: datetime) -> timedelta:
+        return utc.astimezone(self.tz).utcoffset()
+
+    # ---- aware -> local naive ----
+    def to_local_naive(self, dt: datetime) -> datetime:
+        u = dt if dt.tzinfo is _UTC else dt.astimezone(_UTC)
+        if not (self.lo <= u < self.hi):
+            return dt.astimezone(self.tz).replace(tzinfo=None)
+        if self._single:
+            return u.replace(tzinfo=None) + self._offsets[0]
+        return u.replace(tzinfo=None) + self._offsets[bisect_right(self._starts, u) - 1]
+
+    # ---- local naive -> aware UTC ----
+    def to_aware_utc(self, dt: datetime) -> datetime:
+        off = self._local_offset(dt)
+        if off is None:
+            return dt.replace(tzinfo=self.tz).astimezone(_UTC)
+        return (dt - off).replace(tzinfo=_UTC)
+
+    def _local_offset(self, dt: datetime) -> Optional[timedelta]:
+        if not (self._local_lo <= dt < self._local_hi):
+            return None
+        if self._single:
+            return self._offsets[0]
+        i = bisect_right(self._local_starts, dt) - 1
+        # Cerca de una transición la hora local puede no existir o repetirse:
+        # que decida ZoneInfo (fold=0), igual que antes.
+        if i > 0 and dt - self._local_starts[i] < self._guard:
+            return None
+        if i + 1 < len(self._local_starts) and self._local_starts[i + 1] - dt <= self._guard:
+            return None
+        return self._offsets[i]
+
+    # ---- lotes ----
+    def to_local_naive_many(self, dts: Iterable[datetime]) -> List[datetime]:
+        if not self._single:
+            return [self.to_local_naive(d) for d in dts]
+        lo, hi, off = self.lo, self.hi, self._offsets[0]
+        return [
+            d.replace(tzinfo=None) + off if d.tzinfo is _UTC and lo <= d < hi else self.to_local_naive(d)
+            for d in dts
+        ]
+
+    def to_aware_utc_many(self, dts: Iterable[datetime]) -> List[datetime]:
+        if not self._single:
+            return [self.to_aware_utc(d) for d in dts]
+        lo, hi, off = self._local_lo, self._local_hi, self._offsets[0]
+        return [
+            (d - off).replace(tzinfo=_UTC) if lo <= d < hi else d.replace(tzinfo=self.tz).astimezone(_UTC)
+            for d in dts
+        ]
+
+
+@lru_cache(maxsize=1)
+def _default_window() -> TzWindow:
+    return TzWindow(*_DEFAULT_RANGE)
+
+
+def aware_to_local_naive_many(dts: Sequence[datetime]) -> List[datetime]:
+    """Lote de aware -> naive local (Ecuador)."""
+    return _default_window().to_local_naive_many(dts)
+
+
+def local_naive_to_aware_utc_many(dts: Sequence[datetime]) -> List[datetime]:
+    """Lote de naive local (Ecuador) -> aware UTC."""
+    return _default_window().to_aware_utc_many(dts)
+
+
+def db_intervals_to_local_naive(rows: Iterable[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """Intervalos leídos de BD (naive = UTC, o aware) -> LOCAL naive, en lote."""
+    flat = [x if x.tzinfo else x.replace(tzinfo=_UTC) for pair in rows for x in pair]
+    local = aware_to_local_naive_many(flat)
+    return list(zip(local[0::2], local[1::2]))
@@ -1,9 +1,11 @@
 # app/zoom_client.py
 from __future__ import annotations
 from typing import Optional, Dict, Any, Callable
+import asyncio
 import time
 import httpx
 from .config import settings
+from .metrics import track_outbound
 
 
 def _pretty_zoom_error(resp: httpx.Response) -> str:
@@ -39,11 +41,11 @@ class ZoomClient:
         if not (account_id and client_id and client_secret):
             raise RuntimeError("Faltan credenciales Zoom en .env (ZOOM_ACCOUNT_ID/CLIENT_ID/CLIENT_SECRET).")
 
-        token_url = "https://zoom.us/oauth/token"
+        token_url = settings.ZOOM_OAUTH_URL
         auth = (client_id, client_secret)
         params = {"grant_type": "account_credentials", "account_id": account_id}
 
-        async with httpx.AsyncClient(timeout=20.0) as client:
+        async with httpx.AsyncClient(timeout=20.0) as client, track_outbound("zoom", "token"):
             resp = await client.post(token_url, params=params, auth=auth)
             resp.raise_for_status()
             data = resp.json()
@@ -81,27 +83,43 @@ class ZoomClient:
             payload["timezone"] = timezone
         return payload
 
+    async def _send(
+        self,
+        client: httpx.AsyncClient,
+        method: Callable[..., Any],
+        url: str,
+        operation: str,
+        json: Optional[dict],
+    ) -> httpx.Response:
+        """Un intento, medido como `operation` (el token se pide antes: se mide aparte)."""
+        headers = await self._headers()
+        async with track_outbound("zoom", operation) as call:
+            resp = await method(client, url, json=json, headers=headers)
+            if resp.status_code >= 400:
+                call.fail()
+            return resp
+
     async def _request_with_retry(
         self,
         method: Callable[..., Any],
         url: str,
         *,
+        operation: str,
         json: Optional[dict] = None,
     ) -> httpx.Response:
         """
         Hace 1 intento + reintento en:
           - 401: refresca token y reintenta una vez.
           - 429: espera 'Retry-After' (si viene) o 1.2s y reintenta una vez.
-        Lanza RuntimeError si sigue fallando.
+        Devuelve la última respuesta; el llamador decide si es error.
         """
         async with httpx.AsyncClient(timeout=20.0) as client:
             # Primer intento
-            resp = await method(client, url, json=json, headers=await self._headers())
+            resp = await self._send(client, method, url, operation, json)
             if resp.status_code == 401:
                 # Token viejo/invalidado → refrescar y reintentar
                 self._token = None
-                await self._ensure_token()
-                resp = await method(client, url, json=json, headers=await self._headers())
+                resp = await self._send(client, method, url, operation, json)
 
             elif resp.status_code == 429:
                 # Rate limit → esperar y reintentar una vez
@@ -109,9 +127,8 @@ class ZoomClient:
                     retry_after = float(resp.headers.get("Retry-After", "1.2"))
                 except Exception:
                     retry_after = 1.2
-                await httpx.AsyncClient().aclose()  # nada crítico, solo para ser prolijos
-                await httpx.AsyncClient(timeout=retry_after).aclose()
-                resp = await method(client, url, json=json, headers=await self._headers())
+                await asyncio.sleep(min(max(retry_after, 0.0), 10.0))
+                resp = await self._send(client, method, url, operation, json)
 
             return resp
 
@@ -158,7 +175,7 @@ class ZoomClient:
         def _post(client: httpx.AsyncClient, u: str, **kw) -> Any:
             return client.post(u, **kw)
 
-        resp = await self._request_with_retry(_post, url, json=payload)
+        resp = await self._request_with_retry(_post, url, operation="create_meeting", json=payload)
         if resp.status_code >= 400:
             raise RuntimeError(f"zoom.create_meeting: {_pretty_zoom_error(resp)}")
         return resp.json()
@@ -186,7 +203,7 @@ class ZoomClient:
         def _patch(client: httpx.AsyncClient, u: str, **kw) -> Any:
             return client.patch(u, **kw)
 
-        resp = await self._request_with_retry(_patch, url, json=payload)
+        resp = await self._request_with_retry(_patch, url, operation="update_meeting", json=payload)
         if resp.status_code >= 400:
             raise RuntimeError(f"zoom.update_meeting: {_pretty_zoom_error(resp)}")
         # 204 OK → nada que retornar
@@ -198,7 +215,7 @@ class ZoomClient:
         def _get(client: httpx.AsyncClient, u: str, **kw) -> Any:
             return client.get(u, **kw)
 
-        resp = await self._request_with_retry(_get, url)
+        resp = await self._request_with_retry(_get, url, operation="get_meeting")
         if resp.status_code >= 400:
             raise RuntimeError(f"zoom.get_meeting: {_pretty_zoom_error(resp)}")
         return resp.json()
@@ -0,0 +1,184 @@
+# benchmarks/bench_clinical_lists.py
+"""
+Benchmark de GET /clinical_histories con notas grandes: latencia y memoria
+del listado completo (como era antes) frente al resumen con extracto y a
+`?fields=notas`.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_clinical_lists
+    python -m benchmarks.bench_clinical_lists --rows 500 --text-len 20000 --repeat 10
+    python -m benchmarks.bench_clinical_lists --db postgresql+psycopg2://...   # BD desechable
+    python -m benchmarks.bench_clinical_lists --json out.json
+
+Por defecto usa un SQLite temporal (no necesita .env). Mide en proceso la
+consulta + validación del response_model + JSON, sin HTTP. La memoria es el
+pico de tracemalloc durante una llamada.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# La config se valida al importar `app` (igual que tests/conftest.py)
+os.environ.setdefault("JWT_SECRET", "bench")
+for _var in ("ZOOM_ACCOUNT_ID", "ZOOM_CLIENT_ID", "ZOOM_CLIENT_SECRET", "ZOOM_DEFAULT_USER"):
+    os.environ.setdefault(_var, "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "citaspsico-bench-unused.db"))
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, delete, event, insert, select
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.routers.clinical_histories import TEXT_FIELDS, list_ch
+
+LOREM = (
+    "La paciente refiere ansiedad anticipatoria en contextos laborales, "
+    "dificultad para conciliar el sueño y episodios de rumiación nocturna. "
+    "Se acuerda registro diario de pensamientos automáticos y técnicas de "
+    "respiración diafragmática. Antecedentes familiares de depresión. "
+)
+
+
+# =========================
+# Datos
+# =========================
+
+def _engine(url: str | None):
+    if url:
+        return create_engine(url, future=True)
+    path = os.path.join(tempfile.gettempdir(), "citaspsico-bench-clinical.db")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}", future=True)
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_now(dbapi_conn, _rec):
+        dbapi_conn.create_function("now", 0, lambda: datetime.now(timezone.utc).isoformat(sep=" "))
+
+    return engine
+
+
+def _seed(engine, rows: int, text_len: int) -> None:
+    models.Base.metadata.create_all(engine)
+    rnd = random.Random(3)
+    words = (LOREM * (text_len // len(LOREM) + 1)).split()
+
+    def txt() -> str:
+        rnd.shuffle(words)
+        return " ".join(words)[:text_len]
+
+    now = datetime.now(timezone.utc)
+    with Session(engine) as db:
+        db.execute(delete(models.ClinicalHistory))
+        db.execute(delete(models.User).where(models.User.email == "bench-patient@correo.com"))
+        patient = models.User(
+            name="Paciente bench", email="bench-patient@correo.com",
+            password_hash="x", role=models.UserRole.patient,
+        )
+        db.add(patient)
+        db.flush()
+        db.execute(insert(models.ClinicalHistory), [
+            {"patient_id": patient.id, "created_at": now, "updated_at": now, **{f: txt() for f in TEXT_FIELDS}}
+            for _ in range(rows)
+        ])
+        db.commit()
+
+
+# =========================
+# Variantes
+# =========================
+
+def _full(db: Session, limit: int) -> bytes:
+    """Lo que hacía el listado antes: entidades completas + ClinicalHistoryOut."""
+    stmt = select(models.ClinicalHistory).order_by(models.ClinicalHistory.id.desc()).limit(limit)
+    out = TypeAdapter(list[schemas.ClinicalHistoryOut]).validate_python(list(db.scalars(stmt)), from_attributes=True)
+    return TypeAdapter(list[schemas.ClinicalHistoryOut]).dump_json(out)
+
+
+def _listing(fields: str | None):
+    adapter = TypeAdapter(list[schemas.ClinicalHistorySummaryOut])
+
+    def run(db: Session, limit: int) -> bytes:
+        rows = list_ch(db=db, patient_id=None, skip=0, limit=limit, fields=fields)
+        return adapter.dump_json(adapter.validate_python(rows), exclude_unset=True)
+
+    return run
+
+
+VARIANTS = {
+    "full (antes)": _full,
+    "summary": _listing(None),
+    "fields=notas": _listing("notas"),
+    "fields=all": _listing("all"),
+}
+
+
+# =========================
+# Medición
+# =========================
+
+def bench(engine, limit: int, repeat: int) -> list[dict]:
+    results = []
+    for name, fn in VARIANTS.items():
+        timings, peaks, size = [], [], 0
+        for _ in range(repeat):
+            # Sesión nueva por vuelta: sin identity map de la anterior
+            with Session(engine) as db:
+                t0 = time.perf_counter()
+                body = fn(db, limit)
+                timings.append(time.perf_counter() - t0)
+            with Session(engine) as db:
+                tracemalloc.start()
+                fn(db, limit)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            size = len(body)
+        results.append({
+            "variant": name,
+            "rows": limit,
+            "response_bytes": size,
+            "ms_median": round(statistics.median(timings) * 1000, 2),
+            "ms_p95": round(sorted(timings)[int(0.95 * (len(timings) - 1))] * 1000, 2),
+            "peak_mib": round(statistics.median(peaks) / 2**20, 2),
+        })
+    return results
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=500, help="filas sembradas y pedidas (límite del endpoint: 500)")
+    ap.add_argument("--text-len", type=int, default=8000, help="caracteres por columna de texto (9 columnas)")
+    ap.add_argument("--repeat", type=int, default=7)
+    ap.add_argument("--db", default=None, help="URL de BD desechable (por defecto SQLite temporal)")
+    ap.add_argument("--json", dest="json_out", default=None, help="guardar resultados en JSON")
+    args = ap.parse_args()
+
+    engine = _engine(args.db)
+    _seed(engine, args.rows, args.text_len)
+    results = bench(engine, min(args.rows, 500), args.repeat)
+
+    header = f"{'variante':<16}{'filas':>7}{'bytes':>12}{'ms p50':>10}{'ms p95':>10}{'pico MiB':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['variant']:<16}{r['rows']:>7}{r['response_bytes']:>12}"
+            f"{r['ms_median']:>10}{r['ms_p95']:>10}{r['peak_mib']:>10}"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+        print(f"\n→ resultados guardados en {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
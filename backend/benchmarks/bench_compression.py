@@ -0,0 +1,195 @@
+# benchmarks/bench_compression.py
+"""
+Benchmark de compresión de respuestas: bytes en el cable y costo de CPU
+para payloads representativos de la API.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_compression
+    python -m benchmarks.bench_compression --repeat 50 --json out.json
+    python -m benchmarks.bench_compression --all-levels   # + gzip-9 / br-11
+
+No necesita BD ni .env: genera los payloads en memoria con la misma forma
+que devuelven los endpoints (AppointmentOut, UserOut, ClinicalHistoryOut).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.compression import _BrotliCompressor, _GzipCompressor, brotli
+
+LOREM = (
+    "La paciente refiere ansiedad anticipatoria en contextos laborales, "
+    "dificultad para conciliar el sueño y episodios de rumiación nocturna. "
+    "Se acuerda registro diario de pensamientos automáticos y técnicas de "
+    "respiración diafragmática. Antecedentes familiares de depresión. "
+)
+
+
+# =========================
+# Payloads representativos
+# =========================
+
+def _appointments(n: int = 500) -> list[dict]:
+    rnd = random.Random(1)
+    base = datetime(2025, 11, 3, 14, 0, tzinfo=timezone.utc)
+    out = []
+    for i in range(n):
+        s = base + timedelta(hours=i)
+        out.append({
+            "id": 10_000 + i,
+            "doctor_id": 1,
+            "patient_id": rnd.randint(2, 300),
+            "start_at": s.isoformat(),
+            "end_at": (s + timedelta(minutes=50)).isoformat(),
+            "status": rnd.choice(["pending", "confirmed"]),
+            "method": "payphone",
+            "hold_until": None,
+            "zoom_meeting_id": str(80_000_000_000 + rnd.randint(0, 10**9)),
+            "zoom_join_url": f"https://us05web.zoom.us/j/{rnd.randint(10**10, 10**11)}?pwd=abc{i}",
+            "client_tx_id": None,
+            "created_at": (s - timedelta(days=3)).isoformat(),
+        })
+    return out
+
+
+def _users(n: int = 1000) -> list[dict]:
+    rnd = random.Random(2)
+    regions = ["south_america", "north_america", "europe", None]
+    return [
+        {
+            "id": i,
+            "name": f"Paciente {i} Apellido{rnd.randint(1, 999)}",
+            "email": f"paciente{i}@correo.com",
+            "role": "patient",
+            "doctor_id": 1,
+            "region": rnd.choice(regions),
+            "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc).isoformat(),
+        }
+        for i in range(n)
+    ]
+
+
+def _clinical_histories(n: int = 100, text_len: int = 4000) -> list[dict]:
+    rnd = random.Random(3)
+
+    def txt() -> str:
+        words = (LOREM * (text_len // len(LOREM) + 1)).split()
+        rnd.shuffle(words)
+        return " ".join(words)[:text_len]
+
+    fields = [
+        "antecedentes_personales", "antecedentes_familiares", "medicacion_actual",
+        "alergias", "diagnosticos_previos", "consumo", "antecedentes_psico",
+        "notas", "factores_protectores",
+    ]
+    return [
+        {
+            "id": i,
+            "patient_id": rnd.randint(2, 300),
+            **{f: txt() for f in fields},
+            "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc).isoformat(),
+            "updated_at": datetime(2025, 6, 1, tzinfo=timezone.utc).isoformat(),
+        }
+        for i in range(n)
+    ]
+
+
+def _slots(n: int = 300) -> list[dict]:
+    base = datetime(2025, 11, 3, 14, 0, tzinfo=timezone.utc)
+    return [
+        {
+            "doctor_id": 1,
+            "start_at": (base + timedelta(minutes=50 * i)).isoformat(),
+            "end_at": (base + timedelta(minutes=50 * (i + 1))).isoformat(),
+        }
+        for i in range(n)
+    ]
+
+
+PAYLOADS = {
+    "appointments_500": _appointments,
+    "users_1000": _users,
+    "clinical_histories_100": _clinical_histories,
+    "slots_300": _slots,
+}
+
+
+# =========================
+# Medición
+# =========================
+
+def _codecs(all_levels: bool) -> dict:
+    codecs = {
+        "gzip-1": lambda: _GzipCompressor(1),
+        "gzip-6": lambda: _GzipCompressor(6),
+    }
+    if all_levels:
+        codecs["gzip-9"] = lambda: _GzipCompressor(9)
+    if brotli is not None:
+        codecs["br-4"] = lambda: _BrotliCompressor(4)
+        codecs["br-5"] = lambda: _BrotliCompressor(5)
+        if all_levels:
+            # br-11 es de 100 a 200 veces más lento: solo sirve como referencia
+            codecs["br-11"] = lambda: _BrotliCompressor(11)
+    return codecs
+
+
+def bench(repeat: int, all_levels: bool = False) -> list[dict]:
+    results = []
+    for name, factory in PAYLOADS.items():
+        raw = json.dumps(factory(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for codec, new in _codecs(all_levels).items():
+            timings = []
+            size = 0
+            for _ in range(repeat):
+                c = new()
+                t0 = time.perf_counter()
+                data = c.compress(raw) + c.finish()
+                timings.append(time.perf_counter() - t0)
+                size = len(data)
+            results.append({
+                "payload": name,
+                "codec": codec,
+                "raw_bytes": len(raw),
+                "wire_bytes": size,
+                "ratio": round(len(raw) / size, 2),
+                "cpu_ms_median": round(statistics.median(timings) * 1000, 3),
+                "cpu_ms_p95": round(sorted(timings)[int(0.95 * (len(timings) - 1))] * 1000, 3),
+                "mb_per_s": round(len(raw) / statistics.median(timings) / 1e6, 1),
+            })
+    return results
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--all-levels", action="store_true", help="incluye gzip-9 y br-11 (lentos)")
+    ap.add_argument("--json", dest="json_out", default=None, help="guardar resultados en JSON")
+    args = ap.parse_args()
+
+    if brotli is None:
+        print("⚠️  paquete `brotli` no instalado: solo se mide gzip")
+
+    results = bench(args.repeat, args.all_levels)
+    header = f"{'payload':<24}{'codec':<8}{'raw':>10}{'wire':>10}{'ratio':>8}{'ms p50':>9}{'ms p95':>9}{'MB/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['payload']:<24}{r['codec']:<8}{r['raw_bytes']:>10}{r['wire_bytes']:>10}"
+            f"{r['ratio']:>8}{r['cpu_ms_median']:>9}{r['cpu_ms_p95']:>9}{r['mb_per_s']:>8}"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+        print(f"\n→ resultados guardados en {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# benchmarks/loadtest/__main__.py
+"""
+Prueba de carga del flujo de reserva (asyncio + httpx).
+
+Uso (desde backend/):
+    # 1) API ya levantada (apúntala a los stubs con las variables que imprime --print-env)
+    python -m benchmarks.loadtest --api http://127.0.0.1:8000 --users 50 --duration 60
+
+    # 2) Todo en uno: levanta stubs + uvicorn con la BD de DATABASE_URL
+    #    (Postgres local migrado con `alembic upgrade head`; usar una BD desechable)
+    python -m benchmarks.loadtest --spawn --workers 2 --users 80 --duration 120
+
+Reporta throughput, percentiles de latencia por operación, tasa de 409 en
+holds, carreras con más de un ganador y dobles reservas (solapes) al final.
+Sale con código 1 si detecta alguna doble reserva.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .scenarios import run_load, setup_world
+from .stubs import PayphoneStub, StubServer, api_env, zoom_app
+
+
+def _parse_mix(raw: str) -> dict:
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight or 1)
+    unknown = set(mix) - {"browse", "book", "race"}
+    if unknown:
+        raise SystemExit(f"escenarios desconocidos en --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def _print_report(summary: dict) -> None:
+    print()
+    print(f"duración {summary['duration_s']}s · {summary['requests']} requests · "
+          f"{summary['throughput_rps']} req/s")
+    header = f"{'operación':<18}{'n':>7}{'req/s':>8}{'ok%':>7}{'409%':>7}{'err':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}"
+    print(header)
+    print("-" * len(header))
+    for op, r in summary["ops"].items():
+        print(f"{op:<18}{r['count']:>7}{r['rps']:>8}{r['ok_pct']:>7}{r['conflict_pct']:>7}{r['errors']:>6}"
+              f"{r['p50_ms']:>9}{r['p90_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+    print()
+    print(f"carreras: {summary['races']} · con más de un ganador: {summary['race_multi_winners']}")
+    if summary["double_bookings"]:
+        print(f"❌ dobles reservas: {summary['double_bookings']}")
+        for d in summary["double_booking_samples"]:
+            print(f"   doctora {d['doctor_id']}: citas {d['appointment_ids']} @ {d['start_at']}")
+    else:
+        print("✅ sin dobles reservas")
+
+
+def _spawn_api(port: int, workers: int, env_extra: dict) -> subprocess.Popen:
+    env = {**os.environ, **env_extra}
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+           "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(cmd, env=env)
+
+
+async def _wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as c:
+        while time.monotonic() < deadline:
+            try:
+                if (await c.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.3)
+    raise SystemExit(f"la API no respondió en {base_url}")
+
+
+async def main_async(args) -> int:
+    zoom = StubServer(zoom_app(args.stub_latency_ms), args.zoom_port)
+    payphone = PayphoneStub(args.stub_latency_ms)
+    payphone_srv = StubServer(payphone.app, args.payphone_port)
+    await zoom.start()
+    await payphone_srv.start()
+    env = api_env(zoom.url, payphone_srv.url)
+
+    proc = None
+    base_url = args.api
+    try:
+        if args.spawn:
+            proc = _spawn_api(args.api_port, args.workers, env)
+            base_url = f"http://127.0.0.1:{args.api_port}"
+        else:
+            print("La API debe usar los stubs:")
+            for k, v in env.items():
+                print(f"  {k}={v}")
+        await _wait_ready(base_url)
+
+        limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30.0, limits=limits) as client:
+            print(f"→ sembrando {args.doctors} doctoras y {args.patients} pacientes…")
+            world = await setup_world(client, doctors=args.doctors, patients=args.patients,
+                                      duration_min=args.duration_min)
+            print(f"→ {args.users} usuarios virtuales durante {args.duration}s (mix {args.mix})")
+            stats = await run_load(
+                client, world, payphone,
+                users=args.users, duration_s=args.duration, mix=_parse_mix(args.mix),
+                race_size=args.race_size, reschedule_pct=args.reschedule_pct, seed=args.seed,
+            )
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+        await payphone_srv.stop()
+        await zoom.stop()
+
+    summary = stats.summary()
+    _print_report(summary)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, indent=2)
+        print(f"\n→ resultados guardados en {args.json_out}")
+    return 1 if summary["double_bookings"] else 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = ap.add_mutually_exclusive_group(required=True)
+    target.add_argument("--api", help="URL base de una API ya levantada")
+    target.add_argument("--spawn", action="store_true", help="levanta uvicorn apuntando a los stubs")
+    ap.add_argument("--api-port", type=int, default=18000)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--zoom-port", type=int, default=18081)
+    ap.add_argument("--payphone-port", type=int, default=18082)
+    ap.add_argument("--stub-latency-ms", type=float, default=80.0, help="latencia simulada de Zoom/PayPhone")
+    ap.add_argument("--users", type=int, default=30, help="usuarios virtuales concurrentes")
+    ap.add_argument("--duration", type=float, default=30.0, help="segundos de carga")
+    ap.add_argument("--doctors", type=int, default=2)
+    ap.add_argument("--patients", type=int, default=40)
+    ap.add_argument("--duration-min", type=int, default=50, help="duración de la consulta")
+    ap.add_argument("--mix", default="browse=6,book=3,race=1", help="pesos de escenarios")
+    ap.add_argument("--race-size", type=int, default=5, help="pacientes peleando el mismo slot")
+    ap.add_argument("--reschedule-pct", type=float, default=0.3)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", dest="json_out", default=None, help="guardar resultados en JSON")
+    args = ap.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+# benchmarks/loadtest/scenarios.py
+"""
+Escenarios de reserva y métricas del harness de carga.
+
+Cada usuario virtual (VU) repite, hasta que se acaba el tiempo, uno de:
+  - browse:  GET /availability/slots de una doctora (7 días)
+  - book:    slots -> hold -> /payments/payphone/confirm (stub) -> a veces reagenda
+  - race:    N pacientes piden el MISMO slot a la vez; debe ganar uno solo
+Al final se listan las citas y se buscan solapes (doble reserva).
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from .stubs import PayphoneStub
+
+PASSWORD = "loadtest-pass"
+ACTIVE_STATUSES = {"pending", "confirmed"}
+WEEKDAY_RANGES = [{"start": "08:00", "end": "13:00"}, {"start": "14:00", "end": "20:00"}]
+
+
+# =========================
+# Métricas
+# =========================
+
+@dataclass
+class Stats:
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+    statuses: Dict[str, Counter] = field(default_factory=lambda: defaultdict(Counter))
+    races: int = 0
+    race_multi_winners: int = 0
+    started: float = 0.0
+    finished: float = 0.0
+    double_bookings: List[dict] = field(default_factory=list)
+
+    def record(self, op: str, status: int, seconds: float) -> None:
+        self.latencies[op].append(seconds)
+        self.statuses[op][status] += 1
+
+    def summary(self) -> dict:
+        elapsed = max(1e-9, self.finished - self.started)
+        total = sum(len(v) for v in self.latencies.values())
+        ops = {}
+        for op, lat in sorted(self.latencies.items()):
+            st = self.statuses[op]
+            n = len(lat)
+            ordered = sorted(lat)
+            ops[op] = {
+                "count": n,
+                "rps": round(n / elapsed, 2),
+                "ok_pct": round(100 * sum(c for s, c in st.items() if 200 <= s < 400) / n, 1),
+                "conflict_pct": round(100 * st.get(409, 0) / n, 1),
+                "errors": sum(c for s, c in st.items() if s >= 400 and s != 409),
+                "p50_ms": round(statistics.median(ordered) * 1000, 1),
+                "p90_ms": round(_pct(ordered, 0.90) * 1000, 1),
+                "p99_ms": round(_pct(ordered, 0.99) * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+                "statuses": dict(st),
+            }
+        return {
+            "duration_s": round(elapsed, 1),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2),
+            "races": self.races,
+            "race_multi_winners": self.race_multi_winners,
+            "double_bookings": len(self.double_bookings),
+            "double_booking_samples": self.double_bookings[:10],
+            "ops": ops,
+        }
+
+
+def _pct(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# =========================
+# Cliente instrumentado
+# =========================
+
+class Api:
+    def __init__(self, client: httpx.AsyncClient, stats: Stats):
+        self.client = client
+        self.stats = stats
+
+    async def call(self, op: str, method: str, url: str, *, token: Optional[str] = None, **kw) -> httpx.Response:
+        headers = kw.pop("headers", {}) or {}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        t0 = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, headers=headers, **kw)
+        except httpx.HTTPError:
+            self.stats.record(op, 599, time.perf_counter() - t0)
+            raise
+        self.stats.record(op, resp.status_code, time.perf_counter() - t0)
+        return resp
+
+
+# =========================
+# Datos de prueba (vía HTTP, sin tocar la BD)
+# =========================
+
+@dataclass
+class Actor:
+    id: int
+    token: str
+    doctor_id: Optional[int] = None
+
+
+@dataclass
+class World:
+    doctors: List[Actor]
+    patients: List[Actor]
+
+
+async def _register_and_login(client: httpx.AsyncClient, **payload) -> Actor:
+    r = await client.post("/auth/register", json={**payload, "password": PASSWORD})
+    r.raise_for_status()
+    uid = r.json()["id"]
+    r = await client.post("/auth/login", json={"email": payload["email"], "password": PASSWORD})
+    r.raise_for_status()
+    return Actor(id=uid, token=r.json()["access_token"], doctor_id=payload.get("doctor_id"))
+
+
+async def setup_world(client: httpx.AsyncClient, *, doctors: int, patients: int, duration_min: int) -> World:
+    tag = f"{int(time.time())}{random.randint(100, 999)}"
+    docs = []
+    for i in range(doctors):
+        doc = await _register_and_login(
+            client, email=f"load-doc{i}-{tag}@carga.citaspsico.dev", name=f"Doctora carga {i}", role="doctor",
+        )
+        auth = {"Authorization": f"Bearer {doc.token}"}
+        rules = [
+            {"doctor_id": doc.id, "weekday": wd, "enabled": 1 <= wd <= 6,
+             "ranges": WEEKDAY_RANGES if 1 <= wd <= 6 else []}
+            for wd in range(7)
+        ]
+        (await client.put("/availability/weekly/bulk", json={"doctor_id": doc.id, "rules": rules}, headers=auth)).raise_for_status()
+        (await client.put("/settings/consultation", json={
+            "doctor_id": doc.id, "duration_min": duration_min, "price_usd": 35,
+        }, headers=auth)).raise_for_status()
+        docs.append(doc)
+
+    # bcrypt es lento: registramos en paralelo pero acotado
+    sem = asyncio.Semaphore(8)
+
+    async def one(j: int) -> Actor:
+        async with sem:
+            return await _register_and_login(
+                client, email=f"load-pat{j}-{tag}@carga.citaspsico.dev", name=f"Paciente carga {j}",
+                role="patient", doctor_id=docs[j % len(docs)].id,
+            )
+
+    pats = await asyncio.gather(*(one(j) for j in range(patients)))
+    return World(doctors=docs, patients=list(pats))
+
+
+# =========================
+# Escenarios
+# =========================
+
+def _window(days_from: int, days: int) -> dict:
+    start = (datetime.now(timezone.utc) + timedelta(days=days_from)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return {"date_from": start.isoformat(), "date_to": (start + timedelta(days=days)).isoformat()}
+
+
+async def _slots_for(api: Api, doctor_id: int, rnd: random.Random, max_offset: int = 10) -> List[dict]:
+    r = await api.call("slots", "GET", "/availability/slots",
+                       params={"doctor_id": doctor_id, **_window(rnd.randint(1, max_offset), 7)})
+    return r.json() if r.status_code == 200 else []
+
+
+async def browse(api: Api, world: World, rnd: random.Random) -> None:
+    await _slots_for(api, rnd.choice(world.doctors).id, rnd, max_offset=14)
+
+
+async def _hold(api: Api, op: str, patient: Actor, slot: dict) -> httpx.Response:
+    return await api.call(op, "POST", "/appointments/hold", token=patient.token, json={
+        "doctor_id": patient.doctor_id,
+        "hold_minutes": 10,
+        "slots": [{"start_at": slot["start_at"], "end_at": slot["end_at"]}],
+    })
+
+
+async def book(api: Api, world: World, rnd: random.Random, payphone: PayphoneStub, reschedule_pct: float) -> None:
+    patient = rnd.choice(world.patients)
+    slots = await _slots_for(api, patient.doctor_id, rnd)
+    if not slots:
+        return
+    # Los pacientes tienden a elegir los primeros horarios: más contención
+    slot = rnd.choice(slots[:20])
+    r = await _hold(api, "hold", patient, slot)
+    if r.status_code != 201:
+        return
+    appt_ids = [a["id"] for a in r.json()["appointments"]]
+
+    tx_id = payphone.register(appt_ids)
+    r = await api.call("payphone_confirm", "POST", "/payments/payphone/confirm", token=patient.token,
+                       json={"id": tx_id, "clientTxId": f"load-{tx_id}"})
+    if r.status_code != 200 or not r.json().get("confirmed_appointment_ids"):
+        return
+
+    if rnd.random() < reschedule_pct:
+        others = [s for s in await _slots_for(api, patient.doctor_id, rnd) if s["start_at"] != slot["start_at"]]
+        if others:
+            target = rnd.choice(others[:20])
+            await api.call("reschedule", "POST", f"/appointments/{appt_ids[0]}/reschedule", token=patient.token,
+                           json={"start_at": target["start_at"], "end_at": target["end_at"]})
+
+
+async def race(api: Api, world: World, rnd: random.Random, stats: Stats, size: int) -> None:
+    doc = rnd.choice(world.doctors)
+    contenders = [p for p in world.patients if p.doctor_id == doc.id]
+    if len(contenders) < 2:
+        return
+    slots = await _slots_for(api, doc.id, rnd)
+    if not slots:
+        return
+    slot = slots[0]
+    group = rnd.sample(contenders, min(size, len(contenders)))
+    results = await asyncio.gather(*(_hold(api, "hold_race", p, slot) for p in group), return_exceptions=True)
+    winners = sum(1 for r in results if isinstance(r, httpx.Response) and r.status_code == 201)
+    stats.races += 1
+    if winners > 1:
+        stats.race_multi_winners += 1
+
+
+# =========================
+# Verificación final
+# =========================
+
+async def find_double_bookings(client: httpx.AsyncClient, world: World) -> List[dict]:
+    """Solapes entre citas pending/confirmed de una misma doctora."""
+    out: List[dict] = []
+    for doc in world.doctors:
+        appts: List[dict] = []
+        skip = 0
+        while True:
+            r = await client.get("/appointments", params={"doctor_id": doc.id, "skip": skip, "limit": 500},
+                                 headers={"Authorization": f"Bearer {doc.token}"})
+            r.raise_for_status()
+            page = r.json()
+            appts.extend(page)
+            if len(page) < 500:
+                break
+            skip += 500
+
+        active = sorted(
+            (_parse(a["start_at"]), _parse(a["end_at"]), a["id"])
+            for a in appts if a["status"] in ACTIVE_STATUSES
+        )
+        prev = None  # (start, end, id) con el fin más tardío visto hasta ahora
+        for cur in active:
+            if prev is not None and cur[0] < prev[1]:
+                out.append({"doctor_id": doc.id, "appointment_ids": [prev[2], cur[2]],
+                            "start_at": cur[0].isoformat()})
+            if prev is None or cur[1] > prev[1]:
+                prev = cur
+    return out
+
+
+def _parse(iso: str) -> datetime:
+    dt = datetime.fromisoformat(iso.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+# =========================
+# Orquestación
+# =========================
+
+async def run_load(
+    client: httpx.AsyncClient,
+    world: World,
+    payphone: PayphoneStub,
+    *,
+    users: int,
+    duration_s: float,
+    mix: Dict[str, int],
+    race_size: int,
+    reschedule_pct: float,
+    seed: int,
+) -> Stats:
+    stats = Stats()
+    api = Api(client, stats)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    deadline = time.perf_counter() + duration_s
+
+    async def vu(i: int) -> None:
+        rnd = random.Random(seed + i)
+        while time.perf_counter() < deadline:
+            kind = rnd.choices(names, weights)[0]
+            try:
+                if kind == "browse":
+                    await browse(api, world, rnd)
+                elif kind == "book":
+                    await book(api, world, rnd, payphone, reschedule_pct)
+                elif kind == "race":
+                    await race(api, world, rnd, stats, race_size)
+            except httpx.HTTPError:
+                await asyncio.sleep(0.05)  # ya quedó registrado como 599
+
+    stats.started = time.perf_counter()
+    await asyncio.gather(*(vu(i) for i in range(users)))
+    stats.finished = time.perf_counter()
+
+    stats.double_bookings = await find_double_bookings(client, world)
+    return stats
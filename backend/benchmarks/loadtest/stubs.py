@@ -0,0 +1,130 @@
+# benchmarks/loadtest/stubs.py
+"""
+Servidores falsos de Zoom y PayPhone para correr la carga en una laptop.
+
+La API se apunta a ellos con:
+    ZOOM_OAUTH_URL=http://127.0.0.1:<zoom>/oauth/token
+    ZOOM_API_BASE=http://127.0.0.1:<zoom>/v2
+    PAYPHONE_CONFIRM_URL=http://127.0.0.1:<payphone>/api/button/V2/Confirm
+
+El harness registra cada transacción (id -> citas) antes de llamar a
+/payments/payphone/confirm, así el Confirm falso devuelve el
+optionalParameter3 correcto.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+
+
+def zoom_app(latency_ms: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    ids = itertools.count(80_000_000_000)
+
+    async def _lag():
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+    @app.post("/oauth/token")
+    async def token():
+        await _lag()
+        return {"access_token": "stub-token", "token_type": "bearer", "expires_in": 3600}
+
+    @app.post("/v2/users/{user_id}/meetings", status_code=201)
+    async def create_meeting(user_id: str, request: Request):
+        await _lag()
+        body = await request.json()
+        mid = next(ids)
+        return {
+            "id": mid,
+            "topic": body.get("topic"),
+            "start_time": body.get("start_time"),
+            "duration": body.get("duration"),
+            "join_url": f"https://zoom.stub/j/{mid}",
+        }
+
+    @app.patch("/v2/meetings/{meeting_id}", status_code=204)
+    async def update_meeting(meeting_id: str):
+        await _lag()
+        return Response(status_code=204)
+
+    @app.get("/v2/meetings/{meeting_id}")
+    async def get_meeting(meeting_id: str):
+        await _lag()
+        return {"id": meeting_id, "join_url": f"https://zoom.stub/j/{meeting_id}"}
+
+    return app
+
+
+class PayphoneStub:
+    """Confirm falso: Approved para las transacciones registradas."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.transactions: Dict[int, dict] = {}
+        self._ids = itertools.count(1_000_000)
+        self.app = self._build()
+
+    def register(self, appt_ids: List[int], amount_cents: int = 3500) -> int:
+        tx_id = next(self._ids)
+        self.transactions[tx_id] = {
+            "transactionStatus": "Approved",
+            "statusCode": 3,
+            "transactionId": tx_id,
+            "clientTransactionId": f"load-{tx_id}",
+            "amount": amount_cents,
+            "optionalParameter3": "appts=" + ",".join(str(i) for i in appt_ids),
+        }
+        return tx_id
+
+    def _build(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/api/button/V2/Confirm")
+        async def confirm(request: Request):
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000)
+            body = await request.json()
+            tx = self.transactions.get(int(body.get("id", 0)))
+            if not tx:
+                raise HTTPException(404, detail="transacción desconocida")
+            return tx
+
+        return app
+
+
+class StubServer:
+    """uvicorn en el mismo event loop del harness (sin procesos extra)."""
+
+    def __init__(self, app: FastAPI, port: int):
+        self.port = port
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            await asyncio.sleep(0.02)
+
+    async def stop(self) -> None:
+        self._server.should_exit = True
+        if self._task:
+            await self._task
+
+
+def api_env(zoom_url: str, payphone_url: str) -> Dict[str, str]:
+    """Variables de entorno para que la API use los stubs."""
+    return {
+        "ZOOM_OAUTH_URL": f"{zoom_url}/oauth/token",
+        "ZOOM_API_BASE": f"{zoom_url}/v2",
+        "PAYPHONE_CONFIRM_URL": f"{payphone_url}/api/button/V2/Confirm",
+        "PAYPHONE_PRIVATE_TOKEN": "stub-token",
+    }
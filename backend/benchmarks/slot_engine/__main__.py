@@ -0,0 +1,134 @@
+# benchmarks/slot_engine/__main__.py
+"""
+Micro-benchmarks del motor de slots y de las conversiones de zona horaria.
+
+Uso (desde backend/):
+    python -m benchmarks.slot_engine                       # barrido por ejes
+    python -m benchmarks.slot_engine --full                # producto cartesiano (lento)
+    python -m benchmarks.slot_engine --json before.json
+    python -m benchmarks.slot_engine --json after.json --compare before.json
+    python -m benchmarks.slot_engine --stage engine --stage engine_numpy   # Python vs NumPy
+
+Varía largo de ventana, duración del slot, rangos por día, ocupación por
+citas y cantidad de bloqueos. Cada medición usa timeit con autorange y
+reporta mediana/mínimo de `--repeat` muestras. El JSON incluye el commit
+para comparar entre versiones del motor.
+
+No necesita BD ni .env.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timezone
+
+from .cases import build_fixture, full_cases, stages, sweep_cases, tz_micro
+
+
+def _measure(fn, repeat: int) -> dict:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "loops": number,
+    }
+
+
+def _git_rev() -> str:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+def _fmt(seconds: float) -> str:
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:.0f} ns"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} µs"
+    return f"{seconds * 1e3:.2f} ms"
+
+
+def run(args) -> dict:
+    results = []
+
+    for name, fn in tz_micro().items():
+        m = _measure(fn, args.repeat)
+        results.append({"case": "tz", "stage": name, "params": {}, "slots": None, **m})
+        print(f"{'tz':<40}{name:<26}{_fmt(m['median_s']):>12}")
+
+    cases = full_cases() if args.full else sweep_cases()
+    for case in cases:
+        fx = build_fixture(case)
+        for stage, fn in stages(fx).items():
+            if args.stage and stage not in args.stage:
+                continue
+            m = _measure(fn, args.repeat)
+            results.append({
+                "case": case.name, "stage": stage, "params": case.params(),
+                "slots": len(fx.slots_local), "busy": len(fx.busy_utc_rows), **m,
+            })
+            per_slot = m["median_s"] / max(1, len(fx.slots_local))
+            print(f"{case.name:<40}{stage:<26}{_fmt(m['median_s']):>12}"
+                  f"   {len(fx.slots_local):>5} slots  {_fmt(per_slot):>10}/slot")
+
+    return {
+        "meta": {
+            "git": _git_rev(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "repeat": args.repeat,
+            "full": bool(args.full),
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as fh:
+        base = json.load(fh)
+    old = {(r["case"], r["stage"]): r for r in base["results"]}
+    print(f"\nComparación vs {baseline_path} ({base['meta'].get('git')} → {current['meta']['git']})")
+    header = f"{'caso':<40}{'etapa':<26}{'antes':>12}{'ahora':>12}{'Δ':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in current["results"]:
+        prev = old.get((r["case"], r["stage"]))
+        if not prev:
+            continue
+        delta = (r["median_s"] - prev["median_s"]) / prev["median_s"] * 100
+        print(f"{r['case']:<40}{r['stage']:<26}{_fmt(prev['median_s']):>12}{_fmt(r['median_s']):>12}{delta:>+8.1f}%")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=5, help="muestras por medición")
+    ap.add_argument("--full", action="store_true", help="producto cartesiano de todos los ejes")
+    ap.add_argument("--stage", action="append", choices=["busy_convert", "engine", "engine_numpy", "serialize", "pipeline"],
+                    help="medir solo estas etapas (repetible)")
+    ap.add_argument("--json", dest="json_out", default=None, help="guardar resultados en JSON")
+    ap.add_argument("--compare", default=None, help="JSON de una corrida anterior")
+    args = ap.parse_args()
+
+    out = run(args)
+    if args.compare:
+        compare(out, args.compare)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(out, fh, indent=2)
+        print(f"\n→ resultados guardados en {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
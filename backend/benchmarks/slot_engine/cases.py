@@ -0,0 +1,188 @@
+# benchmarks/slot_engine/cases.py
+"""
+Datos sintéticos y funciones medidas del motor de slots (sin BD).
+
+Las etapas replican /availability/slots:
+  busy_convert  filas UTC de BD -> LOCAL naive (db_intervals_to_local_naive, en lote)
+  engine        iter_free_slots (reglas + BusyIndex), consumido completo
+  engine_numpy  el mismo cálculo con slot_engine_numpy (solo si numpy está instalado)
+  serialize     LOCAL naive -> UTC aware en lote + AvailableSlotOut por slot
+  pipeline      las tres juntas (lo que cuesta el endpoint sin la BD)
+"""
+from __future__ import annotations
+
+import random
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Tuple
+
+from app import schemas
+from app import slot_engine_numpy
+from app.slot_engine import iter_free_slots, ranges_by_weekday
+from app.utils.tz import (
+    aware_to_local_naive, db_aware_utc, db_intervals_to_local_naive,
+    local_naive_to_aware_utc, local_naive_to_aware_utc_many,
+)
+
+# Lunes fijo para que los resultados no dependan del día en que se corre
+BASE_UTC = datetime(2025, 11, 3, 5, 0, tzinfo=timezone.utc)  # 00:00 en GYE
+
+RANGE_SETS = {
+    1: [("08:00", "18:00")],
+    2: [("08:00", "12:00"), ("14:00", "18:00")],
+    4: [("07:00", "09:00"), ("10:00", "12:00"), ("14:00", "16:00"), ("17:00", "21:00")],
+}
+
+
+@dataclass(frozen=True)
+class Case:
+    window_days: int = 31
+    duration_min: int = 50
+    ranges: int = 2
+    busy_fill: float = 0.4     # fracción de slots de la grilla ocupados por citas
+    blocks: int = 8            # bloqueos de 3 h repartidos en la ventana
+
+    @property
+    def name(self) -> str:
+        return (f"w{self.window_days}d-dur{self.duration_min}-r{self.ranges}"
+                f"-fill{int(self.busy_fill * 100)}-b{self.blocks}")
+
+    def params(self) -> dict:
+        return asdict(self)
+
+
+BASELINE = Case()
+
+# Barrido de un eje a la vez alrededor de BASELINE (modo por defecto)
+AXES: Dict[str, List] = {
+    "window_days": [7, 31, 90, 365],
+    "duration_min": [30, 50, 90],
+    "ranges": [1, 2, 4],
+    "busy_fill": [0.0, 0.4, 0.8],
+    "blocks": [0, 8, 64],
+}
+
+
+def sweep_cases() -> List[Case]:
+    seen, out = set(), []
+    for axis, values in AXES.items():
+        for v in values:
+            c = Case(**{**BASELINE.params(), axis: v})
+            if c not in seen:
+                seen.add(c)
+                out.append(c)
+    return out
+
+
+def full_cases() -> List[Case]:
+    out = []
+    for w in AXES["window_days"]:
+        for d in AXES["duration_min"]:
+            for r in AXES["ranges"]:
+                for f in AXES["busy_fill"]:
+                    for b in AXES["blocks"]:
+                        out.append(Case(w, d, r, f, b))
+    return out
+
+
+# =========================
+# Datos sintéticos
+# =========================
+
+@dataclass
+class Fixture:
+    ranges_by_wd: dict
+    busy_utc_rows: List[Tuple[datetime, datetime]]   # como vienen de la BD (UTC aware)
+    busy_local: List[Tuple[datetime, datetime]]
+    slots_local: List[Tuple[datetime, datetime]]
+    df_local: datetime
+    dt_local: datetime
+    step: timedelta
+    now_local: datetime
+
+
+def build_fixture(case: Case, seed: int = 7) -> Fixture:
+    rnd = random.Random(seed)
+    ranges = [{"start": s, "end": e} for s, e in RANGE_SETS[case.ranges]]
+    rules = [
+        SimpleNamespace(weekday=wd, enabled=1 <= wd <= 5, ranges=ranges if 1 <= wd <= 5 else [])
+        for wd in range(7)
+    ]
+    ranges_by_wd = ranges_by_weekday(rules)
+    step = timedelta(minutes=case.duration_min)
+
+    df_aware = BASE_UTC
+    dt_aware = BASE_UTC + timedelta(days=case.window_days)
+    df_local = aware_to_local_naive(df_aware)
+    dt_local = aware_to_local_naive(dt_aware)
+    # "ahora" justo antes de la ventana: ningún slot se descarta por pasado
+    now_local = df_local - timedelta(minutes=1)
+
+    grid = list(iter_free_slots(
+        ranges_by_wd=ranges_by_wd, busy_local=[], df_local=df_local, dt_local=dt_local,
+        step=step, now_local=now_local,
+    ))
+    busy_utc: List[Tuple[datetime, datetime]] = [
+        (local_naive_to_aware_utc(s), local_naive_to_aware_utc(e))
+        for s, e in grid if rnd.random() < case.busy_fill
+    ]
+    for _ in range(case.blocks):
+        day = rnd.randrange(case.window_days)
+        start = df_aware + timedelta(days=day, hours=rnd.choice([13, 15, 19]))
+        busy_utc.append((start, start + timedelta(hours=3)))
+    # La BD los entrega naive en SQLite y aware en Postgres: usamos aware
+    rnd.shuffle(busy_utc)
+
+    busy_local = _busy_convert(busy_utc)
+    slots_local = list(iter_free_slots(
+        ranges_by_wd=ranges_by_wd, busy_local=busy_local, df_local=df_local, dt_local=dt_local,
+        step=step, now_local=now_local,
+    ))
+    return Fixture(ranges_by_wd, busy_utc, busy_local, slots_local, df_local, dt_local, step, now_local)
+
+
+# =========================
+# Etapas medidas
+# =========================
+
+def _busy_convert(rows):
+    return db_intervals_to_local_naive(rows)
+
+
+def _engine(fx: Fixture, busy_local, engine=iter_free_slots):
+    return list(engine(
+        ranges_by_wd=fx.ranges_by_wd, busy_local=busy_local, df_local=fx.df_local,
+        dt_local=fx.dt_local, step=fx.step, now_local=fx.now_local,
+    ))
+
+
+def _serialize(slots_local):
+    utc = local_naive_to_aware_utc_many([x for pair in slots_local for x in pair])
+    return [
+        schemas.AvailableSlotOut(doctor_id=1, start_at=utc[2 * i], end_at=utc[2 * i + 1])
+        for i in range(len(slots_local))
+    ]
+
+
+def stages(fx: Fixture) -> Dict[str, Callable[[], object]]:
+    out = {
+        "busy_convert": lambda: _busy_convert(fx.busy_utc_rows),
+        "engine": lambda: _engine(fx, fx.busy_local),
+        "serialize": lambda: _serialize(fx.slots_local),
+        "pipeline": lambda: _serialize(_engine(fx, _busy_convert(fx.busy_utc_rows))),
+    }
+    if slot_engine_numpy.available():
+        out["engine_numpy"] = lambda: _engine(fx, fx.busy_local, slot_engine_numpy.iter_free_slots)
+    return out
+
+
+def tz_micro() -> Dict[str, Callable[[], object]]:
+    """Conversiones sueltas (por llamada) de app/utils/tz.py."""
+    aware = BASE_UTC + timedelta(hours=13)
+    naive = aware_to_local_naive(aware)
+    return {
+        "aware_to_local_naive": lambda: aware_to_local_naive(aware),
+        "local_naive_to_aware_utc": lambda: local_naive_to_aware_utc(naive),
+        "db_aware_utc": lambda: db_aware_utc(aware),
+    }
@@ -0,0 +1,190 @@
+# tests/conftest.py
+"""
+Infraestructura de las pruebas de presupuesto por ruta.
+
+- BD: SQLite en memoria por defecto; con TEST_DATABASE_URL apunta a un
+  Postgres local (¡se recrean las tablas, usar una BD desechable!).
+- Zoom, PayPhone y SMTP se reemplazan por fakes: la suite corre offline.
+- Se siembra una clínica realista una sola vez por sesión (ver seed.py).
+"""
+import os
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+# La config se valida al importar `app`: variables mínimas antes de cualquier import
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("ZOOM_ACCOUNT_ID", "test")
+os.environ.setdefault("ZOOM_CLIENT_ID", "test")
+os.environ.setdefault("ZOOM_CLIENT_SECRET", "test")
+os.environ.setdefault("ZOOM_DEFAULT_USER", "test@zoom")
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite://")
+# app/db.py crea su engine al importar (con pool_size): le damos una URL de
+# archivo que nunca se usa; las sesiones se re-enlazan al engine de pruebas.
+os.environ["DATABASE_URL"] = (
+    TEST_DATABASE_URL if not TEST_DATABASE_URL.startswith("sqlite")
+    else "sqlite:///" + os.path.join(tempfile.gettempdir(), "citaspsico-tests-unused.db")
+)
+os.environ["COMPRESSION_ENABLED"] = "false"
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from app import db as app_db
+from app import models
+from app.config import settings
+from app.query_watch import query_budget
+
+from .seed import seed_clinic
+
+# Multiplica los techos de latencia (máquina lenta: LATENCY_FACTOR=3). Solo
+# informan: el tiempo de pared depende del runner, las sentencias SQL no
+LATENCY_FACTOR = float(os.getenv("LATENCY_FACTOR", "1"))
+
+
+def _make_engine():
+    url = TEST_DATABASE_URL
+    if not url.startswith("sqlite"):
+        return create_engine(url, future=True)
+
+    engine = create_engine(
+        url,
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_now(dbapi_conn, _rec):
+        # server_default=func.now() en los modelos
+        dbapi_conn.create_function(
+            "now", 0, lambda: datetime.now(timezone.utc).isoformat(sep=" ")
+        )
+
+    return engine
+
+
+@pytest.fixture(scope="session")
+def engine():
+    engine = _make_engine()
+    app_db.SessionLocal.configure(bind=engine)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def clinic(engine):
+    db = app_db.SessionLocal()
+    try:
+        return seed_clinic(db)
+    finally:
+        db.close()
+
+
+# =========================
+# Fakes de servicios externos
+# =========================
+
+class FakeZoom:
+    def __init__(self):
+        self.created = []
+        self._next_id = 90_000_000_000
+
+    async def create_meeting(self, **kw):
+        self._next_id += 1
+        self.created.append(kw)
+        return {"id": self._next_id, "join_url": f"https://zoom.test/j/{self._next_id}"}
+
+    async def update_meeting(self, **kw):
+        return None
+
+
+class FakePayphone:
+    """Respuestas de Confirm por transactionId (por defecto: Approved)."""
+
+    def __init__(self):
+        self.responses = {}
+
+    def approve(self, transaction_id: int, appt_ids, amount_cents: int = 3500):
+        self.responses[transaction_id] = {
+            "transactionStatus": "Approved",
+            "statusCode": 3,
+            "transactionId": transaction_id,
+            "clientTransactionId": f"ctx-{transaction_id}",
+            "amount": amount_cents,
+            "optionalParameter3": "appts=" + ",".join(str(i) for i in appt_ids),
+        }
+
+    def __call__(self, *, transaction_id: int, client_tx_id: str):
+        return self.responses[transaction_id]
+
+
+@pytest.fixture(scope="session")
+def fakes():
+    mp = pytest.MonkeyPatch()
+    from app.zoom_client import zoom
+    from app.routers import payments
+    from app import payphone_processing
+    from app.mailer import notifications
+
+    sent = []
+
+    async def fake_send_email(**kw):
+        sent.append(kw)
+
+    zoom_fake = FakeZoom()
+    payphone_fake = FakePayphone()
+    mp.setattr(zoom, "create_meeting", zoom_fake.create_meeting)
+    mp.setattr(zoom, "update_meeting", zoom_fake.update_meeting)
+    mp.setattr(payments, "confirm_button", payphone_fake)
+    mp.setattr(payphone_processing, "confirm_button", payphone_fake)
+    mp.setattr(notifications, "send_email", fake_send_email)
+    yield {"zoom": zoom_fake, "payphone": payphone_fake, "emails": sent}
+    mp.undo()
+
+
+@pytest.fixture(scope="session")
+def client(clinic, fakes):
+    from app.main import app
+
+    # `with` ejecuta startup/shutdown (scheduler + rebuild de jobs)
+    with TestClient(app) as c:
+        yield c
+
+
+# =========================
+# Auth y presupuestos
+# =========================
+
+def auth(user_id: int) -> dict:
+    token = jwt.encode({"sub": str(user_id)}, settings.JWT_SECRET, algorithm=settings.JWT_ALG)
+    return {"Authorization": f"Bearer {token}"}
+
+
+class SlowBlockWarning(UserWarning):
+    """Un bloque de within_budget pasó su techo de latencia (informativo)."""
+
+
+@contextmanager
+def within_budget(*, max_statements: int, max_ms: Optional[float] = None, n1_threshold=None):
+    """
+    Falla si el bloque supera `max_statements` sentencias SQL o repite una
+    misma consulta `n1_threshold` veces. Si tarda más de `max_ms`
+    (× LATENCY_FACTOR) solo emite un SlowBlockWarning: no falla la prueba.
+    """
+    t0 = time.perf_counter()
+    with query_budget(max_statements, n1_threshold=n1_threshold) as qw:
+        yield qw
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if max_ms is not None and elapsed_ms > max_ms * LATENCY_FACTOR:
+        warnings.warn(
+            f"{elapsed_ms:.1f} ms (techo {max_ms * LATENCY_FACTOR:.0f} ms)", SlowBlockWarning, stacklevel=3,
+        )
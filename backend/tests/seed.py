@@ -0,0 +1,146 @@
+# tests/seed.py
+"""
+Clínica sembrada para las pruebas: 3 doctoras, 40 pacientes cada una,
+reglas L-V 08:00-12:00 y 14:00-18:00 (hora GYE), ~6 meses de citas
+(3 hacia atrás y 3 hacia adelante), bloqueos semanales y recordatorios.
+Determinística (random con semilla fija) y relativa a la fecha de hoy.
+"""
+import random
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from app import models
+from app.scheduler import REMINDER_LEAD_MINUTES, get_job_id
+from app.utils.tz import local_naive_to_aware_utc
+
+DOCTORS = 3
+PATIENTS_PER_DOCTOR = 40
+DAYS_BACK = 90
+DAYS_AHEAD = 90
+DURATION_MIN = 50
+RANGES = [{"start": "08:00", "end": "12:00"}, {"start": "14:00", "end": "18:00"}]
+
+
+@dataclass
+class Clinic:
+    doctor_ids: List[int]
+    patients_by_doctor: Dict[int, List[int]]
+    appointments: int = 0
+    blocks: int = 0
+    reminder_jobs: int = 0
+
+
+def _day_slots(day: date):
+    """Slots LOCAL naive de 50 min dentro de cada rango del día."""
+    step = timedelta(minutes=DURATION_MIN)
+    for r in RANGES:
+        sh, sm = map(int, r["start"].split(":"))
+        eh, em = map(int, r["end"].split(":"))
+        cur = datetime(day.year, day.month, day.day, sh, sm)
+        end = datetime(day.year, day.month, day.day, eh, em)
+        while cur + step <= end:
+            yield cur, cur + step
+            cur += step
+
+
+def seed_clinic(db: Session) -> Clinic:
+    rnd = random.Random(20250101)
+    now_utc = datetime.now(timezone.utc)
+    today = now_utc.date()
+
+    doctors = [
+        models.User(
+            name=f"Psicóloga {i}",
+            email=f"doctora{i}@clinica.test",
+            password_hash="x",
+            role=models.UserRole.doctor,
+            region="south_america",
+        )
+        for i in range(1, DOCTORS + 1)
+    ]
+    db.add_all(doctors)
+    db.flush()
+
+    patients_by_doctor: Dict[int, List[int]] = {}
+    for doc in doctors:
+        pats = [
+            models.User(
+                name=f"Paciente {doc.id}-{j}",
+                email=f"paciente{doc.id}_{j}@correo.test",
+                password_hash="x",
+                role=models.UserRole.patient,
+                doctor_id=doc.id,
+            )
+            for j in range(PATIENTS_PER_DOCTOR)
+        ]
+        db.add_all(pats)
+        db.flush()
+        patients_by_doctor[doc.id] = [p.id for p in pats]
+
+        db.add(models.DoctorSettings(doctor_id=doc.id, duration_min=DURATION_MIN, price_usd=35))
+        for wd in range(7):  # modelo: Dom=0..Sáb=6
+            db.add(models.AvailabilityRule(
+                doctor_id=doc.id, weekday=wd, enabled=1 <= wd <= 5, ranges=RANGES if 1 <= wd <= 5 else [],
+            ))
+
+    clinic = Clinic(doctor_ids=[d.id for d in doctors], patients_by_doctor=patients_by_doctor)
+    future_confirmed: List[models.Appointment] = []
+
+    for doc in doctors:
+        pats = patients_by_doctor[doc.id]
+        for offset in range(-DAYS_BACK, DAYS_AHEAD + 1):
+            day = today + timedelta(days=offset)
+            if day.weekday() >= 5:
+                continue
+
+            # Miércoles por la tarde bloqueado (supervisión)
+            if day.weekday() == 2:
+                db.add(models.CalendarBlock(
+                    doctor_id=doc.id,
+                    start_at=local_naive_to_aware_utc(datetime(day.year, day.month, day.day, 14)),
+                    end_at=local_naive_to_aware_utc(datetime(day.year, day.month, day.day, 18)),
+                    reason="Supervisión",
+                    created_by=doc.id,
+                ))
+                clinic.blocks += 1
+
+            # Los primeros días hacia adelante se dejan con huecos para holds
+            fill = 0.6 if offset < 0 else (0.2 if offset <= 14 else 0.45)
+            for s_local, e_local in _day_slots(day):
+                if day.weekday() == 2 and s_local.hour >= 14:
+                    continue
+                if rnd.random() >= fill:
+                    continue
+                s_utc = local_naive_to_aware_utc(s_local)
+                if offset >= 0 and s_utc <= now_utc + timedelta(hours=2):
+                    continue
+                appt = models.Appointment(
+                    doctor_id=doc.id,
+                    patient_id=rnd.choice(pats),
+                    start_at=s_utc,
+                    end_at=local_naive_to_aware_utc(e_local),
+                    status=models.AppointmentStatus.confirmed,
+                    method=models.PaymentMethod.payphone,
+                    zoom_meeting_id=str(rnd.randint(10**10, 10**11)),
+                    zoom_join_url="https://zoom.test/j/seed",
+                )
+                db.add(appt)
+                clinic.appointments += 1
+                if offset >= 0:
+                    future_confirmed.append(appt)
+
+    db.flush()
+    for appt in future_confirmed:
+        db.add(models.ReminderJob(
+            id=get_job_id(appt.id),
+            appointment_id=appt.id,
+            run_at_utc=appt.start_at - timedelta(minutes=REMINDER_LEAD_MINUTES),
+            status=models.ReminderStatus.scheduled,
+        ))
+        clinic.reminder_jobs += 1
+
+    db.commit()
+    return clinic
@@ -0,0 +1,110 @@
+# tests/test_agenda_events.py
+"""
+Eventos de agenda (SSE): los deltas se publican en el broadcaster solo
+cuando la transacción hace commit; un rollback los descarta. La suscripción
+vive en el loop de la prueba y los endpoints publican desde el threadpool
+del TestClient, igual que en producción.
+"""
+import asyncio
+
+from app import db as app_db
+from app import models
+from app.events import (
+    APPT_UPDATED, RESYNC, SLOT_TAKEN, AgendaBroadcaster, broadcaster, emit_agenda_event,
+)
+
+from .test_query_budgets import _hold
+
+
+async def _drain(q: asyncio.Queue, wait: float = 0.2) -> list:
+    """Eventos que llegan a la cola hasta `wait` segundos sin novedades."""
+    got = []
+    while True:
+        try:
+            got.append(await asyncio.wait_for(q.get(), timeout=wait))
+        except asyncio.TimeoutError:
+            return got
+
+
+def test_committed_hold_publishes_slot_taken(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][10]
+
+    async def scenario():
+        q = broadcaster.subscribe(doctor_id)
+        try:
+            ids = await asyncio.to_thread(_hold, client, doctor_id, patient_id)
+            return ids, await _drain(q, wait=1.0)
+        finally:
+            broadcaster.unsubscribe(doctor_id, q)
+
+    (appt_id,), events = asyncio.run(scenario())
+    taken = [ev for ev in events if ev["type"] == SLOT_TAKEN]
+    assert [ev["appointment_id"] for ev in taken] == [appt_id]
+    ev = taken[0]
+    assert ev["doctor_id"] == doctor_id
+    assert ev["status"] == "pending"
+    assert ev["start_at"].endswith("Z") and ev["end_at"].endswith("Z")
+    assert "patient_id" not in ev
+    assert all(e["seq"] < f["seq"] for e, f in zip(events, events[1:]))
+
+
+def test_rolled_back_session_publishes_nothing(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+
+    async def scenario():
+        q = broadcaster.subscribe(doctor_id)
+        try:
+            with app_db.SessionLocal() as db:
+                emit_agenda_event(db, doctor_id, SLOT_TAKEN, appointment_id=-1)
+                db.rollback()
+                rolled_back = await _drain(q)
+
+                # La misma sesión sigue usable: solo sale lo emitido después
+                emit_agenda_event(db, doctor_id, APPT_UPDATED, appointment_id=-2)
+                db.commit()
+            return rolled_back, await _drain(q)
+        finally:
+            broadcaster.unsubscribe(doctor_id, q)
+
+    rolled_back, committed = asyncio.run(scenario())
+    assert rolled_back == []
+    assert [(ev["type"], ev["appointment_id"]) for ev in committed] == [(APPT_UPDATED, -2)]
+
+
+def test_failed_write_publishes_nothing(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+
+    async def scenario():
+        q = broadcaster.subscribe(doctor_id)
+        try:
+            with app_db.SessionLocal() as db:
+                emit_agenda_event(db, doctor_id, SLOT_TAKEN, appointment_id=-3)
+                # Sin start_at/end_at: el INSERT falla y la sesión hace rollback
+                db.add(models.Appointment(doctor_id=doctor_id, patient_id=patient_id))
+                try:
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                else:
+                    raise AssertionError("el commit debía fallar")
+            return await _drain(q)
+        finally:
+            broadcaster.unsubscribe(doctor_id, q)
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_slow_subscriber_gets_resync():
+    async def scenario():
+        b = AgendaBroadcaster(queue_size=2)
+        q = b.subscribe(7)
+        for i in range(3):
+            b.publish({"type": SLOT_TAKEN, "doctor_id": 7, "appointment_id": i})
+        b.publish({"type": SLOT_TAKEN, "doctor_id": 8, "appointment_id": 99})  # otra doctora
+        return await _drain(q, wait=0.05)
+
+    events = asyncio.run(scenario())
+    assert [ev["type"] for ev in events] == [RESYNC]
+    assert events[0]["doctor_id"] == 7 and events[0]["seq"] == 3
@@ -0,0 +1,108 @@
+# tests/test_agenda_index.py
+"""
+El índice de agenda en memoria debe responder igual que la consulta SQL y
+seguir al día con las escrituras del propio proceso sin reconstruirse.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app import agenda_index, models
+from app import db as app_db
+
+from .conftest import auth
+
+
+def test_index_matches_sql(clinic):
+    rnd = random.Random(3)
+    now = datetime.now(timezone.utc)
+    db = app_db.SessionLocal()
+    try:
+        for doctor_id in clinic.doctor_ids:
+            lo, hi = now - timedelta(days=60), now + timedelta(days=60)
+            idx = agenda_index.get_index(db, doctor_id, lo, hi)
+            assert idx is not None
+            for _ in range(400):
+                start = lo + timedelta(minutes=rnd.randrange(0, 120 * 24 * 60))
+                end = start + timedelta(minutes=rnd.choice([7, 30, 50, 95, 240]))
+                for blocks in (True, False):
+                    expected = not agenda_index.sql_conflict(
+                        db, doctor_id=doctor_id, start_utc=start, end_utc=end, blocks=blocks,
+                    )
+                    assert idx.is_free(start, end, now_utc=datetime.now(timezone.utc), blocks=blocks) == expected, (
+                        doctor_id, start, end, blocks,
+                    )
+    finally:
+        db.close()
+
+
+def test_index_follows_local_writes(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    start = (datetime.now(timezone.utc) + timedelta(days=200)).replace(hour=15, minute=0, second=0, microsecond=0)
+    end = start + timedelta(hours=2)
+
+    db = app_db.SessionLocal()
+    try:
+        idx = agenda_index.get_index(db, doctor_id, start, end)
+        assert idx.is_free(start, end, now_utc=datetime.now(timezone.utc))
+    finally:
+        db.close()
+
+    r = client.post("/blocks", json={
+        "doctor_id": doctor_id, "start_at": start.isoformat(), "end_at": end.isoformat(), "reason": "índice",
+    }, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+    block_id = r.json()["id"]
+
+    db = app_db.SessionLocal()
+    try:
+        # Mismo objeto (aplicado en el commit, sin recargar) y ya ocupado
+        assert agenda_index.get_index(db, doctor_id, start, end) is idx
+        assert not idx.is_free(start + timedelta(minutes=30), end, now_utc=datetime.now(timezone.utc))
+    finally:
+        db.close()
+
+    r = client.delete(f"/blocks/{block_id}", headers=auth(doctor_id))
+    assert r.status_code in (200, 204), r.text
+
+    db = app_db.SessionLocal()
+    try:
+        assert agenda_index.get_index(db, doctor_id, start, end) is idx
+        assert idx.is_free(start, end, now_utc=datetime.now(timezone.utc))
+    finally:
+        db.close()
+
+
+def test_commit_revalidates_when_another_writer_slipped_in(clinic):
+    doctor_id = clinic.doctor_ids[1]
+    start = (datetime.now(timezone.utc) + timedelta(days=210)).replace(hour=14, minute=0, second=0, microsecond=0)
+    end = start + timedelta(minutes=50)
+
+    mine = app_db.SessionLocal()
+    other = app_db.SessionLocal()
+    try:
+        assert not agenda_index.has_conflict(mine, doctor_id=doctor_id, start_utc=start, end_utc=end)
+
+        # Otra escritura (otro worker) ocupa el horario y confirma primero
+        block = models.CalendarBlock(doctor_id=doctor_id, start_at=start, end_at=end, reason="carrera",
+                                     created_by=doctor_id)
+        other.add(block)
+        other.commit()
+
+        mine.add(models.Appointment(
+            doctor_id=doctor_id, patient_id=clinic.patients_by_doctor[doctor_id][0],
+            start_at=start, end_at=end, status=models.AppointmentStatus.confirmed,
+            method=models.PaymentMethod.payphone,
+        ))
+        with pytest.raises(HTTPException) as exc:
+            mine.commit()
+        assert exc.value.status_code == 409
+        mine.rollback()
+
+        other.delete(block)
+        other.commit()
+    finally:
+        mine.close()
+        other.close()
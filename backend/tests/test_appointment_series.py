@@ -0,0 +1,93 @@
+# tests/test_appointment_series.py
+"""
+Series recurrentes: expansión semanal/quincenal, conflictos reportados por
+ocurrencia y creación de todas las citas (con Zoom) en una sola llamada.
+"""
+from datetime import datetime, timedelta, timezone
+
+from app import recurrence
+from app.utils.tz import aware_to_local_naive, db_aware_utc
+
+from .conftest import auth
+
+
+def test_iter_weekly_biweekly_days_and_window():
+    rule = recurrence.parse_rrule("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;COUNT=5")
+    start = datetime(2026, 1, 7, 9, 30)  # miércoles: la primera es el jueves
+    got = [occ for _, occ in recurrence.iter_weekly(start, rule)]
+    assert got == [
+        datetime(2026, 1, 8, 9, 30),
+        datetime(2026, 1, 19, 9, 30),
+        datetime(2026, 1, 22, 9, 30),
+        datetime(2026, 2, 2, 9, 30),
+        datetime(2026, 2, 5, 9, 30),
+    ]
+    # Con ventana se salta directo y conserva el índice de la serie
+    tail = list(recurrence.iter_weekly(start, rule, lo=datetime(2026, 1, 20)))
+    assert [i for i, _ in tail] == [2, 3, 4]
+    assert rule.to_rrule() == "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;COUNT=5"
+
+
+def test_series_reports_conflicts_then_skips_them(client, clinic, fakes):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    start = (datetime.now(timezone.utc) + timedelta(days=300)).replace(hour=16, minute=0, second=0, microsecond=0)
+    end = start + timedelta(minutes=50)
+
+    # Bloqueo sobre la 3ª ocurrencia semanal
+    r = client.post("/blocks", json={
+        "doctor_id": doctor_id,
+        "start_at": (start + timedelta(weeks=2)).isoformat(),
+        "end_at": (end + timedelta(weeks=2)).isoformat(),
+        "reason": "congreso",
+    }, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+    block_id = r.json()["id"]
+
+    body = {
+        "doctor_id": doctor_id, "patient_id": patient_id,
+        "start_at": start.isoformat(), "end_at": end.isoformat(),
+        "rrule": "FREQ=WEEKLY;COUNT=4",
+    }
+    r = client.post("/appointments/series", json=body, headers=auth(doctor_id))
+    assert r.status_code == 409, r.text
+    conflicts = r.json()["detail"]["conflicts"]
+    assert [(c["index"], c["reason"], c["conflicting_id"]) for c in conflicts] == [(2, "block", block_id)]
+
+    zoom_before = len(fakes["zoom"].created)
+    r = client.post("/appointments/series", json={**body, "skip_conflicts": True}, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+    out = r.json()
+    assert out["rrule"] == "FREQ=WEEKLY;INTERVAL=1;COUNT=4"
+    assert [c["index"] for c in out["conflicts"]] == [2]
+    assert not out["provisioning_errors"]
+    appts = out["appointments"]
+    assert len(appts) == 3
+    assert all(a["status"] == "confirmed" and a["zoom_join_url"] for a in appts)
+    assert len(fakes["zoom"].created) - zoom_before == 3
+    # Misma hora local en todas las ocurrencias
+    starts = [datetime.fromisoformat(a["start_at"]) for a in appts]
+    local_times = {aware_to_local_naive(db_aware_utc(st)).time() for st in starts}
+    assert len(local_times) == 1
+
+    # Repetir la serie ahora choca con las citas recién creadas
+    r = client.post("/appointments/series", json=body, headers=auth(doctor_id))
+    assert r.status_code == 409
+    reasons = {c["reason"] for c in r.json()["detail"]["conflicts"]}
+    assert reasons == {"appointment", "block"}
+
+
+def test_series_rejects_unbounded_or_too_long_rules(client, clinic):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    start = (datetime.now(timezone.utc) + timedelta(days=320)).replace(hour=15, minute=0, second=0, microsecond=0)
+    body = {
+        "doctor_id": doctor_id, "patient_id": patient_id,
+        "start_at": start.isoformat(), "end_at": (start + timedelta(minutes=50)).isoformat(),
+    }
+    r = client.post("/appointments/series", json=body, headers=auth(doctor_id))
+    assert r.status_code == 400  # sin count ni until
+    r = client.post("/appointments/series", json={**body, "count": 500}, headers=auth(doctor_id))
+    assert r.status_code == 400
+    r = client.post("/appointments/series", json={**body, "rrule": "FREQ=DAILY;COUNT=3"}, headers=auth(doctor_id))
+    assert r.status_code == 400
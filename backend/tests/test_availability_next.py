@@ -0,0 +1,74 @@
+# tests/test_availability_next.py
+"""
+/availability/next: recorre la agenda por tramos de NEXT_CHUNK_DAYS hasta
+tener `n` slots o agotar `max_days`, con slots alineados al inicio de cada
+rango de la regla (L-V 08:00-12:00 y 14:00-18:00, 50 min en la clínica
+sembrada).
+"""
+from datetime import timedelta
+
+from app import db as app_db
+from app import models
+from app.routers.availability import MAX_LOOKAHEAD_DAYS, NEXT_CHUNK_DAYS
+from app.utils.tz import aware_to_local_naive
+
+from .conftest import auth
+from .test_availability_search import _at, _monday_local, _utc
+
+
+def _next(client, doctor_id: int, date_from, **params):
+    r = client.get("/availability/next", params={"doctor_id": doctor_id, "date_from": date_from.isoformat(), **params})
+    assert r.status_code == 200, r.text
+    return [aware_to_local_naive(_utc(s["start_at"])) for s in r.json()]
+
+
+def _block(client, doctor_id: int, start, end):
+    r = client.post("/blocks", json={
+        "doctor_id": doctor_id, "start_at": start.isoformat(), "end_at": end.isoformat(), "reason": "Vacaciones",
+    }, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+
+
+def test_next_finds_a_slot_in_a_later_chunk(client, clinic):
+    doctor_id = clinic.doctor_ids[2]
+    monday = _monday_local(800)
+    # Tres semanas bloqueadas: el primer tramo (14 días) no tiene nada libre
+    _block(client, doctor_id, _at(monday, 0), _at(monday + timedelta(days=21), 0))
+    assert NEXT_CHUNK_DAYS < 21
+
+    back = monday + timedelta(days=21)
+    assert _next(client, doctor_id, _at(monday, 0)) == [aware_to_local_naive(_at(back, 8))]
+    assert [s.strftime("%H:%M") for s in _next(client, doctor_id, _at(monday, 0), n=5)] == [
+        "08:00", "08:50", "09:40", "10:30", "14:00",
+    ]
+
+
+def test_next_returns_empty_when_max_days_runs_out(client, clinic):
+    doctor_id = clinic.doctor_ids[2]
+    monday = _monday_local(840)
+    _block(client, doctor_id, _at(monday, 0), _at(monday + timedelta(days=30), 0))
+
+    assert _next(client, doctor_id, _at(monday, 0), max_days=30, n=3) == []
+    assert _next(client, doctor_id, _at(monday, 0), max_days=31) == [
+        aware_to_local_naive(_at(monday + timedelta(days=30), 8))
+    ]
+
+    r = client.get("/availability/next", params={"doctor_id": doctor_id, "max_days": MAX_LOOKAHEAD_DAYS + 1})
+    assert r.status_code == 422
+
+
+def test_next_slot_right_after_a_busy_interval(client, clinic):
+    doctor_id = clinic.doctor_ids[2]
+    monday = _monday_local(880)
+    with app_db.SessionLocal() as db:
+        db.add(models.Appointment(
+            doctor_id=doctor_id, patient_id=clinic.patients_by_doctor[doctor_id][0],
+            start_at=_at(monday, 8), end_at=_at(monday, 8, 50),
+            status=models.AppointmentStatus.confirmed, method=models.PaymentMethod.payphone,
+        ))
+        db.commit()
+
+    # La cita termina justo cuando empieza el siguiente slot: no lo pisa
+    assert [s.strftime("%H:%M") for s in _next(client, doctor_id, _at(monday, 0), n=2)] == ["08:50", "09:40"]
+    # Alineados a la regla, no a date_from: desde 09:00 el próximo es 09:40
+    assert _next(client, doctor_id, _at(monday, 9)) == [aware_to_local_naive(_at(monday, 9, 40))]
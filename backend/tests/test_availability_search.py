@@ -0,0 +1,115 @@
+# tests/test_availability_search.py
+"""
+/availability/search: slots de todas las doctoras mezclados del más próximo
+al más lejano, cortados por `limit`, en JSON o NDJSON, sin los que pisan
+citas o bloqueos. Ventanas lejanas (~600 días) para no chocar con la
+agenda sembrada ni con otras pruebas.
+"""
+import json
+from datetime import date, datetime, timedelta, timezone
+
+from app import db as app_db
+from app import models
+from app.utils.tz import aware_to_local_naive, db_aware_utc, local_naive_to_aware_utc
+
+from .conftest import auth
+
+
+def _monday_local(days_ahead: int) -> date:
+    d = (datetime.now(timezone.utc) + timedelta(days=days_ahead)).date()
+    return d - timedelta(days=d.weekday())
+
+
+def _at(d: date, hour: int, minute: int = 0) -> datetime:
+    return local_naive_to_aware_utc(datetime(d.year, d.month, d.day, hour, minute))
+
+
+def _window(d: date) -> dict:
+    return {"date_from": _at(d, 0).isoformat(), "date_to": _at(d + timedelta(days=1), 0).isoformat()}
+
+
+def _utc(value: str) -> datetime:
+    return db_aware_utc(datetime.fromisoformat(value))
+
+
+def _key(s: dict):
+    return (_utc(s["start_at"]), s["doctor_id"])
+
+
+def _slot(s: dict):
+    """Slot comparable sin importar cómo se serializó la zona (Z o +00:00)."""
+    return s["doctor_id"], _utc(s["start_at"]), _utc(s["end_at"])
+
+
+def _search(client, **params):
+    r = client.get("/availability/search", params=params)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_search_merges_doctors_earliest_first(client, clinic):
+    monday = _monday_local(600)
+    found = _search(client, **_window(monday))
+
+    # Lo mismo que /slots de cada doctora, ordenado por inicio (y doctora en empates)
+    expected = []
+    for doctor_id in clinic.doctor_ids:
+        r = client.get("/availability/slots", params={"doctor_id": doctor_id, **_window(monday)})
+        assert r.status_code == 200, r.text
+        expected += r.json()
+    expected.sort(key=_key)
+    assert found == expected
+    assert [_key(s) for s in found] == sorted(_key(s) for s in found)
+
+    # Reglas L-V 08:00-12:00 y 14:00-18:00 con 50 min: 8 slots por doctora
+    assert len(found) == 8 * len(clinic.doctor_ids)
+    first = found[:len(clinic.doctor_ids)]
+    assert [s["doctor_id"] for s in first] == sorted(clinic.doctor_ids)
+    assert {aware_to_local_naive(_key(s)[0]).strftime("%H:%M") for s in first} == {"08:00"}
+
+
+def test_search_limit_cuts_the_merge(client, clinic):
+    monday = _monday_local(600)
+    full = _search(client, **_window(monday))
+    assert _search(client, limit=5, **_window(monday)) == full[:5]
+    assert _search(client, limit=1, **_window(monday)) == full[:1]
+
+
+def test_search_stream_is_ndjson(client, clinic):
+    monday = _monday_local(600)
+    full = _search(client, **_window(monday))
+
+    r = client.get("/availability/search", params={"stream": "true", "limit": 7, **_window(monday)})
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = r.text.splitlines()
+    assert len(lines) == 7
+    assert [_slot(json.loads(line)) for line in lines] == [_slot(s) for s in full[:7]]
+
+
+def test_search_skips_appointments_and_blocks(client, clinic):
+    monday = _monday_local(610)
+    doc_appt, doc_block = clinic.doctor_ids[0], clinic.doctor_ids[1]
+
+    with app_db.SessionLocal() as db:
+        db.add(models.Appointment(
+            doctor_id=doc_appt, patient_id=clinic.patients_by_doctor[doc_appt][0],
+            start_at=_at(monday, 8), end_at=_at(monday, 8, 50),
+            status=models.AppointmentStatus.confirmed, method=models.PaymentMethod.payphone,
+        ))
+        db.commit()
+    r = client.post("/blocks", json={
+        "doctor_id": doc_block,
+        "start_at": _at(monday, 14).isoformat(),
+        "end_at": _at(monday, 16).isoformat(),
+        "reason": "Supervisión",
+    }, headers=auth(doc_block))
+    assert r.status_code == 201, r.text
+
+    by_doctor = {}
+    for s in _search(client, **_window(monday)):
+        by_doctor.setdefault(s["doctor_id"], []).append(aware_to_local_naive(_key(s)[0]).strftime("%H:%M"))
+    # La cita quita su slot; el bloqueo 14:00-16:00 quita los tres que lo pisan
+    assert by_doctor[doc_appt] == ["08:50", "09:40", "10:30", "14:00", "14:50", "15:40", "16:30"]
+    assert by_doctor[doc_block] == ["08:00", "08:50", "09:40", "10:30", "16:30"]
+    assert len(by_doctor[clinic.doctor_ids[2]]) == 8
@@ -0,0 +1,137 @@
+# tests/test_booking_lock.py
+"""
+Candado de reservas por doctora: una segunda transacción espera (o agota
+el tiempo) hasta que la primera termina, y la espera queda medida. Las
+llamadas a Zoom van fuera del candado.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app import booking_lock
+from app import db as app_db
+from app.config import settings
+from app.metrics import BOOKING_LOCK_WAIT_SECONDS
+from app.zoom_client import zoom
+
+from .conftest import auth
+from .test_query_budgets import _free_slots, _hold
+
+
+def _count(outcome: str) -> float:
+    return sum(
+        s.value
+        for metric in BOOKING_LOCK_WAIT_SECONDS.collect()
+        for s in metric.samples
+        if s.name.endswith("_count") and s.labels == {"backend": "local", "outcome": outcome}
+    )
+
+
+def test_second_writer_waits_until_first_ends(clinic, monkeypatch):
+    doctor_id = clinic.doctor_ids[0]
+    first = app_db.SessionLocal()
+    second = app_db.SessionLocal()
+    try:
+        booking_lock.lock_doctor(first, doctor_id)
+        booking_lock.lock_doctor(first, doctor_id)  # reentrante en la misma transacción
+
+        monkeypatch.setattr(settings, "BOOKING_LOCK_TIMEOUT_SECONDS", 0.05)
+        timeouts = _count("timeout")
+        with pytest.raises(HTTPException) as exc:
+            booking_lock.lock_doctor(second, doctor_id)
+        assert exc.value.status_code == 503
+        assert _count("timeout") == timeouts + 1
+        second.rollback()
+
+        # Otra doctora no espera
+        booking_lock.lock_doctor(second, clinic.doctor_ids[1])
+        second.rollback()
+
+        monkeypatch.setattr(settings, "BOOKING_LOCK_TIMEOUT_SECONDS", 5.0)
+        threading.Timer(0.1, first.rollback).start()
+        t0 = time.perf_counter()
+        asyncio.run(booking_lock.lock_doctor_async(second, doctor_id))
+        assert time.perf_counter() - t0 >= 0.05
+        second.commit()
+    finally:
+        first.close()
+        second.close()
+
+
+# =========================
+# Zoom fuera del candado
+# =========================
+
+def _zoom_spy(monkeypatch, doctor_id: int, *, fail: bool = False):
+    """Zoom falso que anota si el candado de la doctora estaba tomado durante la llamada."""
+    held = []
+    counter = iter(range(95_000_000_000, 96_000_000_000))
+
+    async def create_meeting(**kw):
+        held.append(booking_lock._local_lock(doctor_id).locked())
+        if fail:
+            raise RuntimeError("Zoom 503")
+        n = next(counter)
+        return {"id": n, "join_url": f"https://zoom.test/j/{n}"}
+
+    async def update_meeting(**kw):
+        held.append(booking_lock._local_lock(doctor_id).locked())
+        raise RuntimeError("Zoom API error 404: meeting does not exist")
+
+    monkeypatch.setattr(zoom, "create_meeting", create_meeting)
+    monkeypatch.setattr(zoom, "update_meeting", update_meeting)
+    return held
+
+
+def test_confirm_and_reschedule_call_zoom_without_the_lock(client, clinic, fakes, monkeypatch):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][-1]
+    held = _zoom_spy(monkeypatch, doctor_id)
+
+    (appt_id,) = _hold(client, doctor_id, patient_id)
+    r = client.post(f"/appointments/{appt_id}/confirm", headers=auth(patient_id))
+    assert r.status_code == 200, r.text
+    assert r.json()["zoom_join_url"].startswith("https://zoom.test/j/95")
+
+    # Reunión inexistente en Zoom: se recrea y se guarda el link nuevo
+    old_url = r.json()["zoom_join_url"]
+    new_slot = _free_slots(client, doctor_id, 1, days_ahead=6)[0]
+    r = client.post(f"/appointments/{appt_id}/reschedule", json=new_slot, headers=auth(patient_id))
+    assert r.status_code == 200, r.text
+    assert r.json()["zoom_join_url"] not in (None, old_url)
+    assert held == [False, False, False]  # create, update (404), create
+
+
+def test_confirm_survives_a_zoom_failure(client, clinic, fakes, monkeypatch):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][-2]
+    held = _zoom_spy(monkeypatch, doctor_id, fail=True)
+
+    (appt_id,) = _hold(client, doctor_id, patient_id)
+    r = client.post(f"/appointments/{appt_id}/confirm", headers=auth(patient_id))
+    assert r.status_code == 200, r.text
+    assert r.json()["status"] == "confirmed" and r.json()["zoom_join_url"] is None
+    assert held == [False]
+
+
+def test_payphone_confirm_calls_zoom_without_the_lock(client, clinic, fakes, monkeypatch):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][-3]
+    held = _zoom_spy(monkeypatch, doctor_id)
+
+    appt_ids = _hold(client, doctor_id, patient_id, n=2)
+    fakes["payphone"].approve(7_400_001, appt_ids)
+    r = client.post(
+        "/payments/payphone/confirm",
+        json={"id": 7_400_001, "clientTxId": "ctx-7400001"},
+        headers=auth(patient_id),
+    )
+    assert r.status_code == 200, r.text
+    assert sorted(r.json()["confirmed_appointment_ids"]) == sorted(appt_ids)
+    assert held == [False, False]
+
+    r = client.get(f"/appointments/{appt_ids[0]}", headers=auth(patient_id))
+    assert r.json()["zoom_join_url"].startswith("https://zoom.test/j/95")
@@ -0,0 +1,56 @@
+# tests/test_clinical_lists.py
+"""
+Listados de historias clínicas y planes: resumen con extracto por defecto,
+textos completos solo si se piden con ?fields= o en GET /{id}.
+"""
+from .conftest import auth, within_budget
+
+BIG = "Refiere ansiedad anticipatoria y rumiación nocturna. " * 400  # ~20 KB
+
+
+def test_clinical_history_list_is_a_summary(client, clinic):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    r = client.post(
+        "/clinical_histories",
+        json={"patient_id": patient_id, "notas": BIG, "alergias": "Penicilina", "antecedentes_psico": BIG},
+        headers=auth(doctor_id),
+    )
+    assert r.status_code == 201, r.text
+    ch_id = r.json()["id"]
+
+    with within_budget(max_statements=2, max_ms=500):
+        r = client.get(f"/clinical_histories?patient_id={patient_id}")
+    assert r.status_code == 200
+    (row,) = [x for x in r.json() if x["id"] == ch_id]
+    assert set(row) == {"id", "patient_id", "snippet", "created_at", "updated_at"}
+    assert row["snippet"] == BIG[:160]
+
+    r = client.get(f"/clinical_histories?patient_id={patient_id}&fields=alergias")
+    (row,) = [x for x in r.json() if x["id"] == ch_id]
+    assert row["alergias"] == "Penicilina" and "notas" not in row
+
+    r = client.get(f"/clinical_histories?patient_id={patient_id}&fields=all")
+    (row,) = [x for x in r.json() if x["id"] == ch_id]
+    assert row["notas"] == BIG and row["consumo"] is None
+
+    assert client.get("/clinical_histories?fields=notas,password").status_code == 422
+    assert client.get(f"/clinical_histories/{ch_id}").json()["antecedentes_psico"] == BIG
+
+
+def test_therapeutic_plan_list_is_a_summary(client, clinic):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][1]
+    r = client.post(
+        "/therapeutic_plans",
+        json={"patient_id": patient_id, "objetivos": "", "notas": BIG, "proxima_revision": "2026-01-15"},
+        headers=auth(doctor_id),
+    )
+    assert r.status_code == 201, r.text
+
+    r = client.get(f"/therapeutic_plans?patient_id={patient_id}")
+    (row,) = r.json()
+    # objetivos vacío: el extracto sale de la siguiente columna con texto
+    assert row["snippet"] == BIG[:160]
+    assert row["proxima_revision"] == "2026-01-15"
+    assert "notas" not in row and "objetivos" not in row
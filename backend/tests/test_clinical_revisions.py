@@ -0,0 +1,102 @@
+# tests/test_clinical_revisions.py
+"""
+Historial de revisiones: diffs entre versiones, fotos periódicas,
+reconstrucción de cualquier versión y registros previos al historial.
+"""
+import random
+
+from sqlalchemy import insert, select
+
+from app import db as app_db
+from app import models, revisions
+from app.config import settings
+
+from .conftest import auth, within_budget
+
+_WORDS = ("paciente refiere ansiedad sueño trabajo familia rumiación nocturna respiración registro "
+          "pensamientos automáticos conciliación semana tarea objetivo sesión madre pareja estrés").split()
+_rnd = random.Random(7)
+# ~20 KB de texto poco repetitivo (la compresión sola no lo reduce mucho)
+NOTES = "Paciente refiere insomnio. " + " ".join(_rnd.choice(_WORDS) + str(_rnd.randint(0, 99)) for _ in range(2500))
+
+
+def test_text_ops_roundtrip():
+    old = "Refiere ansiedad  en el trabajo.\nDuerme mal."
+    new = "Refiere ansiedad leve en el trabajo.\nDuerme bien; sin pesadillas."
+    ops = revisions.text_ops(old, new)
+    assert revisions.apply_ops(old, ops) == new
+    assert revisions.apply_ops("", revisions.text_ops("", new)) == new
+    assert revisions.apply_ops(old, revisions.text_ops(old, "")) == ""
+
+
+def test_revisions_store_diffs_and_materialize_any_version(client, clinic, monkeypatch):
+    monkeypatch.setattr(settings, "REVISION_SNAPSHOT_EVERY", 3)
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][1]
+    h = auth(doctor_id)
+
+    r = client.post("/clinical_histories", json={"patient_id": patient_id, "notas": NOTES, "alergias": "Ninguna"}, headers=h)
+    assert r.status_code == 201, r.text
+    ch_id = r.json()["id"]
+
+    expected = {1: NOTES}
+    notes = NOTES
+    for v in range(2, 7):
+        notes = notes.replace("insomnio", f"insomnio (sesión {v})", 1) + f" Control {v}."
+        assert client.put(f"/clinical_histories/{ch_id}", json={"notas": notes}, headers=h).status_code == 200
+        expected[v] = notes
+    # Mismo contenido: no es una versión nueva
+    client.put(f"/clinical_histories/{ch_id}", json={"notas": notes}, headers=h)
+
+    revs = client.get(f"/clinical_histories/{ch_id}/revisions", headers=h).json()
+    assert [x["version"] for x in revs] == [6, 5, 4, 3, 2, 1]
+    assert [x["version"] for x in revs if x["is_snapshot"]] == [4, 1]  # foto cada 3 versiones: como mucho 2 diffs
+    assert all(x["author_id"] == doctor_id for x in revs)
+    assert revs[0]["changed_fields"] == ["notas"]
+    snapshot_size = revs[-1]["size_bytes"]
+    assert max(x["size_bytes"] for x in revs if not x["is_snapshot"]) * 5 < snapshot_size
+
+    for v, text in expected.items():
+        with within_budget(max_statements=3, max_ms=500):
+            r = client.get(f"/clinical_histories/{ch_id}/revisions/{v}", headers=h)
+        assert r.status_code == 200, r.text
+        assert r.json()["data"]["notas"] == text
+        assert r.json()["data"]["alergias"] == "Ninguna"
+
+    # Borrar deja el historial consultable
+    assert client.delete(f"/clinical_histories/{ch_id}", headers=h).status_code == 204
+    revs = client.get(f"/clinical_histories/{ch_id}/revisions", headers=h).json()
+    assert revs[0]["action"] == "delete"
+    assert client.get(f"/clinical_histories/{ch_id}/revisions/{revs[0]['version']}", headers=h).json()["data"]["notas"] == notes
+    assert client.get(f"/clinical_histories/{ch_id}/revisions/99", headers=h).status_code == 404
+    assert client.get(f"/clinical_histories/{ch_id}/revisions", headers=auth(patient_id)).status_code == 403
+
+
+def test_plan_created_before_history_gets_a_baseline(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][2]
+    db = app_db.SessionLocal()
+    try:
+        # Alta fuera de la unidad de trabajo del ORM: como las filas previas a la migración
+        tp_id = db.scalar(
+            insert(models.TherapeuticPlan)
+            .values(patient_id=patient_id, objetivos="Dormir mejor", frecuencia="Semanal")
+            .returning(models.TherapeuticPlan.id)
+        )
+        db.commit()
+        assert db.scalar(select(models.ClinicalRevision.id).where(models.ClinicalRevision.record_id == tp_id,
+                                                                  models.ClinicalRevision.kind == "therapeutic_plan")) is None
+    finally:
+        db.close()
+
+    h = auth(doctor_id)
+    r = client.put(f"/therapeutic_plans/{tp_id}", json={"frecuencia": "Quincenal", "proxima_revision": "2026-02-01"}, headers=h)
+    assert r.status_code == 200, r.text
+
+    revs = client.get(f"/therapeutic_plans/{tp_id}/revisions", headers=h).json()
+    assert [(x["version"], x["action"]) for x in revs] == [(2, "update"), (1, "baseline")]
+    assert sorted(revs[0]["changed_fields"]) == ["frecuencia", "proxima_revision"]
+    v1 = client.get(f"/therapeutic_plans/{tp_id}/revisions/1", headers=h).json()["data"]
+    v2 = client.get(f"/therapeutic_plans/{tp_id}/revisions/2", headers=h).json()["data"]
+    assert (v1["frecuencia"], v1["proxima_revision"]) == ("Semanal", None)
+    assert (v2["frecuencia"], v2["proxima_revision"], v2["objetivos"]) == ("Quincenal", "2026-02-01", "Dormir mejor")
@@ -0,0 +1,57 @@
+# tests/test_clinical_search.py
+"""
+Búsqueda de texto completo (GET /search/clinical): solo pacientes de la
+doctora, extractos resaltados y escapados, índice al día tras editar.
+"""
+from .conftest import auth, within_budget
+
+
+def _create(client, doctor_id, path, body):
+    r = client.post(path, json=body, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+    return r.json()["id"]
+
+
+def test_search_is_scoped_highlighted_and_current(client, clinic):
+    doctor_id, other_doctor = clinic.doctor_ids[1], clinic.doctor_ids[0]
+    p1, p2 = clinic.patients_by_doctor[doctor_id][:2]
+    ch_id = _create(client, doctor_id, "/clinical_histories", {
+        "patient_id": p1,
+        "notas": "Refiere somnolencia diurna <b>persistente</b> tras cambio de turno.",
+    })
+    tp_id = _create(client, doctor_id, "/therapeutic_plans", {
+        "patient_id": p2, "objetivos": "Reducir la somnolencia con higiene del sueño.",
+    })
+    _create(client, other_doctor, "/clinical_histories", {
+        "patient_id": clinic.patients_by_doctor[other_doctor][0], "notas": "Somnolencia marcada.",
+    })
+
+    with within_budget(max_statements=3, max_ms=500):
+        r = client.get("/search/clinical?q=Somnolencia", headers=auth(doctor_id))
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert {(h["kind"], h["id"]) for h in body["items"]} == {("clinical_history", ch_id), ("therapeutic_plan", tp_id)}
+    hit = next(h for h in body["items"] if h["kind"] == "clinical_history")
+    assert hit["patient_id"] == p1 and hit["patient_name"]
+    assert "<mark>somnolencia</mark>" in hit["snippet"]
+    assert "&lt;b&gt;persistente&lt;/b&gt;" in hit["snippet"]
+    assert "antecedentes_personales" not in hit
+
+    # Paginación y filtros
+    page = client.get("/search/clinical?q=somnolencia&limit=1", headers=auth(doctor_id)).json()
+    assert len(page["items"]) == 1 and page["has_more"] is True
+    only_plans = client.get("/search/clinical?q=somnolencia&kind=therapeutic_plan", headers=auth(doctor_id)).json()
+    assert [h["id"] for h in only_plans["items"]] == [tp_id]
+    assert client.get(f"/search/clinical?q=somnolencia&patient_id={p2}", headers=auth(doctor_id)).json()["items"][0]["id"] == tp_id
+
+    # Editar o borrar actualiza el índice
+    r = client.put(f"/clinical_histories/{ch_id}", json={"notas": "Duerme bien."}, headers=auth(doctor_id))
+    assert r.status_code == 200
+    client.delete(f"/therapeutic_plans/{tp_id}", headers=auth(doctor_id))
+    assert client.get("/search/clinical?q=somnolencia", headers=auth(doctor_id)).json()["items"] == []
+    assert client.get("/search/clinical?q=duerme", headers=auth(doctor_id)).json()["items"][0]["id"] == ch_id
+
+    # Pacientes ajenos y otros roles
+    other_patient = clinic.patients_by_doctor[other_doctor][0]
+    assert client.get(f"/search/clinical?q=x1&patient_id={other_patient}", headers=auth(doctor_id)).status_code == 404
+    assert client.get("/search/clinical?q=somnolencia", headers=auth(p1)).status_code == 403
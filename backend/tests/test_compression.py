@@ -0,0 +1,230 @@
+# tests/test_compression.py
+"""
+CompressionMiddleware (gzip / brotli) sobre apps ASGI mínimas: la suite
+corre con COMPRESSION_ENABLED=false, así que se envuelve la app a mano.
+Los mensajes ASGI se capturan crudos (sin la descompresión automática de
+httpx) para revisar cabeceras y cada trozo enviado.
+"""
+import asyncio
+import gzip
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.responses import Response, StreamingResponse
+
+from app.compression import CompressionMiddleware, brotli
+
+BODY = b"".join(b'{"slot": %d, "doctor": "Dra. Prueba", "libre": true},' % i for i in range(200))
+
+
+def _app(response: Response):
+    async def app(scope, receive, send):
+        await response(scope, receive, send)
+    return app
+
+
+def _call(app, accept_encoding: str = "gzip, br", **mw_kwargs):
+    """Ejecuta un GET contra CompressionMiddleware(app) -> (status, headers, trozos del body)."""
+    mw = CompressionMiddleware(app, **{"minimum_size": 512, **mw_kwargs})
+    scope = {
+        "type": "http", "method": "GET", "path": "/", "query_string": b"",
+        "headers": [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else [],
+    }
+    sent = []
+    requested = False
+
+    async def receive():
+        # Un único http.request; después el cliente "sigue conectado"
+        nonlocal requested
+        if requested:
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(mw(scope, receive, send))
+    start, *bodies = sent
+    headers = {k.decode().lower(): v.decode() for k, v in start["headers"]}
+    return start["status"], headers, [m.get("body", b"") for m in bodies]
+
+
+# =========================
+# Negociación
+# =========================
+
+def test_gzip_when_brotli_not_accepted():
+    status, headers, chunks = _call(_app(Response(BODY, media_type="application/json")), "gzip")
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    raw = b"".join(chunks)
+    assert int(headers["content-length"]) == len(raw) < len(BODY)
+    assert gzip.decompress(raw) == BODY
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli no instalado")
+def test_brotli_preferred_when_accepted():
+    status, headers, chunks = _call(_app(Response(BODY, media_type="application/json")), "gzip, deflate, br")
+    assert headers["content-encoding"] == "br"
+    assert brotli.decompress(b"".join(chunks)) == BODY
+
+
+def test_brotli_disabled_falls_back_to_gzip():
+    _, headers, _ = _call(_app(Response(BODY, media_type="application/json")), "br, gzip", enable_brotli=False)
+    assert headers["content-encoding"] == "gzip"
+
+
+@pytest.mark.parametrize("accept", ["", "identity", "gzip;q=0", "gzip;q=0, br;q=0", "deflate"])
+def test_refused_or_missing_encoding_is_identity(accept):
+    status, headers, chunks = _call(_app(Response(BODY, media_type="application/json")), accept)
+    assert status == 200
+    assert "content-encoding" not in headers
+    assert b"".join(chunks) == BODY
+
+
+def test_q_zero_for_brotli_picks_gzip():
+    _, headers, _ = _call(_app(Response(BODY, media_type="application/json")), "br;q=0, gzip;q=0.5")
+    assert headers["content-encoding"] == "gzip"
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli no instalado")
+@pytest.mark.parametrize("accept, expected", [
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0.5, gzip;q=0.5", "br"),      # empate: preferencia del servidor
+    ("*", "br"),
+    ("gzip;q=0.3, *;q=0.8", "br"),       # br toma el q de *
+    ("*;q=0, gzip", "gzip"),
+    ("gzip ; q=0.9 ; foo=bar", "gzip"),
+    ("gzip;q=0.2, identity", None),      # el cliente prefiere sin comprimir
+    ("*;q=0", None),
+])
+def test_negotiation_follows_q_values(accept, expected):
+    _, headers, _ = _call(_app(Response(BODY, media_type="application/json")), accept)
+    assert headers.get("content-encoding") == expected
+    assert headers["vary"] == "Accept-Encoding"
+
+
+def test_identity_refused_compresses_small_bodies():
+    small = b'{"ok": true}'
+    app = _app(Response(small, media_type="application/json"))
+    _, headers, chunks = _call(app, "gzip, identity;q=0", minimum_size=1024)
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(b"".join(chunks)) == small
+
+
+# =========================
+# Respuestas que no se comprimen
+# =========================
+
+def test_small_body_passes_through():
+    small = b'{"ok": true}'
+    _, headers, chunks = _call(_app(Response(small, media_type="application/json")), minimum_size=1024)
+    assert "content-encoding" not in headers
+    assert headers["content-length"] == str(len(small))
+    assert b"".join(chunks) == small
+    # Otro cliente (o el mismo con un cuerpo más grande) la recibiría comprimida
+    assert headers["vary"] == "Accept-Encoding"
+
+
+def test_vary_without_accept_encoding():
+    _, headers, chunks = _call(_app(Response(BODY, media_type="application/json")), "")
+    assert "content-encoding" not in headers
+    assert headers["vary"] == "Accept-Encoding"
+    assert b"".join(chunks) == BODY
+
+
+def test_content_type_outside_allowlist_passes_through():
+    png = b"\x89PNG\r\n\x1a\n" + bytes(4096)
+    _, headers, chunks = _call(_app(Response(png, media_type="image/png")))
+    assert "content-encoding" not in headers
+    assert "vary" not in headers
+    assert b"".join(chunks) == png
+
+    _, headers, _ = _call(_app(Response(BODY, media_type="text/csv")), content_types=("application/json",))
+    assert "content-encoding" not in headers
+
+
+@pytest.mark.parametrize("status_code", [204, 304])
+def test_empty_statuses_pass_through(status_code):
+    status, headers, chunks = _call(_app(Response(status_code=status_code, headers={"ETag": '"abc"'})))
+    assert status == status_code
+    assert "content-encoding" not in headers
+    assert headers["etag"] == '"abc"'
+    assert b"".join(chunks) == b""
+
+
+def test_already_encoded_passes_through():
+    pre = gzip.compress(BODY)
+    app = _app(Response(pre, media_type="application/json", headers={"Content-Encoding": "gzip"}))
+    _, headers, chunks = _call(app, "br, gzip")
+    assert headers["content-encoding"] == "gzip"
+    assert b"".join(chunks) == pre
+
+
+# =========================
+# Streaming y ETag
+# =========================
+
+def test_streaming_chunks_decompress_in_order():
+    parts = [b"linea %d;" % i * 50 for i in range(5)]
+
+    async def gen():
+        for p in parts:
+            yield p
+
+    _, headers, chunks = _call(_app(StreamingResponse(gen(), media_type="text/csv")), "gzip")
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+
+    # Cada trozo llega con Z_SYNC_FLUSH: se puede descomprimir a medida que llega
+    d = zlib.decompressobj(31)
+    seen = []
+    for chunk in chunks:
+        if chunk:
+            seen.append(d.decompress(chunk))
+    assert seen[:len(parts)] == parts
+    assert b"".join(seen) + d.flush() == b"".join(parts)
+    assert d.eof
+
+
+def test_strong_etag_becomes_weak():
+    def app():
+        return _app(Response(BODY, media_type="application/json", headers={"ETag": '"v1"'}))
+
+    _, headers, _ = _call(app(), "gzip")
+    assert headers["etag"] == 'W/"v1"'
+
+    _, headers, _ = _call(app(), "")
+    assert headers["etag"] == '"v1"'
+
+
+
+def test_not_modified_round_trip_with_compression(client, clinic):
+    from app.main import app
+
+    compressed = TestClient(CompressionMiddleware(app, minimum_size=256))
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    params = {
+        "doctor_id": clinic.doctor_ids[0],
+        "date_from": start.isoformat(),
+        "date_to": (start + timedelta(days=31)).isoformat(),
+    }
+    r = compressed.get("/availability/slots", params=params, headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.json() == client.get("/availability/slots", params=params).json()
+    etag = r.headers["etag"]
+    assert etag.startswith('W/"')
+
+    r = compressed.get(
+        "/availability/slots", params=params,
+        headers={"Accept-Encoding": "gzip", "If-None-Match": etag},
+    )
+    assert r.status_code == 304
+    assert "content-encoding" not in r.headers
+    assert r.content == b""
+    assert r.headers["etag"] == etag
@@ -0,0 +1,72 @@
+# tests/test_idempotency.py
+"""
+Idempotency-Key: el reintento de un hold o de una confirmación devuelve la
+respuesta guardada sin volver a consultar conflictos ni llamar a Zoom.
+"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from app import db as app_db
+from app import idempotency, models
+
+from .conftest import auth, within_budget
+from .test_query_budgets import _free_slots
+
+
+def test_retried_hold_and_confirm_replay_stored_response(client, clinic, fakes):
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    body = {"doctor_id": doctor_id, "slots": _free_slots(client, doctor_id, 1, days_ahead=5)}
+    headers = {**auth(patient_id), "Idempotency-Key": "hold-1"}
+
+    first = client.post("/appointments/hold", json=body, headers=headers)
+    assert first.status_code == 201, first.text
+    # Solo la búsqueda de la clave: ni auth, ni candado, ni chequeo de conflictos
+    with within_budget(max_statements=1, max_ms=100):
+        again = client.post("/appointments/hold", json=body, headers=headers)
+    assert again.status_code == 201
+    assert again.headers["idempotent-replayed"] == "true"
+    assert again.json() == first.json()
+
+    # Misma clave con otro cuerpo
+    other = {**body, "slots": _free_slots(client, doctor_id, 2, days_ahead=5)[1:]}
+    assert client.post("/appointments/hold", json=other, headers=headers).status_code == 422
+
+    appt_id = first.json()["appointments"][0]["id"]
+    headers = {**auth(patient_id), "Idempotency-Key": "confirm-1"}
+    zoom_before = len(fakes["zoom"].created)
+    first = client.post(f"/appointments/{appt_id}/confirm", headers=headers)
+    assert first.status_code == 200, first.text
+    again = client.post(f"/appointments/{appt_id}/confirm", headers=headers)
+    assert again.status_code == 200
+    assert again.json() == first.json()
+    assert len(fakes["zoom"].created) - zoom_before == 1
+
+    # Otra paciente con la misma clave no ve la respuesta ajena
+    stranger = clinic.patients_by_doctor[doctor_id][1]
+    r = client.post(f"/appointments/{appt_id}/confirm", headers={**auth(stranger), "Idempotency-Key": "confirm-1"})
+    assert "idempotent-replayed" not in r.headers
+
+
+def test_purge_survives_a_replay(client, clinic, monkeypatch):
+    doctor_id = clinic.doctor_ids[1]
+    patient_id = clinic.patients_by_doctor[doctor_id][2]
+    body = {"doctor_id": doctor_id, "slots": _free_slots(client, doctor_id, 1, days_ahead=9)}
+    headers = {**auth(patient_id), "Idempotency-Key": "hold-purge"}
+    assert client.post("/appointments/hold", json=body, headers=headers).status_code == 201
+
+    K = models.IdempotencyKey
+    past = datetime.now(timezone.utc) - timedelta(days=3)
+    with app_db.SessionLocal() as db:
+        db.add(K(scope="0 POST /x", key="vencida", fingerprint="f", created_at=past, expires_at=past))
+        db.commit()
+
+    # Toca purgar justo en un reintento (sale de _claim sin commit)
+    monkeypatch.setattr(idempotency, "_next_purge", 0.0)
+    again = client.post("/appointments/hold", json=body, headers=headers)
+    assert again.headers["idempotent-replayed"] == "true"
+
+    with app_db.SessionLocal() as db:
+        assert db.scalar(select(K.id).where(K.key == "vencida")) is None
+    assert idempotency._next_purge > 0
@@ -0,0 +1,97 @@
+# tests/test_payphone_confirm.py
+"""
+Confirmación de un pago de varias citas: conflictos validados en conjunto,
+reuniones Zoom creadas en paralelo y fallos reportados por cita.
+"""
+import asyncio
+
+from sqlalchemy import event, select
+
+from app import db as app_db
+from app import models
+from app.zoom_client import zoom
+
+from .conftest import auth
+from .test_query_budgets import _hold
+
+
+def test_package_confirms_in_parallel_and_reports_failures(client, clinic, fakes, monkeypatch):
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][1]
+    appt_ids = _hold(client, doctor_id, patient_id, n=4)
+    blocked_id, zoom_down_id = appt_ids[1], appt_ids[2]
+
+    # Otro worker bloquea el horario de una de las citas después del hold
+    db = app_db.SessionLocal()
+    try:
+        appt = db.get(models.Appointment, blocked_id)
+        db.add(models.CalendarBlock(
+            doctor_id=doctor_id, start_at=appt.start_at, end_at=appt.end_at,
+            reason="imprevisto", created_by=doctor_id,
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    in_flight = peak = 0
+
+    async def slow_zoom(**kw):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        if kw["topic"].startswith(f"Cita {zoom_down_id} "):
+            raise RuntimeError("Zoom 503")
+        return {"id": kw["topic"], "join_url": "https://zoom.test/j/pkg"}
+
+    monkeypatch.setattr(zoom, "create_meeting", slow_zoom)
+    fakes["payphone"].approve(7_100_001, appt_ids)
+    r = client.post(
+        "/payments/payphone/confirm",
+        json={"id": 7_100_001, "clientTxId": "ctx-7100001"},
+        headers=auth(patient_id),
+    )
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert sorted(body["confirmed_appointment_ids"]) == sorted(set(appt_ids) - {blocked_id})
+    assert [(f["appointment_id"], f["reason"]) for f in body["failed_appointments"]] == [
+        (blocked_id, "Conflicto con otro evento/hold"),
+    ]
+    assert peak == 3
+
+    db = app_db.SessionLocal()
+    try:
+        zoom_down = db.get(models.Appointment, zoom_down_id)
+        assert zoom_down.status == models.AppointmentStatus.confirmed and zoom_down.zoom_join_url is None
+        assert db.get(models.Appointment, blocked_id).status == models.AppointmentStatus.pending
+    finally:
+        db.close()
+
+
+def test_raw_payload_is_compressed_and_only_read_on_demand(client, clinic, fakes, engine):
+    doctor_id = clinic.doctor_ids[1]
+    patient_id = clinic.patients_by_doctor[doctor_id][2]
+    appt_ids = _hold(client, doctor_id, patient_id, n=1)
+    fakes["payphone"].approve(7_100_002, appt_ids)
+    r = client.post(
+        "/payments/payphone/confirm",
+        json={"id": 7_100_002, "clientTxId": "ctx-7100002"},
+        headers=auth(patient_id),
+    )
+    payment_id = r.json()["payment_id"]
+
+    statements = []
+    listener = lambda conn, cursor, stmt, *a: statements.append(stmt)  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    db = app_db.SessionLocal()
+    try:
+        payment = db.scalar(select(models.Payment).where(models.Payment.id == payment_id))
+        assert payment.appointment_ids == appt_ids
+        assert not any("payment_payloads" in s for s in statements)
+
+        assert payment.raw_payload == fakes["payphone"].responses[7_100_002]
+        assert payment.payload.codec in ("zstd", "zlib")
+    finally:
+        db.close()
+        event.remove(engine, "before_cursor_execute", listener)
@@ -0,0 +1,120 @@
+# tests/test_payphone_notify.py
+"""
+Notificación servidor a servidor de PayPhone: se verifica y encola al
+instante; el procesador confirma las citas aunque el navegador nunca vuelva.
+"""
+import asyncio
+from datetime import datetime, timezone
+
+from app import db as app_db
+from app import models, payphone_processing
+from app.config import settings
+
+from .conftest import auth
+from .test_query_budgets import _hold
+
+
+def _notification(transaction_id: int) -> models.PayphoneNotification:
+    db = app_db.SessionLocal()
+    try:
+        return db.query(models.PayphoneNotification).filter_by(transaction_id=str(transaction_id)).one()
+    finally:
+        db.close()
+
+
+def test_notify_confirms_without_browser_and_is_idempotent(client, clinic, fakes, monkeypatch):
+    monkeypatch.setattr(settings, "PAYPHONE_WEBHOOK_TOKEN", "s3cret")
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][1]
+    appt_ids = _hold(client, doctor_id, patient_id, n=2)
+    fakes["payphone"].approve(7_200_001, appt_ids)
+    body = {"TransactionId": 7_200_001, "ClientTransactionId": "ctx-7200001", "StatusCode": 3}
+
+    r = client.post("/payments/payphone/notify", params={"token": "nope"}, json=body)
+    assert r.status_code == 401
+
+    # TestClient corre la tarea en segundo plano al terminar la respuesta
+    r = client.post("/payments/payphone/notify", params={"token": "s3cret"}, json=body)
+    assert r.status_code == 200, r.text
+    assert r.json()["queued"] is True
+    row = _notification(7_200_001)
+    assert row.status == "done" and row.payment_id is not None
+
+    r = client.post("/payments/payphone/notify", headers={"X-Payphone-Token": "s3cret"}, json=body)
+    assert r.json() == {"received": True, "transaction_id": 7_200_001, "queued": False, "status": "done"}
+
+    # El navegador vuelve tarde: ve el pago ya registrado
+    r = client.post(
+        "/payments/payphone/confirm",
+        json={"id": 7_200_001, "clientTxId": "ctx-7200001"},
+        headers=auth(patient_id),
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["payment_id"] == row.payment_id
+    assert sorted(r.json()["confirmed_appointment_ids"]) == sorted(appt_ids)
+
+
+def test_notify_retries_when_confirm_fails(client, clinic, fakes, monkeypatch):
+    monkeypatch.setattr(settings, "PAYPHONE_WEBHOOK_TOKEN", "s3cret")
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    appt_ids = _hold(client, doctor_id, patient_id, n=1)
+
+    # PayPhone aún no conoce la transacción: queda pendiente con backoff
+    r = client.post("/payments/payphone/notify", params={"token": "s3cret"}, json={"transactionId": 7_200_002})
+    assert r.status_code == 200, r.text
+    row = _notification(7_200_002)
+    assert row.status == "pending" and row.attempts == 1 and row.last_error
+
+    fakes["payphone"].approve(7_200_002, appt_ids)
+    db = app_db.SessionLocal()
+    try:
+        db.query(models.PayphoneNotification).filter_by(id=row.id).update(
+            {"next_attempt_at": datetime.now(timezone.utc)}
+        )
+        db.commit()
+    finally:
+        db.close()
+    assert asyncio.run(payphone_processing.process_due_notifications()) == 1
+
+    row = _notification(7_200_002)
+    assert row.status == "done" and row.attempts == 2
+    db = app_db.SessionLocal()
+    try:
+        assert db.get(models.Appointment, appt_ids[0]).status == models.AppointmentStatus.confirmed
+    finally:
+        db.close()
+
+
+def test_browser_losing_the_race_sees_the_notification_payment(client, clinic, fakes, monkeypatch):
+    monkeypatch.setattr(settings, "PAYPHONE_WEBHOOK_TOKEN", "s3cret")
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][2]
+    appt_ids = _hold(client, doctor_id, patient_id, n=1)
+    fakes["payphone"].approve(7_200_003, appt_ids)
+    body = {"TransactionId": 7_200_003, "ClientTransactionId": "ctx-7200003", "StatusCode": 3}
+    assert client.post("/payments/payphone/notify", params={"token": "s3cret"}, json=body).status_code == 200
+    payment_id = _notification(7_200_003).payment_id
+    assert payment_id is not None
+
+    # El chequeo inicial del navegador corrió antes del commit de la
+    # notificación: ya no quedan citas confirmables, pero el pago existe
+    real = payphone_processing._existing_payment
+    calls = []
+
+    def stale_first(db, transaction_id):
+        calls.append(transaction_id)
+        return None if len(calls) == 1 else real(db, transaction_id)
+
+    monkeypatch.setattr(payphone_processing, "_existing_payment", stale_first)
+    r = client.post("/payments/payphone/confirm", json={"id": 7_200_003, "clientTxId": "ctx-7200003"}, headers=auth(patient_id))
+    assert r.status_code == 200, r.text
+    assert r.json()["approved"] is True and r.json()["payment_id"] == payment_id
+    assert len(calls) == 2
+
+    db = app_db.SessionLocal()
+    try:
+        tx = db.query(models.PayphoneTransaction).filter_by(transaction_id="7200003").one()
+        assert tx.payment_id == payment_id
+    finally:
+        db.close()
@@ -0,0 +1,203 @@
+# tests/test_query_budgets.py
+"""
+Presupuesto de SQL y latencia por ruta sobre la clínica sembrada.
+Si un cambio agrega consultas (p.ej. un db.get dentro de un for), la prueba
+falla con QueryBudgetExceeded indicando la consulta repetida. Los techos
+en ms solo se informan (SlowBlockWarning): dependen de la máquina.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from app import db as app_db
+from app import models
+from app.routers.appointments import delete_stale_holds
+
+from .conftest import auth, within_budget
+
+
+def _free_slots(client, doctor_id: int, n: int, days_ahead: int = 2, window_days: int = 14):
+    start = (datetime.now(timezone.utc) + timedelta(days=days_ahead)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    r = client.get("/availability/slots", params={
+        "doctor_id": doctor_id,
+        "date_from": start.isoformat(),
+        "date_to": (start + timedelta(days=window_days)).isoformat(),
+    })
+    assert r.status_code == 200, r.text
+    slots = r.json()
+    assert len(slots) >= n, "la clínica sembrada no tiene huecos suficientes"
+    return [{"start_at": s["start_at"], "end_at": s["end_at"]} for s in slots[:n]]
+
+
+def _hold(client, doctor_id: int, patient_id: int, n: int = 1):
+    r = client.post(
+        "/appointments/hold",
+        json={"doctor_id": doctor_id, "slots": _free_slots(client, doctor_id, n)},
+        headers=auth(patient_id),
+    )
+    assert r.status_code == 201, r.text
+    return [a["id"] for a in r.json()["appointments"]]
+
+
+# =========================
+# Disponibilidad
+# =========================
+
+def test_availability_slots_one_month(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    params = {
+        "doctor_id": doctor_id,
+        "date_from": start.isoformat(),
+        "date_to": (start + timedelta(days=31)).isoformat(),
+    }
+    client.get("/availability/slots", params=params)  # calentamiento
+
+    # versión de agenda (ETag) + holds vencidos + settings + reglas + citas + bloqueos
+    with within_budget(max_statements=6, max_ms=250):
+        r = client.get("/availability/slots", params=params)
+    assert r.status_code == 200
+    assert len(r.json()) > 0
+
+
+def test_availability_slots_not_modified(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    params = {
+        "doctor_id": doctor_id,
+        "date_from": start.isoformat(),
+        "date_to": (start + timedelta(days=31)).isoformat(),
+    }
+    etag = client.get("/availability/slots", params=params).headers["etag"]
+
+    # 304: solo se consulta la versión de agenda
+    with within_budget(max_statements=1, max_ms=50):
+        r = client.get("/availability/slots", params=params, headers={"If-None-Match": etag})
+    assert r.status_code == 304
+
+
+# =========================
+# Citas
+# =========================
+
+def test_hold_statements_do_not_grow_with_slots(client, clinic):
+    doctor_id = clinic.doctor_ids[1]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    slots = _free_slots(client, doctor_id, 11)
+
+    # auth + holds vencidos + doctora + candado + citas + bloqueos + INSERT ... RETURNING + commit
+    counts = []
+    for chosen in (slots[:3], slots[3:11]):
+        with within_budget(max_statements=10, max_ms=250) as qw:
+            r = client.post(
+                "/appointments/hold",
+                json={"doctor_id": doctor_id, "slots": chosen},
+                headers=auth(patient_id),
+            )
+        assert r.status_code == 201, r.text
+        assert len(r.json()["appointments"]) == len(chosen)
+        counts.append(qw.statements)
+    # 3 y 8 huecos: mismas sentencias
+    assert counts[0] == counts[1], counts
+
+
+def _expired_holds(
+    doctor_id: int, patient_id: int, n: int, ctx_prefix: str = "ctx-stale", ago: timedelta = timedelta(minutes=1),
+) -> List[int]:
+    """Inserta `n` holds de PayPhone ya vencidos (con clientTxId, como los del checkout)."""
+    now = datetime.now(timezone.utc)
+    with app_db.SessionLocal() as db:
+        holds = [
+            models.Appointment(
+                doctor_id=doctor_id, patient_id=patient_id,
+                start_at=now + timedelta(days=300, hours=i), end_at=now + timedelta(days=300, hours=i, minutes=45),
+                status=models.AppointmentStatus.pending, method=models.PaymentMethod.payphone,
+                hold_until=now - ago, client_tx_id=f"{ctx_prefix}-{uuid.uuid4().hex[:8]}-{i}",
+            )
+            for i in range(n)
+        ]
+        db.add_all(holds)
+        db.commit()
+        return [h.id for h in holds]
+
+
+def test_stale_hold_cleanup_does_not_grow_with_expired_holds(client, clinic):
+    doctor_id = clinic.doctor_ids[1]
+    patient_id = clinic.patients_by_doctor[doctor_id][4]
+    counts = []
+    for n in (1, 6):
+        _expired_holds(doctor_id, patient_id, n)
+        with app_db.SessionLocal() as db:
+            with within_budget(max_statements=8, max_ms=250, n1_threshold=2) as qw:
+                assert delete_stale_holds(db) == n
+        counts.append(qw.statements)
+    assert counts[0] == counts[1], counts
+
+
+def test_confirm_appointment(client, clinic, fakes):
+    doctor_id = clinic.doctor_ids[1]
+    patient_id = clinic.patients_by_doctor[doctor_id][1]
+    (appt_id,) = _hold(client, doctor_id, patient_id)
+
+    # Incluye Zoom (fake), emails en background (TestClient los ejecuta), el recordatorio,
+    # releer la cita bajo el candado de reservas y el link de Zoom en una segunda
+    # transacción (UPDATE + versión de agenda), ya sin el candado
+    with within_budget(max_statements=15, max_ms=300):
+        r = client.post(f"/appointments/{appt_id}/confirm", headers=auth(patient_id))
+    assert r.status_code == 200, r.text
+    assert r.json()["status"] == "confirmed"
+    assert r.json()["zoom_join_url"].startswith("https://zoom.test/")
+
+
+def test_payphone_confirm_two_appointments(client, clinic, fakes):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    appt_ids = _hold(client, doctor_id, patient_id, n=2)
+    fakes["payphone"].approve(7_000_001, appt_ids)
+
+    # _appt_context hace 2 db.get(User) por email (N+1 conocido): 2 citas => 4 + auth;
+    # + re-chequeo del pago bajo candado, caché del estado PayPhone (con savepoint)
+    # y el payload comprimido en payment_payloads; los links de Zoom van después del
+    # commit (sin candado): una lectura de las citas confirmadas + su UPDATE
+    with within_budget(max_statements=30, max_ms=400, n1_threshold=6):
+        r = client.post(
+            "/payments/payphone/confirm",
+            json={"id": 7_000_001, "clientTxId": "ctx-7000001"},
+            headers=auth(patient_id),
+        )
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert sorted(body["confirmed_appointment_ids"]) == sorted(appt_ids)
+    assert body["payment_id"] is not None
+
+    # Reintento del front: idempotente y barato
+    with within_budget(max_statements=3, max_ms=100):
+        r = client.post(
+            "/payments/payphone/confirm",
+            json={"id": 7_000_001, "clientTxId": "ctx-7000001"},
+            headers=auth(patient_id),
+        )
+    assert r.status_code == 200
+    assert r.json()["payment_id"] == body["payment_id"]
+
+
+# =========================
+# Jobs
+# =========================
+
+def test_jobs_list_doctor(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    with within_budget(max_statements=2, max_ms=400):
+        r = client.get("/jobs", headers=auth(doctor_id))
+    assert r.status_code == 200
+    assert len(r.json()) >= clinic.reminder_jobs
+
+
+def test_jobs_list_patient(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][3]
+    with within_budget(max_statements=2, max_ms=100):
+        r = client.get("/jobs", headers=auth(patient_id), params={"status_filter": "scheduled"})
+    assert r.status_code == 200
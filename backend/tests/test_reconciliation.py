@@ -0,0 +1,101 @@
+# tests/test_reconciliation.py
+"""
+Conciliación de pagos: cobros aprobados sin pago registrado, pagos cuyas
+citas ya no están confirmadas y holds de PayPhone vencidos sin pago.
+"""
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from app import db as app_db
+from app import models, reconciliation
+from app.routers.appointments import delete_stale_holds
+
+from .conftest import auth
+from .test_query_budgets import _expired_holds, _hold
+
+
+def _confirm(client, patient_id: int, tx: int):
+    r = client.post("/payments/payphone/confirm", json={"id": tx, "clientTxId": f"ctx-{tx}"}, headers=auth(patient_id))
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def _tombstones(db, *client_tx_ids: str):
+    # Por clientTxId: SQLite puede reusar el id de una cita borrada
+    H = models.ExpiredHold
+    return set(db.scalars(select(H.appointment_id).where(H.client_tx_id.in_(client_tx_ids))))
+
+
+def test_reconciliation_reports_mismatches_incrementally(client, clinic, fakes, monkeypatch):
+    doctor_id = clinic.doctor_ids[1]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+
+    # 1) El hold venció (y se borró) antes de que volviera el pago aprobado
+    (gone_id,) = _hold(client, doctor_id, patient_id)
+    db = app_db.SessionLocal()
+    try:
+        db.delete(db.get(models.Appointment, gone_id))
+        db.commit()
+    finally:
+        db.close()
+    fakes["payphone"].approve(7_300_001, [gone_id])
+    assert _confirm(client, patient_id, 7_300_001)["payment_id"] is None
+
+    # 2) Pago registrado, pero la cita se canceló después
+    (appt_id,) = _hold(client, doctor_id, patient_id)
+    fakes["payphone"].approve(7_300_002, [appt_id])
+    payment_id = _confirm(client, patient_id, 7_300_002)["payment_id"]
+    db = app_db.SessionLocal()
+    try:
+        db.get(models.Appointment, appt_id).status = models.AppointmentStatus.cancelled
+        db.commit()
+    finally:
+        db.close()
+
+    # Lotes chicos: la pasada avanza igual hasta agotar lo nuevo
+    monkeypatch.setattr(reconciliation.settings, "RECONCILIATION_BATCH_SIZE", 2)
+    first = reconciliation.run_reconciliation()
+    assert first["payments"]["scanned"] >= 1
+
+    r = client.get("/payments/reconciliation", headers=auth(doctor_id))
+    assert r.status_code == 200, r.text
+    body = r.json()
+    found = {(i["kind"], i["subject"]) for i in body["recent"]}
+    assert ("approved_without_payment", "tx:7300001") in found
+    assert ("appointment_not_confirmed", f"payment:{payment_id}:appt:{appt_id}") in found
+    assert {w["name"] for w in body["watermarks"]} == set(reconciliation.SCANS)
+
+    # Segunda pasada: nada nuevo que leer ni reportar
+    again = reconciliation.run_reconciliation()
+    assert all(s == {"scanned": 0, "issues": 0} for s in again.values())
+    assert client.get("/payments/reconciliation", headers=auth(patient_id)).status_code == 403
+
+
+def test_expired_hold_without_payment_is_reported(client, clinic):
+    doctor_id = clinic.doctor_ids[2]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+
+    # Dos holds de PayPhone vencidos hace una hora; solo uno llegó a pagarse
+    unpaid_id, paid_id = _expired_holds(doctor_id, patient_id, 2, ctx_prefix="ctx-recon", ago=timedelta(hours=1))
+    with app_db.SessionLocal() as db:
+        unpaid_ctx, paid_ctx = (db.get(models.Appointment, i).client_tx_id for i in (unpaid_id, paid_id))
+        db.add(models.Payment(method="payphone", amount_cents=2500, payphone_tx_id="7500001", client_tx_id=paid_ctx))
+        db.commit()
+
+        # La limpieza borra los holds pero deja la lápida para la conciliación
+        assert delete_stale_holds(db) >= 2
+        assert db.get(models.Appointment, unpaid_id) is None
+        assert _tombstones(db, unpaid_ctx, paid_ctx) == {unpaid_id, paid_id}
+
+    reconciliation.run_reconciliation()
+    found = {(i["kind"], i["subject"]) for i in client.get(
+        "/payments/reconciliation", headers=auth(doctor_id)
+    ).json()["recent"]}
+    assert ("hold_expired_unpaid", f"appt:{unpaid_id}") in found
+    assert ("hold_expired_unpaid", f"appt:{paid_id}") not in found
+
+    # Las lápidas revisadas se consumen: la siguiente pasada no las relee
+    with app_db.SessionLocal() as db:
+        assert _tombstones(db, unpaid_ctx, paid_ctx) == set()
+    assert reconciliation.run_reconciliation()["stale_holds"] == {"scanned": 0, "issues": 0}
@@ -0,0 +1,108 @@
+# tests/test_recurring_blocks.py
+"""
+Bloqueos recurrentes: una fila, ocurrencias expandidas solo para la ventana
+consultada, vistas igual por /slots, el índice de agenda y el SQL.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from app import agenda_index
+from app import db as app_db
+from app.utils.tz import aware_to_local_naive, db_aware_utc, local_naive_to_aware_utc
+
+from .conftest import auth
+
+
+def _monday_local(days_ahead: int) -> date:
+    d = (datetime.now(timezone.utc) + timedelta(days=days_ahead)).date()
+    return d - timedelta(days=d.weekday())
+
+
+def _at(d: date, hour: int) -> datetime:
+    return local_naive_to_aware_utc(datetime(d.year, d.month, d.day, hour))
+
+
+def test_recurring_block_hides_slots_and_conflicts(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    monday = _monday_local(400)
+
+    # 09:00-10:00 de lunes a viernes, 10 ocurrencias (dos semanas)
+    r = client.post("/blocks", json={
+        "doctor_id": doctor_id,
+        "start_at": _at(monday, 9).isoformat(),
+        "end_at": _at(monday, 10).isoformat(),
+        "reason": "Supervisión diaria",
+        "rrule": "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR;COUNT=10",
+    }, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+    block = r.json()
+    assert db_aware_utc(datetime.fromisoformat(block["recur_until"])) == _at(monday + timedelta(days=11), 10)
+
+    r = client.get("/availability/slots", params={
+        "doctor_id": doctor_id,
+        "date_from": _at(monday, 0).isoformat(),
+        "date_to": _at(monday + timedelta(days=21), 0).isoformat(),
+    })
+    assert r.status_code == 200, r.text
+    by_day = {}
+    for s in r.json():
+        local = aware_to_local_naive(db_aware_utc(datetime.fromisoformat(s["start_at"])))
+        by_day.setdefault(local.date(), []).append(local.strftime("%H:%M"))
+    # Semanas 1 y 2 sin los slots que pisan 09:00-10:00; semana 3 completa
+    assert by_day[monday][:2] == ["08:00", "10:30"]
+    assert by_day[monday + timedelta(days=11)][:2] == ["08:00", "10:30"]
+    assert by_day[monday + timedelta(days=14)][:3] == ["08:00", "08:50", "09:40"]
+
+    # El índice y el SQL coinciden ocurrencia a ocurrencia
+    db = app_db.SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
+        idx = agenda_index.get_index(db, doctor_id, _at(monday, 0), _at(monday + timedelta(days=21), 0))
+        for offset in range(21):
+            s = _at(monday + timedelta(days=offset), 9)
+            e = s + timedelta(minutes=30)
+            expected = not agenda_index.sql_conflict(db, doctor_id=doctor_id, start_utc=s, end_utc=e)
+            assert expected == (offset >= 14 or (monday + timedelta(days=offset)).weekday() >= 5)
+            assert idx.is_free(s, e, now_utc=now) == expected
+    finally:
+        db.close()
+
+    r = client.delete(f"/blocks/{block['id']}", headers=auth(doctor_id))
+    assert r.status_code == 204
+
+    db = app_db.SessionLocal()
+    try:
+        s = _at(monday, 9)
+        assert not agenda_index.has_conflict(db, doctor_id=doctor_id, start_utc=s, end_utc=s + timedelta(hours=1))
+    finally:
+        db.close()
+
+
+def test_recurring_block_rejected_over_existing_appointment(client, clinic):
+    doctor_id = clinic.doctor_ids[0]
+    patient_id = clinic.patients_by_doctor[doctor_id][0]
+    monday = _monday_local(500)
+
+    # Cita un jueves de la cuarta semana a las 12:00
+    thursday = monday + timedelta(days=24)
+    r = client.post("/appointments", json={
+        "doctor_id": doctor_id, "patient_id": patient_id,
+        "start_at": _at(thursday, 12).isoformat(), "end_at": _at(thursday, 13).isoformat(), "method": "payphone",
+    }, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+    appt_id = r.json()["id"]
+
+    body = {
+        "doctor_id": doctor_id,
+        "start_at": _at(monday, 12).isoformat(),
+        "end_at": _at(monday, 13).isoformat(),
+        "reason": "Almuerzo",
+    }
+    # Sin fin: la cita cae en una ocurrencia
+    r = client.post("/blocks", json={**body, "rrule": "FREQ=WEEKLY;BYDAY=MO,TH"}, headers=auth(doctor_id))
+    assert r.status_code == 409
+    assert f"#{appt_id}" in r.json()["detail"]
+
+    # Quincenal: la cuarta semana no tiene ocurrencias
+    r = client.post("/blocks", json={**body, "rrule": "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH"}, headers=auth(doctor_id))
+    assert r.status_code == 201, r.text
+    assert r.json()["recur_until"] is None
@@ -0,0 +1,78 @@
+# tests/test_zoom_metrics.py
+"""
+Métricas de llamadas salientes a Zoom: operación por método de la API,
+el token OAuth medido aparte (sin contarlo dos veces en el request) y las
+respuestas HTTP >= 400 como error.
+"""
+import asyncio
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from app import metrics
+from app.zoom_client import ZoomClient
+
+_RealAsyncClient = httpx.AsyncClient
+
+
+def _sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def _seconds_sum(operation: str, outcome: str) -> float:
+    return _sample("outbound_request_duration_seconds_sum", service="zoom", operation=operation, outcome=outcome)
+
+
+def _use_transport(monkeypatch, handler):
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(httpx, "AsyncClient", lambda **kw: _RealAsyncClient(transport=transport, **kw))
+
+
+def _run_in_request(coro):
+    """Corre `coro` con estadísticas de request activas (como MetricsMiddleware)."""
+    stats = metrics.RequestStats()
+
+    async def main():
+        metrics._current.set(stats)
+        return await coro
+
+    return asyncio.run(main()), stats
+
+
+def test_zoom_calls_are_labelled_per_operation_and_token_counted_once(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/oauth/token"):
+            return httpx.Response(200, json={"access_token": "tok", "expires_in": 3600})
+        return httpx.Response(201, json={"id": 123, "join_url": "https://zoom.test/j/123"})
+
+    _use_transport(monkeypatch, handler)
+    before = {k: _seconds_sum(k, "ok") for k in ("token", "create_meeting")}
+    count_before = _sample("outbound_request_duration_seconds_count", service="zoom", operation="create_meeting", outcome="ok")
+
+    meeting, stats = _run_in_request(ZoomClient().create_meeting(
+        user_id="me", topic="Consulta", start_time_iso="2026-01-10T14:00:00Z", duration_minutes=50,
+    ))
+
+    assert meeting["id"] == 123
+    assert _sample("outbound_request_duration_seconds_count", service="zoom", operation="create_meeting", outcome="ok") == count_before + 1
+    spent = sum(_seconds_sum(k, "ok") - v for k, v in before.items())
+    assert stats.outbound_seconds == pytest.approx(spent)
+
+
+def test_zoom_http_error_is_recorded_as_error(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/oauth/token"):
+            return httpx.Response(200, json={"access_token": "tok", "expires_in": 3600})
+        return httpx.Response(404, json={"code": 3001, "message": "Meeting does not exist"})
+
+    _use_transport(monkeypatch, handler)
+    errors_before = _sample("outbound_request_errors_total", service="zoom", operation="update_meeting")
+
+    with pytest.raises(RuntimeError, match="zoom.update_meeting"):
+        _run_in_request(ZoomClient().update_meeting(
+            meeting_id="1", start_time_iso="2026-01-10T14:00:00Z", duration_minutes=50,
+        ))
+
+    assert _sample("outbound_request_errors_total", service="zoom", operation="update_meeting") == errors_before + 1
+    assert _sample("outbound_request_duration_seconds_count", service="zoom", operation="update_meeting", outcome="ok") == 0
@@ -67,7 +67,10 @@ export default function ClinicalHistory() {
                 const list = await apiGet(`/clinical_histories?patient_id=${id}&skip=0&limit=1`)
                 if (!alive) return
 
-                const exists = Array.isArray(list) && list.length > 0 ? list[0] : null
+                const summary = Array.isArray(list) && list.length > 0 ? list[0] : null
+                // El listado trae solo un resumen: el texto completo está en /clinical_histories/:id
+                const exists = summary ? await apiGet(`/clinical_histories/${summary.id}`) : null
+                if (!alive) return
                 setHistory(exists)
 
                 if (exists) {
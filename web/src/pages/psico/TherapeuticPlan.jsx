@@ -58,7 +58,10 @@ export default function TherapeuticPlan() {
                 // Traemos el primer plan (si existe) por patient_id
                 const list = await apiGet(`/therapeutic_plans?patient_id=${id}&skip=0&limit=1`)
                 if (!alive) return
-                const exists = Array.isArray(list) && list.length > 0 ? list[0] : null
+                const summary = Array.isArray(list) && list.length > 0 ? list[0] : null
+                // El listado trae solo un resumen: el texto completo está en /therapeutic_plans/:id
+                const exists = summary ? await apiGet(`/therapeutic_plans/${summary.id}`) : null
+                if (!alive) return
                 setPlan(exists)
 
                 if (exists) {